@@ -68,6 +68,89 @@ PERPLEXITY_MODEL = _env("PERPLEXITY_MODEL", "sonar")
 ANTHROPIC_API_KEY = _env("ANTHROPIC_API_KEY")
 ANTHROPIC_MODEL = _env("ANTHROPIC_MODEL", "claude-sonnet-4-6")
 
+# ============ LLM 连接池（客户端复用 / keep-alive） ============
+LLM_POOL_MAX_CONNECTIONS = int(_env("LLM_POOL_MAX_CONNECTIONS", "64"))      # 单客户端最大连接数
+LLM_POOL_MAX_KEEPALIVE = int(_env("LLM_POOL_MAX_KEEPALIVE", "32"))          # 保持空闲的 keep-alive 连接数
+LLM_POOL_KEEPALIVE_EXPIRY = float(_env("LLM_POOL_KEEPALIVE_EXPIRY", "60"))  # 空闲连接回收秒数
+LLM_HTTP2 = _env("LLM_HTTP2", "1") not in ("0", "false", "False", "")       # 安装 h2 时启用 HTTP/2
+LLM_ASYNC_CONCURRENCY = int(_env("LLM_ASYNC_CONCURRENCY", "16"))            # achat_many 默认并发上限
+
+# ============ LLM 响应缓存（output/cache/llm_responses.sqlite3） ============
+LLM_CACHE_MODE = _env("LLM_CACHE_MODE", "rw")                               # rw=读写 / ro=只读回放 / off=旁路
+LLM_CACHE_MAX_MB = float(_env("LLM_CACHE_MAX_MB", "512"))                   # 缓存总大小上限
+LLM_CACHE_MAX_AGE_DAYS = float(_env("LLM_CACHE_MAX_AGE_DAYS", "30"))        # 条目最长存活天数
+LLM_CACHE_NONDETERMINISTIC = _env("LLM_CACHE_NONDETERMINISTIC", "0") in ("1", "true", "True")  # 缓存 temperature>0 的调用
+LLM_SINGLE_FLIGHT = _env("LLM_SINGLE_FLIGHT", "1") not in ("0", "false", "False", "")  # 合并同时在途的相同请求
+
+# ============ LLM 流式生成（chat_streamed：增量落盘 + 断流续写） ============
+LLM_STREAM = _env("LLM_STREAM", "1") not in ("0", "false", "False", "")     # 0=长输出调用退化为非流式 chat()
+LLM_STREAM_MAX_RESUMES = int(_env("LLM_STREAM_MAX_RESUMES", "3"))           # 单次调用最多续传次数
+LLM_MAX_CONTINUATIONS = int(_env("LLM_MAX_CONTINUATIONS", "3"))             # 输出达到 max_tokens 被截断时最多续写次数，0=不续写
+
+# ============ LLM 对冲请求 / 故障转移（chat(hedge=True) 或 --hedge） ============
+LLM_HEDGE = _env("LLM_HEDGE", "0") in ("1", "true", "True")                # 默认对所有 chat() 启用对冲
+LLM_HEDGE_PROVIDERS = _env("LLM_HEDGE_PROVIDERS", "")                       # 备选 provider 顺序，如 "gemini,grok"
+LLM_HEDGE_QUANTILE = float(_env("LLM_HEDGE_QUANTILE", "0.9"))              # 触发阈值取观测延迟的分位数
+LLM_HEDGE_MIN_SAMPLES = int(_env("LLM_HEDGE_MIN_SAMPLES", "5"))             # 样本不足时使用下方兜底阈值
+LLM_HEDGE_TTFB_FALLBACK = float(_env("LLM_HEDGE_TTFB_FALLBACK", "60"))      # 兜底：首字节等待秒数
+LLM_HEDGE_TOTAL_FALLBACK = float(_env("LLM_HEDGE_TOTAL_FALLBACK", "300"))   # 兜底：总耗时秒数
+LLM_HEDGE_MAX = int(_env("LLM_HEDGE_MAX", "1"))                             # 单次调用最多追加的备选请求数
+
+# ============ LLM 批处理（--batch-mode：非交互步骤的章节调用走 OpenAI 兼容 Batch API，src/utils/batch_api.py） ============
+LLM_BATCH_MODE = _env("LLM_BATCH_MODE", "0") in ("1", "true", "True")           # 默认关闭
+LLM_BATCH_PROVIDERS = _env("LLM_BATCH_PROVIDERS", "openai,qwen")               # 支持 Batch API 的 provider，其余走实时并发
+LLM_BATCH_STEPS = _env("LLM_BATCH_STEPS", "step3_experts,step4_report_v2,step5_report_final,step7_report_policy,step8_report_v5")  # 适用步骤（支持通配）
+LLM_BATCH_WINDOW = float(_env("LLM_BATCH_WINDOW", "3"))                        # 收集窗口：最后一个请求到达后等待秒数再提交
+LLM_BATCH_MAX_REQUESTS = int(_env("LLM_BATCH_MAX_REQUESTS", "1000"))           # 单个批处理任务的请求数上限
+LLM_BATCH_POLL_INTERVAL = float(_env("LLM_BATCH_POLL_INTERVAL", "30"))         # 轮询间隔（秒）
+LLM_BATCH_MAX_WAIT = float(_env("LLM_BATCH_MAX_WAIT", "86400"))                # 超过后取消任务并回退实时调用（秒）
+
+# ============ LLM 重试与熔断（按 provider 共享） ============
+LLM_RETRY_ATTEMPTS = int(_env("LLM_RETRY_ATTEMPTS", "3"))                   # 单次调用最多尝试次数（含首次）
+LLM_RETRY_MAX_WAIT = float(_env("LLM_RETRY_MAX_WAIT", "120"))              # 服务端 Retry-After 等待上限（秒）
+LLM_BREAKER = _env("LLM_BREAKER", "1") not in ("0", "false", "False", "")   # 启用 provider 熔断
+LLM_BREAKER_FAILURES = int(_env("LLM_BREAKER_FAILURES", "5"))               # 连续失败次数阈值
+LLM_BREAKER_ERROR_RATE = float(_env("LLM_BREAKER_ERROR_RATE", "0.5"))       # 窗口内错误率阈值
+LLM_BREAKER_WINDOW = int(_env("LLM_BREAKER_WINDOW", "20"))                  # 错误率统计窗口（最近 N 次请求）
+LLM_BREAKER_MIN_CALLS = int(_env("LLM_BREAKER_MIN_CALLS", "10"))            # 窗口内至少 N 次请求才按错误率判定
+LLM_BREAKER_OPEN_SECONDS = float(_env("LLM_BREAKER_OPEN_SECONDS", "30"))    # 熔断后多久进入半开探测
+LLM_BREAKER_FALLBACK = _env("LLM_BREAKER_FALLBACK", "")                     # 熔断时改道的 provider 顺序，如 "gemini,deepseek"；空=快速失败
+
+# ============ 自适应并发（AIMD，按 provider 共享；parallel_map 等扇出按上限最大值开线程） ============
+LLM_AIMD = _env("LLM_AIMD", "1") not in ("0", "false", "False", "")       # 0=关闭，扇出退回固定线程数
+LLM_AIMD_INITIAL = int(_env("LLM_AIMD_INITIAL", "4"))                       # 初始并发上限
+LLM_AIMD_MIN = int(_env("LLM_AIMD_MIN", "1"))                               # 并发上限下限
+LLM_AIMD_MAX = int(_env("LLM_AIMD_MAX", "32"))                              # 并发上限上限（也是扇出线程数）
+LLM_AIMD_BACKOFF = float(_env("LLM_AIMD_BACKOFF", "0.5"))                   # 429/5xx/延迟突增时上限乘以该系数
+LLM_AIMD_LATENCY_SPIKE = float(_env("LLM_AIMD_LATENCY_SPIKE", "2.0"))       # 归一化延迟超过基线该倍数视为突增
+PARALLEL_POOL_WORKERS = int(_env("PARALLEL_POOL_WORKERS", "64"))           # 扇出共享线程池常驻线程数（满时按 high/normal/low 通道择优）
+
+# ============ 路由池（src/utils/key_pool.py：多 Key / 多 provider 加权最少在途分发） ============
+LLM_KEY_POOL = _env("LLM_KEY_POOL", "")                                     # 额外 Key，如 "kimi:sk-a,sk-b*2;deepseek:sk-c"（主 Key 自动加入）
+LLM_ROUTING_POOL = _env("LLM_ROUTING_POOL", "")                             # 跨 provider 路由池，如 "kimi,deepseek*0.5"；空=只在同 provider 的 Key 间分流
+
+# ============ 调用点模型路由（src/utils/model_routes.py；报告类型配置 "## 模型路由" 章节可覆盖） ============
+LLM_ROUTES = _env("LLM_ROUTES", "")                                         # 如 "_api_deduplicate_chapter:provider=deepseek,max_tokens=8192;step4b_consistency_check:provider=qwen"
+
+# ============ LLM 限流（按 provider / provider/model 的令牌桶，同步与异步共享） ============
+LLM_RATE_RPM = float(_env("LLM_RATE_RPM", "0"))                             # 默认每分钟请求数，0=不限
+LLM_RATE_TPM = float(_env("LLM_RATE_TPM", "0"))                             # 默认每分钟 token 数（估算输入 + max_tokens）
+LLM_RATE_MAX_INFLIGHT = int(_env("LLM_RATE_MAX_INFLIGHT", "0"))             # 默认最大在途请求数，0=不限
+LLM_RATE_LIMITS = _env("LLM_RATE_LIMITS", "perplexity:rpm=50")              # 覆盖项，如 "kimi:rpm=200,tpm=2000000,inflight=16;kimi/kimi-k2.5:tpm=1000000"
+
+# ============ 上下文预算（src/utils/token_budget.py） ============
+LLM_CONTEXT_WINDOWS = _env("LLM_CONTEXT_WINDOWS", "")                      # 覆盖上下文窗口，如 "kimi:131072,qwen/qwen-long:1000000"
+LLM_BUDGET_SAFETY = float(_env("LLM_BUDGET_SAFETY", "0.9"))                 # 上下文窗口可用比例（留出估算误差）
+
+# ============ LLM 调用指标 ============
+LLM_METRICS_TEXTFILE = _env("LLM_METRICS_TEXTFILE", "")                    # Prometheus textfile 路径（如 node_exporter 目录），默认 output/metrics/
+
+# ============ LLM 离线录制 / 回放（src/utils/replay.py；LLM_PROVIDER=replay 时默认回放） ============
+LLM_REPLAY_MODE = _env("LLM_REPLAY_MODE", "off")                            # off / record=录制真实调用 / replay=离线回放
+LLM_REPLAY_LATENCY = float(_env("LLM_REPLAY_LATENCY", "0"))                 # 回放延迟 = 录制耗时 × 该倍率，0=不等待
+LLM_REPLAY_JITTER = float(_env("LLM_REPLAY_JITTER", "0"))                   # 延迟抖动比例，如 0.2 表示 ±20%
+LLM_REPLAY_STRICT = _env("LLM_REPLAY_STRICT", "1") not in ("0", "false", "False", "")  # 未命中时报错；0=返回占位文本继续
+
 # 报告语言
 REPORT_LANGUAGE = _env("REPORT_LANGUAGE", "zh")
 
@@ -79,6 +162,12 @@ REPORT_DIR = OUTPUT_DIR / "reports"    # 报告 1.0 / 2.0
 EXPERT_DIR = OUTPUT_DIR / "experts"    # 专家意见
 SKILL_DIR = OUTPUT_DIR / "skill"       # Step7 风格化 Skill 目录
 FILES_DIR = OUTPUT_DIR / "files"       # 用户语料目录（如 2026dong）
+LLM_CACHE_DIR = OUTPUT_DIR / "cache"   # LLM 响应缓存
+LLM_STREAM_SPOOL_DIR = OUTPUT_DIR / "spool"  # 流式输出的未完成部分（*.partial）
+METRICS_DIR = OUTPUT_DIR / "metrics"   # 每次运行的 LLM 调用指标（JSON / Prometheus）
+LLM_BATCH_DIR = OUTPUT_DIR / "batch"   # 批处理任务文件（*.jsonl）、任务状态与结果
+CHECKPOINT_DIR = OUTPUT_DIR / "checkpoints"  # 流水线工作单元检查点（{base}.jsonl）
+LLM_REPLAY_ARCHIVE = _env("LLM_REPLAY_ARCHIVE") or str(OUTPUT_DIR / "replay" / "llm_replay.jsonl.gz")  # 录制 / 回放归档
 
 # 爬虫
 MIN_CONTENT_BYTES = 1000   # 低于此字节数视为未完整遍历
@@ -86,6 +175,7 @@ RETRY_WAIT_SECONDS = 15    # 重试前等待秒数
 CRAWL_MAX_RETRIES = 5      # 最大重试次数
 
 # ============ 内容截断限制（各 Step prompt 截取上限） ============
+# 字符上限按默认 provider（kimi）标定；经 token_budget 装箱时作为软上限，并按实际上下文窗口收紧
 # Step2 报告 1.0
 RAW_LOAD_LIMIT = 130_000               # 原始语料加载上限
 OUTLINE_RAW_LIMIT = 80_000             # 构建大纲时语料截取
@@ -138,9 +228,22 @@ OUTLINE_REVIEW_RAW_LIMIT = 60_000      # 大纲审阅时语料截取
 # Step3 专家意见仲裁
 ARBITRATE_EXPERT_LIMIT = 50_000        # 仲裁时专家意见截取
 
-# ============ API 调用延迟（秒） ============
-STEP6_CHAPTER_DELAY = float(_env("STEP6_CHAPTER_DELAY", "1.5"))
-STEP8_ITERATION_DELAY = float(_env("STEP8_ITERATION_DELAY", "1"))
+# 全流程任务图（full-report）：同时执行的节点数上限；节点内 LLM 调用仍受 provider 级自适应并发约束
+PIPELINE_MAX_PARALLEL = int(_env("PIPELINE_MAX_PARALLEL", "3"))
+# Step4→5→6 以章为粒度流水执行（各章整改完成即改写、核查，不等待其他章节）；0=逐步执行
+PIPELINE_CHAPTER_STREAM = _env("PIPELINE_CHAPTER_STREAM", "1") not in ("0", "false", "False", "")
+# 工作单元级检查点（每章 / 每节 / 每位专家 / 每章引用核查），中断后只重跑缺失或输入已变化的单元；0=关闭
+PIPELINE_CHECKPOINTS = _env("PIPELINE_CHECKPOINTS", "1") not in ("0", "false", "False", "")
+
+# 多轮对话流水线（all-context / step_report_pipeline）
+PIPELINE_BOUNDED_CONTEXT = _env("PIPELINE_BOUNDED_CONTEXT", "1") not in ("0", "false", "False", "")  # 0=每轮追加完整历史（旧行为）
+PIPELINE_ROUND_TOKENS = int(_env("PIPELINE_ROUND_TOKENS", "120000"))        # 每轮请求的输入 token 上限
+PIPELINE_SUMMARY_CHARS = int(_env("PIPELINE_SUMMARY_CHARS", "800"))         # 压缩历史轮次时保留的开头摘录字数
+
+# 编辑脚本模式（src/utils/edit_script.py：去重 / 补充 / 整改只输出编辑操作，本地应用，定位失败回退整章重写）
+LLM_EDIT_SCRIPT = _env("LLM_EDIT_SCRIPT", "0") not in ("0", "false", "False", "")  # 1=启用
+EDIT_SCRIPT_MAX_TOKENS = int(_env("EDIT_SCRIPT_MAX_TOKENS", "8192"))        # 编辑脚本输出上限
+
 
 # ============ Step0b 语料预处理 ============
 PREPROCESS_MODE = _env("PREPROCESS_MODE", "A")
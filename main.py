@@ -16,7 +16,7 @@ from config import RAW_DIR, REPORT_DIR
 from src.report_type_profiles import list_supported_report_types, load_report_type_profile
 
 REPORT_TYPE_CHOICES = list_supported_report_types()
-_PROVIDER_CHOICES = ["kimi", "gemini", "grok", "minimax", "glm", "qwen", "deepseek", "openai", "perplexity", "claude"]
+_PROVIDER_CHOICES = ["kimi", "gemini", "grok", "minimax", "glm", "qwen", "deepseek", "openai", "perplexity", "claude", "replay"]
 
 
 def _add_provider_arg(parser: argparse.ArgumentParser):
@@ -49,6 +49,22 @@ def _log_step(step_name: str):
     print(f"\n[{ts}] ---------- {step_name} ----------\n", flush=True)
 
 
+def _report_metrics(base: str):
+    """打印按 Step 汇总的 LLM 调用指标，并导出 JSON 摘要与 Prometheus textfile。"""
+    from config import METRICS_DIR, LLM_METRICS_TEXTFILE
+    from src.utils.metrics import get_metrics
+    metrics = get_metrics()
+    table = metrics.format_step_table()
+    if not table:
+        return
+    print(f"\nLLM 调用指标（按 Step）\n{table}\n", flush=True)
+    ts = time.strftime("%Y%m%d_%H%M%S")
+    json_path = metrics.write_json(METRICS_DIR / f"{base}_{ts}_metrics.json", run=base)
+    prom_path = Path(LLM_METRICS_TEXTFILE) if LLM_METRICS_TEXTFILE else METRICS_DIR / f"{base}_metrics.prom"
+    metrics.write_prometheus(prom_path, run=base)
+    print(f"指标已导出: {json_path.name}，{prom_path}", flush=True)
+
+
 def _find_report(base: str, suffix: str, ext: str = ".md") -> Path:
     """查找报告文件，优先无 _new 后缀，回退到 _new 变体。"""
     path = REPORT_DIR / f"{base}_{suffix}{ext}"
@@ -156,6 +172,106 @@ def _apply_lang(lang: str):
         config.REPORT_LANGUAGE = lang
 
 
+def _apply_cache(args):
+    """命令行指定缓存模式 / 非确定性缓存时覆盖 .env 配置。"""
+    mode = getattr(args, "cache", None)
+    nondeterministic = True if getattr(args, "cache_nondeterministic", False) else None
+    if mode or nondeterministic:
+        from src.utils.llm_cache import configure_response_cache
+        configure_response_cache(mode, nondeterministic)
+
+
+def _add_cache_arg(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--cache",
+        default=None,
+        choices=["rw", "ro", "off"],
+        help="LLM 响应缓存模式（rw=读写, ro=只读回放, off=旁路；默认取 LLM_CACHE_MODE）",
+    )
+    parser.add_argument(
+        "--cache-nondeterministic",
+        action="store_true",
+        help="同时缓存 temperature>0 的调用，使重跑结果可复现",
+    )
+
+
+def _apply_hedge(args):
+    """命令行 --hedge 启用对冲请求，可附带备选 provider 顺序。"""
+    hedge = getattr(args, "hedge", None)
+    if hedge is not None:
+        from src.llm_client import configure_hedging
+        configure_hedging(True, [p for p in hedge.split(",") if p.strip()] or None)
+
+
+def _add_hedge_arg(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--hedge",
+        nargs="?",
+        const="",
+        default=None,
+        metavar="PROVIDERS",
+        help="启用对冲请求：主 provider 超过 p90 延迟时向备选发副本并取先完成者（可指定顺序如 gemini,grok；默认取 LLM_HEDGE_PROVIDERS）",
+    )
+
+
+def _apply_batch_mode(args):
+    """命令行 --batch-mode 启用 Batch API 执行模式，可附带支持批处理的 provider 列表。"""
+    batch = getattr(args, "batch_mode", None)
+    if batch is not None:
+        from src.utils.batch_api import configure_batch_mode
+        configure_batch_mode(True, [p for p in batch.split(",") if p.strip()] or None)
+
+
+def _add_batch_arg(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--batch-mode",
+        nargs="?",
+        const="",
+        default=None,
+        metavar="PROVIDERS",
+        help="Step3/4/5/7/8 的章节调用走 provider Batch API（夜间任务，费用更低；可指定支持批处理的 provider 如 openai,qwen；不支持时回退实时调用）",
+    )
+
+
+def _apply_replay(args):
+    """命令行 --replay / --replay-archive 覆盖离线录制 / 回放配置。"""
+    mode = getattr(args, "replay", None)
+    archive = getattr(args, "replay_archive", None)
+    if mode or archive:
+        from src.utils.replay import configure_replay
+        configure_replay(mode, archive)
+
+
+def _add_replay_arg(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--replay",
+        default=None,
+        choices=["off", "record", "replay"],
+        help="LLM 离线录制 / 回放（record=录制真实调用, replay=不联网按归档回放；默认取 LLM_REPLAY_MODE）",
+    )
+    parser.add_argument(
+        "--replay-archive",
+        default=None,
+        metavar="PATH",
+        help="录制 / 回放归档路径（默认 output/replay/llm_replay.jsonl.gz）",
+    )
+
+
+def _apply_model_routes(args):
+    """加载报告类型配置中的模型路由章节，并叠加命令行 --routes。"""
+    from src.utils.model_routes import configure_model_routes
+    configure_model_routes(getattr(args, "report_type", None), getattr(args, "routes", None))
+
+
+def _add_routes_arg(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--routes",
+        default=None,
+        metavar="SPEC",
+        help="调用点模型路由，如 \"_api_deduplicate_chapter:provider=deepseek;step4b_consistency_check:provider=qwen\"（叠加在 LLM_ROUTES 与报告类型配置之上）",
+    )
+
+
 def _add_lang_arg(parser: argparse.ArgumentParser):
     parser.add_argument(
         "--lang",
@@ -286,6 +402,11 @@ def cmd_batch(args):
     """Step0 语料重整 + 全流程：读取目录语料 → 去重排序 → 1.0 → 专家 → 2.0 → 3.0"""
     _apply_provider(getattr(args, "provider", None))
     _apply_lang(getattr(args, "lang", None))
+    _apply_cache(args)
+    _apply_hedge(args)
+    _apply_batch_mode(args)
+    _apply_replay(args)
+    _apply_model_routes(args)
     dir_path = Path(args.dir)
     if not dir_path.is_absolute():
         dir_path = Path.cwd() / dir_path
@@ -304,7 +425,9 @@ def cmd_batch(args):
         _log_step("Step0 语料重整")
         raw_path = run_corpus_merge(dir_path, base, getattr(args, "recursive", False))
 
-    _run_standard_pipeline(raw_path, base, getattr(args, "final_style", "A"), getattr(args, "report_type", None), getattr(args, "interactive", False))
+    from src.utils.checkpoint import checkpoint_scope
+    with checkpoint_scope(base):
+        _run_standard_pipeline(raw_path, base, getattr(args, "final_style", "A"), getattr(args, "report_type", None), getattr(args, "interactive", False))
     from src.llm_client import print_token_summary
     print_token_summary()
     _log_banner("批量语料流程完成")
@@ -445,6 +568,11 @@ def cmd_all(args):
     """全流程：抓取/导入 → 报告1.0 → 专家 → 报告2.0 → 报告3.0 最终版+Word"""
     _apply_provider(getattr(args, "provider", None))
     _apply_lang(getattr(args, "lang", None))
+    _apply_cache(args)
+    _apply_hedge(args)
+    _apply_batch_mode(args)
+    _apply_replay(args)
+    _apply_model_routes(args)
     t_start = time.time()
     _log_banner("全流程开始")
     print(f"  输入: {args.input}", flush=True)
@@ -453,40 +581,28 @@ def cmd_all(args):
     raw_path = run_ingest(args.input, args.output)
     base = args.output or (raw_path.stem if raw_path else "share")
 
-    _run_standard_pipeline(raw_path, base, getattr(args, "final_style", "A"), getattr(args, "report_type", None), getattr(args, "interactive", False))
+    from src.utils.checkpoint import checkpoint_scope
+    with checkpoint_scope(base):
+        _run_standard_pipeline(raw_path, base, getattr(args, "final_style", "A"), getattr(args, "report_type", None), getattr(args, "interactive", False))
 
     from src.llm_client import print_token_summary
     print_token_summary()
+    _report_metrics(base)
     elapsed = time.time() - t_start
     _log_banner(f"全流程完成，总耗时 {elapsed/60:.1f} 分钟")
 
 
-def cmd_full_report(args):
-    """全流程 Step0→Step8：语料目录/文件 → 1.0→专家→2.0→3.0→4.0→Step7 学术分析→5.0，使用 Gemini，输出各版本文件。"""
-    _apply_provider(getattr(args, "provider", None))
-    _apply_lang(getattr(args, "lang", None))
-    input_path = Path(args.input)
-    if not input_path.is_absolute():
-        input_path = PROJECT_ROOT / input_path
-    base = args.output_base or (input_path.name if input_path.is_dir() else input_path.stem)
-    report_type = getattr(args, "report_type", None)
-    policy = getattr(args, "policy", "policy1")
-    no_resume = getattr(args, "no_resume", False)
-
-    from src.utils.progress import load_progress, save_progress, should_skip_step
-
-    progress = {} if no_resume else load_progress(base, REPORT_DIR)
-
+def _prepare_corpus(input_path: Path, base: str, args) -> Path:
+    """Step0：语料目录合并 / 本地预处理，或单文件导入，返回 output/raw 下的语料路径。"""
     if input_path.is_dir():
         if getattr(args, "preprocess", False):
             from src.step0b_preprocess import run_preprocess
             preprocess_mode = getattr(args, "preprocess_mode", "A")
             _log_step(f"Step0b 本地预处理 (Mode {preprocess_mode})")
-            raw_path = run_preprocess(input_path, base, preprocess_mode, getattr(args, "recursive", True))
-        else:
-            from src.step0_corpus_merge import run_corpus_merge
-            raw_path = run_corpus_merge(input_path, base, getattr(args, "recursive", True))
-    elif input_path.is_file():
+            return run_preprocess(input_path, base, preprocess_mode, getattr(args, "recursive", True))
+        from src.step0_corpus_merge import run_corpus_merge
+        return run_corpus_merge(input_path, base, getattr(args, "recursive", True))
+    if input_path.is_file():
         import shutil
         raw_path = RAW_DIR / f"{base}.txt"
         if input_path.suffix.lower() in (".txt", ".md"):
@@ -502,71 +618,287 @@ def cmd_full_report(args):
             else:
                 text = import_from_file(input_path)
             raw_path.write_text(text, encoding="utf-8", errors="replace")
-    else:
-        raise FileNotFoundError(f"输入不存在: {input_path}")
+        return raw_path
+    raise FileNotFoundError(f"输入不存在: {input_path}")
+
+
+def _docx_or_md(base: str, suffix: str) -> Path:
+    """优先 .docx，不存在时回退 .md（Step7/8/9 的输入）。"""
+    path = _find_report(base, suffix, ext=".docx")
+    return path if path.is_file() else _find_report(base, suffix)
+
+
+# 增量重建：各步骤在上游产物之外的输入——实现源文件（多数提示词内嵌其中）、提示词文件、相关截断上限；
+# 报告类型配置、Skill 目录与命令行参数在 _full_report_graph 中按本次参数补充
+_STEP_DEPS = {
+    "step0": {"files": ("src/step0_corpus_merge.py", "src/step0b_preprocess.py", "src/preprocess"),
+              "config": ("TEXT_EXTENSIONS", "PREPROCESS_NEAR_DEDUP_THRESHOLD", "PREPROCESS_PARAGRAPH_DEDUP_THRESHOLD",
+                         "PREPROCESS_MIN_BODY_CHARS", "PREPROCESS_TEXTRANK_SENTENCES", "PREPROCESS_CLUSTER_RANGE",
+                         "PREPROCESS_MAX_REPRESENTATIVES", "PREPROCESS_MINHASH_PERMS")},
+    "step2": {"files": ("src/step2_report_v1.py", "src/prompts.py"),
+              "config": ("RAW_LOAD_LIMIT", "OUTLINE_RAW_LIMIT", "OUTLINE_REVIEW_RAW_LIMIT", "CHAPTER_INTRO_BODY_LIMIT",
+                         "SUPPLEMENT_RAW_LIMIT", "SUPPLEMENT_REPORT_LIMIT", "DEDUP_REPORT_LIMIT", "ASSEMBLE_CHUNK_SIZE",
+                         "EDIT_SCRIPT_MAX_TOKENS")},
+    "step3": {"files": ("src/step3_experts.py",), "config": ("EXPERT_PREVIEW_LIMIT", "ARBITRATE_EXPERT_LIMIT")},
+    "step3b": {"files": ("src/step3b_expert_eval.py",), "config": ("EXPERT_PREVIEW_LIMIT",)},
+    "step4": {"files": ("src/step4_report_v2.py",),
+              "config": ("RAW_LOAD_LIMIT_V2", "HALLUCINATION_TEXT_LIMIT", "REVISE_RAW_CHUNK_LIMIT", "REVISE_EXPERT_LIMIT",
+                         "REVISE_CHAPTER_BODY_LIMIT", "EDIT_SCRIPT_MAX_TOKENS")},
+    "step5": {"files": ("src/step5_report_final.py", "prompts/common"),
+              "config": ("RAW_LOAD_LIMIT_FINAL", "PROSE_RAW_LIMIT", "PROSE_CHAPTER_BODY_LIMIT")},
+    "step4b": {"files": ("src/step4b_consistency_check.py",), "config": ("CONSISTENCY_REPORT_LIMIT", "CONSISTENCY_RAW_LIMIT")},
+    "step6": {"files": ("src/step6_report_v4.py",), "config": ("CITATION_CHAPTER_BODY_LIMIT", "PERPLEXITY_MODEL")},
+    "chapter_stream": {"files": ("src/step_chapter_stream.py",)},
+    "quality_eval": {"files": ("src/utils/quality_eval.py",)},
+    "drift_check": {"files": ("src/utils/semantic_drift.py",)},
+    "step7": {"files": ("src/step7_report_policy.py",),
+              "config": ("POLICY_CHAPTER_BODY_LIMIT", "POLICY_RAW_PREVIEW_LIMIT", "POLICY_RAW_TOTAL_LIMIT",
+                         "SKILL_TEXT_LIMIT", "SUMMARY_TEXT_LIMIT")},
+    "step8": {"files": ("src/step8_report_v5.py",),
+              "config": ("COMPRESS_SKILL_TEXT_LIMIT", "COMPRESS_SUMMARY_TEXT_LIMIT", "COMPRESS_DOC_LIMIT")},
+    "step9": {"files": ("src/step9_expert_polish.py", "src/research"), "config": ("PERPLEXITY_MODEL",)},
+}
+
+
+def _full_report_graph(input_path: Path, base: str, args):
+    """
+    full-report 任务图：Step0 → 2 → 3 → 4 → 5 → 6 → 7 → 8（→ 9），
+    Step4→5→6 默认合并为章节流水线节点（各章独立流经三步，见 step_chapter_stream）；
+    Step4b 一致性校验与 --checks 指定的质量评估 / 漂移检测作为旁路节点，与 Step6 之后的主链并行。
+    --eval-driven / --interactive 时 Step2~Step5 合并为一个节点（内部有迭代或人工确认点）。
+    各节点的 deps 声明上游产物之外的输入（见 _STEP_DEPS），用于增量重建。
+    """
+    from config import EXPERT_DIR, PIPELINE_CHAPTER_STREAM, SKILL_DIR
+    from src.report_type_profiles import DEFAULT_REPORT_TYPE, REPORT_TYPES_DIR
+    from src.utils.incremental import StepDeps
+    from src.utils.task_graph import TaskGraph
 
-    # Step2~Step5: 选择管线模式
-    use_eval_driven = getattr(args, "eval_driven", False)
-    if should_skip_step(progress, "standard_pipeline"):
-        _log_step("跳过 Step2~Step5（已完成）")
-    elif use_eval_driven:
+    report_type = getattr(args, "report_type", None)
+    policy = getattr(args, "policy", "policy1")
+    style = getattr(args, "style", "A")
+    if report_type and style == "A":
+        style = load_report_type_profile(report_type).get("default_style", style)
+    step7_suffix = load_report_type_profile(report_type).get("step7_title_suffix", "学术风格分析报告")
+    # 与 Step7/Step8 相同的 policy 解析：指定报告类型且未显式指定 policy 时取报告类型配置中的 policy_name
+    resolved_policy = policy
+    if policy == "policy1" and report_type:
+        resolved_policy = load_report_type_profile(report_type).get("policy_name", "policy1")
+    checks = {c.strip() for c in (getattr(args, "checks", None) or "").split(",") if c.strip()}
+    # 章节流水线只用于逐步管线（评估驱动 / 交互式管线内部自行生成 3.0）
+    chapter_stream_enabled = (PIPELINE_CHAPTER_STREAM and not getattr(args, "no_chapter_stream", False)
+                              and not getattr(args, "eval_driven", False) and not getattr(args, "interactive", False))
+
+    typed = StepDeps(files=(REPORT_TYPES_DIR / f"{(report_type or DEFAULT_REPORT_TYPE).strip()}.md",),
+                     params={"report_type": report_type})
+    styled = StepDeps(params={"style": style})
+    skill = StepDeps(files=(SKILL_DIR / resolved_policy,), params={"policy": resolved_policy})
+
+    def deps(*steps: str, extra: tuple = ()) -> StepDeps:
+        return StepDeps().merge(*(StepDeps(**_STEP_DEPS[s]) for s in steps), *extra)
+
+    graph = TaskGraph(f"full-report {base}")
+    for name, desc in (
+        ("raw", "原始语料"), ("report_v1", "报告 1.0"), ("experts", "专家意见仲裁 / 汇总"),
+        ("report_v2", "报告 2.0"), ("report_v3", "报告 3.0"), ("consistency", "一致性校验建议"),
+        ("quality", "质量评估 JSON"), ("drift", "语义漂移检测 JSON"), ("report_v4", "报告 4.0"),
+        ("policy_report", f"Step7 {step7_suffix}"), ("report_v5", "报告 5.0"), ("polished", "Step9 润色报告"),
+    ):
+        graph.artifact(name, Path, desc)
+
+    def step0(_):
+        return {"raw": _prepare_corpus(input_path, base, args)}
+
+    def raw_path() -> Path:
+        """Step0 的输出位置：预处理结果 / 语料包目录（含图片时）或文本文件，两者都在时取较新的。"""
+        if input_path.is_dir() and getattr(args, "preprocess", False):
+            return RAW_DIR / f"{base}_preprocessed.txt"
+        candidates = [RAW_DIR / f"{base}.txt"] + ([RAW_DIR / base] if input_path.is_dir() else [])
+        return max((p for p in candidates if p.exists()), key=lambda p: p.stat().st_mtime, default=candidates[0])
+
+    def step2(a):
+        from src.step2_report_v1 import run_meta_and_report_v1
+        return {"report_v1": run_meta_and_report_v1(a["raw"], base, report_type)["report_v1_path"]}
+
+    def experts_path() -> Path:
+        path = EXPERT_DIR / f"{base}_专家意见仲裁.md"
+        return path if path.is_file() else EXPERT_DIR / f"{base}_专家意见汇总.md"
+
+    def step3(a):
+        from src.step3_experts import run_experts
+        run_experts(a["report_v1"], base, report_type)
+        return {"experts": experts_path()}
+
+    def step4(a):
+        from src.step4_report_v2 import run_report_v2_and_docx
+        return {"report_v2": run_report_v2_and_docx(a["report_v1"], a["experts"], base, a["raw"])["report_v2_path"]}
+
+    def step5(a):
+        from src.step5_report_final import run_report_final
+        return {"report_v3": run_report_final(a["report_v2"], base, style, a["raw"])["report_v3_path"]}
+
+    def eval_pipeline(a):
         _log_step("评估驱动管线: Step2 → Step3b → Step5（迭代）→ Step4b")
-        _run_eval_driven_pipeline(raw_path, base, getattr(args, "style", "A"), report_type)
-        save_progress(base, REPORT_DIR, "standard_pipeline")
-    else:
-        _run_standard_pipeline(raw_path, base, getattr(args, "style", "A"), report_type, getattr(args, "interactive", False))
-        save_progress(base, REPORT_DIR, "standard_pipeline")
-
-    # Step6: 报告 4.0
-    if should_skip_step(progress, "step6"):
-        _log_step("跳过 Step6（已完成）")
-    else:
-        report_v3_path = _find_report(base, "report_v3")
+        _run_eval_driven_pipeline(a["raw"], base, style, report_type)
+        return {"report_v3": _find_report(base, "report_v3")}
+
+    def standard_pipeline(a):
+        _run_standard_pipeline(a["raw"], base, style, report_type, interactive=True)
+        report_v3 = _find_report(base, "report_v3")
+        if not report_v3.is_file():
+            raise RuntimeError("交互式审阅中止，未生成报告 3.0")
+        return {"report_v3": report_v3}
+
+    def step4b(a):
+        from src.step4b_consistency_check import run_consistency_check
+        return {"consistency": run_consistency_check(a["report_v3"], a["raw"], base)["suggestions_path"]}
+
+    def quality(a):
+        from src.utils.quality_eval import evaluate_report_quality
+        from src.utils.markdown_utils import read_report_text
+        from src.utils.file_utils import load_raw_content
+        output_path = REPORT_DIR / f"{base}_quality_eval.json"
+        evaluate_report_quality(read_report_text(a["report_v3"]), load_raw_content(a["raw"]), base, output_path)
+        return {"quality": output_path}
+
+    def drift(a):
+        from src.utils.semantic_drift import run_drift_check
+        return {"drift": run_drift_check(a["report_v1"], a["report_v3"], base).get("result_path")}
+
+    def chapter_stream(a):
+        from src.step_chapter_stream import run_chapter_stream
+        r = run_chapter_stream(a["report_v1"], a["experts"], base, a["raw"], style)
+        return {"report_v2": r["report_v2_path"], "report_v3": r["report_v3_path"],
+                "report_v4": _docx_or_md(base, "report_v4")}
+
+    def step6(a):
         from src.step6_report_v4 import run_report_v4
-        run_report_v4(report_v3_path, base)
-        save_progress(base, REPORT_DIR, "step6")
+        run_report_v4(a["report_v3"], base)
+        return {"report_v4": _docx_or_md(base, "report_v4")}
 
-    # Step7: 学术风格分析
-    if should_skip_step(progress, "step7"):
-        _log_step("跳过 Step7（已完成）")
-    else:
-        report_v4_path = _find_report(base, "report_v4", ext=".docx")
-        if not report_v4_path.is_file():
-            report_v4_path = _find_report(base, "report_v4")
+    def step7(a):
         from src.step7_report_policy import run_report_policy
-        run_report_policy(raw_path, report_v4_path, base, policy, report_type)
-        save_progress(base, REPORT_DIR, "step7")
+        run_report_policy(a["raw"], a["report_v4"], base, policy, report_type)
+        return {"policy_report": _docx_or_md(base, step7_suffix)}
 
-    # Step8: 压缩
-    if should_skip_step(progress, "step8"):
-        _log_step("跳过 Step8（已完成）")
-    else:
-        profile = load_report_type_profile(report_type)
-        step7_suffix = profile.get("step7_title_suffix", "学术风格分析报告")
-        policy_report = _find_report(base, step7_suffix, ext=".docx")
-        if not policy_report.is_file():
-            policy_report = _find_report(base, step7_suffix)
+    def step8(a):
         from src.step8_report_v5 import run_report_v5
-        run_report_v5(policy_report, base, policy, report_type)
-        save_progress(base, REPORT_DIR, "step8")
-
-    # Step9（可选）: 深度研究专家润色
-    if getattr(args, "deep_research", False):
-        if should_skip_step(progress, "step9"):
-            _log_step("跳过 Step9（已完成）")
+        return {"report_v5": run_report_v5(a["policy_report"], base, policy, report_type)["report_path"]}
+
+    def step9(a):
+        from src.step9_expert_polish import run_expert_polish
+        return {"polished": run_expert_polish(a["policy_report"], base)["report_path"]}
+
+    graph.node("step0", "Step0 语料整理", step0, outputs=("raw",), cost=2,
+               locate=lambda: {"raw": raw_path()},
+               deps=deps("step0", extra=(StepDeps(files=(input_path,), params={
+                   "preprocess": getattr(args, "preprocess", False),
+                   "preprocess_mode": getattr(args, "preprocess_mode", "A"),
+                   "recursive": getattr(args, "recursive", True)}),)))
+    if getattr(args, "eval_driven", False):
+        graph.node("eval_pipeline", "评估驱动管线 Step2→3b→5→4b", eval_pipeline, ("raw",), ("report_v3",), cost=30,
+                   locate=lambda: {"report_v3": _find_report(base, "report_v3")},
+                   deps=deps("step2", "step3b", "step5", "step4b", extra=(typed, styled, skill)))
+    elif getattr(args, "interactive", False):
+        graph.node("standard_pipeline", "交互式管线 Step2→5→4b", standard_pipeline, ("raw",), ("report_v3",), cost=36,
+                   locate=lambda: {"report_v3": _find_report(base, "report_v3")},
+                   deps=deps("step2", "step3", "step4", "step5", "step4b", extra=(typed, styled)))
+    else:
+        graph.node("step2", "Step2 报告 1.0", step2, ("raw",), ("report_v1",), cost=10,
+                   locate=lambda: {"report_v1": _find_report(base, "report_v1")}, deps=deps("step2", extra=(typed,)))
+        graph.node("step3", "Step3 专家评审", step3, ("report_v1",), ("experts",), cost=6,
+                   locate=lambda: {"experts": experts_path()}, deps=deps("step3", extra=(typed,)))
+        if chapter_stream_enabled:
+            graph.node("chapter_stream", "章节流水线 Step4→5→6", chapter_stream, ("report_v1", "experts", "raw"),
+                       ("report_v2", "report_v3", "report_v4"), cost=14,
+                       locate=lambda: {"report_v2": _find_report(base, "report_v2"),
+                                       "report_v3": _find_report(base, "report_v3"),
+                                       "report_v4": _docx_or_md(base, "report_v4")},
+                       deps=deps("chapter_stream", "step4", "step5", "step6", extra=(styled,)))
         else:
-            profile = load_report_type_profile(report_type)
-            step7_suffix = profile.get("step7_title_suffix", "学术风格分析报告")
-            polish_input = _find_report(base, step7_suffix, ext=".docx")
-            if not polish_input.is_file():
-                polish_input = _find_report(base, step7_suffix)
-            _log_step("Step9 深度研究专家润色")
-            from src.step9_expert_polish import run_expert_polish
-            run_expert_polish(polish_input, base)
-            save_progress(base, REPORT_DIR, "step9")
+            graph.node("step4", "Step4 报告 2.0", step4, ("report_v1", "experts", "raw"), ("report_v2",), cost=10,
+                       locate=lambda: {"report_v2": _find_report(base, "report_v2")}, deps=deps("step4"))
+            graph.node("step5", "Step5 报告 3.0", step5, ("report_v2", "raw"), ("report_v3",), cost=8,
+                       locate=lambda: {"report_v3": _find_report(base, "report_v3")}, deps=deps("step5", extra=(styled,)))
+        graph.node("step4b", "Step4b 一致性校验", step4b, ("report_v3", "raw"), ("consistency",), cost=2,
+                   locate=lambda: {"consistency": REPORT_DIR / f"{base}_consistency_suggestions.md"}, deps=deps("step4b"))
+        if "drift" in checks:
+            graph.node("drift_check", "语义漂移检测 1.0→3.0", drift, ("report_v1", "report_v3"), ("drift",),
+                       cost=1, required=False, locate=lambda: {"drift": REPORT_DIR / f"{base}_drift_check.json"},
+                       deps=deps("drift_check"))
+    if "quality" in checks:
+        graph.node("quality_eval", "报告 3.0 质量评估", quality, ("report_v3", "raw"), ("quality",),
+                   cost=1, required=False, locate=lambda: {"quality": REPORT_DIR / f"{base}_quality_eval.json"},
+                   deps=deps("quality_eval"))
+    if not chapter_stream_enabled:
+        graph.node("step6", "Step6 报告 4.0", step6, ("report_v3",), ("report_v4",), cost=4,
+                   locate=lambda: {"report_v4": _docx_or_md(base, "report_v4")}, deps=deps("step6"))
+    graph.node("step7", "Step7 学术风格分析", step7, ("raw", "report_v4"), ("policy_report",), cost=6,
+               locate=lambda: {"policy_report": _docx_or_md(base, step7_suffix)},
+               deps=deps("step7", extra=(typed, skill)))
+    graph.node("step8", "Step8 报告 5.0", step8, ("policy_report",), ("report_v5",), cost=4,
+               locate=lambda: {"report_v5": _find_report(base, "report_v5")}, deps=deps("step8", extra=(typed, skill)))
+    if getattr(args, "deep_research", False):
+        graph.node("step9", "Step9 深度研究专家润色", step9, ("policy_report",), ("polished",), cost=6,
+                   locate=lambda: {"polished": _find_report(base, "expert_polished")}, deps=deps("step9"))
+    return graph
 
-    from src.llm_client import print_token_summary
-    print_token_summary()
+
+def cmd_full_report(args):
+    """全流程 Step0→Step8：语料目录/文件 → 1.0→专家→2.0→3.0→4.0→Step7 学术分析→5.0，按任务图调度，输出各版本文件。"""
+    input_path = Path(args.input)
+    if not input_path.is_absolute():
+        input_path = PROJECT_ROOT / input_path
+    base = args.output_base or (input_path.name if input_path.is_dir() else input_path.stem)
+    graph = _full_report_graph(input_path, base, args)
+    view = getattr(args, "graph", None)
+    if view:
+        print(graph.to_dot() if view == "dot" else graph.describe())
+        return
+
+    _apply_provider(getattr(args, "provider", None))
+    _apply_lang(getattr(args, "lang", None))
+    _apply_cache(args)
+    _apply_hedge(args)
+    _apply_batch_mode(args)
+    _apply_replay(args)
+    _apply_model_routes(args)
+    from config import PIPELINE_MAX_PARALLEL
+    from src.utils.checkpoint import checkpoint_scope
+    from src.utils.incremental import explain_rebuild, step_fingerprint
+    from src.utils.log import log as _log
+    from src.utils.progress import last_build, load_progress, save_progress
+
+    resume = not getattr(args, "no_resume", False)
+    explain = getattr(args, "explain", False)
+    progress = load_progress(base, REPORT_DIR) if resume else {}
+    fingerprints = {}
+
+    def is_done(node, inputs, located) -> bool:
+        """增量重建：输入指纹与上次构建记录一致且输出仍在时跳过；--explain 时记录每个节点的判断依据。"""
+        fingerprint = fingerprints[node.name] = step_fingerprint(inputs, node.deps)
+        if not resume:
+            reasons = ["--no-resume"]
+        else:
+            reasons = explain_rebuild(last_build(progress, node.name), fingerprint)
+            if not reasons and located is None:
+                reasons = ["输出缺失"]
+        if explain:
+            _log(f"[增量] {node.name}: " + ("最新，跳过" if not reasons else "重建 ← " + "；".join(reasons)))
+        return not reasons
+
+    def mark_done(node, inputs, outputs):
+        build = fingerprints.get(node.name) or step_fingerprint(inputs, node.deps)
+        save_progress(base, REPORT_DIR, node.name, build=build)
+
+    max_parallel = getattr(args, "max_parallel", None) or PIPELINE_MAX_PARALLEL
+    _log_step(f"任务图调度（并行节点上限 {max_parallel}）")
+    try:
+        with checkpoint_scope(base, resume=resume):
+            graph.run(max_parallel=max_parallel, is_done=is_done, mark_done=mark_done)
+    finally:
+        from src.llm_client import print_token_summary
+        print_token_summary()
+        _report_metrics(base)
     _log_banner("全流程完成，已输出至 output/reports")
 
 
@@ -654,6 +986,11 @@ def main():
     _add_provider_arg(p0b2)
     _add_report_type_arg(p0b2)
     _add_lang_arg(p0b2)
+    _add_cache_arg(p0b2)
+    _add_hedge_arg(p0b2)
+    _add_batch_arg(p0b2)
+    _add_replay_arg(p0b2)
+    _add_routes_arg(p0b2)
     p0b2.set_defaults(func=cmd_batch)
 
     p2 = sub.add_parser("report-v1", help="Step2: 生成标题/摘要/关键词与深度报告 1.0")
@@ -778,6 +1115,11 @@ def main():
     _add_provider_arg(p0)
     _add_report_type_arg(p0)
     _add_lang_arg(p0)
+    _add_cache_arg(p0)
+    _add_hedge_arg(p0)
+    _add_batch_arg(p0)
+    _add_replay_arg(p0)
+    _add_routes_arg(p0)
     p0.set_defaults(func=cmd_all)
 
     p0b = sub.add_parser("all-v3", help="全流程：fetch → report-v3（按章节分段，篇幅充足）")
@@ -803,11 +1145,23 @@ def main():
     pfr.add_argument("--policy", default="policy1", help="Step7/Step8 使用的 skill 子目录")
     _add_report_type_arg(pfr)
     pfr.add_argument("-s", "--style", default="A", choices=["A", "B", "C", "D"], help="报告3.0风格(A=商业/B=可行性/C=学术/D=政治评论)")
-    pfr.add_argument("--no-resume", action="store_true", help="禁用断点续跑，强制从头执行")
+    pfr.add_argument("--no-resume", action="store_true", help="禁用断点续跑（步骤进度与工作单元检查点），强制从头执行")
+    pfr.add_argument("--explain", action="store_true",
+                     help="输出各步骤跳过 / 重建的原因（上游产物、提示词与配置文件、截断上限、模型、参数的变化）")
     pfr.add_argument("--eval-driven", action="store_true", help="评估驱动管线: Step3b评估→Step5改写（跳过Step3+Step4，质量闭环迭代）")
     pfr.add_argument("--deep-research", action="store_true", help="启用 Step9 深度研究专家润色（Perplexity）")
     pfr.add_argument("--interactive", action="store_true", help="交互式审阅模式")
+    pfr.add_argument("--checks", default=None, help="旁路校验节点，逗号分隔: quality（3.0 质量评估）, drift（1.0→3.0 漂移检测）")
+    pfr.add_argument("--no-chapter-stream", action="store_true", help="Step4/5/6 逐步执行（每步等待全部章节完成），不使用章节流水线")
+    pfr.add_argument("--max-parallel", type=int, default=None, help="同时执行的任务图节点数上限（默认 PIPELINE_MAX_PARALLEL）")
+    pfr.add_argument("--graph", nargs="?", const="text", choices=["text", "dot"], default=None,
+                     help="只打印执行计划（text=节点/关键路径/并行层级，dot=Graphviz）后退出，不执行")
     _add_lang_arg(pfr)
+    _add_cache_arg(pfr)
+    _add_hedge_arg(pfr)
+    _add_batch_arg(pfr)
+    _add_replay_arg(pfr)
+    _add_routes_arg(pfr)
     pfr.set_defaults(func=cmd_full_report)
 
     args = parser.parse_args()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+基准：对比 Step2 章节去重的「整章重写」与「编辑脚本」两种输出模式的输出 token 与墙钟耗时。
+对本地 Stub 服务发请求，Stub 按输出字数模拟生成耗时（--cps 字/秒），两种模式的修改内容相同：
+整章重写返回删去重复段落后的全文，编辑脚本返回对应的 delete 操作；最后校验两种模式结果一致。
+
+用法：python scripts/bench_edit_script.py --chapters 4 --cps 300
+"""
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+sys.path.insert(0, str(PROJECT_ROOT / "scripts"))
+
+os.environ.update(KIMI_API_KEY="stub", LLM_PROVIDER="kimi", LLM_CACHE_MODE="off", LLM_REPLAY_MODE="off")
+
+from src import llm_client
+from src.step2_report_v1 import _api_deduplicate_chapter
+from src.utils.edit_script import edit_script_stats
+from stub_openai_server import start_stub_server
+
+_SENTENCES = [
+    "数字经济的核心在于数据要素的流通与定价，{n} 号案例显示地方数据交易所的挂牌量同比增长显著。",
+    "从产业链角度看，上游算力与下游应用之间存在明显的结构性错配，第 {n} 组调研数据支持这一判断。",
+    "政策层面需要兼顾激励与规范，避免以规模为单一指标的粗放扩张，参见附表 {n} 的区域对比。",
+    "企业端的数字化投入呈现出边际收益递减的特征，{n} 家样本企业的投入产出比在第三年后明显回落。",
+]
+
+
+def _chapter(index: int, paragraphs: int, duplicates: int) -> tuple[str, str, list[str]]:
+    """生成一章：paragraphs 个互不相同的段落，另有 duplicates 个段落重复出现；返回 (标题, 正文, 重复段落)。"""
+    paras = []
+    for p in range(paragraphs):
+        paras.append("".join(s.format(n=f"{index}-{p}-{k}") for k, s in enumerate(_SENTENCES * 2)))
+    dups = [f"如前所述，{para}" for para in paras[1:1 + duplicates]]  # 换个说法重复前文
+    body = []
+    for p, para in enumerate(paras):
+        if p and p % 3 == 0:
+            body.append(f"### {index}.{p // 3} 小节")
+        body.append(para)
+    body += dups  # 章末重复出现前文段落
+    return f"## 第{index}章 基准章节", "\n\n".join(body), dups
+
+
+def _responder(chapters: dict):
+    """按请求中的章节返回去重结果：编辑脚本模式返回 delete 操作，否则返回整章。"""
+    def respond(payload: dict) -> str:
+        user = payload["messages"][-1]["content"]
+        title = next(t for t in chapters if f"【本章标题】{t}" in user)
+        body, dups = chapters[title]
+        if "编辑脚本" in user:
+            edits = [{"op": "delete", "anchor": f"{d[:20]}……{d[-24:]}"} for d in dups]
+            return json.dumps({"edits": edits}, ensure_ascii=False)
+        kept = [para for para in body.split("\n\n") if para not in dups]
+        return f"{title}\n\n" + "\n\n".join(kept)
+    return respond
+
+
+def _run(chapters: dict, edit_script: bool) -> tuple[list[float], int, list[str]]:
+    llm_client.reset_token_tracker()
+    samples, results = [], []
+    for i, (title, (body, _)) in enumerate(chapters.items()):
+        t0 = time.perf_counter()
+        results.append(_api_deduplicate_chapter(title, body, i + 1, len(chapters), edit_script=edit_script))
+        samples.append(time.perf_counter() - t0)
+    return samples, llm_client._tracker.summary()["total_output_tokens"], results
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="整章重写 vs 编辑脚本：输出 token 与耗时基准")
+    parser.add_argument("--chapters", type=int, default=4, help="章节数")
+    parser.add_argument("--paragraphs", type=int, default=12, help="每章段落数")
+    parser.add_argument("--duplicates", type=int, default=2, help="每章重复段落数")
+    parser.add_argument("--cps", type=float, default=300.0, help="模拟生成速度（输出字/秒）")
+    args = parser.parse_args()
+
+    chapters = {}
+    for i in range(1, args.chapters + 1):
+        title, body, dups = _chapter(i, args.paragraphs, args.duplicates)
+        chapters[title] = (body, dups)
+    server, base_url = start_stub_server(responder=_responder(chapters), char_latency=1.0 / args.cps)
+    llm_client.PROVIDER_CONFIG["kimi"]["base_url"] = base_url
+    avg = statistics.mean(len(b) for b, _ in chapters.values())
+    print(f"Stub 服务: {base_url}  章节 {args.chapters} × 约 {avg:,.0f} 字，生成速度 {args.cps:.0f} 字/秒\n")
+    try:
+        rows = {}
+        for label, mode in (("整章重写", False), ("编辑脚本", True)):
+            samples, out_tokens, results = _run(chapters, mode)
+            rows[label] = results
+            print(f"{label:<8} 输出 tokens={out_tokens:>8,}  总耗时={sum(samples):7.2f}s  "
+                  f"单章 p50={statistics.median(samples):6.2f}s  max={max(samples):6.2f}s")
+        same = rows["整章重写"] == rows["编辑脚本"]
+        print(f"\n两种模式结果{'一致' if same else '不一致'}；编辑脚本统计: {edit_script_stats()}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+微基准：对比「每次新建 OpenAI 客户端」与「共享连接池客户端」的单次调用开销。
+对本地 Stub 服务发请求，排除网络与模型延迟，只衡量客户端自身开销。
+
+用法：python scripts/bench_llm_client.py -n 200
+"""
+import statistics
+import sys
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+sys.path.insert(0, str(PROJECT_ROOT / "scripts"))
+
+import httpx
+from openai import OpenAI
+
+from src import llm_client
+from stub_openai_server import start_stub_server
+
+_MESSAGES = [{"role": "user", "content": "ping"}]
+
+
+def _call_fresh_client(base_url: str):
+    """旧路径：每次调用新建 httpx.Client + OpenAI。"""
+    client = OpenAI(api_key="stub", base_url=base_url, http_client=httpx.Client(timeout=llm_client.HTTP_TIMEOUT))
+    client.chat.completions.create(model="stub", messages=_MESSAGES, max_tokens=16)
+
+
+def _call_pooled_client(base_url: str):
+    """新路径：从注册表取共享客户端。"""
+    client = llm_client._get_openai_client("openai", "stub", base_url)
+    client.chat.completions.create(model="stub", messages=_MESSAGES, max_tokens=16)
+
+
+def _bench(label: str, fn, base_url: str, n: int) -> list[float]:
+    fn(base_url)  # 预热
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn(base_url)
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    p50 = statistics.median(samples)
+    p90 = samples[int(len(samples) * 0.9) - 1]
+    print(f"{label:<16} n={n:<5} mean={statistics.mean(samples):7.2f}ms  p50={p50:7.2f}ms  p90={p90:7.2f}ms")
+    return samples
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="LLM 客户端连接池微基准")
+    parser.add_argument("-n", type=int, default=200, help="每组调用次数")
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server()
+    print(f"Stub 服务: {base_url}")
+    try:
+        before = _bench("fresh-client", _call_fresh_client, base_url, args.n)
+        after = _bench("pooled-client", _call_pooled_client, base_url, args.n)
+        saved = statistics.mean(before) - statistics.mean(after)
+        print(f"平均每次调用节省 {saved:.2f}ms（{100 * saved / statistics.mean(before):.0f}%）")
+    finally:
+        llm_client.close_clients()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+本地 OpenAI 兼容 Stub 服务：供基准测试使用，无需网络与 API Key。
+POST /chat/completions 返回固定回复（支持 stream=true 的 SSE），可模拟服务端延迟与按输出字数计的生成耗时；
+传入 responder 时按请求内容生成回复。
+
+同时模拟 OpenAI Batch API（供 --batch-mode 测试）：POST /files（multipart 上传任务文件）、POST /batches、
+GET /batches/{id}、POST /batches/{id}/cancel、GET /files/{id}/content；任务在 batch_latency 秒后完成，
+各行按 /chat/completions 同样的规则生成回复。
+"""
+import email.parser
+import email.policy
+import itertools
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+
+class _BatchStore:
+    """Batch API 的内存状态：上传的文件与批处理任务。"""
+
+    def __init__(self, latency: float, answer):
+        self.latency = latency
+        self.answer = answer
+        self.lock = threading.Lock()
+        self.files: dict[str, dict] = {}
+        self.batches: dict[str, dict] = {}
+        self._ids = itertools.count(1)
+
+    def add_file(self, filename: str, content: bytes, purpose: str) -> dict:
+        with self.lock:
+            file_id = f"file-{next(self._ids)}"
+            self.files[file_id] = {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                                   "filename": filename, "purpose": purpose, "status": "processed", "content": content}
+        return {k: v for k, v in self.files[file_id].items() if k != "content"}
+
+    def create_batch(self, body: dict) -> dict:
+        with self.lock:
+            if body.get("input_file_id") not in self.files:
+                return None
+            batch_id = f"batch-{next(self._ids)}"
+            self.batches[batch_id] = {
+                "id": batch_id, "object": "batch", "endpoint": body.get("endpoint"), "errors": None,
+                "input_file_id": body["input_file_id"], "completion_window": body.get("completion_window", "24h"),
+                "status": "validating", "output_file_id": None, "error_file_id": None,
+                "created_at": int(time.time()), "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            }
+        threading.Thread(target=self._process, args=(batch_id,), daemon=True).start()
+        return dict(self.batches[batch_id])
+
+    def _process(self, batch_id: str):
+        batch = self.batches[batch_id]
+        batch["status"] = "in_progress"
+        time.sleep(self.latency)
+        if batch["status"] != "in_progress":  # 已取消
+            return
+        lines = self.files[batch["input_file_id"]]["content"].decode("utf-8").splitlines()
+        output = []
+        for line in filter(str.strip, lines):
+            row = json.loads(line)
+            text = self.answer(row["body"])
+            output.append(json.dumps({
+                "id": f"resp-{row['custom_id']}", "custom_id": row["custom_id"], "error": None,
+                "response": {"status_code": 200, "request_id": row["custom_id"], "body": _completion(row["body"], text)},
+            }, ensure_ascii=False))
+        out = self.add_file(f"{batch_id}_output.jsonl", ("\n".join(output) + "\n").encode("utf-8"), "batch_output")
+        with self.lock:
+            batch.update(status="completed", output_file_id=out["id"],
+                         request_counts={"total": len(output), "completed": len(output), "failed": 0})
+
+
+def _completion(payload: dict, text: str) -> dict:
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload.get("model", "stub"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": text},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 10, "completion_tokens": len(text), "total_tokens": 10 + len(text)},
+    }
+
+
+def _make_handler(latency: float, reply: str, responder=None, char_latency: float = 0.0, batch_latency: float = 0.0):
+    batches = _BatchStore(batch_latency, lambda payload: responder(payload) if responder else reply)
+
+    class _Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # 支持 keep-alive
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, body: dict):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_stream(self, payload: dict, reply: str):
+            """SSE 流式响应：按字切分回复，末尾附 usage。"""
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            base = {"id": "chatcmpl-stub", "object": "chat.completion.chunk",
+                    "created": int(time.time()), "model": payload.get("model", "stub")}
+            for ch in reply:
+                event = {**base, "choices": [{"index": 0, "delta": {"content": ch}, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+            done = {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": len(reply), "total_tokens": 10 + len(reply)}}
+            self.wfile.write(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+            self.close_connection = True
+
+        def _upload(self, raw: bytes):
+            """multipart/form-data 上传：字段 file 与 purpose。"""
+            head = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("utf-8")
+            message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(head + raw)
+            fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+            if "file" not in fields:
+                self._send_json(400, {"error": {"message": "missing file"}})
+                return
+            purpose = fields["purpose"].get_content().strip() if "purpose" in fields else "batch"
+            self._send_json(200, batches.add_file(fields["file"].get_filename() or "upload.jsonl",
+                                                  fields["file"].get_payload(decode=True), purpose))
+
+        def do_GET(self):
+            parts = self.path.rstrip("/").split("/")
+            if len(parts) >= 2 and parts[-2] == "batches" and parts[-1] in batches.batches:
+                self._send_json(200, batches.batches[parts[-1]])
+            elif len(parts) >= 3 and parts[-1] == "content" and parts[-2] in batches.files:
+                data = batches.files[parts[-2]]["content"]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            else:
+                self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length)
+            path = self.path.rstrip("/")
+            if path.endswith("/files"):
+                self._upload(raw)
+                return
+            payload = json.loads(raw or b"{}")
+            if path.endswith("/batches"):
+                batch = batches.create_batch(payload)
+                if batch is None:
+                    self._send_json(400, {"error": {"message": "unknown input_file_id"}})
+                else:
+                    self._send_json(200, batch)
+                return
+            if path.endswith("/cancel") and path.split("/")[-2] in batches.batches:
+                batch = batches.batches[path.split("/")[-2]]
+                batch["status"] = "cancelled"
+                self._send_json(200, batch)
+                return
+            if not path.endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+                return
+            text = responder(payload) if responder else reply
+            if latency or char_latency:
+                time.sleep(latency + char_latency * len(text))
+            if payload.get("stream"):
+                self._send_stream(payload, text)
+                return
+            self._send_json(200, _completion(payload, text))
+
+    return _Handler
+
+
+class _StubServer(ThreadingHTTPServer):
+    request_queue_size = 128  # 默认 backlog 为 5，高并发压测时会触发 SYN 重传
+    daemon_threads = True
+
+
+def start_stub_server(port: int = 0, latency: float = 0.0, reply: str = "ok", responder=None,
+                      char_latency: float = 0.0, batch_latency: float = 0.0) -> tuple[ThreadingHTTPServer, str]:
+    """
+    后台线程启动 Stub 服务，返回 (server, base_url)。port=0 时自动分配端口。
+    responder(payload) -> str 按请求生成回复（覆盖 reply）；char_latency 为每输出一个字的模拟生成耗时（秒）；
+    batch_latency 为批处理任务从创建到完成的耗时（秒）。
+    """
+    server = _StubServer(("127.0.0.1", port), _make_handler(latency, reply, responder, char_latency, batch_latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, real_port = server.server_address[:2]
+    return server, f"http://{host}:{real_port}/v1"
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容 Stub 服务")
+    parser.add_argument("--port", type=int, default=8765, help="监听端口")
+    parser.add_argument("--latency", type=float, default=0.0, help="模拟服务端延迟（秒）")
+    parser.add_argument("--batch-latency", type=float, default=5.0, help="批处理任务完成耗时（秒）")
+    args = parser.parse_args()
+    srv, url = start_stub_server(args.port, args.latency, batch_latency=args.batch_latency)
+    print(f"Stub 服务已启动: {url}（Ctrl-C 退出）")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        srv.shutdown()
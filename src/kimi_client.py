@@ -4,15 +4,15 @@ import src  # noqa: F401  — 确保 PROJECT_ROOT 加入 sys.path
 
 from config import KIMI_API_KEY, KIMI_BASE_URL
 from src.llm_client import chat as _chat, chat_vision as _chat_vision
+from src.utils.bounded_context import BoundedContext
 
 
 def get_client():
-    """兼容旧代码，返回可用于直接调用的 chat 函数。"""
-    import httpx
-    from openai import OpenAI
+    """兼容旧代码，返回共享连接池中的 Kimi OpenAI 客户端。"""
+    from src.llm_client import _get_openai_client
     if not KIMI_API_KEY:
         raise ValueError("请设置环境变量 KIMI_API_KEY 或在 .env 中配置")
-    return OpenAI(api_key=KIMI_API_KEY, base_url=KIMI_BASE_URL, http_client=httpx.Client(timeout=60.0, read=180.0))
+    return _get_openai_client("kimi", KIMI_API_KEY, KIMI_BASE_URL)
 
 
 def chat(messages: list, model: str = None, max_tokens: int = 8192, temperature: float = 0.6, provider: str = None) -> str:
@@ -26,16 +26,25 @@ def chat_vision(messages: list, model: str = None, max_tokens: int = 8192, tempe
 
 
 def chat_append(
-    messages: list,
+    messages,
     user_content: str,
     model: str = None,
     max_tokens: int = 8192,
     temperature: float = 0.6,
-) -> tuple[str, list]:
+    label: str = "",
+    keep: bool = False,
+):
     """
     多轮对话：追加 user 消息，调用 API，追加 assistant 回复。
-    返回 (assistant 回复文本, 更新后的 messages 列表)。
+    messages 为消息列表时返回 (assistant 回复文本, 更新后的 messages 列表)；
+    为 BoundedContext 时按其规则组装本轮消息（label / keep 标记该轮在后续轮次中的保留方式），
+    返回 (assistant 回复文本, 同一个 BoundedContext)。
     """
+    if isinstance(messages, BoundedContext):
+        reply = chat(messages.messages_for(user_content, max_tokens), model=model, max_tokens=max_tokens,
+                     temperature=temperature)
+        messages.append(user_content, reply, label=label, keep=keep)
+        return reply, messages
     messages = list(messages)
     messages.append({"role": "user", "content": user_content})
     reply = chat(messages, model=model, max_tokens=max_tokens, temperature=temperature)
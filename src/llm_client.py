@@ -1,10 +1,22 @@
 # -*- coding: utf-8 -*-
 """
 统一 LLM 客户端：支持 Kimi、Gemini、Grok、MiniMax、GLM、Qwen、DeepSeek、OpenAI、Perplexity、Claude。
-通过 LLM_PROVIDER 环境变量或 provider 参数切换。
+通过 LLM_PROVIDER 环境变量或 provider 参数切换；replay 为离线回放 provider（见 src/utils/replay.py）。
 """
+import asyncio
+import atexit
+import contextvars
+import inspect
+import json
 import os
+import random
+import re
 import threading
+import weakref
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Iterator
 
 import src  # noqa: F401  — 确保 PROJECT_ROOT 加入 sys.path
 
@@ -14,6 +26,25 @@ import httpx
 from openai import OpenAI
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception
 
+from src.utils.adaptive_concurrency import get_adaptive_concurrency
+from src.utils.batch_api import BatchUnavailable, batch_mode_applies, batch_stats, get_batch_collector, realtime
+from src.utils.circuit_breaker import CircuitOpenError, get_circuit_breakers
+from src.utils.llm_cache import get_response_cache, request_hash
+from src.utils.hedge import LatencyStats, parse_provider_list
+from src.utils.json_output import JSONOutputError, parse_json_output, repair_prompt, schema_digest
+from src.utils.key_pool import current_endpoint, get_key_pool, parse_weighted
+from src.utils.metrics import (
+    track_call, current_call, current_tags, note_tokens, note_model, note_retry, note_continuation, note_first_byte,
+    note_cache_hit, note_coalesced,
+)
+from src.utils.model_routes import get_model_routes
+from src.utils.parallel import check_cancelled
+from src.utils.prompt_prefix import EPHEMERAL, MIN_CACHE_CHARS, plain_messages
+from src.utils.rate_limit import get_rate_limiter, settle_current
+from src.utils.replay import ReplayMiss, get_replay_archive, replay_key
+from src.utils.single_flight import SingleFlight
+from src.utils.token_budget import estimate_message_tokens, estimate_tokens
+
 from config import (
     LLM_PROVIDER,
     KIMI_API_KEY, KIMI_BASE_URL, KIMI_MODEL, KIMI_VISION_MODEL,
@@ -26,6 +57,12 @@ from config import (
     OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_MODEL,
     PERPLEXITY_API_KEY, PERPLEXITY_BASE_URL, PERPLEXITY_MODEL,
     ANTHROPIC_API_KEY, ANTHROPIC_MODEL,
+    LLM_POOL_MAX_CONNECTIONS, LLM_POOL_MAX_KEEPALIVE, LLM_POOL_KEEPALIVE_EXPIRY, LLM_HTTP2,
+    LLM_ASYNC_CONCURRENCY, LLM_STREAM, LLM_STREAM_MAX_RESUMES, LLM_STREAM_SPOOL_DIR, LLM_MAX_CONTINUATIONS,
+    LLM_HEDGE, LLM_HEDGE_PROVIDERS, LLM_HEDGE_QUANTILE, LLM_HEDGE_MIN_SAMPLES,
+    LLM_HEDGE_TTFB_FALLBACK, LLM_HEDGE_TOTAL_FALLBACK, LLM_HEDGE_MAX,
+    LLM_SINGLE_FLIGHT, LLM_RETRY_ATTEMPTS, LLM_RETRY_MAX_WAIT, LLM_BREAKER_FALLBACK,
+    LLM_ROUTING_POOL,
 )
 
 HTTP_TIMEOUT = httpx.Timeout(60.0, read=600.0)
@@ -80,54 +117,260 @@ PROVIDER_CONFIG = {
         "key": GEMINI_API_KEY,
         "model": GEMINI_MODEL,
     },
+    # 离线回放：不发起网络请求，响应来自 LLM_REPLAY_ARCHIVE
+    "replay": {
+        "key": "offline",
+        "model": "replay",
+    },
 }
 
 # OpenAI 兼容的 provider 列表
 _OPENAI_COMPATIBLE = ("kimi", "grok", "minimax", "glm", "qwen", "deepseek", "openai", "perplexity")
 
 
+# ============ 客户端连接池 ============
+class _ClientRegistry:
+    """
+    线程安全的长连接客户端注册表。
+    按 (provider, base_url, key, timeout) 缓存 SDK 客户端与 httpx 连接池，
+    避免每次调用重复 TLS 握手与 SDK 初始化。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients: dict[tuple, object] = {}
+        self._closers: list = []
+
+    def get(self, key: tuple, factory):
+        """取出 key 对应的客户端，不存在时调用 factory() 创建。factory 返回 (client, closer)。"""
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client, closer = factory()
+                self._clients[key] = client
+                if closer is not None:
+                    self._closers.append(closer)
+            return client
+
+    def _drain(self) -> list:
+        with self._lock:
+            closers, self._closers = self._closers, []
+            self._clients.clear()
+        return closers
+
+    def close_all(self):
+        """关闭所有底层连接池，清空注册表。"""
+        for closer in self._drain():
+            try:
+                closer()
+            except Exception:
+                pass
+
+    async def aclose_all(self):
+        """异步客户端的关闭（closer 可返回协程）。"""
+        for closer in self._drain():
+            try:
+                result = closer()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                pass
+
+
+_clients = _ClientRegistry()
+
+
+def _timeout_key(timeout: httpx.Timeout) -> tuple:
+    return (timeout.connect, timeout.read, timeout.write, timeout.pool)
+
+
+def _http2_enabled() -> bool:
+    """LLM_HTTP2 开启且已安装 h2 时使用 HTTP/2。"""
+    if not LLM_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _new_http_client(timeout: httpx.Timeout = HTTP_TIMEOUT) -> httpx.Client:
+    """创建带连接池上限的 httpx.Client。"""
+    return httpx.Client(
+        timeout=timeout,
+        limits=httpx.Limits(
+            max_connections=LLM_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_POOL_KEEPALIVE_EXPIRY,
+        ),
+        http2=_http2_enabled(),
+    )
+
+
+def _get_http_client(provider: str, timeout: httpx.Timeout = HTTP_TIMEOUT) -> httpx.Client:
+    """provider 共享的原生 httpx 客户端（Perplexity 引用接口等直连 REST 的调用）。"""
+    def _factory():
+        client = _new_http_client(timeout)
+        return client, client.close
+    return _clients.get(("httpx", provider, _timeout_key(timeout)), _factory)
+
+
+def _get_openai_client(provider: str, key: str, base_url: str = None, timeout: httpx.Timeout = HTTP_TIMEOUT) -> OpenAI:
+    """OpenAI 兼容 provider 的共享客户端。"""
+    def _factory():
+        http_client = _new_http_client(timeout)
+        client = OpenAI(api_key=key, base_url=base_url, http_client=http_client, max_retries=0)
+        return client, http_client.close
+    return _clients.get(("openai", provider, base_url, key, _timeout_key(timeout)), _factory)
+
+
+def _get_anthropic_client(key: str, timeout: httpx.Timeout = HTTP_TIMEOUT):
+    """Anthropic 共享客户端。"""
+    try:
+        from anthropic import Anthropic
+    except ImportError:
+        raise ImportError("Claude 需安装 anthropic: pip install anthropic")
+
+    def _factory():
+        http_client = _new_http_client(timeout)
+        client = Anthropic(api_key=key, http_client=http_client, max_retries=0)
+        return client, http_client.close
+    return _clients.get(("claude", None, key, _timeout_key(timeout)), _factory)
+
+
+def _get_gemini_model(key: str, model: str):
+    """Gemini 共享 GenerativeModel。genai.configure 为进程级设置，仅在 key 变化时重新执行。"""
+    try:
+        import google.generativeai as genai
+    except ImportError:
+        raise ImportError("Gemini 需安装 google-generativeai: pip install google-generativeai")
+
+    def _configure():
+        genai.configure(api_key=key)
+        return key, None
+
+    _clients.get(("gemini-configure", None, key, None), _configure)
+    return _clients.get(("gemini", model, key, None), lambda: (genai.GenerativeModel(model), None))
+
+
+def close_clients():
+    """关闭所有共享客户端与连接池（进程退出时自动调用）。"""
+    _clients.close_all()
+
+
+atexit.register(close_clients)
+
+
 # ============ Token 用量统计 ============
 class _TokenTracker:
-    """线程安全的 token 用量统计。"""
+    """线程安全的 token 用量统计（按 provider 聚合，内存固定）；明细分布见 src/utils/metrics.py。"""
 
     def __init__(self):
         self._lock = threading.Lock()
-        self._calls: list[dict] = []
+        self._by_provider: dict[str, dict] = {}
+        self._hedged_calls = 0
+        self._hedge_wins: dict[str, int] = {}
+        self._continued_calls = 0
+        self._continuations = 0
+        self._still_truncated = 0
+        self._json_repairs = 0
+        self._json_failures = 0
 
-    def record(self, provider: str, model: str, input_tokens: int = 0, output_tokens: int = 0):
+    def record(self, provider: str, model: str, input_tokens: int = 0, output_tokens: int = 0,
+               cached_tokens: int = 0):
+        """cached_tokens 为 input_tokens 中命中 provider 提示缓存的部分。"""
+        settle_current(input_tokens + output_tokens)
+        note_tokens(input_tokens, output_tokens, cached_tokens)
+        note_model(provider, model)
         with self._lock:
-            self._calls.append({
-                "provider": provider, "model": model,
-                "input_tokens": input_tokens, "output_tokens": output_tokens,
-                "ts": _time.time(),
-            })
+            g = self._by_provider.setdefault(
+                provider, {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cached_input_tokens": 0})
+            g["calls"] += 1
+            g["input_tokens"] += input_tokens
+            g["output_tokens"] += output_tokens
+            g["cached_input_tokens"] += cached_tokens
+
+    def record_hedge(self, primary: str, winner: str, launched: list[str]):
+        """记录一次对冲调用：主 provider、胜出 provider 与实际发出的各路请求。"""
+        with self._lock:
+            self._hedged_calls += 1
+            if len(launched) > 1 or winner != primary:
+                self._hedge_wins[winner] = self._hedge_wins.get(winner, 0) + 1
+
+    def record_continuation(self, rounds: int, still_truncated: bool):
+        """记录一次因 max_tokens 截断而续写的调用：续写轮数，以及达到上限后是否仍被截断。"""
+        with self._lock:
+            self._continued_calls += 1
+            self._continuations += rounds
+            self._still_truncated += int(still_truncated)
+
+    def record_json_repair(self):
+        with self._lock:
+            self._json_repairs += 1
+
+    def record_json_failure(self):
+        with self._lock:
+            self._json_failures += 1
 
     def summary(self) -> dict:
         with self._lock:
-            total_in = sum(c["input_tokens"] for c in self._calls)
-            total_out = sum(c["output_tokens"] for c in self._calls)
-            by_provider: dict[str, dict] = {}
-            for c in self._calls:
-                p = c["provider"]
-                g = by_provider.setdefault(p, {"calls": 0, "input_tokens": 0, "output_tokens": 0})
-                g["calls"] += 1
-                g["input_tokens"] += c["input_tokens"]
-                g["output_tokens"] += c["output_tokens"]
+            by_provider = {p: dict(g) for p, g in self._by_provider.items()}
+            total_in = sum(g["input_tokens"] for g in by_provider.values())
+            total_out = sum(g["output_tokens"] for g in by_provider.values())
             return {
-                "total_calls": len(self._calls),
+                "total_calls": sum(g["calls"] for g in by_provider.values()),
                 "total_input_tokens": total_in,
+                "total_cached_input_tokens": sum(g["cached_input_tokens"] for g in by_provider.values()),
                 "total_output_tokens": total_out,
                 "total_tokens": total_in + total_out,
                 "by_provider": by_provider,
+                "hedged_calls": self._hedged_calls,
+                "hedges_fired": sum(self._hedge_wins.values()),
+                "hedge_wins": dict(self._hedge_wins),
+                "continued_calls": self._continued_calls,
+                "continuations": self._continuations,
+                "still_truncated": self._still_truncated,
+                "json_repairs": self._json_repairs,
+                "json_failures": self._json_failures,
             }
 
     def reset(self):
         with self._lock:
-            self._calls.clear()
+            self._by_provider.clear()
+            self._hedged_calls = 0
+            self._hedge_wins.clear()
+            self._continued_calls = 0
+            self._continuations = 0
+            self._still_truncated = 0
+            self._json_repairs = 0
+            self._json_failures = 0
 
 
 _tracker = _TokenTracker()
 
+# 相同请求的在途合并（线程与 asyncio 路径共用）
+_single_flight = SingleFlight(LLM_SINGLE_FLIGHT)
+
+
+class _ProviderHTTPError(RuntimeError):
+    """直连 REST 接口（Perplexity）的 HTTP 错误；保留响应以便读取 Retry-After 等头。"""
+
+    def __init__(self, message: str, response: httpx.Response):
+        super().__init__(message)
+        self.response = response
+        self.status_code = response.status_code
+
+
+def _status_code(exc: BaseException) -> int | None:
+    code = getattr(exc, "status_code", None)
+    if code is None:
+        code = getattr(getattr(exc, "response", None), "status_code", None)
+    return code if isinstance(code, int) else None
+
 
 def _is_retryable(exc: BaseException) -> bool:
     """判断异常是否值得重试：5xx、429、超时、连接错误。"""
@@ -160,33 +403,264 @@ def _is_retryable(exc: BaseException) -> bool:
     return False
 
 
+def _is_service_failure(exc: BaseException) -> bool:
+    """计入熔断的失败：可重试错误中除 429 以外的（超时、连接错误、5xx）。"""
+    if not isinstance(exc, Exception) or isinstance(exc, CircuitOpenError):
+        return False
+    return _is_retryable(exc) and _status_code(exc) != 429 and "API 429" not in str(exc)
+
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+def _parse_reset(value: str) -> float | None:
+    """解析 x-ratelimit-reset* 头：秒数、Unix 时间戳，或 OpenAI 风格的 "6m0s" / "20ms"。"""
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+        return seconds - _time.time() if seconds > 1e9 else seconds
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    unit = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(n) * unit[u] for n, u in parts)
+
+
+def _retry_after(exc: BaseException) -> float | None:
+    """从错误响应头读取服务端建议的等待秒数：retry-after-ms > retry-after > x-ratelimit-reset*。"""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return max(0.0, float(headers["retry-after-ms"]) / 1000)
+    except ValueError:
+        pass
+    retry_after = (headers.get("retry-after") or "").strip()
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - _time.time())
+            except (TypeError, ValueError):
+                pass
+    # 优先取已耗尽（remaining=0）那一项的重置时间
+    resets = []
+    for kind in ("requests", "tokens"):
+        reset = _parse_reset(headers.get(f"x-ratelimit-reset-{kind}"))
+        if reset is not None:
+            exhausted = (headers.get(f"x-ratelimit-remaining-{kind}") or "").strip() == "0"
+            resets.append((exhausted, reset))
+    if resets:
+        exhausted = [r for e, r in resets if e]
+        return max(0.0, max(exhausted or [r for _, r in resets]))
+    reset = _parse_reset(headers.get("x-ratelimit-reset"))
+    return max(0.0, reset) if reset is not None else None
+
+
+_backoff = wait_exponential(multiplier=2, min=2, max=16)
+
+
+def _retry_wait(retry_state) -> float:
+    """重试等待：服务端给出 Retry-After / x-ratelimit-reset 时按其等待（上限 LLM_RETRY_MAX_WAIT，加少量抖动），否则指数退避 2–16s。"""
+    hinted = _retry_after(retry_state.outcome.exception())
+    if hinted is not None:
+        return min(hinted, LLM_RETRY_MAX_WAIT) + random.uniform(0, 0.5)
+    return _backoff(retry_state)
+
+
 def _log_retry(retry_state):
     """重试时打印日志。"""
     exc = retry_state.outcome.exception()
     attempt = retry_state.attempt_number
+    wait = retry_state.next_action.sleep if retry_state.next_action else 0
+    hinted = "，按服务端提示" if _retry_after(exc) is not None else ""
+    note_retry()
     ts = _time.strftime("%H:%M:%S", _time.localtime())
-    print(f"[{ts}] [LLM重试] 第 {attempt} 次失败: {type(exc).__name__}: {str(exc)[:200]}，即将重试...", flush=True)
+    print(f"[{ts}] [LLM重试] 第 {attempt} 次失败: {type(exc).__name__}: {str(exc)[:200]}，{wait:.1f}s 后重试{hinted}...", flush=True)
 
 
 _llm_retry = retry(
     retry=retry_if_exception(_is_retryable),
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=2, min=2, max=16),
+    stop=stop_after_attempt(LLM_RETRY_ATTEMPTS),
+    wait=_retry_wait,
     before_sleep=_log_retry,
     reraise=True,
 )
 
 
-@_llm_retry
-def _openai_compatible_chat(provider: str, messages: list, model: str = None, max_tokens: int = 8192, temperature: float = 0.6) -> str:
-    """OpenAI 兼容 API。"""
+def _record_outcome(breaker, aimd, started, exc: BaseException | None):
+    """按请求结果更新熔断器与 AIMD 并发上限。"""
+    if aimd is not None:
+        rec = current_call()
+        output_tokens = rec.output_tokens - started[1] if rec is not None else 0
+        if exc is None:
+            outcome = "ok"
+        elif isinstance(exc, Exception) and _is_retryable(exc):
+            outcome = "overload"
+        else:
+            outcome = "neutral"
+        aimd.release(started[0], outcome, output_tokens)
+    if breaker is None:
+        return
+    if exc is None:
+        breaker.record_success()
+    elif _is_service_failure(exc):
+        breaker.record_failure(f"{type(exc).__name__}: {str(exc)[:100]}")
+    else:
+        breaker.record_neutral()
+
+
+def _output_tokens_so_far() -> int:
+    rec = current_call()
+    return rec.output_tokens if rec is not None else 0
+
+
+@contextmanager
+def _call_guard(provider: str, model: str, messages: list, max_tokens: int):
+    """
+    单次 API 请求的守卫：熔断器 open 时立即抛出 CircuitOpenError（不等待限流）；
+    否则占用该 provider 的 AIMD 并发名额，再按 provider/model 限流（RPM / TPM / 在途数，
+    TPM 预占 = 估算输入 + max_tokens），请求结束后按结果更新熔断器与并发上限。
+    路由池选中某个 Key 时，并发与限流按该 Key（"provider#序号"）计量，熔断仍按 provider。
+    所在的并行扇出已取消（同批其他项失败）时不再发出请求，抛出 Cancelled。
+    """
+    check_cancelled()
+    breaker = get_circuit_breakers().get(provider)
+    if breaker is not None:
+        breaker.before_call()
+    meter = _meter_name(provider)
+    aimd = get_adaptive_concurrency().get(meter)
+    started = (aimd.acquire() if aimd is not None else 0.0, _output_tokens_so_far())
+    try:
+        with get_rate_limiter().limit(meter, model, estimate_message_tokens(messages, provider) + max_tokens):
+            yield
+    except BaseException as e:
+        _record_outcome(breaker, aimd, started, e)
+        raise
+    _record_outcome(breaker, aimd, started, None)
+
+
+@asynccontextmanager
+async def _acall_guard(provider: str, model: str, messages: list, max_tokens: int):
+    """_call_guard 的异步版本。"""
+    check_cancelled()
+    breaker = get_circuit_breakers().get(provider)
+    if breaker is not None:
+        breaker.before_call()
+    meter = _meter_name(provider)
+    aimd = get_adaptive_concurrency().get(meter)
+    started = (await aimd.aacquire() if aimd is not None else 0.0, _output_tokens_so_far())
+    try:
+        async with get_rate_limiter().alimit(meter, model, estimate_message_tokens(messages, provider) + max_tokens):
+            yield
+    except BaseException as e:
+        _record_outcome(breaker, aimd, started, e)
+        raise
+    _record_outcome(breaker, aimd, started, None)
+
+
+def _breaker_fallback(p: str) -> str | None:
+    """熔断改道目标：LLM_BREAKER_FALLBACK 中第一个已配置且未熔断的 provider。"""
+    breakers = get_circuit_breakers()
+    for b in parse_provider_list(LLM_BREAKER_FALLBACK):
+        if b != p and b in PROVIDER_CONFIG and _provider_available(b) and breakers.allows(b):
+            return b
+    return None
+
+
+def _reroute(p: str, exc: CircuitOpenError) -> str:
+    """provider 熔断时选择改道目标；没有可用目标则原样抛出（快速失败）。"""
+    fallback = _breaker_fallback(p)
+    if fallback is None:
+        raise exc
+    get_circuit_breakers().note_reroute(p, fallback)
+    ts = _time.strftime("%H:%M:%S", _time.localtime())
+    print(f"[{ts}] [LLM熔断] {exc}，改道 → {fallback}", flush=True)
+    return fallback
+
+
+# ============ 多 Key / 多 provider 路由池 ============
+def _api_key(provider: str, default: str) -> str:
+    """当前调用被路由到该 provider 的某个 Key 时返回该 Key，否则返回配置中的主 Key。"""
+    ep = current_endpoint(provider)
+    return ep.key if ep is not None else default
+
+
+def _meter_name(provider: str) -> str:
+    """限流与 AIMD 的计量名：多 Key 时为 "provider#序号"。"""
+    ep = current_endpoint(provider)
+    return ep.name if ep is not None else provider
+
+
+def _routing_candidates(p: str, pool) -> list[tuple[str, float]]:
+    """
+    路由候选 [(provider, 权重)]。pool 为 None 时取 LLM_ROUTING_POOL（"kimi,deepseek*0.5" 或列表）；
+    p 不在池中时只在 p 自身的多个 Key 间分流（如显式指定 provider="perplexity" 的调用）。
+    """
+    spec = LLM_ROUTING_POOL if pool is None else pool
+    items = spec.split(",") if isinstance(spec, str) else list(spec)
+    cands = [(name.lower(), w) for name, w in (parse_weighted(i) for i in items if i and i.strip())]
+    if p not in (name for name, _ in cands):
+        return [(p, 1.0)]
+    return [
+        (name, w) for name, w in cands
+        if name == p or (name in PROVIDER_CONFIG and name != "replay" and _provider_available(name))
+    ]
+
+
+def _pick_endpoint(p: str, pool, model: str, messages: list, max_tokens: int):
+    """
+    按加权最少在途选择端点：跳过熔断中的 provider，优先选限流额度无需等待的 Key。
+    候选端点只有一个时返回 None（直接走原路径）。
+    """
+    cands = _routing_candidates(p, pool)
+    key_pool = get_key_pool()
+    if key_pool.size([name for name, _ in cands]) <= 1:
+        return None
+    breakers, limiter = get_circuit_breakers(), get_rate_limiter()
+    tokens = estimate_message_tokens(messages, p) + max_tokens
+
+    def _headroom(ep):
+        if not breakers.allows(ep.provider):
+            return None
+        lim = limiter.get(ep.name, model if ep.provider == p and model else "")
+        return lim.expected_wait(tokens) if lim is not None else 0.0
+
+    return key_pool.pick(cands, _headroom)
+
+
+def _route_call(p: str, pool, model: str, messages: list, max_tokens: int, fn):
+    """选择端点后执行 fn(provider, model)；改用其他 provider 时使用其默认模型。"""
+    ep = _pick_endpoint(p, pool, model, messages, max_tokens)
+    if ep is None:
+        return fn(p, model)
+    with get_key_pool().use(ep):
+        return fn(ep.provider, model if ep.provider == p else None)
+
+
+async def _aroute_call(p: str, pool, model: str, messages: list, max_tokens: int, fn):
+    """_route_call 的异步版本，fn 返回协程。"""
+    ep = _pick_endpoint(p, pool, model, messages, max_tokens)
+    if ep is None:
+        return await fn(p, model)
+    with get_key_pool().use(ep):
+        return await fn(ep.provider, model if ep.provider == p else None)
+
+
+def _openai_request(provider: str, messages: list, model: str, max_tokens: int, temperature: float) -> tuple[str, str, dict]:
+    """OpenAI 兼容请求参数：返回 (key, base_url, create kwargs)。同步/异步路径共用。"""
     cfg = PROVIDER_CONFIG.get(provider, PROVIDER_CONFIG["kimi"])
-    key = cfg["key"]
+    key = _api_key(provider, cfg["key"])
     base_url = cfg.get("base_url")
     default_model = cfg.get("model", "gpt-5.4")
     if not key:
         raise ValueError(f"请设置 {provider.upper()}_API_KEY 或在 .env 中配置")
-    client = OpenAI(api_key=key, base_url=base_url, http_client=httpx.Client(timeout=HTTP_TIMEOUT))
     m = model or default_model
     # kimi-k2.5 等模型仅允许 temperature=1
     if provider == "kimi" and "k2" in m.lower():
@@ -194,73 +668,170 @@ def _openai_compatible_chat(provider: str, messages: list, model: str = None, ma
     # deepseek max_tokens 上限 8192
     if provider == "deepseek" and max_tokens > 8192:
         max_tokens = 8192
-    resp = client.chat.completions.create(
-        model=m,
-        messages=messages,
-        max_tokens=max_tokens,
-        temperature=temperature,
-    )
+    kwargs = {
+        "model": m,
+        "messages": plain_messages(messages),
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+    }
+    response_format = _json_response_format(provider)
+    if response_format:
+        kwargs["response_format"] = response_format
+    return key, base_url, kwargs
+
+
+def _field(obj, name: str):
+    """SDK 对象或 dict 的字段（provider 扩展字段在 SDK 对象上是额外属性）。"""
+    if obj is None:
+        return None
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+
+def _openai_usage(usage) -> tuple[int, int, int]:
+    """
+    OpenAI 兼容 usage → (输入, 输出, 命中缓存的输入)。命中数的字段各家不同：
+    OpenAI / Qwen / Grok 为 prompt_tokens_details.cached_tokens，DeepSeek 为 prompt_cache_hit_tokens，
+    Kimi 为 cached_tokens。
+    """
+    cached = (_field(_field(usage, "prompt_tokens_details"), "cached_tokens")
+              or _field(usage, "prompt_cache_hit_tokens")
+              or _field(usage, "cached_tokens") or 0)
+    return _field(usage, "prompt_tokens") or 0, _field(usage, "completion_tokens") or 0, cached
+
+
+def _claude_usage(usage) -> tuple[int, int, int]:
+    """Claude 的 input_tokens 不含缓存读写部分，这里加回，使输入 token 与其他 provider 口径一致。"""
+    read = _field(usage, "cache_read_input_tokens") or 0
+    written = _field(usage, "cache_creation_input_tokens") or 0
+    return (_field(usage, "input_tokens") or 0) + read + written, _field(usage, "output_tokens") or 0, read
+
+
+def _gemini_usage(meta) -> tuple[int, int, int]:
+    return (_field(meta, "prompt_token_count") or 0, _field(meta, "candidates_token_count") or 0,
+            _field(meta, "cached_content_token_count") or 0)
+
+
+def _openai_result(provider: str, m: str, resp) -> str:
+    """记录 OpenAI 兼容响应的 token 用量并提取正文。"""
     if hasattr(resp, "usage") and resp.usage:
-        _tracker.record(provider, m, resp.usage.prompt_tokens or 0, resp.usage.completion_tokens or 0)
-    return (resp.choices[0].message.content or "").strip()
+        _tracker.record(provider, m, *_openai_usage(resp.usage))
+    return _finish_text(resp.choices[0].message.content or "", resp.choices[0].finish_reason)
 
 
 @_llm_retry
-def _claude_chat(messages: list, model: str = None, max_tokens: int = 8192, temperature: float = 0.6) -> str:
-    """Anthropic Claude API。"""
+def _openai_compatible_chat(provider: str, messages: list, model: str = None, max_tokens: int = 8192, temperature: float = 0.6) -> str:
+    """OpenAI 兼容 API。批处理模式适用时先经 Batch API，不可用时回退实时调用。"""
+    key, base_url, kwargs = _openai_request(provider, messages, model, max_tokens, temperature)
+    client = _get_openai_client(provider, key, base_url)
+    if batch_mode_applies(provider):
+        try:
+            return _openai_batch_chat(provider, key, base_url, client, kwargs)
+        except BatchUnavailable:
+            pass
+    with _call_guard(provider, kwargs["model"], messages, kwargs["max_tokens"]):
+        resp = client.chat.completions.create(**kwargs)
+        return _openai_result(provider, kwargs["model"], resp)
+
+
+def _openai_batch_chat(provider: str, key: str, base_url: str, client, kwargs: dict) -> str:
+    """
+    经 Batch API 完成一次调用：阻塞至所在批次完成。批处理有独立配额，不占实时限流 / 并发名额；
+    响应 body 还原为 ChatCompletion 后与实时路径共用结果提取（token 统计、截断标记）。
+    """
+    from openai.types.chat import ChatCompletion
+    body = get_batch_collector(provider, key, base_url, client).submit(kwargs)
+    _batched.set(True)
+    return _openai_result(provider, kwargs["model"], ChatCompletion.model_validate(body))
+
+
+def _flatten_content(content) -> str:
+    """多模态 content 列表只保留文本部分。"""
+    if isinstance(content, list):
+        return "\n".join(
+            p.get("text", str(p)) for p in content
+            if isinstance(p, dict) and ("text" in p or p.get("type") == "text")
+        )
+    return content
+
+
+# Claude 单次请求最多 4 个 cache_control 断点
+_CLAUDE_MAX_BREAKPOINTS = 4
+
+
+def _claude_blocks(content) -> list[dict]:
+    """content → Claude 文本块列表，保留 cache_control 断点（图片等非文本块只取文本，同 _flatten_content）。"""
+    if isinstance(content, list):
+        return [
+            {"type": "text", "text": p.get("text", ""), **({"cache_control": p["cache_control"]} if "cache_control" in p else {})}
+            for p in content if isinstance(p, dict) and ("text" in p or p.get("type") == "text")
+        ]
+    return [{"type": "text", "text": content}] if content else []
+
+
+def _claude_request(messages: list, model: str, max_tokens: int, temperature: float) -> dict:
+    """
+    Claude messages.create 参数：system 单独传入（多条 system 依次合并为文本块），其余按 user/assistant 排列。
+    消息中的 cache_control 断点原样保留；没有显式断点时，足够长的 system 末尾自动打一个断点，
+    使各章节 / 各专家共用的规范与上下文按缓存计费。
+    """
     if not ANTHROPIC_API_KEY:
         raise ValueError("请设置 ANTHROPIC_API_KEY 或在 .env 中配置")
-    try:
-        from anthropic import Anthropic
-    except ImportError:
-        raise ImportError("Claude 需安装 anthropic: pip install anthropic")
-    client = Anthropic(api_key=ANTHROPIC_API_KEY)
     m = model or ANTHROPIC_MODEL
-    system = ""
+    system: list[dict] = []
     msgs = []
     for item in messages:
         role = item.get("role", "")
         content = item.get("content", "")
-        if isinstance(content, list):
-            content = "\n".join(
-                p.get("text", str(p)) for p in content
-                if isinstance(p, dict) and ("text" in p or p.get("type") == "text")
-            )
         if role == "system":
-            system = content
-        elif role == "assistant":
-            msgs.append({"role": "assistant", "content": content})
-        elif role == "user":
-            msgs.append({"role": "user", "content": content})
+            system += _claude_blocks(content)
+        elif role in ("assistant", "user"):
+            if isinstance(content, list) and any(isinstance(p, dict) and "cache_control" in p for p in content):
+                msgs.append({"role": role, "content": _claude_blocks(content)})
+            else:
+                msgs.append({"role": role, "content": _flatten_content(content)})
     kwargs = {"model": m, "max_tokens": max_tokens, "temperature": temperature, "messages": msgs}
+    marked = [b for b in system if "cache_control" in b] + [
+        b for msg in msgs if isinstance(msg["content"], list) for b in msg["content"] if "cache_control" in b]
+    if system and not marked and sum(len(b["text"]) for b in system) >= MIN_CACHE_CHARS:
+        system[-1]["cache_control"] = dict(EPHEMERAL)
+    # 超出上限时只保留最前面的断点（越靠前的前缀被复用的范围越大）
+    for block in marked[_CLAUDE_MAX_BREAKPOINTS:]:
+        block.pop("cache_control")
     if system:
-        kwargs["system"] = system
-    resp = client.messages.create(**kwargs)
+        has_breakpoint = any("cache_control" in b for b in system)
+        kwargs["system"] = system if has_breakpoint else "\n\n".join(b["text"] for b in system)
+    return kwargs
+
+
+def _claude_result(m: str, resp) -> str:
     if hasattr(resp, "usage") and resp.usage:
-        _tracker.record("claude", m, getattr(resp.usage, "input_tokens", 0) or 0, getattr(resp.usage, "output_tokens", 0) or 0)
-    return (resp.content[0].text if resp.content else "").strip()
+        _tracker.record("claude", m, *_claude_usage(resp.usage))
+    return _finish_text(resp.content[0].text if resp.content else "", getattr(resp, "stop_reason", None))
 
 
 @_llm_retry
-def _gemini_chat(messages: list, model: str = None, max_tokens: int = 8192, temperature: float = 0.6) -> str:
-    """Google Gemini API。"""
+def _claude_chat(messages: list, model: str = None, max_tokens: int = 8192, temperature: float = 0.6) -> str:
+    """Anthropic Claude API。"""
+    kwargs = _claude_request(messages, model, max_tokens, temperature)
+    client = _get_anthropic_client(_api_key("claude", ANTHROPIC_API_KEY))
+    with _call_guard("claude", kwargs["model"], messages, max_tokens):
+        resp = client.messages.create(**kwargs)
+        return _claude_result(kwargs["model"], resp)
+
+
+def _gemini_request(messages: list, model: str, max_tokens: int, temperature: float) -> tuple[str, str, object]:
+    """Gemini 请求参数：返回 (model, prompt, generation_config)。"""
     if not GEMINI_API_KEY:
         raise ValueError("请设置 GEMINI_API_KEY 或在 .env 中配置")
     try:
         import google.generativeai as genai
     except ImportError:
         raise ImportError("Gemini 需安装 google-generativeai: pip install google-generativeai")
-    genai.configure(api_key=GEMINI_API_KEY)
     m = model or GEMINI_MODEL
     parts = []
-    for item in messages:
+    for item in plain_messages(messages):
         role = item.get("role", "")
-        content = item.get("content", "")
-        if isinstance(content, list):
-            content = "\n".join(
-                p.get("text", str(p)) for p in content
-                if isinstance(p, dict) and ("text" in p or p.get("type") == "text")
-            )
+        content = _flatten_content(item.get("content", ""))
         if role == "system":
             parts.append(f"[System]\n{content}")
         elif role == "user":
@@ -268,19 +839,29 @@ def _gemini_chat(messages: list, model: str = None, max_tokens: int = 8192, temp
         elif role == "assistant":
             parts.append(f"[Assistant]\n{content}")
     prompt = "\n\n".join(parts) if parts else ""
-    gen_model = genai.GenerativeModel(m)
-    resp = gen_model.generate_content(
-        prompt,
-        generation_config=genai.types.GenerationConfig(
-            max_output_tokens=max_tokens,
-            temperature=temperature,
-        ),
+    extra = {"response_mime_type": "application/json"} if _json_native("gemini") else {}
+    config = genai.types.GenerationConfig(
+        max_output_tokens=max_tokens,
+        temperature=temperature,
+        **extra,
     )
+    return m, prompt, config
+
+
+def _gemini_result(m: str, resp) -> str:
     if hasattr(resp, "usage_metadata") and resp.usage_metadata:
-        _tracker.record("gemini", m,
-            getattr(resp.usage_metadata, "prompt_token_count", 0) or 0,
-            getattr(resp.usage_metadata, "candidates_token_count", 0) or 0)
-    return (resp.text or "").strip()
+        _tracker.record("gemini", m, *_gemini_usage(resp.usage_metadata))
+    return _finish_text(resp.text or "", _gemini_finish_reason(resp))
+
+
+@_llm_retry
+def _gemini_chat(messages: list, model: str = None, max_tokens: int = 8192, temperature: float = 0.6) -> str:
+    """Google Gemini API。"""
+    m, prompt, config = _gemini_request(messages, model, max_tokens, temperature)
+    gen_model = _get_gemini_model(GEMINI_API_KEY, m)
+    with _call_guard("gemini", m, messages, max_tokens):
+        resp = gen_model.generate_content(prompt, generation_config=config)
+        return _gemini_result(m, resp)
 
 
 def chat(
@@ -290,26 +871,319 @@ def chat(
     max_tokens: int = 8192,
     temperature: float = 0.6,
     reasoning: bool = False,
+    hedge: bool = None,
+    pool=None,
 ) -> str:
     """
     统一对话接口。provider 未指定时使用环境变量 LLM_PROVIDER（默认 kimi）。
     reasoning=True 时，Grok 自动切换到推理模型（GROK_REASONING_MODEL）。
+    hedge=True 时启用对冲：主请求超过观测 p90 仍无首字节或未完成，则向备选 provider 发出副本，
+    取先完成者并取消其余；主请求失败时直接切换到备选。None 表示取 LLM_HEDGE 配置。
+    pool 为路由池（"kimi,deepseek*0.5" 或列表，None 取 LLM_ROUTING_POOL）：provider 在池中时，
+    每次请求按加权最少在途在池内各 provider 的各个 Key（LLM_KEY_POOL）间分发。
+    调用点命中模型路由表（LLM_ROUTES / 报告类型 "## 模型路由"）时，provider / model / reasoning / max_tokens
+    以路由表为准。
     """
+    if hedge is None:
+        hedge = _hedge_policy["enabled"]
+    with track_call("chat") as rec:
+        # 批处理的等待以小时计，不做对冲
+        call = _hedged_chat if hedge and not batch_mode_applies(step=rec.step) else _dispatch_chat
+        p, model, max_tokens = _routed_args(rec, provider, model, max_tokens, reasoning)
+        return _cached_call(
+            "chat", p, model, messages, max_tokens, temperature,
+            lambda: _route_call(
+                p, pool, model, messages, max_tokens,
+                lambda q, m: call(q, messages, m, max_tokens, temperature),
+            ),
+        )
+
+
+def _resolve_provider(provider: str = None) -> str:
+    """解析 provider：参数 > 环境变量 LLM_PROVIDER > config；未知 provider 按 kimi 处理。"""
     p = (provider or os.getenv("LLM_PROVIDER") or LLM_PROVIDER or "kimi").lower().strip()
+    return p if p in PROVIDER_CONFIG else "kimi"
+
+
+def routed_target(provider: str = None, model: str = None, max_tokens: int = 8192, reasoning: bool = False,
+                  step: str = None, site: str = None) -> tuple[str, str, int]:
+    """
+    预先解析此处发起的 chat() 将使用的 (provider, model, max_tokens)，供 prompt 装箱（token_budget）按路由后的
+    模型上下文窗口与 max_tokens 计算预算。step / site 未指定时取当前指标标签（scope / 调用栈推断）。
+    """
+    auto_step, auto_site = current_tags()
+    return _route(step or auto_step, site or auto_site, provider, model, max_tokens, reasoning, count=False)
+
+
+def _routed_args(rec, provider: str, model: str, max_tokens: int, reasoning: bool) -> tuple[str, str, int]:
+    """按 rec 的 step / site 标签解析路由，见 _route。"""
+    if rec is None:
+        return _route(None, None, provider, model, max_tokens, reasoning)
+    return _route(rec.step, rec.site, provider, model, max_tokens, reasoning)
+
+
+def _route(step: str | None, site: str | None, provider: str, model: str, max_tokens: int, reasoning: bool,
+           count: bool = True) -> tuple[str, str, int]:
+    """
+    解析 provider 并按调用点模型路由表覆盖参数，返回 (provider, model, max_tokens)。
+    路由改用其他 provider 且未指定 model 时使用其默认模型；路由的 provider 未配置 Key 时保留原 provider。
+    """
+    p = _resolve_provider(provider)
+    matched = get_model_routes().lookup(step, site, count) if step is not None else None
+    if matched:
+        label, route = matched
+        q = route.get("provider")
+        if q and q != p:
+            if q in PROVIDER_CONFIG and _provider_available(q):
+                p, model = q, None
+            else:
+                get_model_routes().warn_once(label, f"provider {q} 未配置或无 Key，沿用 {p}")
+        model = route.get("model", model)
+        max_tokens = route.get("max_tokens", max_tokens)
+        reasoning = route.get("reasoning", reasoning)
     # Grok 推理模型路由
     if reasoning and p == "grok" and not model:
         model = GROK_REASONING_MODEL
+    return p, model, max_tokens
+
+
+def _dispatch_chat(p: str, messages: list, model: str, max_tokens: int, temperature: float) -> str:
+    """按 provider 分发到具体实现；provider 熔断时改道 LLM_BREAKER_FALLBACK（使用其默认模型）。"""
+    try:
+        return _dispatch_provider(p, messages, model, max_tokens, temperature)
+    except CircuitOpenError as e:
+        fallback = _reroute(p, e)
+    return _dispatch_provider(fallback, messages, None, max_tokens, temperature)
+
+
+def _dispatch_provider(p: str, messages: list, model: str, max_tokens: int, temperature: float) -> str:
+    t0 = _time.monotonic()
+    _length_cut.set(False)
+    _batched.set(False)
+    result = _provider_chat(p, messages, model, max_tokens, temperature)
+    # 批处理耗时以分钟 / 小时计，不计入对冲阈值所用的实时延迟统计
+    if not _batched.get():
+        _latency.record(p, _time.monotonic() - t0)
+    return _continue_truncated(
+        p, messages, result,
+        lambda msgs: _realtime_chat(p, msgs, model, max_tokens, temperature),
+    )
+
+
+def _realtime_chat(p: str, messages: list, model: str, max_tokens: int, temperature: float) -> str:
+    """不经批处理的单次请求（截断续写用）。"""
+    with realtime():
+        return _provider_chat(p, messages, model, max_tokens, temperature)
+
+
+def _provider_chat(p: str, messages: list, model: str, max_tokens: int, temperature: float) -> str:
     if p == "claude":
         return _claude_chat(messages, model, max_tokens, temperature)
     if p == "gemini":
         return _gemini_chat(messages, model, max_tokens, temperature)
-    if p in _OPENAI_COMPATIBLE:
-        return _openai_compatible_chat(p, messages, model, max_tokens, temperature)
-    # 默认按 kimi 处理
-    return _openai_compatible_chat("kimi", messages, model, max_tokens, temperature)
+    return _openai_compatible_chat(p, messages, model, max_tokens, temperature)
+
+
+# ============ max_tokens 截断续写 ============
+# 最近一次响应是否经 Batch API 完成（由 _openai_batch_chat 设置）
+_batched: contextvars.ContextVar[bool] = contextvars.ContextVar("llm_batched", default=False)
+# 最近一次响应是否因达到 max_tokens 被截断（由各 provider 的结果提取函数设置）
+_length_cut: contextvars.ContextVar[bool] = contextvars.ContextVar("llm_length_cut", default=False)
+# 续写片段与已输出结尾的重复检测窗口（字符）与最短重复长度
+_STITCH_WINDOW = 300
+_STITCH_MIN_OVERLAP = 8
+
+
+def _is_length_finish(reason) -> bool:
+    """统一各 provider 的截断标记：OpenAI 兼容 "length"、Claude "max_tokens"、Gemini MAX_TOKENS。"""
+    name = str(getattr(reason, "name", reason) or "").lower()
+    return name in ("length", "max_tokens")
+
+
+def _finish_text(text: str, reason) -> str:
+    """记录截断状态并返回正文；被截断时保留首尾空白，便于与续写片段无缝拼接。"""
+    cut = _is_length_finish(reason)
+    _length_cut.set(cut)
+    return text if cut else text.strip()
+
+
+def _gemini_finish_reason(resp):
+    candidates = getattr(resp, "candidates", None)
+    return getattr(candidates[0], "finish_reason", None) if candidates else None
+
+
+def _stitch(head: str, tail: str) -> str:
+    """拼接续写片段：去掉续写开头与已输出结尾重复的部分（模型常会重复中断处的半句）。"""
+    probe = head[-_STITCH_WINDOW:]
+    for n in range(min(len(probe), len(tail)), _STITCH_MIN_OVERLAP - 1, -1):
+        if tail.startswith(probe[-n:]):
+            return head + tail[n:]
+    return head + tail
+
+
+def _log_continuation(msg: str):
+    ts = _time.strftime("%H:%M:%S", _time.localtime())
+    print(f"[{ts}] [LLM续写] {msg}", flush=True)
+
+
+def _continuation_plan(p: str, text: str, rounds: int) -> bool:
+    """是否继续续写；达到上限仍被截断时记录并提示。"""
+    if not _length_cut.get():
+        return False
+    if rounds >= LLM_MAX_CONTINUATIONS:
+        if LLM_MAX_CONTINUATIONS:
+            _log_continuation(f"{p} 已续写 {rounds} 次仍达到 max_tokens 上限（{len(text)} 字），输出可能不完整")
+        return False
+    note_continuation()
+    _log_continuation(f"{p} 输出达到 max_tokens 上限（已收 {len(text)} 字），第 {rounds + 1}/{LLM_MAX_CONTINUATIONS} 次续写...")
+    return True
+
+
+def _continue_truncated(p: str, messages: list, text: str, call) -> str:
+    """
+    text 因 max_tokens 被截断时，以已输出内容为前缀（_continuation_messages）续写并拼接，
+    最多 LLM_MAX_CONTINUATIONS 次；call(messages) 发出一次不续写的请求。
+    """
+    if not _length_cut.get():
+        return text
+    rounds = 0
+    while _continuation_plan(p, text, rounds):
+        rounds += 1
+        text = _stitch(text, call(_continuation_messages(p, messages, text)))
+    _tracker.record_continuation(rounds, _length_cut.get())
+    return text.strip()
+
+
+async def _acontinue_truncated(p: str, messages: list, text: str, call) -> str:
+    """_continue_truncated 的异步版本，call(messages) 返回协程。"""
+    if not _length_cut.get():
+        return text
+    rounds = 0
+    while _continuation_plan(p, text, rounds):
+        rounds += 1
+        text = _stitch(text, await call(_continuation_messages(p, messages, text)))
+    _tracker.record_continuation(rounds, _length_cut.get())
+    return text.strip()
+
+
+def _cached_call(kind: str, p: str, model: str, messages: list, max_tokens: int, temperature: float, fn):
+    """
+    响应缓存包装：可缓存时先查缓存，未命中再调用 fn() 并写回；外层为离线录制 / 回放。
+    缓存未命中（或不可缓存）时经 single-flight 合并：相同请求已在途则等待其结果，不重复请求 API。
+    """
+    return _replay_call(
+        kind, p, model, messages, max_tokens, temperature,
+        lambda: _response_cache_call(kind, p, model, messages, max_tokens, temperature, fn),
+    )
+
+
+def _response_cache_call(kind: str, p: str, model: str, messages: list, max_tokens: int, temperature: float, fn):
+    cache = get_response_cache()
+    resolved_model = model or PROVIDER_CONFIG.get(p, {}).get("model", "")
+    key = request_hash(kind, p, resolved_model, messages, temperature, max_tokens)
+    cacheable = cache.cacheable(temperature)
+    if cacheable:
+        hit = cache.get(key)
+        if hit is not None:
+            note_cache_hit()
+            return hit
+
+    def _fetch():
+        result = fn()
+        if result and cacheable:
+            cache.put(key, result, kind, p, resolved_model)
+        return result
+
+    return _single_flight.do(key, _fetch, note_coalesced)
+
+
+# ============ 离线录制 / 回放 ============
+def _replay_serve(kind: str, p: str, messages: list, max_tokens: int, temperature: float):
+    """回放：返回 (响应, 模拟延迟秒数)；未命中时严格模式抛出 ReplayMiss，否则返回占位响应。"""
+    replay = get_replay_archive()
+    rec = current_call()
+    step, site = (rec.step, rec.site) if rec is not None else ("", "")
+    entry = replay.lookup(kind, p, messages, temperature, max_tokens, step, site)
+    if entry is None:
+        key = replay_key(kind, messages, temperature, max_tokens)
+        msg = f"回放归档中没有该请求（kind={kind}, provider={p}, 调用点={step}.{site}, key={key[:12]}）"
+        if replay.strict:
+            raise ReplayMiss(msg)
+        _log_replay(msg + "，返回占位响应")
+        return replay.placeholder(kind, key), 0.0
+    _tracker.record(entry.get("provider") or p, entry.get("model", ""),
+                    entry.get("input_tokens", 0), entry.get("output_tokens", 0))
+    note_first_byte()
+    return entry["response"], replay.delay(entry)
+
+
+def _replay_started():
+    rec = current_call()
+    tokens = (rec.input_tokens, rec.output_tokens) if rec is not None else (0, 0)
+    return rec, tokens, _time.monotonic()
+
+
+def _replay_record(kind: str, p: str, model: str, messages: list, max_tokens: int, temperature: float, started, result):
+    rec, (in0, out0), t0 = started
+    resolved_model = model or PROVIDER_CONFIG.get(p, {}).get("model", "")
+    get_replay_archive().record(
+        kind, p, resolved_model, messages, temperature, max_tokens, result,
+        latency=_time.monotonic() - t0,
+        input_tokens=rec.input_tokens - in0 if rec is not None else 0,
+        output_tokens=rec.output_tokens - out0 if rec is not None else 0,
+        step=rec.step if rec is not None else "",
+        site=rec.site if rec is not None else "",
+    )
+
+
+def _replay_call(kind: str, p: str, model: str, messages: list, max_tokens: int, temperature: float, fn):
+    """LLM_REPLAY_MODE=replay 时直接返回归档响应（不联网）；record 时调用 fn() 并把结果写入归档。"""
+    replay = get_replay_archive()
+    if replay.replaying:
+        result, delay = _replay_serve(kind, p, messages, max_tokens, temperature)
+        if delay:
+            _time.sleep(delay)
+        return result
+    if not replay.recording:
+        return fn()
+    started = _replay_started()
+    result = fn()
+    _replay_record(kind, p, model, messages, max_tokens, temperature, started, result)
+    return result
+
+
+async def _areplay_call(kind: str, p: str, model: str, messages: list, max_tokens: int, temperature: float, fn):
+    """_replay_call 的异步版本，fn() 返回协程。"""
+    replay = get_replay_archive()
+    if replay.replaying:
+        result, delay = _replay_serve(kind, p, messages, max_tokens, temperature)
+        if delay:
+            await asyncio.sleep(delay)
+        return result
+    if not replay.recording:
+        return await fn()
+    started = _replay_started()
+    result = await fn()
+    _replay_record(kind, p, model, messages, max_tokens, temperature, started, result)
+    return result
+
+
+def _replay_stream(p: str, messages: list, max_tokens: int, temperature: float, chunk_chars: int = 64) -> Iterator[str]:
+    """回放模式下的 chat_stream：把归档响应按小段 yield，模拟延迟均摊到各段。"""
+    text, delay = _replay_serve("chat", p, messages, max_tokens, temperature)
+    pieces = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)] or [""]
+    pause = delay / len(pieces)
+    for piece in pieces:
+        if pause:
+            _time.sleep(pause)
+        yield piece
+
+
+def _log_replay(msg: str):
+    ts = _time.strftime("%H:%M:%S", _time.localtime())
+    print(f"[{ts}] [LLM回放] {msg}", flush=True)
 
 
-@_llm_retry
 def perplexity_chat_with_citations(
     messages: list,
     model: str = None,
@@ -320,6 +1194,23 @@ def perplexity_chat_with_citations(
     调用 Perplexity API，返回 (content, citations)。
     citations 格式: [{"url": str, "title": str}, ...]，来自 search_results 或 citations。
     """
+    with track_call("perplexity_citations"):
+        content, citations = _cached_call(
+            "perplexity_citations", "perplexity", model or PROVIDER_CONFIG["perplexity"].get("model", "sonar"),
+            messages, max_tokens, temperature,
+            lambda: _perplexity_chat_with_citations(messages, model, max_tokens, temperature),
+        )
+    return content, citations
+
+
+@_llm_retry
+def _perplexity_chat_with_citations(
+    messages: list,
+    model: str = None,
+    max_tokens: int = 4096,
+    temperature: float = 0.3,
+) -> tuple[str, list[dict]]:
+    """Perplexity 引用接口的实际请求（带重试）。"""
     if not PERPLEXITY_API_KEY:
         raise ValueError("请设置 PERPLEXITY_API_KEY 或在 .env 中配置")
     cfg = PROVIDER_CONFIG["perplexity"]
@@ -327,30 +1218,27 @@ def perplexity_chat_with_citations(
     m = model or cfg.get("model", "sonar")
     payload = {
         "model": m,
-        "messages": messages,
+        "messages": plain_messages(messages),
         "max_tokens": max_tokens,
         "temperature": temperature,
     }
-    resp = httpx.post(
-        url,
-        json=payload,
-        headers={
-            "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-            "Content-Type": "application/json",
-        },
-        timeout=HTTP_TIMEOUT,
-    )
-    if resp.status_code >= 400:
-        try:
+    with _call_guard("perplexity", m, messages, max_tokens):
+        resp = _get_http_client("perplexity").post(
+            url,
+            json=payload,
+            headers={
+                "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
+                "Content-Type": "application/json",
+            },
+        )
+        if resp.status_code >= 400:
             err_body = resp.text[:500] if resp.text else "(empty)"
-            raise RuntimeError(f"Perplexity API {resp.status_code}: {err_body}")
-        except RuntimeError:
-            raise
-    resp.raise_for_status()
-    data = resp.json()
-    usage = data.get("usage", {})
-    if usage:
-        _tracker.record("perplexity", m, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
+            raise _ProviderHTTPError(f"Perplexity API {resp.status_code}: {err_body}", resp)
+        resp.raise_for_status()
+        data = resp.json()
+        usage = data.get("usage", {})
+        if usage:
+            _tracker.record("perplexity", m, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
     content = ""
     if data.get("choices") and len(data["choices"]) > 0:
         msg = data["choices"][0].get("message", {})
@@ -381,6 +1269,14 @@ def perplexity_deep_research(
     调用 Perplexity sonar-deep-research（异步模式）。
     提交请求后轮询直到完成，返回 (content, citations)。
     """
+    with track_call("perplexity_deep_research"):
+        return _replay_call(
+            "perplexity_deep_research", "perplexity", "sonar-deep-research", messages, max_tokens, 0.0,
+            lambda: _perplexity_deep_research(messages, max_tokens, poll_interval, max_wait),
+        )
+
+
+def _perplexity_deep_research(messages: list, max_tokens: int, poll_interval: float, max_wait: float) -> tuple[str, list[dict]]:
     if not PERPLEXITY_API_KEY:
         raise ValueError("请设置 PERPLEXITY_API_KEY 或在 .env 中配置")
     base_url = (PROVIDER_CONFIG["perplexity"].get("base_url") or "https://api.perplexity.ai").rstrip("/")
@@ -390,22 +1286,8 @@ def perplexity_deep_research(
     }
     model = "sonar-deep-research"
 
-    # 1. 提交请求（deep research 耗时较长，用更大超时）
-    deep_timeout = httpx.Timeout(60.0, read=300.0)
-    payload = {
-        "model": model,
-        "messages": messages,
-        "max_tokens": max_tokens,
-    }
-    resp = httpx.post(
-        f"{base_url}/chat/completions",
-        json=payload,
-        headers=headers,
-        timeout=deep_timeout,
-    )
-    if resp.status_code >= 400:
-        raise RuntimeError(f"Perplexity Deep Research 提交失败 {resp.status_code}: {resp.text[:500]}")
-    data = resp.json()
+    # 1. 提交请求（429 / 5xx 由 _llm_retry 按 Retry-After 重试）
+    data = _perplexity_deep_research_submit(base_url, headers, model, messages, max_tokens)
 
     # 如果直接返回了结果（同步兼容）
     if data.get("choices"):
@@ -427,10 +1309,9 @@ def perplexity_deep_research(
         _time.sleep(poll_interval)
         elapsed += poll_interval
         try:
-            poll_resp = httpx.get(
+            poll_resp = _get_http_client("perplexity").get(
                 f"{base_url}/chat/completions/{request_id}",
                 headers=headers,
-                timeout=HTTP_TIMEOUT,
             )
             if poll_resp.status_code == 200:
                 poll_data = poll_resp.json()
@@ -446,6 +1327,26 @@ def perplexity_deep_research(
     raise TimeoutError(f"Deep Research 超时（{max_wait}s），request_id={request_id}")
 
 
+@_llm_retry
+def _perplexity_deep_research_submit(base_url: str, headers: dict, model: str, messages: list, max_tokens: int) -> dict:
+    """提交 deep research 请求（带重试；耗时较长，用更大超时）。"""
+    deep_timeout = httpx.Timeout(60.0, read=300.0)
+    payload = {
+        "model": model,
+        "messages": messages,
+        "max_tokens": max_tokens,
+    }
+    with _call_guard("perplexity", model, messages, max_tokens):
+        resp = _get_http_client("perplexity", deep_timeout).post(
+            f"{base_url}/chat/completions",
+            json=payload,
+            headers=headers,
+        )
+        if resp.status_code >= 400:
+            raise _ProviderHTTPError(f"Perplexity Deep Research API {resp.status_code}: {resp.text[:500]}", resp)
+    return resp.json()
+
+
 def _extract_perplexity_response(data: dict, model: str) -> tuple[str, list[dict]]:
     """从 Perplexity 响应中提取 content 和 citations。"""
     usage = data.get("usage", {})
@@ -475,27 +1376,715 @@ def chat_vision(
     temperature: float = 0.3,
 ) -> str:
     """多模态对话（支持图片）。优先使用 Vision 模型。"""
-    p = (provider or os.getenv("LLM_PROVIDER") or LLM_PROVIDER or "kimi").lower().strip()
+    p = _resolve_provider(provider)
     if p == "kimi":
-        from config import KIMI_VISION_MODEL
         model = model or KIMI_VISION_MODEL
-        return _openai_compatible_chat("kimi", messages, model, max_tokens, temperature)
-    if p in ("openai", "grok", "perplexity", "glm", "minimax", "qwen", "deepseek"):
-        if p == "glm":
-            model = model or GLM_VISION_MODEL
-        return _openai_compatible_chat(p, messages, model, max_tokens, temperature)
+    elif p == "glm":
+        model = model or GLM_VISION_MODEL
+    with track_call("vision"):
+        return _cached_call(
+            "vision", p, model, messages, max_tokens, temperature,
+            lambda: _dispatch_chat(p, messages, model, max_tokens, temperature),
+        )
+
+
+# ============ 结构化输出（JSON） ============
+# 支持 response_format={"type": "json_schema"} 的 provider，以及只支持 {"type": "json_object"} 的 provider
+_JSON_SCHEMA_PROVIDERS = ("openai", "grok")
+_JSON_OBJECT_PROVIDERS = ("kimi", "deepseek", "qwen", "glm", "minimax")
+# chat_json 进行中时为 (schema,)；各 provider 的请求构造据此开启原生 JSON 模式
+_json_mode: contextvars.ContextVar[tuple | None] = contextvars.ContextVar("llm_json_mode", default=None)
+# 拒绝过 response_format 的 provider（本进程内不再尝试原生模式）
+_json_native_rejected: set[str] = set()
+
+
+def _json_native(provider: str) -> bool:
+    return _json_mode.get() is not None and provider not in _json_native_rejected
+
+
+def _json_response_format(provider: str) -> dict | None:
+    """
+    当前 chat_json 调用在该 provider 上的 response_format：有 Schema 且支持时用 json_schema；
+    json_object 模式只保证输出对象，Schema 顶层不是 object 时不开启。
+    """
+    if not _json_native(provider):
+        return None
+    schema = _json_mode.get()[0]
+    if provider in _JSON_SCHEMA_PROVIDERS and schema:
+        return {"type": "json_schema", "json_schema": {"name": "result", "schema": schema, "strict": False}}
+    if provider in _JSON_OBJECT_PROVIDERS + _JSON_SCHEMA_PROVIDERS and (not schema or schema.get("type") == "object"):
+        return {"type": "json_object"}
+    return None
+
+
+def _log_json(msg: str):
+    ts = _time.strftime("%H:%M:%S", _time.localtime())
+    print(f"[{ts}] [LLM结构化] {msg}", flush=True)
+
+
+def chat_json(
+    messages: list,
+    schema: dict = None,
+    provider: str = None,
+    model: str = None,
+    max_tokens: int = 4096,
+    temperature: float = 0.3,
+    reasoning: bool = False,
+    repair: bool = True,
+    pool=None,
+):
+    """
+    结构化输出：返回解析后的 JSON（dict / list）。
+    provider 支持时使用原生 JSON 模式（OpenAI / Grok 为 json_schema，Kimi / DeepSeek / Qwen / GLM / MiniMax
+    为 json_object，Gemini 为 application/json）；回复会去掉代码块包裹并按 schema（JSON Schema 子集）本地校验，
+    不通过时带上具体错误发起一次修复请求，仍不通过则抛出 JSONOutputError（.text 为最后一次输出）。
+    只缓存校验通过的结果；缓存 / 回放键包含 schema。
+    """
+    kind = f"json:{schema_digest(schema)}" if schema else "json"
+    with track_call("json") as rec:
+        p, model, max_tokens = _routed_args(rec, provider, model, max_tokens, reasoning)
+        text = _cached_call(
+            kind, p, model, messages, max_tokens, temperature,
+            lambda: _route_call(
+                p, pool, model, messages, max_tokens,
+                lambda q, m: _json_roundtrip(q, messages, m, max_tokens, temperature, schema, repair),
+            ),
+        )
+    data, errors = parse_json_output(text, schema)
+    if errors:
+        raise JSONOutputError(f"JSON 输出不符合要求: {'; '.join(errors[:3])}", text, errors)
+    return data
+
+
+def _json_roundtrip(p: str, messages: list, model: str, max_tokens: int, temperature: float,
+                    schema: dict | None, repair: bool) -> str:
+    """一次结构化请求（必要时加一轮修复），返回校验通过的规范化 JSON 文本。"""
+    token = _json_mode.set((schema,))
+    try:
+        try:
+            text = _dispatch_chat(p, messages, model, max_tokens, temperature)
+        except Exception as e:
+            if _status_code(e) != 400 or not (_json_response_format(p) or (p == "gemini" and _json_native(p))):
+                raise
+            # 该 provider / 模型不接受 response_format：退回普通请求，由本地校验兜底
+            _json_native_rejected.add(p)
+            _log_json(f"{p} 不支持原生 JSON 模式（{str(e)[:120]}），改用普通请求 + 本地校验")
+            text = _dispatch_chat(p, messages, model, max_tokens, temperature)
+        data, errors = parse_json_output(text, schema)
+        if errors and repair:
+            _tracker.record_json_repair()
+            _log_json(f"{p} 输出未通过校验（{'; '.join(errors[:3])}），发起一次修复请求...")
+            fix = list(messages) + [
+                {"role": "assistant", "content": text},
+                {"role": "user", "content": repair_prompt(errors, schema)},
+            ]
+            text = _dispatch_chat(p, fix, model, max_tokens, temperature)
+            data, errors = parse_json_output(text, schema)
+        if errors:
+            _tracker.record_json_failure()
+            raise JSONOutputError(f"{p} JSON 输出不符合要求: {'; '.join(errors[:3])}", text, errors)
+        return json.dumps(data, ensure_ascii=False)
+    finally:
+        _json_mode.reset(token)
+
+
+# ============ 流式生成 ============
+# 支持 stream_options.include_usage 的 provider；其余按估算记录 token
+_STREAM_USAGE_PROVIDERS = ("openai", "deepseek", "qwen")
+
+
+def _record_stream_usage(provider: str, m: str, messages: list, text: str, usage: tuple | None):
+    """流式调用的 token 记账：优先用服务端 usage，缺失（含中途断流）时按估算。"""
+    if usage:
+        _tracker.record(provider, m, *usage)
+    else:
+        _tracker.record(provider, m, estimate_message_tokens(messages, provider), estimate_tokens(text, provider))
+
+
+def _openai_compatible_stream(provider: str, messages: list, model: str, max_tokens: int, temperature: float) -> Iterator[str]:
+    key, base_url, kwargs = _openai_request(provider, messages, model, max_tokens, temperature)
+    kwargs["stream"] = True
+    if provider in _STREAM_USAGE_PROVIDERS:
+        kwargs["stream_options"] = {"include_usage": True}
+    client = _get_openai_client(provider, key, base_url)
+    m = kwargs["model"]
+    with _call_guard(provider, m, messages, kwargs["max_tokens"]):
+        parts, usage = [], None
+        _length_cut.set(False)
+        try:
+            stream = client.chat.completions.create(**kwargs)
+            with stream:
+                for chunk in stream:
+                    if getattr(chunk, "usage", None):
+                        usage = _openai_usage(chunk.usage)
+                    if chunk.choices and chunk.choices[0].finish_reason:
+                        _length_cut.set(_is_length_finish(chunk.choices[0].finish_reason))
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        delta = chunk.choices[0].delta.content
+                        parts.append(delta)
+                        yield delta
+        finally:
+            _record_stream_usage(provider, m, messages, "".join(parts), usage)
+
+
+def _claude_stream(messages: list, model: str, max_tokens: int, temperature: float) -> Iterator[str]:
+    kwargs = _claude_request(messages, model, max_tokens, temperature)
+    client = _get_anthropic_client(_api_key("claude", ANTHROPIC_API_KEY))
+    m = kwargs["model"]
+    with _call_guard("claude", m, messages, max_tokens):
+        parts, usage = [], None
+        _length_cut.set(False)
+        try:
+            with client.messages.stream(**kwargs) as stream:
+                for delta in stream.text_stream:
+                    parts.append(delta)
+                    yield delta
+                final = stream.get_final_message()
+                _length_cut.set(_is_length_finish(getattr(final, "stop_reason", None)))
+                if getattr(final, "usage", None):
+                    usage = _claude_usage(final.usage)
+        finally:
+            _record_stream_usage("claude", m, messages, "".join(parts), usage)
+
+
+def _gemini_stream(messages: list, model: str, max_tokens: int, temperature: float) -> Iterator[str]:
+    m, prompt, config = _gemini_request(messages, model, max_tokens, temperature)
+    gen_model = _get_gemini_model(GEMINI_API_KEY, m)
+    with _call_guard("gemini", m, messages, max_tokens):
+        parts, usage = [], None
+        _length_cut.set(False)
+        try:
+            resp = gen_model.generate_content(prompt, generation_config=config, stream=True)
+            for chunk in resp:
+                meta = getattr(chunk, "usage_metadata", None)
+                if meta:
+                    usage = _gemini_usage(meta)
+                reason = _gemini_finish_reason(chunk)
+                if reason:
+                    _length_cut.set(_is_length_finish(reason))
+                delta = chunk.text if chunk.parts else ""
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        finally:
+            _record_stream_usage("gemini", m, messages, "".join(parts), usage)
+
+
+def chat_stream(
+    messages: list,
+    provider: str = None,
+    model: str = None,
+    max_tokens: int = 8192,
+    temperature: float = 0.6,
+    reasoning: bool = False,
+) -> Iterator[str]:
+    """
+    流式对话：逐段 yield 文本增量，参数同 chat()。不经过响应缓存与自动重试；
+    需要断点续传、落盘与缓存时用 chat_streamed()。
+    """
+    p = _resolve_provider(provider)
+    if reasoning and p == "grok" and not model:
+        model = GROK_REASONING_MODEL
+    if get_replay_archive().replaying:
+        return _replay_stream(p, messages, max_tokens, temperature)
     if p == "claude":
-        return _claude_chat(messages, model, max_tokens, temperature)
+        return _claude_stream(messages, model, max_tokens, temperature)
     if p == "gemini":
-        return _gemini_chat(messages, model, max_tokens, temperature)
-    return _openai_compatible_chat("kimi", messages, model or KIMI_VISION_MODEL, max_tokens, temperature)
+        return _gemini_stream(messages, model, max_tokens, temperature)
+    return _openai_compatible_stream(p, messages, model, max_tokens, temperature)
+
+
+def _continuation_messages(provider: str, messages: list, partial: str) -> list:
+    """续写请求：Claude 用 assistant 预填充原生续写，其余 provider 附带已输出内容并要求接着写。"""
+    if provider == "claude":
+        return list(messages) + [{"role": "assistant", "content": partial.rstrip()}]
+    return list(messages) + [
+        {"role": "assistant", "content": partial},
+        {"role": "user", "content": "输出在上面中断了。请从中断处紧接着继续输出剩余内容，不要重复已输出的部分，不要任何说明。"},
+    ]
+
+
+def _is_stream_drop(exc: BaseException) -> bool:
+    """流式输出中途断开（读超时、连接被重置、服务端 5xx/429 等），可续传。"""
+    return isinstance(exc, httpx.TransportError) or _is_retryable(exc)
+
+
+def _spool_path(spool, kind: str, p: str, model: str, messages: list, max_tokens: int, temperature: float) -> Path | None:
+    if not spool:
+        return None
+    if spool is True:
+        resolved_model = model or PROVIDER_CONFIG.get(p, {}).get("model", "")
+        key = request_hash(kind, p, resolved_model, messages, temperature, max_tokens)
+        return LLM_STREAM_SPOOL_DIR / f"{key}.partial"
+    return Path(spool)
+
+
+def _stream_with_resume(
+    p: str, messages: list, model: str, max_tokens: int, temperature: float,
+    spool_path: Path | None, on_delta, max_resumes: int,
+) -> str:
+    partial = ""
+    if spool_path and spool_path.is_file():
+        partial = spool_path.read_text(encoding="utf-8")
+        if partial:
+            _log_stream(f"发现未完成输出 {spool_path.name}（{len(partial)} 字），从断点续写")
+    if spool_path:
+        spool_path.parent.mkdir(parents=True, exist_ok=True)
+    drops = rounds = 0
+    segment = 0  # 本段输出（首次请求或最近一次 max_tokens 续写）在 partial 中的起点
+    head = None  # max_tokens 续写开头的缓冲：攒够后与已输出结尾去重再输出
+    with (spool_path.open("a", encoding="utf-8") if spool_path else nullcontext()) as fh:
+        def emit(delta: str):
+            nonlocal partial
+            partial += delta
+            if fh:
+                fh.write(delta)
+                fh.flush()
+            if on_delta:
+                on_delta(delta)
+
+        def flush_head():
+            nonlocal head
+            if head:
+                emit(_stitch(partial, head)[len(partial):])
+            head = None
+
+        while True:
+            req = _continuation_messages(p, messages, partial) if partial else messages
+            # 断流续传只补足本段剩余额度；max_tokens 截断后的续写重新给满 max_tokens
+            done = partial[segment:]
+            budget = max(1024, max_tokens - estimate_tokens(done, p)) if done else max_tokens
+            _length_cut.set(False)
+            try:
+                for delta in chat_stream(req, p, model, budget, temperature):
+                    note_first_byte()
+                    if head is None:
+                        emit(delta)
+                        continue
+                    head += delta
+                    if len(head) >= _STITCH_WINDOW:
+                        flush_head()
+                flush_head()
+                if _continuation_plan(p, partial, rounds):
+                    rounds += 1
+                    segment = len(partial)
+                    head = ""
+                    continue
+                if rounds or _length_cut.get():
+                    _tracker.record_continuation(rounds, _length_cut.get())
+                break
+            except CircuitOpenError as e:
+                p, model = _reroute(p, e), None
+                continue
+            except Exception as e:
+                flush_head()
+                if not _is_stream_drop(e) or drops >= max_resumes:
+                    raise
+                drops += 1
+                note_retry()
+                _log_stream(f"流式输出中断（已收 {len(partial)} 字）: {type(e).__name__}: {str(e)[:200]}，"
+                            f"第 {drops}/{max_resumes} 次续传...")
+                _time.sleep(min(2 ** drops, 16))
+    if spool_path:
+        spool_path.unlink(missing_ok=True)
+    return partial.strip()
+
+
+def _log_stream(msg: str):
+    ts = _time.strftime("%H:%M:%S", _time.localtime())
+    print(f"[{ts}] [LLM流式] {msg}", flush=True)
+
+
+def chat_streamed(
+    messages: list,
+    provider: str = None,
+    model: str = None,
+    max_tokens: int = 8192,
+    temperature: float = 0.6,
+    reasoning: bool = False,
+    spool=True,
+    on_delta=None,
+    max_resumes: int = LLM_STREAM_MAX_RESUMES,
+    pool=None,
+) -> str:
+    """
+    以流式方式完成一次 chat()，返回完整文本；与 chat() 共用响应缓存键。
+    spool=True 时增量写入 output/spool/<请求哈希>.partial（也可传入路径），完成后删除；
+    流中途断开时从已收到的部分续写（最多 max_resumes 次），进程崩溃后重跑同一请求也会从 .partial 续写。
+    on_delta(delta) 可用于实时展示。pool 同 chat()。LLM_STREAM=0 时退化为 chat()；
+    当前步骤走批处理（--batch-mode，且路由后的 provider 支持 Batch API）时同样退化为 chat()，经批处理完成。
+    """
+    if not LLM_STREAM or (batch_mode_applies() and batch_mode_applies(routed_target(provider, model, max_tokens, reasoning)[0])):
+        return chat(messages, provider, model, max_tokens, temperature, reasoning, pool=pool)
+    with track_call("stream") as rec:
+        p, model, max_tokens = _routed_args(rec, provider, model, max_tokens, reasoning)
+        spool_path = _spool_path(spool, "chat", p, model, messages, max_tokens, temperature)
+        return _cached_call(
+            "chat", p, model, messages, max_tokens, temperature,
+            lambda: _route_call(
+                p, pool, model, messages, max_tokens,
+                lambda q, m: _stream_with_resume(q, messages, m, max_tokens, temperature, spool_path, on_delta, max_resumes),
+            ),
+        )
+
+
+# ============ 对冲请求 / 跨 provider 故障转移 ============
+_latency = LatencyStats()
+_hedge_policy = {
+    "enabled": LLM_HEDGE,
+    "providers": parse_provider_list(LLM_HEDGE_PROVIDERS),
+}
+
+
+def configure_hedging(enabled: bool = None, providers: list[str] = None):
+    """命令行覆盖对冲开关与备选 provider 顺序。"""
+    if enabled is not None:
+        _hedge_policy["enabled"] = enabled
+    if providers:
+        _hedge_policy["providers"] = [p.lower() for p in providers]
+
+
+def _provider_available(p: str) -> bool:
+    if p == "claude":
+        return bool(ANTHROPIC_API_KEY)
+    if p == "gemini":
+        return bool(GEMINI_API_KEY)
+    return bool(PROVIDER_CONFIG.get(p, {}).get("key"))
+
+
+class _HedgeAttempt:
+    """对冲中的一路请求：后台线程流式执行，在增量之间检查取消（关闭流即断开连接、停止计费）。"""
+
+    def __init__(self, provider: str, model: str, messages: list, max_tokens: int, temperature: float,
+                 cond: threading.Condition):
+        self.provider = provider
+        self.started = _time.monotonic()
+        self.first_byte: float | None = None
+        self.model = model
+        self.result: str | None = None
+        self.truncated = False
+        self.error: BaseException | None = None
+        self.done = False
+        self.cancelled = threading.Event()
+        self._cond = cond
+        self._args = (messages, provider, model, max_tokens, temperature)
+        # 复制调用方上下文，使备选请求的 token 计入同一次调用的指标
+        ctx = contextvars.copy_context()
+        threading.Thread(target=ctx.run, args=(self._run,), name=f"llm-hedge-{provider}", daemon=True).start()
+
+    def _run(self):
+        parts = []
+        try:
+            stream = chat_stream(*self._args)
+            try:
+                for delta in stream:
+                    if self.cancelled.is_set():
+                        return
+                    if self.first_byte is None:
+                        self.first_byte = _time.monotonic() - self.started
+                        note_first_byte()
+                        with self._cond:
+                            self._cond.notify_all()
+                    parts.append(delta)
+            finally:
+                stream.close()
+            self.truncated = _length_cut.get()
+            self.result = "".join(parts) if self.truncated else "".join(parts).strip()
+            _latency.record(self.provider, _time.monotonic() - self.started, self.first_byte)
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._cond:
+                self.done = True
+                self._cond.notify_all()
+
+    def deadline(self) -> float:
+        """该路请求被视为「慢」的时刻（monotonic）：未到首字节按 ttfb 阈值，否则按总耗时阈值。"""
+        q, n = LLM_HEDGE_QUANTILE, LLM_HEDGE_MIN_SAMPLES
+        total = _latency.threshold(self.provider, "total", q, n, LLM_HEDGE_TOTAL_FALLBACK)
+        if self.first_byte is None:
+            ttfb = _latency.threshold(self.provider, "ttfb", q, n, LLM_HEDGE_TTFB_FALLBACK)
+            return self.started + min(ttfb, total)
+        return self.started + total
+
+
+def _hedged_chat(p: str, messages: list, model: str, max_tokens: int, temperature: float) -> str:
+    """
+    对冲执行：先发主请求；最新一路超过阈值仍未完成（或全部失败）时按 LLM_HEDGE_PROVIDERS 顺序
+    追加备选请求，取第一个成功结果并取消其余。备选 provider 使用各自默认模型。
+    """
+    breakers = get_circuit_breakers()
+    backups = [
+        b for b in _hedge_policy["providers"]
+        if b != p and b in PROVIDER_CONFIG and _provider_available(b) and breakers.allows(b)
+    ]
+    if not backups:
+        return _dispatch_chat(p, messages, model, max_tokens, temperature)
+    cond = threading.Condition()
+    with cond:
+        attempts = [_HedgeAttempt(p, model, messages, max_tokens, temperature, cond)]
+        while True:
+            winner = next((a for a in attempts if a.done and a.error is None and a.result is not None), None)
+            if winner:
+                break
+            pending = [a for a in attempts if not a.done]
+            if not pending and not backups:
+                raise attempts[0].error
+            reason, timeout = None, None
+            if backups:
+                latest = pending[-1] if pending else attempts[-1]
+                if not pending:
+                    reason = "失败"
+                elif len(pending) <= LLM_HEDGE_MAX:
+                    timeout = latest.deadline() - _time.monotonic()
+                    if timeout <= 0:
+                        reason = "无首字节" if latest.first_byte is None else "未完成"
+            if reason:
+                nxt = backups.pop(0)
+                ts = _time.strftime("%H:%M:%S", _time.localtime())
+                print(f"[{ts}] [LLM对冲] {latest.provider} {reason}，发出备选请求 → {nxt}", flush=True)
+                attempts.append(_HedgeAttempt(nxt, None, messages, max_tokens, temperature, cond))
+                continue
+            cond.wait(timeout)
+    for a in attempts:
+        if a is not winner:
+            a.cancelled.set()
+    _tracker.record_hedge(p, winner.provider, [a.provider for a in attempts])
+    # 对冲各路在独立线程中执行，截断状态由胜出者带回
+    _length_cut.set(winner.truncated)
+    return _continue_truncated(
+        winner.provider, messages, winner.result,
+        lambda msgs: _provider_chat(winner.provider, msgs, winner.model, max_tokens, temperature),
+    )
+
+
+# ============ 异步 API ============
+# 异步客户端绑定事件循环，按 loop 分别注册；loop 销毁后对应注册表随之回收。
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _ClientRegistry]" = weakref.WeakKeyDictionary()
+_async_clients_lock = threading.Lock()
+
+
+def _loop_registry() -> _ClientRegistry:
+    loop = asyncio.get_running_loop()
+    with _async_clients_lock:
+        registry = _async_clients.get(loop)
+        if registry is None:
+            registry = _async_clients[loop] = _ClientRegistry()
+    return registry
+
+
+def _new_async_http_client(timeout: httpx.Timeout = HTTP_TIMEOUT) -> httpx.AsyncClient:
+    """创建带连接池上限的 httpx.AsyncClient。"""
+    return httpx.AsyncClient(
+        timeout=timeout,
+        limits=httpx.Limits(
+            max_connections=LLM_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_POOL_KEEPALIVE_EXPIRY,
+        ),
+        http2=_http2_enabled(),
+    )
+
+
+def _get_async_openai_client(provider: str, key: str, base_url: str = None, timeout: httpx.Timeout = HTTP_TIMEOUT):
+    """当前事件循环内共享的 AsyncOpenAI 客户端。"""
+    from openai import AsyncOpenAI
+
+    def _factory():
+        http_client = _new_async_http_client(timeout)
+        client = AsyncOpenAI(api_key=key, base_url=base_url, http_client=http_client, max_retries=0)
+        return client, http_client.aclose
+    return _loop_registry().get(("openai", provider, base_url, key, _timeout_key(timeout)), _factory)
+
+
+def _get_async_anthropic_client(key: str, timeout: httpx.Timeout = HTTP_TIMEOUT):
+    """当前事件循环内共享的 AsyncAnthropic 客户端。"""
+    try:
+        from anthropic import AsyncAnthropic
+    except ImportError:
+        raise ImportError("Claude 需安装 anthropic: pip install anthropic")
+
+    def _factory():
+        http_client = _new_async_http_client(timeout)
+        client = AsyncAnthropic(api_key=key, http_client=http_client, max_retries=0)
+        return client, http_client.aclose
+    return _loop_registry().get(("claude", None, key, _timeout_key(timeout)), _factory)
+
+
+@_llm_retry
+async def _aopenai_compatible_chat(provider: str, messages: list, model: str = None, max_tokens: int = 8192, temperature: float = 0.6) -> str:
+    """OpenAI 兼容 API（异步）。"""
+    key, base_url, kwargs = _openai_request(provider, messages, model, max_tokens, temperature)
+    client = _get_async_openai_client(provider, key, base_url)
+    async with _acall_guard(provider, kwargs["model"], messages, kwargs["max_tokens"]):
+        resp = await client.chat.completions.create(**kwargs)
+        return _openai_result(provider, kwargs["model"], resp)
+
+
+@_llm_retry
+async def _aclaude_chat(messages: list, model: str = None, max_tokens: int = 8192, temperature: float = 0.6) -> str:
+    """Anthropic Claude API（异步）。"""
+    kwargs = _claude_request(messages, model, max_tokens, temperature)
+    client = _get_async_anthropic_client(_api_key("claude", ANTHROPIC_API_KEY))
+    async with _acall_guard("claude", kwargs["model"], messages, max_tokens):
+        resp = await client.messages.create(**kwargs)
+        return _claude_result(kwargs["model"], resp)
+
+
+@_llm_retry
+async def _agemini_chat(messages: list, model: str = None, max_tokens: int = 8192, temperature: float = 0.6) -> str:
+    """Google Gemini API（异步）。"""
+    m, prompt, config = _gemini_request(messages, model, max_tokens, temperature)
+    gen_model = _get_gemini_model(GEMINI_API_KEY, m)
+    async with _acall_guard("gemini", m, messages, max_tokens):
+        resp = await gen_model.generate_content_async(prompt, generation_config=config)
+        return _gemini_result(m, resp)
+
+
+async def _adispatch_chat(p: str, messages: list, model: str, max_tokens: int, temperature: float) -> str:
+    try:
+        return await _adispatch_provider(p, messages, model, max_tokens, temperature)
+    except CircuitOpenError as e:
+        fallback = _reroute(p, e)
+    return await _adispatch_provider(fallback, messages, None, max_tokens, temperature)
+
+
+async def _adispatch_provider(p: str, messages: list, model: str, max_tokens: int, temperature: float) -> str:
+    _length_cut.set(False)
+    result = await _aprovider_chat(p, messages, model, max_tokens, temperature)
+    return await _acontinue_truncated(
+        p, messages, result,
+        lambda msgs: _aprovider_chat(p, msgs, model, max_tokens, temperature),
+    )
+
+
+async def _aprovider_chat(p: str, messages: list, model: str, max_tokens: int, temperature: float) -> str:
+    if p == "claude":
+        return await _aclaude_chat(messages, model, max_tokens, temperature)
+    if p == "gemini":
+        return await _agemini_chat(messages, model, max_tokens, temperature)
+    return await _aopenai_compatible_chat(p, messages, model, max_tokens, temperature)
+
+
+async def _acached_call(kind: str, p: str, model: str, messages: list, max_tokens: int, temperature: float, fn):
+    """_cached_call 的异步版本，fn() 返回协程。"""
+    return await _areplay_call(
+        kind, p, model, messages, max_tokens, temperature,
+        lambda: _aresponse_cache_call(kind, p, model, messages, max_tokens, temperature, fn),
+    )
+
+
+async def _aresponse_cache_call(kind: str, p: str, model: str, messages: list, max_tokens: int, temperature: float, fn):
+    cache = get_response_cache()
+    resolved_model = model or PROVIDER_CONFIG.get(p, {}).get("model", "")
+    key = request_hash(kind, p, resolved_model, messages, temperature, max_tokens)
+    cacheable = cache.cacheable(temperature)
+    if cacheable:
+        hit = cache.get(key)
+        if hit is not None:
+            note_cache_hit()
+            return hit
+
+    async def _fetch():
+        result = await fn()
+        if result and cacheable:
+            cache.put(key, result, kind, p, resolved_model)
+        return result
+
+    return await _single_flight.ado(key, _fetch, note_coalesced)
+
+
+async def achat(
+    messages: list,
+    provider: str = None,
+    model: str = None,
+    max_tokens: int = 8192,
+    temperature: float = 0.6,
+    reasoning: bool = False,
+    pool=None,
+) -> str:
+    """chat() 的异步版本：参数、重试、缓存、路由池与 token 统计语义相同，不占用线程。"""
+    with track_call("chat") as rec:
+        p, model, max_tokens = _routed_args(rec, provider, model, max_tokens, reasoning)
+        return await _acached_call(
+            "chat", p, model, messages, max_tokens, temperature,
+            lambda: _aroute_call(
+                p, pool, model, messages, max_tokens,
+                lambda q, m: _adispatch_chat(q, messages, m, max_tokens, temperature),
+            ),
+        )
+
+
+async def achat_vision(
+    messages: list,
+    provider: str = None,
+    model: str = None,
+    max_tokens: int = 8192,
+    temperature: float = 0.3,
+) -> str:
+    """chat_vision() 的异步版本。"""
+    p = _resolve_provider(provider)
+    if p == "kimi":
+        model = model or KIMI_VISION_MODEL
+    elif p == "glm":
+        model = model or GLM_VISION_MODEL
+    with track_call("vision"):
+        return await _acached_call(
+            "vision", p, model, messages, max_tokens, temperature,
+            lambda: _adispatch_chat(p, messages, model, max_tokens, temperature),
+        )
+
+
+async def achat_many(
+    requests: list[dict],
+    concurrency: int = LLM_ASYNC_CONCURRENCY,
+    return_exceptions: bool = False,
+) -> list:
+    """
+    并发执行多个 achat 请求，按输入顺序返回结果。
+    requests 每项为 achat 的关键字参数，如 {"messages": [...], "max_tokens": 4096}；
+    含 "vision": True 时走 achat_vision。concurrency 为同时在途的请求上限。
+    return_exceptions=True 时失败项返回异常对象而非整体抛出。
+    """
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def _one(req: dict):
+        kwargs = dict(req)
+        fn = achat_vision if kwargs.pop("vision", False) else achat
+        async with sem:
+            return await fn(**kwargs)
+
+    return await asyncio.gather(*(_one(r) for r in requests), return_exceptions=return_exceptions)
+
+
+def run_chat_many(
+    requests: list[dict],
+    concurrency: int = LLM_ASYNC_CONCURRENCY,
+    return_exceptions: bool = False,
+) -> list:
+    """同步入口：在新事件循环中执行 achat_many，结束后关闭该循环的异步连接池。"""
+    async def _main():
+        try:
+            return await achat_many(requests, concurrency, return_exceptions)
+        finally:
+            await aclose_clients()
+    return asyncio.run(_main())
+
+
+async def aclose_clients():
+    """关闭当前事件循环内的异步客户端连接池。"""
+    loop = asyncio.get_running_loop()
+    with _async_clients_lock:
+        registry = _async_clients.pop(loop, None)
+    if registry is not None:
+        await registry.aclose_all()
 
 
 # ============ Token 统计公开 API ============
 def print_token_summary():
     """打印 token 用量摘要。"""
     s = _tracker.summary()
-    if s["total_calls"] == 0:
+    if s["total_calls"] == 0 and not get_response_cache().stats()["hits"] and not get_replay_archive().miss_count:
         return
     print(f"\n{'='*60}")
     print(f"API 调用统计")
@@ -504,9 +2093,58 @@ def print_token_summary():
     print(f"总 Token:    {s['total_tokens']:,} (输入 {s['total_input_tokens']:,} / 输出 {s['total_output_tokens']:,})")
     for p, g in s["by_provider"].items():
         print(f"  {p}: {g['calls']} 次, {g['input_tokens']+g['output_tokens']:,} tokens")
+    if s["total_cached_input_tokens"]:
+        ratio = s["total_cached_input_tokens"] / max(1, s["total_input_tokens"])
+        print(f"提示缓存: 输入中 {s['total_cached_input_tokens']:,} tokens 命中 provider 前缀缓存（{ratio:.0%}）")
+    c = get_response_cache().stats()
+    if c["hits"] or c["misses"]:
+        print(f"响应缓存({c['mode']}): 命中 {c['hits']} / 未命中 {c['misses']}，写入 {c['writes']}，淘汰 {c['evicted']}")
+    f = _single_flight.stats()
+    if f["coalesced"]:
+        print(f"在途合并: {f['coalesced']} 次调用复用了相同请求的在途结果（实际发出 {f['leaders']} 次）")
+    if s["continued_calls"]:
+        still = f"，{s['still_truncated']} 次达到续写上限仍被截断" if s["still_truncated"] else ""
+        print(f"截断续写: {s['continued_calls']} 次调用输出达到 max_tokens，共续写 {s['continuations']} 次{still}")
+    if s["json_repairs"] or s["json_failures"]:
+        print(f"结构化输出: 修复请求 {s['json_repairs']} 次，修复后仍失败 {s['json_failures']} 次")
+    b = batch_stats()
+    if b["jobs"] or b["fallbacks"]:
+        print(f"批处理: 提交 {b['jobs']} 个任务 / {b['requests']} 个请求，完成 {b['completed']}，回退实时调用 {b['fallbacks']}")
+    if s["hedges_fired"]:
+        wins = "，".join(f"{k} 胜 {v}" for k, v in s["hedge_wins"].items())
+        print(f"对冲请求: {s['hedged_calls']} 次调用中 {s['hedges_fired']} 次触发备选（{wins}）")
+    waited = get_rate_limiter().stats()
+    if waited:
+        print("限流累计等待: " + "，".join(f"{k} {v}s" for k, v in waited.items()))
+    breakers = get_circuit_breakers()
+    for name, b in breakers.stats().items():
+        changes = "，".join(f"{k.replace('->', '→')} {v} 次" for k, v in b["transitions"].items())
+        print(f"熔断 {name}（当前 {b['state']}）: {changes or '无状态变化'}，快速失败 {b['rejected']} 次")
+    if breakers.rerouted:
+        print("熔断改道: " + "，".join(f"{k.replace('->', '→')} {v} 次" for k, v in breakers.rerouted.items()))
+    aimd = get_adaptive_concurrency().stats()
+    if aimd:
+        print("自适应并发: " + "，".join(
+            f"{k} 当前 {v['limit']}（峰值 {v['peak']}，降档 {v['decreases']} 次）" for k, v in aimd.items()))
+    model_routes = get_model_routes().stats()
+    if model_routes:
+        print("模型路由: " + "，".join(
+            f"{label}（{', '.join(f'{k}={v}' for k, v in r.items() if k != 'hits')}）{r['hits']} 次"
+            for label, r in model_routes.items()))
+    routed = get_key_pool().stats()
+    if routed:
+        print("路由池: " + "，".join(f"{k} {v} 次" for k, v in routed.items()))
+    r = get_replay_archive().stats()
+    if r["mode"] == "record":
+        print(f"离线录制: 写入 {r['recorded']} 条 → {r['archive']}")
+    elif r["mode"] == "replay":
+        print(f"离线回放: 命中 {r['served']} / 未命中 {r['misses']}（{r['archive']}）")
+        for miss in get_replay_archive().misses[:10]:
+            print(f"  未命中 {miss['key'][:12]} {miss['kind']} @ {miss['step']}.{miss['site']}: {miss['prompt'][:60]}")
     print(f"{'='*60}\n")
 
 
 def reset_token_tracker():
     """重置 token 统计。"""
     _tracker.reset()
+    _single_flight.reset_stats()
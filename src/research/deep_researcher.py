@@ -46,7 +46,6 @@ def run_deep_research(
     search_provider: str = "perplexity",
     max_questions: int = 5,
     max_iterations: int = 2,
-    search_delay: float = 3.0,
 ) -> ResearchReport:
     """
     执行深度研究，返回结构化研究报告。
@@ -57,7 +56,6 @@ def run_deep_research(
         search_provider: 搜索源 (perplexity/grok/gemini)
         max_questions: 最大子问题数
         max_iterations: 最大迭代轮次（1=不追问，2=追问一次）
-        search_delay: 搜索间隔秒数（避免限流）
 
     Returns:
         ResearchReport: 结构化研究报告
@@ -77,10 +75,8 @@ def run_deep_research(
     all_citations: List[dict] = []
     total_searches = 0
 
+    # 搜索源限流由 llm_client 的令牌桶负责，无需固定间隔
     for i, question in enumerate(questions):
-        if i > 0:
-            time.sleep(search_delay)
-
         _log(f"  [{i+1}/{len(questions)}] 搜索: {question[:60]}...")
         result = adapter.search(question, context)
         total_searches += 1
@@ -103,7 +99,6 @@ def run_deep_research(
         if followup_questions:
             _log(f"  追问: {len(followup_questions)} 个补充问题")
             for i, fq in enumerate(followup_questions):
-                time.sleep(search_delay)
                 _log(f"  [追问 {i+1}/{len(followup_questions)}] {fq[:60]}...")
                 result = adapter.search(fq, context)
                 total_searches += 1
@@ -12,7 +12,7 @@ from typing import List, Tuple
 import src  # noqa: F401  — 确保 PROJECT_ROOT 加入 sys.path
 
 from config import RAW_DIR, CORPUS_EXTENSIONS
-from src.llm_client import chat
+from src.llm_client import chat_streamed
 from src.ingest.file_importer import import_from_file
 from src.corpus_extractors import (
     extract_from_docx_rich, extract_from_pdf_rich, extract_from_image,
@@ -102,7 +102,8 @@ def _api_reorganize_corpus(combined: str, total_chars: int) -> str:
     if len(combined) > MAX_CHARS_PER_CALL:
         prompt += f"\n\n（注：原文已截断至前 {MAX_CHARS_PER_CALL} 字，请对截断部分进行重整；超出部分将在后续步骤中保留。）"
 
-    resp = chat(
+    # 长输出（32K tokens）：流式生成并落盘，断流时从已输出部分续写
+    resp = chat_streamed(
         [
             {
                 "role": "system",
@@ -12,7 +12,6 @@ Step2: 根据本地原始语料，调用远程 API 生成报告 1.0。
 import json
 import re
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 import src  # noqa: F401  — 确保 PROJECT_ROOT 加入 sys.path
@@ -22,16 +21,53 @@ from config import (
     OUTLINE_RAW_LIMIT, OUTLINE_REVIEW_RAW_LIMIT, CHAPTER_INTRO_BODY_LIMIT,
     SUPPLEMENT_RAW_LIMIT,
     ASSEMBLE_CHUNK_SIZE,
+    LLM_EDIT_SCRIPT, EDIT_SCRIPT_MAX_TOKENS,
 )
-from src.llm_client import chat
+from src.llm_client import chat, chat_json, chat_streamed
+from src.utils.checkpoint import checkpointed, skip_checkpoint
+from src.utils.adaptive_concurrency import fanout_workers
 from src.utils.log import log as _log
-from src.utils.file_utils import load_raw_content as _load_raw_content, clean_json as _clean_json
+from src.utils.edit_script import EDIT_SCRIPT_INSTRUCTIONS, edit_or_rewrite
+from src.utils.file_utils import load_raw_content as _load_raw_content
+from src.utils.json_output import JSONOutputError
+from src.utils.token_budget import adaptive_chunk_chars, fit_text
 
 
 from src.prompts import REPORT_WRITER_PROMPT as SYSTEM_PROMPT
 
-# 并行工作线程数（章节装配 / 专家评审）
-MAX_WORKERS = 4
+# 大纲 JSON 的结构约束（chat_json 据此校验并在不符合时发起一次修复请求）
+OUTLINE_SCHEMA = {
+    "type": "object",
+    "required": ["title", "summary", "keywords", "outline"],
+    "properties": {
+        "title": {"type": "string", "minLength": 1},
+        "summary": {"type": "string"},
+        "keywords": {"type": "array", "items": {"type": "string"}},
+        "outline": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "required": ["level1", "level2"],
+                "properties": {
+                    "level1": {"type": "string", "minLength": 1},
+                    "density": {"type": "integer", "minimum": 1, "maximum": 5},
+                    "level2": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "required": ["title"],
+                            "properties": {
+                                "title": {"type": "string"},
+                                "level3": {"type": "array", "items": {"type": "string"}},
+                            },
+                        },
+                    },
+                },
+            },
+        },
+    },
+}
 
 
 def _merge_duplicate_chapters(report_text: str) -> str:
@@ -72,6 +108,8 @@ def _merge_duplicate_chapters(report_text: str) -> str:
     return f"{header}\n\n" + "\n\n".join(merged_parts)
 
 
+@checkpointed("step2.outline", config=("OUTLINE_RAW_LIMIT", "LLM_BUDGET_SAFETY", "LLM_CONTEXT_WINDOWS"),
+              files=("src/prompts.py",))
 def _api_build_outline(content: str, template_constraints: str = "") -> dict:
     """调用 API 分析语料，构建文档大纲。≤7 章，最多三级目录。"""
     prompt = """请分析以下「原始对话语料」的整体内容，构建一份文档大纲。
@@ -114,36 +152,28 @@ def _api_build_outline(content: str, template_constraints: str = "") -> dict:
     prompt += f"""
 原始语料：
 ---
-{content[:OUTLINE_RAW_LIMIT]}
+{fit_text(content, OUTLINE_RAW_LIMIT, max_tokens=8192, overhead_tokens=2048)}
 ---
 
 直接输出 JSON，不要 markdown 代码块包裹。"""
 
     _log("调用 API：分析语料，构建文档大纲（标题/摘要/关键词/章节结构）...", "1")
     t0 = time.time()
-    resp = chat(
-        [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
-        max_tokens=8192,
-        temperature=0.3,
-        reasoning=True,
-    )
-    _log(f"API#1 完成，耗时 {time.time()-t0:.1f}s，响应约 {len(resp)} 字", "1")
-    text = _clean_json(resp)
-    try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        pass
-    # 尝试修复常见问题：截断处补全、去除控制字符
     try:
-        text_fix = text.replace("\r\n", " ").replace("\n", " ")
-        if '"outline":' in text_fix and text_fix.rstrip() and not text_fix.rstrip().endswith("}"):
-            idx = text_fix.rfind('"level1"')
-            if idx > 0:
-                text_fix = text_fix[:idx] + ']}'
-        return json.loads(text_fix)
-    except (json.JSONDecodeError, Exception):
-        pass
-    # 兜底：从响应中提取 title/summary/keywords，使用默认大纲
+        meta = chat_json(
+            [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
+            schema=OUTLINE_SCHEMA,
+            max_tokens=8192,
+            temperature=0.3,
+            reasoning=True,
+        )
+        _log(f"API#1 完成，耗时 {time.time()-t0:.1f}s，大纲 {len(meta['outline'])} 章", "1")
+        return meta
+    except JSONOutputError as e:
+        _log(f"[警告] 大纲 JSON 修复后仍不合格（{'; '.join(e.errors[:2])}），使用默认大纲", "1")
+        skip_checkpoint()
+        text = e.text
+    # 兜底：从最后一次响应中提取 title/summary/keywords，使用默认大纲
     meta = {"title": "深度调查报告", "summary": "", "keywords": [], "outline": []}
     if '"title"' in text:
         m = re.search(r'"title"\s*:\s*"([^"]*)"', text)
@@ -168,6 +198,7 @@ def _api_build_outline(content: str, template_constraints: str = "") -> dict:
     return meta
 
 
+@checkpointed("step2.outline_review", config=("OUTLINE_REVIEW_RAW_LIMIT",), files=("src/prompts.py",))
 def _api_review_outline(outline_json: dict, content: str) -> dict:
     """重新审阅大纲，检查覆盖度、独立性、逻辑递进、均衡性，返回修正后的大纲 JSON。"""
     outline_str = json.dumps(outline_json, ensure_ascii=False, indent=2)
@@ -195,29 +226,23 @@ def _api_review_outline(outline_json: dict, content: str) -> dict:
 
     _log("调用 API：审阅并优化大纲...", "1b")
     t0 = time.time()
-    resp = chat(
-        [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
-        max_tokens=8192,
-        temperature=0.3,
-        reasoning=True,
-    )
-    _log(f"API#1b 大纲审阅完成，耗时 {time.time()-t0:.1f}s", "1b")
-    text = _clean_json(resp)
     try:
-        reviewed = json.loads(text)
-        # 确保关键字段存在
-        if "outline" in reviewed and isinstance(reviewed["outline"], list):
-            # 保留原始 title/summary/keywords 如果审阅版缺失
-            for key in ("title", "summary", "keywords"):
-                if key not in reviewed and key in outline_json:
-                    reviewed[key] = outline_json[key]
-            return reviewed
-    except (json.JSONDecodeError, Exception):
-        pass
-    _log("[警告] 大纲审阅结果解析失败，保留原始大纲")
-    return outline_json
+        reviewed = chat_json(
+            [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
+            schema=OUTLINE_SCHEMA,
+            max_tokens=8192,
+            temperature=0.3,
+            reasoning=True,
+        )
+    except JSONOutputError:
+        _log("[警告] 大纲审阅结果解析失败，保留原始大纲")
+        skip_checkpoint()
+        return outline_json
+    _log(f"API#1b 大纲审阅完成，耗时 {time.time()-t0:.1f}s", "1b")
+    return reviewed
 
 
+@checkpointed("step2.section", files=("src/prompts.py",))
 def _api_assemble_section(
     raw_chunk: str,
     chapter_title: str,
@@ -251,7 +276,8 @@ def _api_assemble_section(
 
 请输出该部分的完整正文（保持充实篇幅）。"""
 
-    resp = chat(
+    # 长输出：流式生成并落盘，断流时从已输出部分续写
+    resp = chat_streamed(
         [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
         max_tokens=16384,
         temperature=0.4,
@@ -261,6 +287,7 @@ def _api_assemble_section(
     return resp
 
 
+@checkpointed("step2.intro_summary", config=("CHAPTER_INTRO_BODY_LIMIT",), files=("src/prompts.py",))
 def _api_add_chapter_intro_summary(
     chapter_title: str,
     chapter_body: str,
@@ -293,7 +320,8 @@ def _api_add_chapter_intro_summary(
 3. 过渡文字要简洁、专业，不要重复正文内容。
 4. 直接输出**完整章节**（含新增的章首描述 + 原文正文 + 章末总结），使用 Markdown 格式。不要单独输出描述和总结。"""
 
-    resp = chat(
+    # 长输出：流式生成并落盘，断流时从已输出部分续写
+    resp = chat_streamed(
         [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
         max_tokens=16384,
         temperature=0.4,
@@ -303,15 +331,18 @@ def _api_add_chapter_intro_summary(
     return resp
 
 
+@checkpointed("step2.supplement", config=("SUPPLEMENT_RAW_LIMIT", "EDIT_SCRIPT_MAX_TOKENS"),
+              files=("src/prompts.py", "src/utils/edit_script.py"))
 def _api_supplement_chapter(
     chapter_title: str,
     chapter_body: str,
     raw_chunk: str,
     chapter_idx: int,
     total_chapters: int,
+    edit_script: bool = None,
 ) -> str:
-    """对比原始语料与单章内容，补充缺失内容。"""
-    prompt = f"""请对比以下「原始语料片段」与「报告第 {chapter_idx}/{total_chapters} 章」，补充缺失内容。
+    """对比原始语料与单章内容，补充缺失内容。edit_script 为 None 时按 LLM_EDIT_SCRIPT 决定是否用编辑脚本模式。"""
+    task = f"""请对比以下「原始语料片段」与「报告第 {chapter_idx}/{total_chapters} 章」，补充缺失内容。
 
 【本章标题】{chapter_title}
 
@@ -320,12 +351,8 @@ def _api_supplement_chapter(
 2. 将缺失内容**补充到本章对应小节**下，保持目录结构不变。
 3. 补充时保持原文表述，不编造。
 4. 若未发现明显缺失，输出原章节内容（可做必要格式整理）。
-
-【要求】
-- 直接输出本章**完整正文**（以 ## 标题开头），使用 Markdown。
-- 不要输出缺失清单或分析说明。
-- 篇幅只增不减，不要压缩已有内容。
-
+"""
+    material = f"""
 ---
 【原始语料片段】
 {raw_chunk[:SUPPLEMENT_RAW_LIMIT]}
@@ -333,26 +360,45 @@ def _api_supplement_chapter(
 ---
 【本章正文】
 {chapter_body}
+"""
 
+    def _rewrite() -> str:
+        prompt = task + """
+【要求】
+- 直接输出本章**完整正文**（以 ## 标题开头），使用 Markdown。
+- 不要输出缺失清单或分析说明。
+- 篇幅只增不减，不要压缩已有内容。
+""" + material + """
 ---
 请输出补充后的本章完整正文。"""
+        resp = chat(
+            [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
+            max_tokens=16384,
+            temperature=0.3,
+        )
+        return resp.strip()
 
-    resp = chat(
+    if not (LLM_EDIT_SCRIPT if edit_script is None else edit_script):
+        return _rewrite()
+    prompt = task + "5. 只用 insert_after / insert_before 插入缺失内容，不要改动已有内容；未发现缺失时输出空操作列表。\n" \
+        + material + EDIT_SCRIPT_INSTRUCTIONS
+    body = edit_or_rewrite(
         [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
-        max_tokens=16384,
-        temperature=0.3,
+        chapter_body, _rewrite, label=f"[补充] 第 {chapter_idx} 章", max_tokens=EDIT_SCRIPT_MAX_TOKENS,
     )
-    return resp.strip()
+    return body if body.lstrip().startswith("## ") else f"{chapter_title}\n\n{body.strip()}"
 
 
+@checkpointed("step2.dedup", config=("EDIT_SCRIPT_MAX_TOKENS",), files=("src/prompts.py", "src/utils/edit_script.py"))
 def _api_deduplicate_chapter(
     chapter_title: str,
     chapter_body: str,
     chapter_idx: int,
     total_chapters: int,
+    edit_script: bool = None,
 ) -> str:
-    """对单章进行重复内容去重。"""
-    prompt = f"""请对以下报告第 {chapter_idx}/{total_chapters} 章进行**重复内容去重**。
+    """对单章进行重复内容去重。edit_script 为 None 时按 LLM_EDIT_SCRIPT 决定是否用编辑脚本模式。"""
+    task = f"""请对以下报告第 {chapter_idx}/{total_chapters} 章进行**重复内容去重**。
 
 【本章标题】{chapter_title}
 
@@ -361,25 +407,38 @@ def _api_deduplicate_chapter(
 2. 合并重复内容：保留表述最佳的版本，删除其余重复处。
 3. 保持小节结构、论证逻辑不变。
 4. 去重后语句通顺，段落衔接自然。
+"""
+    material = f"""
+---
+【本章正文】
+{chapter_body}
+"""
 
+    def _rewrite() -> str:
+        prompt = task + """
 【要求】
 - 直接输出本章**去重后的完整正文**（以 ## 标题开头），使用 Markdown。
 - 不要输出去重说明，只输出本章正文。
 - 若未发现明显重复，保持原文输出或做少量润色。
-
----
-【本章正文】
-{chapter_body}
-
+""" + material + """
 ---
 请输出去重后的本章正文。"""
+        resp = chat(
+            [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
+            max_tokens=16384,
+            temperature=0.3,
+        )
+        return resp.strip()
 
-    resp = chat(
+    if not (LLM_EDIT_SCRIPT if edit_script is None else edit_script):
+        return _rewrite()
+    prompt = task + "5. 用 delete 删除重复处，必要时用 replace 修补衔接语句；未发现重复时输出空操作列表。\n" \
+        + material + EDIT_SCRIPT_INSTRUCTIONS
+    body = edit_or_rewrite(
         [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
-        max_tokens=16384,
-        temperature=0.3,
+        chapter_body, _rewrite, label=f"[去重] 第 {chapter_idx} 章", max_tokens=EDIT_SCRIPT_MAX_TOKENS,
     )
-    return resp.strip()
+    return body if body.lstrip().startswith("## ") else f"{chapter_title}\n\n{body.strip()}"
 
 
 def _api_supplement_missing(raw_content: str, report_text: str, step_desc: str = "") -> str:
@@ -457,13 +516,17 @@ def _assemble_chapter(
     content: str,
     chapter_title: str,
     level2_list: list,
-    chunk_size: int = ASSEMBLE_CHUNK_SIZE,
+    chunk_size: int = None,
     chapter_idx: int = 0,
 ) -> str:
     """
     装配单章内容。若二级目录较多或语料较长，按二级目录或语料块分批次装配后合并。
+    chunk_size 默认由 ASSEMBLE_CHUNK_SIZE 按当前 provider 的分词比例与上下文窗口换算。
     返回装配结果文本。
     """
+    if chunk_size is None:
+        chunk_size = adaptive_chunk_chars(ASSEMBLE_CHUNK_SIZE, max_tokens=16384, overhead_tokens=2048, sample_text=content,
+                                          site="_api_assemble_section")
     section_titles = [s.get("title", str(s)) for s in level2_list if s]
     raw_len = len(content)
     ch_tag = f"Ch{chapter_idx+1}"
@@ -559,7 +622,8 @@ def run_meta_and_report_v1(raw_path: Path, output_basename: str = None, report_t
 
     # --- 2. 并行装配各章节
     total_chapters = len(outline)
-    _log(f"Step2 并行装配：共 {total_chapters} 章，{MAX_WORKERS} 线程并发，原始语料 {len(content)} 字")
+    workers = fanout_workers(total_chapters)
+    _log(f"Step2 并行装配：共 {total_chapters} 章，{workers} 线程（并发由 AIMD 自适应），原始语料 {len(content)} 字")
     t_assemble = time.time()
 
     chapter_bodies = [None] * total_chapters  # 按索引保持顺序
@@ -571,19 +635,16 @@ def run_meta_and_report_v1(raw_path: Path, output_basename: str = None, report_t
         body = _assemble_chapter(content, level1, level2_list, chapter_idx=i)
         return i, level1, body
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(_do_assemble, i, ch): i for i, ch in enumerate(outline)}
-        for future in as_completed(futures):
-            i, level1, body = future.result()
-            chapter_bodies[i] = {"title": level1, "body": body}
-            _log(f"--- [并行] 章节 {i+1}/{total_chapters}「{level1}」装配完成，约 {len(body)} 字 ---")
+    from src.utils.parallel import imap, parallel_map
+    for i, (_, level1, body) in imap(_do_assemble, outline, max_workers=workers):
+        chapter_bodies[i] = {"title": level1, "body": body}
+        _log(f"--- [并行] 章节 {i+1}/{total_chapters}「{level1}」装配完成，约 {len(body)} 字 ---")
 
     _log(f"Step2 全部章节装配完成，耗时 {time.time()-t_assemble:.1f}s")
 
     # --- 3. 并行为每章添加章首描述、章末总结（承上启下）
-    _log(f"Step2 并行添加章首章末（{MAX_WORKERS} 线程）...")
+    _log(f"Step2 并行添加章首章末（{workers} 线程）...")
     t_intro = time.time()
-    final_chapters = [None] * total_chapters
 
     def _do_intro_summary(i, cb):
         prev_title = chapter_bodies[i - 1]["title"] if i > 0 else ""
@@ -594,11 +655,7 @@ def run_meta_and_report_v1(raw_path: Path, output_basename: str = None, report_t
         )
         return i, enhanced
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(_do_intro_summary, i, cb): i for i, cb in enumerate(chapter_bodies)}
-        for future in as_completed(futures):
-            i, enhanced = future.result()
-            final_chapters[i] = enhanced
+    final_chapters = [enhanced for _, enhanced in parallel_map(_do_intro_summary, chapter_bodies, max_workers=workers)]
 
     _log(f"Step2 章首章末全部完成，耗时 {time.time()-t_intro:.1f}s")
 
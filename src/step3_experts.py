@@ -8,7 +8,6 @@ Step3: 并行调用 LLM API 生成 5 个评审专家 Agent：
 所有 5 位专家并行调用，大幅缩短 Step3 总耗时。
 """
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 import src  # noqa: F401  — 确保 PROJECT_ROOT 加入 sys.path
@@ -16,8 +15,11 @@ import src  # noqa: F401  — 确保 PROJECT_ROOT 加入 sys.path
 from config import EXPERT_DIR, EXPERT_PREVIEW_LIMIT, ARBITRATE_EXPERT_LIMIT
 from src.llm_client import chat
 from src.llm_client import perplexity_chat_with_citations
+from src.utils.checkpoint import checkpointed, skip_checkpoint
 from src.report_type_profiles import load_report_type_profile
+from src.utils.parallel import imap
 from src.utils.log import log as _log
+from src.utils.prompt_prefix import prefixed_messages
 
 
 EXPERT_1_SYSTEM = """你是一位严谨的「事实与逻辑」评审专家。你的评审重点：
@@ -77,6 +79,9 @@ DEFAULT_USER_TEMPLATE = """请对以下《深度调查报告 1.0》进行评审
 """
 
 
+EXPERT_TASK = "请以上述评审角色，按其评审重点对前面给出的报告进行评审，按要求输出修改意见。"
+
+
 def _extract_hallucination_list(text: str) -> str:
     """从专家4输出中提取【幻觉清单】部分。"""
     for sep in ["【幻觉清单】", "## 幻觉清单", "### 幻觉清单", "幻觉清单：", "幻觉清单：\n"]:
@@ -112,19 +117,21 @@ def _build_profile_prompts(report_type: str | None = None) -> tuple[dict[str, st
     return prompts, user_template, profile
 
 
+@checkpointed("step3.expert", config=("PERPLEXITY_MODEL",))
 def _call_expert(name: str, system: str, user_msg: str, expert_idx: int) -> tuple[str, str, str]:
-    """调用单个专家，返回 (name, opinion, error_msg)。"""
+    """
+    调用单个专家，返回 (name, opinion, error_msg)。
+    五位专家共用同一份报告与评审要求（user_msg），放在消息最前面作为可缓存前缀，专家人设随后。
+    """
     _log(f"[并行] API 调用 #{expert_idx}: {name} 评审中...")
     t0 = time.time()
     opinion = ""
+    messages = prefixed_messages(user_msg, EXPERT_TASK, role=system)
     try:
         if name == "专家4_事实核查":
             try:
                 opinion, citations = perplexity_chat_with_citations(
-                    [
-                        {"role": "system", "content": system},
-                        {"role": "user", "content": user_msg},
-                    ],
+                    messages,
                     max_tokens=6144,
                     temperature=0.3,
                 )
@@ -135,16 +142,10 @@ def _call_expert(name: str, system: str, user_msg: str, expert_idx: int) -> tupl
                     opinion = opinion + ref_block
             except Exception as e:
                 _log(f"    Perplexity 调用失败，回退至主 LLM: {e}")
-                opinion = chat(
-                    [{"role": "system", "content": system}, {"role": "user", "content": user_msg}],
-                    max_tokens=6144, temperature=0.4,
-                )
+                opinion = chat(messages, max_tokens=6144, temperature=0.4)
         else:
             opinion = chat(
-                [
-                    {"role": "system", "content": system},
-                    {"role": "user", "content": user_msg},
-                ],
+                messages,
                 max_tokens=6144,
                 temperature=0.4,
                 reasoning=True,
@@ -153,6 +154,7 @@ def _call_expert(name: str, system: str, user_msg: str, expert_idx: int) -> tupl
         return name, opinion, ""
     except Exception as e:
         _log(f"[并行] API#{expert_idx} {name} 失败: {e}")
+        skip_checkpoint()
         return name, "", str(e)
 
 
@@ -241,36 +243,29 @@ def run_experts(
     results = {}
 
     # 并行调用所有专家
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = {}
-        for i, (name, system) in enumerate(prompts.items(), 1):
-            future = executor.submit(_call_expert, name, system, user_msg, i)
-            futures[future] = (i, name)
-
-        for future in as_completed(futures):
-            i, name = futures[future]
-            expert_name, opinion, error = future.result()
-            if error:
-                _log(f"专家 {expert_name} 出错: {error}")
-                continue
-
-            out_path = EXPERT_DIR / f"{base}_{expert_name}.md"
-            out_path.write_text(f"# {expert_name} 评审意见\n\n{opinion}", encoding="utf-8")
-            results[expert_name] = {"path": str(out_path), "content": opinion}
-            _log(f"已保存: {out_path.name}")
-
-            # 专家4：单独保存幻觉清单（始终保存，便于 Step4 加载）
-            if expert_name == "专家4_事实核查":
-                hallucination = _extract_hallucination_list(opinion)
-                if not hallucination:
-                    hallucination = "未发现虚构内容。"
-                halluc_path = EXPERT_DIR / f"{base}_专家4_幻觉清单.md"
-                halluc_path.write_text(
-                    f"# 幻觉清单（虚构事实/人物/实体，不得出现在报告 2.0 中）\n\n{hallucination}",
-                    encoding="utf-8",
-                )
-                results["_hallucination_path"] = str(halluc_path)
-                _log(f"已保存幻觉清单: {halluc_path.name}")
+    experts = list(prompts.items())
+    for _, (expert_name, opinion, error) in imap(lambda i, e: _call_expert(e[0], e[1], user_msg, i + 1), experts):
+        if error:
+            _log(f"专家 {expert_name} 出错: {error}")
+            continue
+
+        out_path = EXPERT_DIR / f"{base}_{expert_name}.md"
+        out_path.write_text(f"# {expert_name} 评审意见\n\n{opinion}", encoding="utf-8")
+        results[expert_name] = {"path": str(out_path), "content": opinion}
+        _log(f"已保存: {out_path.name}")
+
+        # 专家4：单独保存幻觉清单（始终保存，便于 Step4 加载）
+        if expert_name == "专家4_事实核查":
+            hallucination = _extract_hallucination_list(opinion)
+            if not hallucination:
+                hallucination = "未发现虚构内容。"
+            halluc_path = EXPERT_DIR / f"{base}_专家4_幻觉清单.md"
+            halluc_path.write_text(
+                f"# 幻觉清单（虚构事实/人物/实体，不得出现在报告 2.0 中）\n\n{hallucination}",
+                encoding="utf-8",
+            )
+            results["_hallucination_path"] = str(halluc_path)
+            _log(f"已保存幻觉清单: {halluc_path.name}")
 
     _log(f"Step3 全部专家评审完成，总耗时 {time.time()-t_start:.1f}s")
 
@@ -17,11 +17,48 @@ from pathlib import Path
 import src  # noqa: F401
 
 from config import EXPERT_DIR, REPORT_DIR, EXPERT_PREVIEW_LIMIT
-from src.llm_client import chat, perplexity_chat_with_citations
+from src.llm_client import chat, chat_json, perplexity_chat_with_citations
+from src.utils.checkpoint import checkpointed, skip_checkpoint
+from src.utils.json_output import JSONOutputError
 from src.utils.log import log as _log
 from src.utils.file_utils import load_raw_content as _load_raw_content
 
 
+DOMAIN_SCHEMA = {
+    "type": "object",
+    "required": ["domain", "expert_persona"],
+    "properties": {
+        "domain": {"type": "string", "minLength": 1},
+        "sub_domains": {"type": "array", "items": {"type": "string"}},
+        "expert_persona": {"type": "string"},
+        "key_concepts": {"type": "array", "items": {"type": "string"}},
+        "evaluation_focus": {"type": "string"},
+    },
+}
+
+DIMENSION_SCHEMA = {
+    "type": "object",
+    "required": ["score", "assessment", "issues"],
+    "properties": {
+        "score": {"type": "number", "minimum": 0, "maximum": 100},
+        "assessment": {"type": "string"},
+        "issues": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["problem"],
+                "properties": {
+                    "location": {"type": "string"},
+                    "problem": {"type": "string"},
+                    "suggestion": {"type": "string"},
+                    "severity": {"type": "string"},
+                },
+            },
+        },
+    },
+}
+
+
 # ============ 五维度评估框架 ============
 
 EVAL_DIMENSIONS = {
@@ -99,20 +136,18 @@ def _detect_domain_and_build_persona(report_preview: str) -> tuple[str, str]:
 直接输出 JSON，不要代码块。"""
 
     _log("  识别报告领域，生成专家人设...")
-    resp = chat(
-        [
-            {"role": "system", "content": "你是学术领域分类专家。根据文本内容精准识别研究领域并构建对应的评审专家画像。输出严格 JSON。"},
-            {"role": "user", "content": prompt},
-        ],
-        max_tokens=1024,
-        temperature=0.2,
-        reasoning=True,
-    )
-
     try:
-        from src.utils.file_utils import clean_json
-        data = json.loads(clean_json(resp))
-    except (json.JSONDecodeError, Exception):
+        data = chat_json(
+            [
+                {"role": "system", "content": "你是学术领域分类专家。根据文本内容精准识别研究领域并构建对应的评审专家画像。输出严格 JSON。"},
+                {"role": "user", "content": prompt},
+            ],
+            schema=DOMAIN_SCHEMA,
+            max_tokens=1024,
+            temperature=0.2,
+            reasoning=True,
+        )
+    except JSONOutputError:
         data = {
             "domain": "综合研究",
             "sub_domains": [],
@@ -184,6 +219,7 @@ def _search_domain_sota(domain: str, key_concepts: list[str], report_preview: st
         return ""
 
 
+@checkpointed("step3b.dimension")
 def _evaluate_single_dimension(
     dim_key: str,
     dim: dict,
@@ -241,21 +277,20 @@ def _evaluate_single_dimension(
 
 直接输出 JSON，不要代码块。"""
 
-    resp = chat(
-        [
-            {"role": "system", "content": expert_persona + f"\n\n你当前只评估「{dim['name']}」这一个维度，请深入、具体。"},
-            {"role": "user", "content": prompt},
-        ],
-        max_tokens=2048,
-        temperature=0.2,
-        reasoning=True,
-    )
-
     try:
-        from src.utils.file_utils import clean_json
-        return json.loads(clean_json(resp))
-    except (json.JSONDecodeError, Exception):
-        return {"score": -1, "assessment": resp[:200], "issues": []}
+        return chat_json(
+            [
+                {"role": "system", "content": expert_persona + f"\n\n你当前只评估「{dim['name']}」这一个维度，请深入、具体。"},
+                {"role": "user", "content": prompt},
+            ],
+            schema=DIMENSION_SCHEMA,
+            max_tokens=2048,
+            temperature=0.2,
+            reasoning=True,
+        )
+    except JSONOutputError as e:
+        skip_checkpoint()
+        return {"score": -1, "assessment": e.text[:200], "issues": []}
 
 
 def _verify_key_facts(report_text: str, domain: str) -> tuple[list, list]:
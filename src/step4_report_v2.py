@@ -14,12 +14,19 @@ from config import (
     REPORT_DIR, EXPERT_DIR, RAW_DIR,
     HALLUCINATION_TEXT_LIMIT,
     REVISE_RAW_CHUNK_LIMIT, REVISE_EXPERT_LIMIT, REVISE_CHAPTER_BODY_LIMIT,
+    LLM_EDIT_SCRIPT, EDIT_SCRIPT_MAX_TOKENS,
 )
 from src.llm_client import chat
+from src.utils.checkpoint import checkpointed
 from src.utils.log import log as _log
 from src.utils.markdown_utils import parse_report_chapters as _parse_report_v1_chapters, extract_chapter_context as _extract_chapter_context
 from src.utils.docx_utils import save_docx_safe
+from src.utils.edit_script import EDIT_SCRIPT_INSTRUCTIONS, edit_or_rewrite
 from src.utils.parallel import parallel_map
+from src.utils.prompt_prefix import prefixed_messages
+from src.utils.token_budget import Section, count_tokens, pack_sections
+
+REVISE_SYSTEM = "你是专业的研究报告修订专家。核心原则：1) 篇幅必须充足，每章不少于目标字数；2) 保留论述逻辑与案例丰富度；3) 重写而非压缩；4) 吸收专家意见。输出严格为 Markdown。"
 
 
 def _load_expert_combined(base: str) -> str:
@@ -44,30 +51,67 @@ def _load_hallucination_list(base: str) -> str:
 from src.utils.file_utils import load_raw_content as _load_raw_content
 
 
+def _revise_sections(chapter_body: str, expert_text: str, hallucination_text: str, raw_chunk: str) -> list[Section]:
+    """各段按优先级装入当前模型的上下文预算：章节正文 > 专家意见 / 幻觉清单 > 原始语料。"""
+    return [
+        Section("body", chapter_body, priority=3, min_tokens=6000, max_chars=REVISE_CHAPTER_BODY_LIMIT),
+        Section("expert", expert_text, priority=2, min_tokens=4000, max_chars=REVISE_EXPERT_LIMIT),
+        Section("hallucination", hallucination_text, priority=2, max_chars=HALLUCINATION_TEXT_LIMIT),
+        Section("raw", raw_chunk, priority=1, max_chars=REVISE_RAW_CHUNK_LIMIT),
+    ]
+
+
+def _pack_shared_context(expert_text: str, hallucination_text: str, longest_body: str, longest_raw: str) -> list[str]:
+    """
+    专家意见与幻觉清单各章共用：按最长章节与最长语料片段装箱一次，各章请求使用同一份截取结果，
+    使其作为逐字节相同的前缀命中 provider 提示缓存。
+    """
+    packed = pack_sections(
+        _revise_sections(longest_body, expert_text, hallucination_text, longest_raw),
+        max_tokens=16384,
+        overhead_tokens=2048,
+        site="_api_revise_chapter",
+    )
+    shared = [REVISE_SYSTEM, f"""【专家评审意见】（采纳可执行的改进）
+---
+{packed["expert"]}
+---"""]
+    if packed["hallucination"]:
+        shared.append(f"""【幻觉清单】必须删除以下内容，不得出现在报告 2.0 中：
+{packed["hallucination"]}""")
+    return shared
+
+
+@checkpointed("step4.revise",
+              config=("REVISE_CHAPTER_BODY_LIMIT", "REVISE_RAW_CHUNK_LIMIT", "REVISE_EXPERT_LIMIT", "HALLUCINATION_TEXT_LIMIT",
+                      "EDIT_SCRIPT_MAX_TOKENS", "LLM_BUDGET_SAFETY", "LLM_CONTEXT_WINDOWS"),
+              files=("src/utils/edit_script.py",))
 def _api_revise_chapter(
     chapter_title: str,
     chapter_body: str,
-    expert_text: str,
-    hallucination_text: str,
+    shared: list[str],
     raw_chunk: str,
     target_chars: int,
     chapter_idx: int,
     total_chapters: int,
     context: dict = None,
+    edit_script: bool = None,
 ) -> str:
-    """对单章进行整改，返回该章完整正文（含章标题）。强调篇幅必须达标。"""
-    hall_section = ""
-    if hallucination_text:
-        hall_section = f"""
-【幻觉清单】必须删除以下内容，不得出现在本章：
-{hallucination_text[:HALLUCINATION_TEXT_LIMIT]}
-"""
+    """
+    对单章进行整改，返回该章完整正文（含章标题）。强调篇幅必须达标。shared 见 _pack_shared_context。
+    edit_script 为 None 时按 LLM_EDIT_SCRIPT 决定是否用编辑脚本模式。
+    """
+    packed = pack_sections(
+        _revise_sections(chapter_body, "", "", raw_chunk),
+        max_tokens=16384,
+        overhead_tokens=2048 + sum(count_tokens(block) for block in shared),
+    )
     raw_section = ""
-    if raw_chunk:
+    if packed["raw"]:
         raw_section = f"""
 【原始语料】（供参考，优先保留论证、案例、数据、公式）
 ---
-{raw_chunk[:REVISE_RAW_CHUNK_LIMIT]}
+{packed["raw"]}
 ---
 """
     prompt = f"""请对《深度调查报告 1.0》的**第 {chapter_idx}/{total_chapters} 章**进行整改，输出该章的完整正文。
@@ -76,14 +120,9 @@ def _api_revise_chapter(
 
 【本章正文（报告 1.0）】
 ---
-{chapter_body}
----
-
-【专家评审意见】（采纳可执行的改进）
----
-{expert_text[:REVISE_EXPERT_LIMIT]}
+{packed["body"]}
 ---
-{hall_section}{raw_section}"""
+{raw_section}"""
     # 章节上下文（仅对较长章节注入）
     if context and len(chapter_body) >= 1500:
         ctx_section = "\n【章节上下文（供衔接参考）】\n"
@@ -95,35 +134,45 @@ def _api_revise_chapter(
             ctx_section += f"下一章开头：{context['next_summary']}\n"
         prompt += ctx_section
 
-    prompt += f"""
+    def _rewrite() -> str:
+        resp = chat(
+            prefixed_messages(shared, prompt + f"""
 【极其重要的篇幅要求（必须遵守）】
 - 本章输出字数**不少于 {target_chars} 字**。禁止压缩、禁止将多段合并成一句或要点罗列。
+- 吸收上面的专家评审意见，删除幻觉清单中涉及本章的内容。
 - 重写、去重、理顺逻辑，但**不要删减论证、案例、表格、数据、公式**。数学公式（`$...$` / `$$...$$`）须原样保留。
-- 直接输出本章完整正文，以 `## {chapter_title}` 开头，使用 Markdown（### 等）。不要 JSON 或多余说明。"""
-
-    resp = chat(
-        [
-            {
-                "role": "system",
-                "content": "你是专业的研究报告修订专家。核心原则：1) 篇幅必须充足，每章不少于目标字数；2) 保留论述逻辑与案例丰富度；3) 重写而非压缩；4) 吸收专家意见。输出严格为 Markdown。",
-            },
-            {"role": "user", "content": prompt},
-        ],
-        max_tokens=16384,
-        temperature=0.4,
+- 直接输出本章完整正文，以 `## {chapter_title}` 开头，使用 Markdown（### 等）。不要 JSON 或多余说明。"""),
+            max_tokens=16384,
+            temperature=0.4,
+        )
+        return resp.strip()
+
+    # 编辑脚本只做定点修改；正文被截断或篇幅未达目标（需要整体扩写）时仍走整章重写
+    if edit_script is None:
+        edit_script = LLM_EDIT_SCRIPT
+    if not edit_script or packed["body"] != chapter_body or len(chapter_body) < target_chars:
+        return _rewrite()
+    edit_prompt = prompt + f"""
+【修改要求】
+- 吸收上面的专家评审意见做定点修改：修正错误与不严谨表述、删除幻觉清单中涉及本章的内容、删去重复、补足衔接。
+- **不要删减论证、案例、表格、数据、公式**，修改后本章字数不少于 {target_chars} 字（当前 {len(chapter_body)} 字）。
+{EDIT_SCRIPT_INSTRUCTIONS}"""
+    body = edit_or_rewrite(
+        prefixed_messages(shared, edit_prompt), chapter_body, _rewrite,
+        label=f"[整改] 第 {chapter_idx} 章", max_tokens=EDIT_SCRIPT_MAX_TOKENS, temperature=0.4,
     )
-    return resp.strip()
+    return body if body.lstrip().startswith("## ") else f"{chapter_title}\n\n{body.strip()}"
 
 
-def run_report_v2_and_docx(
+def _prepare_revision(
     report_v1_path: Path,
     expert_combined_path: Path = None,
     output_basename: str = None,
     raw_path: Path = None,
 ) -> dict:
     """
-    根据报告 1.0、专家意见汇总与（可选）原始语料，生成报告 2.0 的 Markdown，再转为 Word。
-    返回 report_v2_path（.md）与 docx_path（.docx）。
+    读取报告 1.0、专家意见与原始语料，计算各章整改所需的参数（字数目标、上下文、语料片段、共享前缀）。
+    run_report_v2_and_docx 与章节流水线（step_chapter_stream）共用。
     """
     report_v1_path = Path(report_v1_path)
     if not report_v1_path.is_file():
@@ -173,38 +222,52 @@ def run_report_v2_and_docx(
     _log(f"报告 1.0: 约 {len(report_v1_text)} 字 | 原始语料: 约 {raw_full_len} 字 | 字数目标: ≥{target_min_chars} 字")
     _log(f"章节数: {num_chapters} | 密度权重: {densities} | 加权目标: {chapter_targets}")
     _log("=" * 60)
-    t0 = time.time()
 
     raw_len = len(raw_text)
-    contexts = _extract_chapter_context(chapters)
-
-    def _revise_one(idx, chapter):
-        ch_title, ch_body = chapter
-        _log(f"[并行] 整改第 {idx + 1}/{num_chapters} 章: {ch_title[:40]}... (目标 ≥{chapter_targets[idx]} 字)")
-        start_pos = idx * raw_len // num_chapters if raw_len else 0
-        end_pos = (idx + 1) * raw_len // num_chapters if raw_len else raw_len
-        raw_chunk = raw_text[start_pos:end_pos] if raw_text else ""
-        revised = _api_revise_chapter(
-            ch_title,
-            ch_body[:REVISE_CHAPTER_BODY_LIMIT],
-            expert_text,
-            hallucination_text,
-            raw_chunk,
-            chapter_targets[idx],
-            idx + 1,
-            num_chapters,
-            context=contexts[idx],
-        )
-        _log(f"[并行] 第 {idx + 1} 章完成，输出约 {len(revised)} 字")
-        return revised
+    raw_chunks = [
+        raw_text[idx * raw_len // num_chapters:(idx + 1) * raw_len // num_chapters] if raw_text else ""
+        for idx in range(num_chapters)
+    ]
+    shared = _pack_shared_context(
+        expert_text,
+        hallucination_text,
+        max((body for _, body in chapters), key=len, default=""),
+        max(raw_chunks, key=len, default=""),
+    )
+    return {
+        "base": base,
+        "header": header,
+        "chapters": chapters,
+        "targets": chapter_targets,
+        "contexts": _extract_chapter_context(chapters),
+        "raw_chunks": raw_chunks,
+        "shared": shared,
+    }
 
-    revised_parts = parallel_map(_revise_one, chapters)
 
-    # 拼接：头部 + 各章
-    report_v2_body = "\n\n".join(revised_parts)
-    report_v2_text = f"{header}\n\n{report_v2_body}".strip()
+def _revise_chapter_at(plan: dict, idx: int) -> str:
+    """按 _prepare_revision 的结果整改第 idx 章（0 起），返回该章完整正文（含章标题）。"""
+    ch_title, ch_body = plan["chapters"][idx]
+    num_chapters = len(plan["chapters"])
+    _log(f"[并行] 整改第 {idx + 1}/{num_chapters} 章: {ch_title[:40]}... (目标 ≥{plan['targets'][idx]} 字)")
+    revised = _api_revise_chapter(
+        ch_title,
+        ch_body,
+        plan["shared"],
+        plan["raw_chunks"][idx],
+        plan["targets"][idx],
+        idx + 1,
+        num_chapters,
+        context=plan["contexts"][idx],
+    )
+    _log(f"[并行] 第 {idx + 1} 章完成，输出约 {len(revised)} 字")
+    return revised
 
-    _log(f"分章整改完成，总耗时 {time.time()-t0:.1f}s，报告 2.0 约 {len(report_v2_text)} 字")
+
+def _save_report_v2(base: str, header: str, revised_parts: list[str]) -> dict:
+    """拼接头部与各章，保存报告 2.0 的 Markdown 与 Word。"""
+    report_v2_text = f"{header}\n\n" + "\n\n".join(revised_parts)
+    report_v2_text = report_v2_text.strip()
 
     report_v2_path = REPORT_DIR / f"{base}_report_v2.md"
     report_v2_path.write_text(report_v2_text, encoding="utf-8")
@@ -222,6 +285,26 @@ def run_report_v2_and_docx(
     }
 
 
+def run_report_v2_and_docx(
+    report_v1_path: Path,
+    expert_combined_path: Path = None,
+    output_basename: str = None,
+    raw_path: Path = None,
+) -> dict:
+    """
+    根据报告 1.0、专家意见汇总与（可选）原始语料，生成报告 2.0 的 Markdown，再转为 Word。
+    返回 report_v2_path（.md）与 docx_path（.docx）。
+    """
+    plan = _prepare_revision(report_v1_path, expert_combined_path, output_basename, raw_path)
+    t0 = time.time()
+
+    revised_parts = parallel_map(lambda idx, _: _revise_chapter_at(plan, idx), plan["chapters"])
+
+    result = _save_report_v2(plan["base"], plan["header"], revised_parts)
+    _log(f"分章整改完成，总耗时 {time.time()-t0:.1f}s，报告 2.0 约 {len(result['report_v2_text'])} 字")
+    return result
+
+
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="根据专家意见生成报告2.0并导出Word")
@@ -10,19 +10,46 @@ from pathlib import Path
 import src  # noqa: F401
 
 from config import REPORT_DIR, CONSISTENCY_REPORT_LIMIT, CONSISTENCY_RAW_LIMIT
-from src.llm_client import chat
+from src.llm_client import chat_json
+from src.utils.checkpoint import checkpointed, skip_checkpoint
 from src.utils.log import log as _log
-from src.utils.file_utils import load_raw_content as _load_raw_content, clean_json as _clean_json
-
-
-def _api_check_consistency(report_text: str, raw_summary: str) -> str:
-    """单次 LLM 调用，检查全文一致性问题。返回 JSON 字符串。"""
+from src.utils.token_budget import Section, pack_sections
+from src.utils.file_utils import load_raw_content as _load_raw_content
+from src.utils.json_output import JSONOutputError
+
+ISSUES_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "required": ["type", "description"],
+        "properties": {
+            "type": {"type": "string"},
+            "severity": {"type": "string", "enum": ["高", "中", "低"]},
+            "location": {"type": "string"},
+            "description": {"type": "string"},
+            "suggestion": {"type": "string"},
+        },
+    },
+}
+
+
+@checkpointed("step4b.consistency",
+              config=("CONSISTENCY_REPORT_LIMIT", "CONSISTENCY_RAW_LIMIT", "LLM_BUDGET_SAFETY", "LLM_CONTEXT_WINDOWS"))
+def _api_check_consistency(report_text: str, raw_summary: str) -> list | str:
+    """单次 LLM 调用，检查全文一致性问题。返回问题列表；修复后仍不合格时返回原始回复文本。"""
+    packed = pack_sections(
+        [
+            Section("report", report_text, priority=2, min_tokens=16_000, max_chars=CONSISTENCY_REPORT_LIMIT),
+            Section("raw", raw_summary, priority=1, max_chars=CONSISTENCY_RAW_LIMIT),
+        ],
+        max_tokens=8192,
+    )
     raw_section = ""
-    if raw_summary:
+    if packed["raw"]:
         raw_section = f"""
 【原始语料摘要】（供交叉比对）
 ---
-{raw_summary}
+{packed["raw"]}
 ---
 """
     prompt = f"""请对以下报告进行**全文一致性校验**，从四个维度检查问题：
@@ -36,7 +63,7 @@ def _api_check_consistency(report_text: str, raw_summary: str) -> str:
 
 【报告全文】
 ---
-{report_text[:CONSISTENCY_REPORT_LIMIT]}
+{packed["report"]}
 ---
 
 请输出一个 JSON 数组，每个元素为一个问题：
@@ -54,17 +81,23 @@ def _api_check_consistency(report_text: str, raw_summary: str) -> str:
 
     _log("调用 API：全文一致性校验...", "consistency")
     t0 = time.time()
-    resp = chat(
-        [
-            {"role": "system", "content": "你是专业的文档质量审核专家，擅长发现跨章节的一致性问题。输出严格 JSON。"},
-            {"role": "user", "content": prompt},
-        ],
-        max_tokens=8192,
-        temperature=0.3,
-        reasoning=True,
-    )
+    try:
+        issues = chat_json(
+            [
+                {"role": "system", "content": "你是专业的文档质量审核专家，擅长发现跨章节的一致性问题。输出严格 JSON。"},
+                {"role": "user", "content": prompt},
+            ],
+            schema=ISSUES_SCHEMA,
+            max_tokens=8192,
+            temperature=0.3,
+            reasoning=True,
+        )
+    except JSONOutputError as e:
+        _log("[警告] LLM 返回非标准 JSON，将原文保存为建议")
+        skip_checkpoint()
+        return e.text
     _log(f"一致性校验完成，耗时 {time.time()-t0:.1f}s", "consistency")
-    return resp
+    return issues
 
 
 def run_consistency_check(
@@ -98,22 +131,13 @@ def run_consistency_check(
     _log(f"报告: {report_path.name}, 约 {len(report_text)} 字")
     _log("=" * 60)
 
-    resp = _api_check_consistency(report_text, raw_summary)
-    cleaned = _clean_json(resp)
-
-    # 解析 JSON
-    try:
-        issues = json.loads(cleaned)
-    except json.JSONDecodeError:
-        _log("[警告] LLM 返回非标准 JSON，将原文保存为建议")
-        issues = []
-
+    issues = _api_check_consistency(report_text, raw_summary)
     issues_count = len(issues) if isinstance(issues, list) else 0
 
     # 保存 JSON
     json_path = REPORT_DIR / f"{base}_consistency_suggestions.json"
     json_path.write_text(
-        json.dumps(issues, ensure_ascii=False, indent=2) if isinstance(issues, list) else cleaned,
+        json.dumps(issues, ensure_ascii=False, indent=2) if isinstance(issues, list) else issues,
         encoding="utf-8",
     )
 
@@ -129,7 +153,7 @@ def run_consistency_check(
             md_lines.append(f"- **建议**: {item.get('suggestion', '')}")
             md_lines.append("")
     else:
-        md_lines.append(cleaned)
+        md_lines.append(issues)
 
     md_path = REPORT_DIR / f"{base}_consistency_suggestions.md"
     md_path.write_text("\n".join(md_lines), encoding="utf-8")
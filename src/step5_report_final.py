@@ -11,11 +11,13 @@ from pathlib import Path
 import src  # noqa: F401  — 确保 PROJECT_ROOT 加入 sys.path
 
 from config import REPORT_DIR, PROSE_RAW_LIMIT, PROSE_CHAPTER_BODY_LIMIT
-from src.llm_client import chat
+from src.llm_client import chat_streamed
+from src.utils.checkpoint import checkpointed
 from src.utils.markdown_utils import parse_report_chapters as _parse_report_v1_chapters, extract_chapter_context as _extract_chapter_context
 from src.utils.docx_utils import save_docx_safe
 from src.utils.file_utils import load_raw_content as _load_raw_content
 from src.utils.parallel import parallel_map
+from src.utils.prompt_prefix import prefixed_messages
 
 STYLE_PROMPTS = {
     "A": {
@@ -126,6 +128,7 @@ def _merge_same_title_chapters(
     return merged
 
 
+@checkpointed("step5.prose", config=("PROSE_RAW_LIMIT", "PROSE_CHAPTER_BODY_LIMIT"), files=("prompts/common",))
 def _api_convert_chapter_to_prose(
     chapter_title: str,
     chapter_body: str,
@@ -136,7 +139,21 @@ def _api_convert_chapter_to_prose(
     context: dict = None,
     eval_guidance: str = "",
 ) -> str:
-    """将单章内容转换为自然叙述文体，应用指定风格；并剔除未在原始语料出现的幻觉内容。"""
+    """
+    将单章内容转换为自然叙述文体，应用指定风格；并剔除未在原始语料出现的幻觉内容。
+    各章共用的改写规范、风格要求、原始语料与写作规范放在消息最前面作为可缓存前缀，本章原文与评估意见随后。
+    """
+    system_content = """你是专业的文档改写专家。核心任务：将列表式、大纲式内容改写为自然流畅的叙述文体，同时保持信息完整、逻辑清晰。
+
+严禁：
+- 输出任何预处理统计信息（聚类数、silhouette、压缩率、有效文档数等）
+- 使用"值得注意的是""综上所述""不难发现"等 AI 套话
+- 反复使用相同的过渡词
+- 在正文中出现裸 URL 或 ISO 时间戳"""
+    if raw_chunk:
+        system_content += " 重要：报告内容须严格忠于原始语料，删除报告 2.0 中未在原始语料出现的新知识、新观点、新数据（视为幻觉）。"
+    system_content += " 输出严格为 Markdown。"
+
     hallucination_rule = ""
     if raw_chunk:
         hallucination_rule = f"""
@@ -147,25 +164,29 @@ def _api_convert_chapter_to_prose(
 {raw_chunk[:PROSE_RAW_LIMIT]}
 ---
 """
-    eval_section = ""
-    if eval_guidance:
-        eval_section = f"""
-6. **专家评估意见（必须落实）**：以下是领域专家对本章的评估，改写时须针对性解决这些问题：
-{eval_guidance}
-"""
-    prompt = f"""请将以下报告章节改写为**自然流畅的叙述性语言**，输出完整章节正文。
-
-【本章标题】{chapter_title}
-
-【风格要求】
+    shared = [system_content, f"""【风格要求】
 {style_desc}
 
 【核心改写规则（必须遵守）】
 1. **列表改段落**：将过多的 - 列表、①②③ 条目、编号列表，改写为连贯的段落叙述。可保留少量必要的要点列表（如参数表、对照表），但主体内容应为叙述性段落。
 2. **自然衔接**：用「首先」「其次」「在此基础上」「具体而言」等过渡词串联，使阅读如文章而非大纲。
 3. **信息不丢失**：所有**在原始语料中有依据**的论证、案例、数据、参数、数学公式须完整保留，仅改变呈现形式。公式标记（`$...$` / `$$...$$`）须原样保留，不得改写为自然语言。
-4. **篇幅相当**：输出长度与原文相当或略长，不得压缩删减。{hallucination_rule}{eval_section}
+4. **篇幅相当**：输出长度与原文相当或略长，不得压缩删减。{hallucination_rule}"""]
+    # 注入公共规范
+    common_rules = _get_common_rules()
+    if common_rules:
+        shared.append(f"【写作规范（必须遵守）】\n{common_rules[:3000]}")
+
+    eval_section = ""
+    if eval_guidance:
+        eval_section = f"""
+【专家评估意见（必须落实）】以下是领域专家对本章的评估，改写时须针对性解决这些问题：
+{eval_guidance}
+"""
+    prompt = f"""请按上述风格要求与改写规则，将以下报告章节改写为**自然流畅的叙述性语言**，输出完整章节正文。
 
+【本章标题】{chapter_title}
+{eval_section}
 【本章原文】
 ---
 {chapter_body[:PROSE_CHAPTER_BODY_LIMIT]}
@@ -186,33 +207,124 @@ def _api_convert_chapter_to_prose(
     prompt += f"""
 请直接输出改写后的完整章节，以 `## {chapter_title}` 开头，使用 Markdown（### 等）。不要 JSON 或多余说明。"""
 
-    # 注入公共规范
-    common_rules = _get_common_rules()
-    if common_rules:
-        prompt += f"\n\n【写作规范（必须遵守）】\n{common_rules[:3000]}\n"
-
-    system_content = """你是专业的文档改写专家。核心任务：将列表式、大纲式内容改写为自然流畅的叙述文体，同时保持信息完整、逻辑清晰。
-
-严禁：
-- 输出任何预处理统计信息（聚类数、silhouette、压缩率、有效文档数等）
-- 使用"值得注意的是""综上所述""不难发现"等 AI 套话
-- 反复使用相同的过渡词
-- 在正文中出现裸 URL 或 ISO 时间戳"""
-    if raw_chunk:
-        system_content += " 重要：报告内容须严格忠于原始语料，删除报告 2.0 中未在原始语料出现的新知识、新观点、新数据（视为幻觉）。"
-    system_content += " 输出严格为 Markdown。"
-
-    resp = chat(
-        [
-            {"role": "system", "content": system_content},
-            {"role": "user", "content": prompt},
-        ],
+    # 长输出：流式生成并落盘，断流时从已输出部分续写
+    resp = chat_streamed(
+        prefixed_messages(shared, prompt),
         max_tokens=16384,
         temperature=0.4,
     )
     return resp.strip()
 
 
+def _load_eval_result(base: str) -> dict | None:
+    """加载 Step3b 评估结果（如存在）。"""
+    import json as _json
+    from config import EXPERT_DIR
+    eval_json_path = EXPERT_DIR / f"{base}_Step3b_评估结果.json"
+    if eval_json_path.is_file():
+        try:
+            eval_result = _json.loads(eval_json_path.read_text(encoding="utf-8"))
+            _log(f"已加载 Step3b 评估结果: 总分 {eval_result.get('overall_score', 'N/A')}/100")
+            return eval_result
+        except Exception:
+            pass
+    return None
+
+
+def _build_eval_guidance(eval_result: dict | None, ch_title: str, ch_idx: int) -> str:
+    """从评估结果中提取与本章相关的修改意见。"""
+    if not eval_result:
+        return ""
+    lines = []
+    for issue in eval_result.get("top_issues", []):
+        loc = issue.get("location", "")
+        if ch_title[:10] in loc or f"第{ch_idx}" in loc or f"章节{ch_idx}" in loc or not loc:
+            lines.append(f"- [{issue.get('severity', '中')}] {issue.get('problem', '')} → {issue.get('suggestion', '')}")
+    for dim_key, dim_data in eval_result.get("dimensions", {}).items():
+        for issue in dim_data.get("issues", []):
+            loc = issue.get("location", "")
+            if ch_title[:10] in loc or f"第{ch_idx}" in loc or not loc:
+                lines.append(f"- [{issue.get('severity', '中')}][{dim_key}] {issue.get('problem', '')} → {issue.get('suggestion', '')}")
+    for h in eval_result.get("hallucinations", []):
+        lines.append(f"- [高][幻觉] 疑似编造，须删除: {h}")
+    for m in eval_result.get("missing_topics", []):
+        lines.append(f"- [中][遗漏] 原始语料有但未覆盖: {m}")
+    return "\n".join(lines[:15]) if lines else ""
+
+
+def _style_info(style: str) -> dict:
+    style_upper = style.upper()
+    if style_upper not in STYLE_PROMPTS:
+        raise ValueError(f"风格须为 A/B/C/D 之一，当前: {style}")
+    return STYLE_PROMPTS[style_upper]
+
+
+def _header_v3(header: str, style_info: dict) -> str:
+    """更新头部：版本号改为 3.0 最终版，一级标题后注明风格。"""
+    header_v3 = header
+    for pattern in ["2.0", "1.0", "补充完整版"]:
+        if pattern in header_v3:
+            header_v3 = header_v3.replace(pattern, "3.0 最终版", 1)
+            break
+    if "## " not in header_v3.split("\n")[0]:
+        first_line = header_v3.split("\n")[0]
+        if first_line.startswith("# "):
+            header_v3 = header_v3.replace(first_line, first_line + f"（{style_info['name']}）", 1)
+    return header_v3
+
+
+def _convert_chapter(
+    ch_title: str,
+    ch_body: str,
+    idx: int,
+    total: int,
+    style_info: dict,
+    raw_text: str,
+    context: dict = None,
+    eval_result: dict = None,
+) -> str:
+    """改写第 idx 章（0 起）为叙述文体，附带本章相关的 Step3b 评估指导。"""
+    eval_guidance = _build_eval_guidance(eval_result, ch_title, idx + 1)
+    label = "（含评估指导）" if eval_guidance else ""
+    _log(f"[并行] 改写第 {idx + 1}/{total} 章{label}: {ch_title[:40]}...")
+    revised = _api_convert_chapter_to_prose(
+        ch_title,
+        ch_body,
+        style_info["desc"],
+        raw_text,
+        idx + 1,
+        total,
+        context=context,
+        eval_guidance=eval_guidance,
+    )
+    _log(f"[并行] 第 {idx + 1} 章完成，输出约 {len(revised)} 字")
+    return revised
+
+
+def _save_report_v3(base: str, header_v3: str, chapters: list[tuple[str, str]], prose_parts: list[str]) -> dict:
+    """合并同名章节，拼接头部与各章，保存报告 3.0 的 Markdown 与 Word。"""
+    # 合并同名章节：将标题相同的相邻章节合并为一章
+    merged_parts = _merge_same_title_chapters(chapters, prose_parts)
+    _log(f"章节合并: {len(prose_parts)} → {len(merged_parts)} 章")
+
+    report_v3_body = "\n\n".join(merged_parts)
+    report_v3_text = f"{header_v3}\n\n{report_v3_body}".strip()
+
+    report_v3_path = REPORT_DIR / f"{base}_report_v3.md"
+    report_v3_path.write_text(report_v3_text, encoding="utf-8")
+    _log(f"报告 3.0 (Markdown) 已保存: {report_v3_path.name}")
+
+    _log("导出 Word：报告 3.0 → .docx")
+    docx_path = save_docx_safe(report_v3_text, REPORT_DIR / f"{base}_report_v3.docx")
+    _log(f"Step5 完成：报告 3.0 (Word) 已保存 {docx_path.name}")
+
+    return {
+        "report_v3_path": str(report_v3_path),
+        "docx_path": str(docx_path),
+        "report_v3_text": report_v3_text,
+    }
+
+
 def run_report_final(
     report_v2_path: Path,
     output_basename: str = None,
@@ -226,17 +338,11 @@ def run_report_final(
     raw_path: 原始语料路径（用于幻觉校验）
     返回 report_v3_path（.md）与 docx_path（.docx）。
     """
-    import json as _json
-    from config import EXPERT_DIR
-
     report_v2_path = Path(report_v2_path)
     if not report_v2_path.is_file():
         raise FileNotFoundError(f"报告不存在: {report_v2_path}")
 
-    style_upper = style.upper()
-    if style_upper not in STYLE_PROMPTS:
-        raise ValueError(f"风格须为 A/B/C/D 之一，当前: {style}")
-    style_info = STYLE_PROMPTS[style_upper]
+    style_info = _style_info(style)
 
     base = output_basename or report_v2_path.stem.replace("_report_v2", "").replace("_report_v2_new", "").replace("_report_v1", "")
     report_text = report_v2_path.read_text(encoding="utf-8", errors="replace")
@@ -245,15 +351,7 @@ def run_report_final(
     if raw_path and not raw_text:
         _log(f"[警告] 未加载到原始语料: {raw_path}，无法进行幻觉校验")
 
-    # 加载 Step3b 评估结果（如存在）
-    eval_result = None
-    eval_json_path = EXPERT_DIR / f"{base}_Step3b_评估结果.json"
-    if eval_json_path.is_file():
-        try:
-            eval_result = _json.loads(eval_json_path.read_text(encoding="utf-8"))
-            _log(f"已加载 Step3b 评估结果: 总分 {eval_result.get('overall_score', 'N/A')}/100")
-        except Exception:
-            pass
+    eval_result = _load_eval_result(base)
 
     header, chapters = _parse_report_v1_chapters(report_text)
     # 降级：如果无 ## 章节，尝试按 ### 拆分，或整篇处理
@@ -276,7 +374,7 @@ def run_report_final(
     source_label = "v1（Step3b 评估驱动）" if eval_result else "v2"
     _log("=" * 60)
     _log("Step5 报告 3.0 最终版：开始")
-    _log(f"输入: 约 {len(report_text)} 字 | 来源: {source_label} | 风格: {style_info['name']} ({style_upper})")
+    _log(f"输入: 约 {len(report_text)} 字 | 来源: {source_label} | 风格: {style_info['name']} ({style.upper()})")
     _log(f"章节数: {num_chapters} | 原始语料: 约 {len(raw_text)} 字（幻觉校验）")
     if eval_result:
         dims = eval_result.get("dimensions", {})
@@ -285,78 +383,14 @@ def run_report_final(
     _log("=" * 60)
     t0 = time.time()
 
-    # 更新头部
-    header_v3 = header
-    for pattern in ["2.0", "1.0", "补充完整版"]:
-        if pattern in header_v3:
-            header_v3 = header_v3.replace(pattern, "3.0 最终版", 1)
-            break
-    if "## " not in header_v3.split("\n")[0]:
-        first_line = header_v3.split("\n")[0]
-        if first_line.startswith("# "):
-            header_v3 = header_v3.replace(first_line, first_line + f"（{style_info['name']}）", 1)
-
     contexts = _extract_chapter_context(chapters)
 
-    def _build_eval_guidance(ch_title: str, ch_idx: int) -> str:
-        """从评估结果中提取与本章相关的修改意见。"""
-        if not eval_result:
-            return ""
-        lines = []
-        for issue in eval_result.get("top_issues", []):
-            loc = issue.get("location", "")
-            if ch_title[:10] in loc or f"第{ch_idx}" in loc or f"章节{ch_idx}" in loc or not loc:
-                lines.append(f"- [{issue.get('severity', '中')}] {issue.get('problem', '')} → {issue.get('suggestion', '')}")
-        for dim_key, dim_data in eval_result.get("dimensions", {}).items():
-            for issue in dim_data.get("issues", []):
-                loc = issue.get("location", "")
-                if ch_title[:10] in loc or f"第{ch_idx}" in loc or not loc:
-                    lines.append(f"- [{issue.get('severity', '中')}][{dim_key}] {issue.get('problem', '')} → {issue.get('suggestion', '')}")
-        for h in eval_result.get("hallucinations", []):
-            lines.append(f"- [高][幻觉] 疑似编造，须删除: {h}")
-        for m in eval_result.get("missing_topics", []):
-            lines.append(f"- [中][遗漏] 原始语料有但未覆盖: {m}")
-        return "\n".join(lines[:15]) if lines else ""
-
     def _convert_one(idx, chapter):
         ch_title, ch_body = chapter
-        eval_guidance = _build_eval_guidance(ch_title, idx + 1)
-        label = "（含评估指导）" if eval_guidance else ""
-        _log(f"[并行] 改写第 {idx + 1}/{num_chapters} 章{label}: {ch_title[:40]}...")
-        revised = _api_convert_chapter_to_prose(
-            ch_title,
-            ch_body,
-            style_info["desc"],
-            raw_text,
-            idx + 1,
-            num_chapters,
-            context=contexts[idx],
-            eval_guidance=eval_guidance,
-        )
-        _log(f"[并行] 第 {idx + 1} 章完成，输出约 {len(revised)} 字")
-        return revised
+        return _convert_chapter(ch_title, ch_body, idx, num_chapters, style_info, raw_text,
+                                context=contexts[idx], eval_result=eval_result)
 
     prose_parts = parallel_map(_convert_one, chapters)
+    _log(f"报告 3.0 改写完成，总耗时 {time.time()-t0:.1f}s")
 
-    # 合并同名章节：将标题相同的相邻章节合并为一章
-    merged_parts = _merge_same_title_chapters(chapters, prose_parts)
-    _log(f"章节合并: {len(prose_parts)} → {len(merged_parts)} 章")
-
-    report_v3_body = "\n\n".join(merged_parts)
-    report_v3_text = f"{header_v3}\n\n{report_v3_body}".strip()
-
-    _log(f"报告 3.0 生成完成，总耗时 {time.time()-t0:.1f}s，约 {len(report_v3_text)} 字")
-
-    report_v3_path = REPORT_DIR / f"{base}_report_v3.md"
-    report_v3_path.write_text(report_v3_text, encoding="utf-8")
-    _log(f"报告 3.0 (Markdown) 已保存: {report_v3_path.name}")
-
-    _log("导出 Word：报告 3.0 → .docx")
-    docx_path = save_docx_safe(report_v3_text, REPORT_DIR / f"{base}_report_v3.docx")
-    _log(f"Step5 完成：报告 3.0 (Word) 已保存 {docx_path.name}")
-
-    return {
-        "report_v3_path": str(report_v3_path),
-        "docx_path": str(docx_path),
-        "report_v3_text": report_v3_text,
-    }
+    return _save_report_v3(base, _header_v3(header, style_info), chapters, prose_parts)
@@ -7,19 +7,21 @@ Step6: 对报告 3.0 进行事实核查与出处标注，生成报告 4.0。
 """
 import json
 import re
-import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 import src  # noqa: F401  — 确保 PROJECT_ROOT 加入 sys.path
 
-from config import REPORT_DIR, CITATION_CHAPTER_BODY_LIMIT, STEP6_CHAPTER_DELAY
+from config import REPORT_DIR, CITATION_CHAPTER_BODY_LIMIT
 from src.llm_client import perplexity_chat_with_citations
+from src.utils.checkpoint import checkpointed, skip_checkpoint
 from src.utils.markdown_utils import parse_report_chapters as _parse_report_v1_chapters, read_report_text as _read_report_text
+from src.utils.parallel import parallel_map
+from src.utils.replay import get_replay_archive
 from src.utils.docx_utils import save_docx_safe
 from src.utils.log import log as _log
 
 
+@checkpointed("step6.citations", config=("CITATION_CHAPTER_BODY_LIMIT", "PERPLEXITY_MODEL"))
 def _process_chapter_with_perplexity(chapter_title: str, chapter_body: str) -> tuple[str, list[dict]]:
     """
     将单章内容提交给 Perplexity，让其分析事实、实体、事件并标注引用。
@@ -49,6 +51,7 @@ def _process_chapter_with_perplexity(chapter_title: str, chapter_body: str) -> t
         return (content.strip(), citations)
     except Exception as e:
         _log(f"    Perplexity 调用失败: {e}")
+        skip_checkpoint()
         return (chapter_body, [])
 
 
@@ -82,6 +85,10 @@ def _format_references(ref_list: list[dict], style: str = "numbered") -> str:
     return "\n".join(lines)
 
 
+# URL 可达性检查不是 LLM 调用，不受 AIMD 约束，用固定并发
+_URL_CHECK_WORKERS = 8
+
+
 def _verify_citations(ref_list: list[dict], timeout: float = 10.0) -> list[dict]:
     """并行 HTTP HEAD 检查引用 URL 可达性，返回带 status 字段的列表。"""
     import urllib.request
@@ -98,15 +105,7 @@ def _verify_citations(ref_list: list[dict], timeout: float = 10.0) -> list[dict]
         except (urllib.error.URLError, urllib.error.HTTPError, OSError, Exception):
             return {**ref, "status": "unreachable"}
 
-    results = []
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        futures = {executor.submit(_check_one, r): i for i, r in enumerate(ref_list)}
-        indexed = [None] * len(ref_list)
-        for future in as_completed(futures):
-            i = futures[future]
-            indexed[i] = future.result()
-        results = indexed
-    return results
+    return parallel_map(lambda _, r: _check_one(r), ref_list, max_workers=_URL_CHECK_WORKERS)
 
 
 def _mark_unverified_in_text(report_text: str, unverified_indices: list[int]) -> str:
@@ -116,66 +115,42 @@ def _mark_unverified_in_text(report_text: str, unverified_indices: list[int]) ->
     return report_text
 
 
-def run_report_v4(
-    report_v3_path: Path,
-    output_basename: str = None,
-    skip_citation_verify: bool = False,
-    citation_style: str = "numbered",
-) -> dict:
-    """
-    对报告 3.0 做事实核查与引用标注，生成报告 4.0。
-    按章节顺序提交给 Perplexity，由 Perplexity 自动分析并标注引用。
-    citation_style: "numbered" → [1] Title. URL
-                    "author_year" → [1] Author (Year). Title. URL
-    返回 report_v4_path（.md）、docx_path（.docx）、report_v4_text。
-    """
-    report_v3_path = Path(report_v3_path)
-    if not report_v3_path.is_file():
-        raise FileNotFoundError(f"报告 3.0 不存在: {report_v3_path}")
+def _cite_chapter(ch_title: str, ch_body: str, idx: int, total: int) -> tuple[str, list[dict]]:
+    """单章事实核查：返回 (以章标题开头、不含 [n] 标记的正文, 本章引用来源 [{"url","title"}, ...])。"""
+    _log(f"--- 处理第 {idx + 1}/{total} 章: {ch_title[:50]}...")
 
-    base = output_basename or report_v3_path.stem.replace("_report_v3", "")
-    report_text = _read_report_text(report_v3_path)
-
-    header, chapters = _parse_report_v1_chapters(report_text)
-    num_chapters = len(chapters)
-
-    _log("=" * 60)
-    _log("Step6 报告 4.0：按章节事实核查与引用标注")
-    _log(f"输入: {report_v3_path.name} | 章节数: {num_chapters}")
-    _log("=" * 60)
+    # 单章不宜过长，截断以保证在上下文限制内
+    body_chunk = ch_body[:CITATION_CHAPTER_BODY_LIMIT] + ("\n\n[已截断]" if len(ch_body) > CITATION_CHAPTER_BODY_LIMIT else "")
 
-    ref_list: list[dict] = []
-    revised_parts: list[str] = []
-    ref_offset = 0
+    revised, citations = _process_chapter_with_perplexity(ch_title, body_chunk)
 
-    for idx, (ch_title, ch_body) in enumerate(chapters):
-        _log(f"--- 处理第 {idx + 1}/{num_chapters} 章: {ch_title[:50]}...")
+    # 收集引用来源（不在正文插标记）
+    refs = []
+    for c in citations:
+        url = (c.get("url") or "").strip()
+        if url:
+            refs.append({"url": url, "title": c.get("title") or url})
 
-        # 单章不宜过长，截断以保证在上下文限制内
-        body_chunk = ch_body[:CITATION_CHAPTER_BODY_LIMIT] + ("\n\n[已截断]" if len(ch_body) > CITATION_CHAPTER_BODY_LIMIT else "")
+    # 清理 LLM 可能仍然插入的 [n] 标记
+    revised = re.sub(r"\s*\[\d+\]", "", revised)
 
-        revised, citations = _process_chapter_with_perplexity(ch_title, body_chunk)
+    # 确保以章标题开头
+    if not revised.strip().startswith("##"):
+        revised = f"## {ch_title}\n\n{revised}"
 
-        # 收集引用来源（不在正文插标记）
-        for c in citations:
-            url = (c.get("url") or "").strip()
-            if url:
-                ref_list.append({"url": url, "title": c.get("title") or url})
+    _log(f"    完成，本章 {len(citations)} 个引用")
+    return revised, refs
 
-        n_refs_this_chapter = len(citations)
-        # 清理 LLM 可能仍然插入的 [n] 标记
-        revised = re.sub(r"\s*\[\d+\]", "", revised)
-
-        # 确保以章标题开头
-        if not revised.strip().startswith("##"):
-            revised = f"## {ch_title}\n\n{revised}"
-
-        revised_parts.append(revised)
-        _log(f"    完成，本章 {n_refs_this_chapter} 个引用")
-
-        if idx < num_chapters - 1:
-            time.sleep(STEP6_CHAPTER_DELAY)
 
+def _save_report_v4(
+    base: str,
+    header: str,
+    revised_parts: list[str],
+    ref_list: list[dict],
+    skip_citation_verify: bool = False,
+    citation_style: str = "numbered",
+) -> dict:
+    """拼接头部、各章与 References，引用验证后保存报告 4.0 的 Markdown 与 Word。"""
     report_v4_body = "\n\n".join(revised_parts)
 
     # 拼接：头部 + 正文 + References
@@ -196,7 +171,9 @@ def run_report_v4(
     _log(f"共获得 {len(ref_list)} 个引用来源")
 
     # 引用验证
-    if ref_list and not skip_citation_verify:
+    if ref_list and not skip_citation_verify and get_replay_archive().replaying:
+        _log("Step6 离线回放模式：跳过引用 URL 验证")
+    elif ref_list and not skip_citation_verify:
         _log("Step6 引用验证：并行检查 URL 可达性...")
         verified_refs = _verify_citations(ref_list)
         unverified = [i + 1 for i, r in enumerate(verified_refs) if r.get("status") != "ok"]
@@ -230,6 +207,44 @@ def run_report_v4(
     }
 
 
+def run_report_v4(
+    report_v3_path: Path,
+    output_basename: str = None,
+    skip_citation_verify: bool = False,
+    citation_style: str = "numbered",
+) -> dict:
+    """
+    对报告 3.0 做事实核查与引用标注，生成报告 4.0。
+    按章节顺序提交给 Perplexity，由 Perplexity 自动分析并标注引用。
+    citation_style: "numbered" → [1] Title. URL
+                    "author_year" → [1] Author (Year). Title. URL
+    返回 report_v4_path（.md）、docx_path（.docx）、report_v4_text。
+    """
+    report_v3_path = Path(report_v3_path)
+    if not report_v3_path.is_file():
+        raise FileNotFoundError(f"报告 3.0 不存在: {report_v3_path}")
+
+    base = output_basename or report_v3_path.stem.replace("_report_v3", "")
+    report_text = _read_report_text(report_v3_path)
+
+    header, chapters = _parse_report_v1_chapters(report_text)
+    num_chapters = len(chapters)
+
+    _log("=" * 60)
+    _log("Step6 报告 4.0：按章节事实核查与引用标注")
+    _log(f"输入: {report_v3_path.name} | 章节数: {num_chapters}")
+    _log("=" * 60)
+
+    ref_list: list[dict] = []
+    revised_parts: list[str] = []
+    for idx, (ch_title, ch_body) in enumerate(chapters):
+        revised, refs = _cite_chapter(ch_title, ch_body, idx, num_chapters)
+        revised_parts.append(revised)
+        ref_list.extend(refs)
+
+    return _save_report_v4(base, header, revised_parts, ref_list, skip_citation_verify, citation_style)
+
+
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="对报告 3.0 做事实核查与引用，生成报告 4.0（按章节提交 Perplexity）")
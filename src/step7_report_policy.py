@@ -14,16 +14,19 @@ from config import (
     SKILL_TEXT_LIMIT, SUMMARY_TEXT_LIMIT, POLICY_RAW_TOTAL_LIMIT,
 )
 from src.llm_client import chat
+from src.utils.checkpoint import checkpointed
 from src.report_type_profiles import load_report_type_profile
 from src.utils.markdown_utils import parse_report_chapters as _parse_report_v1_chapters, read_report_text as _read_report_text, extract_chapter_context as _extract_chapter_context
 from src.utils.docx_utils import save_docx_safe
 from src.utils.parallel import parallel_map
+from src.utils.prompt_prefix import prefixed_messages
 
 
 from src.utils.log import log as _log
 from src.utils.file_utils import load_skill_and_summary as _load_skill_and_summary
 
 
+@checkpointed("step7.chapter", config=("POLICY_CHAPTER_BODY_LIMIT", "POLICY_RAW_PREVIEW_LIMIT"))
 def _process_single_chapter(
     idx: int,
     total: int,
@@ -33,13 +36,14 @@ def _process_single_chapter(
     raw_preview: str,
     context: dict = None,
 ) -> tuple[int, str, str]:
-    """处理单个章节的风格化改写，返回 (idx, ch_title, revised_text)。"""
+    """
+    处理单个章节的风格化改写，返回 (idx, ch_title, revised_text)。
+    写作规范、改写要求与原始语料摘要各章相同，放在消息最前面作为可缓存前缀。
+    """
     _log(f"[并行] 风格化第 {idx + 1}/{total} 章: {ch_title[:40]}...")
     t0 = time.time()
     body_limit = POLICY_CHAPTER_BODY_LIMIT
-    prompt = f"""你是一位学术分析报告写作专家。请将以下章节按照上方【写作规范】改写为学术风格分析报告。
-
-要求：
+    shared = [style_guide + "\n\n你是学术分析报告写作专家，严格按规范输出。", f"""改写要求（各章通用）：
 1. 严格遵循 Skill.md 与 summary.md 中的结构规范、论证范式、语言与修辞、元认知框架；
 2. 采用学术写作规范，章节结构清晰、论证可追溯、概念界定明确；
 3. 使用中性、客观、可证据支撑的表述，避免政治动员语气；
@@ -47,7 +51,8 @@ def _process_single_chapter(
 5. **完整保留原文中的事实、数据、案例、论证链、数学公式，不要压缩或省略**。公式标记（`$...$` / `$$...$$`）须原样保留。
 
 【原始语料摘要】（供参考）
-{raw_preview[:POLICY_RAW_PREVIEW_LIMIT]}
+{raw_preview[:POLICY_RAW_PREVIEW_LIMIT]}"""]
+    prompt = f"""请将以下章节按照上方【写作规范】与改写要求改写为学术风格分析报告。
 
 【本章标题】{ch_title}
 
@@ -70,10 +75,7 @@ def _process_single_chapter(
 请直接输出改写后的完整章节，以 `## {ch_title}` 开头，使用 Markdown。不要 JSON 或多余说明。"""
 
     resp = chat(
-        [
-            {"role": "system", "content": style_guide + "\n\n你是学术分析报告写作专家，严格按规范输出。"},
-            {"role": "user", "content": prompt},
-        ],
+        prefixed_messages(shared, prompt),
         max_tokens=8192,
         temperature=0.4,
     )
@@ -10,8 +10,9 @@ from pathlib import Path
 
 import src  # noqa: F401  — 确保 PROJECT_ROOT 加入 sys.path
 
-from config import REPORT_DIR, COMPRESS_SKILL_TEXT_LIMIT, COMPRESS_SUMMARY_TEXT_LIMIT, STEP8_ITERATION_DELAY
+from config import REPORT_DIR, COMPRESS_SKILL_TEXT_LIMIT, COMPRESS_SUMMARY_TEXT_LIMIT
 from src.llm_client import chat
+from src.utils.checkpoint import checkpointed
 from src.report_type_profiles import load_report_type_profile
 from src.utils.markdown_utils import read_report_text as _read_report_text, parse_report_chapters as _parse_chapters
 from src.utils.docx_utils import save_docx_safe
@@ -29,6 +30,7 @@ MAX_COMPRESSION_RATIO = 0.20   # 每轮最多压缩 20%
 MIN_FINAL_RATIO = 0.65         # 最终尺寸不低于原始 65%
 
 
+@checkpointed("step8.compress")
 def _compress_chapter(
     ch_title: str,
     ch_body: str,
@@ -176,7 +178,6 @@ def run_report_v5(
         if len(current_doc) < min_final_size:
             _log(f"    已达尺寸下限（{min_final_size} 字），停止")
             break
-        time.sleep(STEP8_ITERATION_DELAY)
 
     final_size = len(current_doc)
     _log(f"收敛完成，共 {iteration} 轮，最终约 {final_size} 字（原始 {int(100*final_size/original_size):.0f}%）")
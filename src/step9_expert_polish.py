@@ -16,6 +16,7 @@ import src  # noqa: F401
 
 from config import REPORT_DIR
 from src.llm_client import perplexity_chat_with_citations, chat
+from src.utils.checkpoint import checkpointed, skip_checkpoint
 from src.research.deep_researcher import run_deep_research, format_report_markdown
 from src.utils.markdown_utils import parse_report_chapters as _parse_chapters, read_report_text as _read_report_text
 from src.utils.docx_utils import save_docx_safe
@@ -103,6 +104,7 @@ def _merge_subchapters(chapters: list[tuple[str, str]]) -> list[tuple[str, str]]
     return merged
 
 
+@checkpointed("step9.research")
 def _research_chapter(
     expert: dict,
     ch_title: str,
@@ -122,30 +124,23 @@ def _research_chapter(
 
     _log(f"    [{expert['name']}] 研究第 {ch_idx} 章: {ch_title[:40]}...")
     t0 = time.time()
-    max_retries = 3
-    for attempt in range(1, max_retries + 1):
-        try:
-            content, citations = perplexity_deep_research(
-                [
-                    {"role": "system", "content": expert["system"]},
-                    {"role": "user", "content": prompt},
-                ],
-                max_tokens=4096,
-            )
-            _log(f"    [{expert['name']}] 第 {ch_idx} 章完成，耗时 {time.time()-t0:.1f}s，{len(citations)} 个引用")
-            return content, citations
-        except Exception as e:
-            err_msg = str(e)
-            if "429" in err_msg and attempt < max_retries:
-                wait = 30 * attempt
-                _log(f"    [{expert['name']}] 第 {ch_idx} 章限流，等待 {wait}s 后重试 ({attempt}/{max_retries})...")
-                time.sleep(wait)
-            else:
-                _log(f"    [{expert['name']}] 第 {ch_idx} 章失败: {e}")
-                return "", []
-    return "", []
+    try:
+        content, citations = perplexity_deep_research(
+            [
+                {"role": "system", "content": expert["system"]},
+                {"role": "user", "content": prompt},
+            ],
+            max_tokens=4096,
+        )
+        _log(f"    [{expert['name']}] 第 {ch_idx} 章完成，耗时 {time.time()-t0:.1f}s，{len(citations)} 个引用")
+        return content, citations
+    except Exception as e:
+        _log(f"    [{expert['name']}] 第 {ch_idx} 章失败: {e}")
+        skip_checkpoint()
+        return "", []
 
 
+@checkpointed("step9.merge")
 def _merge_research_into_chapter(
     ch_title: str,
     ch_body: str,
@@ -270,7 +265,6 @@ C. 对立观点与平衡性：搜索对立证据、替代解释、争议标注
             search_provider=search_provider,
             max_questions=5,
             max_iterations=2,
-            search_delay=5.0,
         )
         research_content = report_obj.synthesis
         research_citations = report_obj.all_citations
@@ -307,9 +301,8 @@ C. 对立观点与平衡性：搜索对立证据、替代解释、争议标注
 【报告内容】
 {report_digest}"""
 
-    max_retries = 3
+    # 429 由 llm_client 限流与重试处理
     if not deep:
-      for attempt in range(1, max_retries + 1):
         try:
             research_content, research_citations = perplexity_chat_with_citations(
                 [
@@ -321,15 +314,8 @@ C. 对立观点与平衡性：搜索对立证据、替代解释、争议标注
                 temperature=0.3,
             )
             _log(f"Phase 1 完成，耗时 {time.time()-t1:.1f}s，{len(research_citations)} 个引用")
-            break
         except Exception as e:
-            if "429" in str(e) and attempt < max_retries:
-                wait = 30 * attempt
-                _log(f"  限流，等待 {wait}s 后重试 ({attempt}/{max_retries})...")
-                time.sleep(wait)
-            else:
-                _log(f"  Perplexity 研究失败: {e}")
-                break
+            _log(f"  Perplexity 研究失败: {e}")
 
     if not research_content:
         _log("[警告] Deep Research 无结果，输出原始报告")
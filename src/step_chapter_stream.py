@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+章节流水线 Step4 → Step5 → Step6：以章为粒度串联整改（2.0）、叙述化改写（3.0）与 Perplexity 事实核查（4.0）。
+第 i 章的 2.0 整改完成后立即开始该章的 3.0 改写，随后做该章的引用核查，各章之间互不等待；
+报告拼接、同名章节合并、引用编号、URL 验证与 Word 导出在全部章节完成后统一进行一次。
+端到端耗时由「最慢一章的三步之和」决定，而不是三个步骤各自最慢一章之和。
+
+与逐步执行的差异：Step5 的章节上下文（目录、上一章末尾 / 下一章开头）取自报告 1.0 的相邻章节，
+因为改写某章时相邻章节的 2.0 可能尚未完成。
+"""
+import time
+from pathlib import Path
+
+import src  # noqa: F401  — 确保 PROJECT_ROOT 加入 sys.path
+
+from src.step4_report_v2 import _prepare_revision, _revise_chapter_at, _save_report_v2
+from src.step5_report_final import (
+    _convert_chapter, _header_v3, _load_eval_result, _merge_same_title_chapters, _save_report_v3, _style_info,
+)
+from src.step6_report_v4 import _cite_chapter, _save_report_v4
+from src.utils.file_utils import load_raw_content as _load_raw_content
+from src.utils.log import log as _log
+from src.utils.markdown_utils import parse_report_chapters as _parse_report_chapters
+from src.utils.parallel import parallel_map
+
+
+def _split_chapter(text: str, fallback_title: str) -> list[tuple[str, str]]:
+    """
+    将单章输出解析为 [(章标题, 章正文), ...]。模型偶尔在一章内输出多个一级章标题，此时与整篇解析一致地拆为多章；
+    无法识别章标题时沿用原章标题。
+    """
+    head, chapters = _parse_report_chapters(text)
+    if not chapters:
+        lines = text.strip().split("\n", 1)
+        body = lines[1].strip() if len(lines) > 1 and lines[0].lstrip().startswith("#") else text.strip()
+        return [(fallback_title, body)]
+    if head:
+        title, body = chapters[0]
+        chapters[0] = (title, f"{head}\n\n{body}".strip())
+    return chapters
+
+
+def run_chapter_stream(
+    report_v1_path: Path,
+    expert_combined_path: Path = None,
+    output_basename: str = None,
+    raw_path: Path = None,
+    style: str = "A",
+) -> dict:
+    """
+    以章为粒度执行 Step4 → Step5 → Step6，输出报告 2.0 / 3.0 / 4.0（Markdown 与 Word），文件与逐步执行相同。
+    返回 report_v2_path、report_v3_path、report_v4_path。
+    """
+    plan = _prepare_revision(report_v1_path, expert_combined_path, output_basename, raw_path)
+    base, chapters = plan["base"], plan["chapters"]
+    num_chapters = len(chapters)
+    style_info = _style_info(style)
+    raw_text = _load_raw_content(raw_path) if raw_path else ""
+    eval_result = _load_eval_result(base)
+
+    _log("=" * 60)
+    _log(f"章节流水线 Step4→5→6：{num_chapters} 章并行，每章整改 → 改写（{style_info['name']}）→ 引用核查")
+    _log("=" * 60)
+    t0 = time.time()
+
+    def _chain(idx, chapter):
+        ch_title = chapter[0]
+        t = time.time()
+        v2 = _revise_chapter_at(plan, idx)
+        v2_chapters = _split_chapter(v2, ch_title)
+        v3 = [
+            _convert_chapter(title, body, idx, num_chapters, style_info, raw_text,
+                             context=plan["contexts"][idx], eval_result=eval_result)
+            for title, body in v2_chapters
+        ]
+        v3_chapters = [c for part, (title, _) in zip(v3, v2_chapters) for c in _split_chapter(part, title)]
+        v4 = [_cite_chapter(title, body, idx, num_chapters) for title, body in v3_chapters]
+        _log(f"[章节流水线] 第 {idx + 1}/{num_chapters} 章 2.0→3.0→4.0 完成，耗时 {time.time() - t:.1f}s")
+        return v2, v2_chapters, v3, v3_chapters, v4
+
+    results = parallel_map(_chain, chapters)
+    _log(f"章节流水线全部完成，总耗时 {time.time() - t0:.1f}s，开始拼接与导出")
+
+    r2 = _save_report_v2(base, plan["header"], [r[0] for r in results])
+
+    v2_chapters = [c for r in results for c in r[1]]
+    header_v3 = _header_v3(plan["header"], style_info)
+    r3 = _save_report_v3(base, header_v3, v2_chapters, [p for r in results for p in r[2]])
+
+    # 与逐步执行一致：4.0 的同名章节按 3.0 的合并规则合并，引用按章节顺序编号
+    v3_chapters = [c for r in results for c in r[3]]
+    v4_parts = [revised for r in results for revised, _ in r[4]]
+    ref_list = [ref for r in results for _, refs in r[4] for ref in refs]
+    r4 = _save_report_v4(base, header_v3, _merge_same_title_chapters(v3_chapters, v4_parts), ref_list)
+
+    return {
+        "report_v2_path": r2["report_v2_path"],
+        "report_v3_path": r3["report_v3_path"],
+        "report_v4_path": r4["report_v4_path"],
+        "docx_path": r4["docx_path"],
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="章节流水线：报告 1.0 → 2.0 → 3.0 → 4.0（以章为粒度流水执行）")
+    parser.add_argument("report_v1", type=Path, help="报告 1.0 路径")
+    parser.add_argument("-e", "--expert-file", type=Path, default=None, help="专家意见汇总路径（可选）")
+    parser.add_argument("-r", "--raw-file", type=Path, default=None, help="原始语料路径（可选）")
+    parser.add_argument("-s", "--style", default="A", choices=["A", "B", "C", "D"], help="报告 3.0 风格")
+    parser.add_argument("-o", "--output-base", default=None, help="输出文件名前缀")
+    args = parser.parse_args()
+    run_chapter_stream(args.report_v1, args.expert_file, args.output_base, args.raw_file, args.style)
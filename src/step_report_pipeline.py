@@ -8,8 +8,9 @@ from pathlib import Path
 
 import src  # noqa: F401  — 确保 PROJECT_ROOT 加入 sys.path
 
-from config import REPORT_DIR, EXPERT_DIR
-from src.kimi_client import chat, chat_append
+from config import REPORT_DIR, EXPERT_DIR, PIPELINE_BOUNDED_CONTEXT
+from src.kimi_client import chat_append
+from src.utils.bounded_context import BoundedContext
 from src.utils.file_utils import load_raw_content as _load_raw_content, clean_json
 from src.utils.log import log as _log
 
@@ -20,6 +21,8 @@ from src.prompts import PIPELINE_WRITER_PROMPT as SYSTEM_PROMPT
 def run_pipeline(raw_path: Path, output_basename: str = None) -> dict:
     """
     多轮对话流水线：原始语料 → 元数据 → 报告 1.0 → 三位专家 → 报告 2.0（保持篇幅）。
+    PIPELINE_BOUNDED_CONTEXT 开启时（默认）语料为固定缓存前缀，专家轮只带报告 1.0 全文与之前输出的摘录，
+    撰写报告 2.0 时再带上各专家意见全文；关闭时每轮追加完整历史。
     """
     raw_path = Path(raw_path)
     if not raw_path.is_file():
@@ -28,28 +31,28 @@ def run_pipeline(raw_path: Path, output_basename: str = None) -> dict:
     base = output_basename or raw_path.stem
     raw_char_count = len(content)
 
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": f"""以下为「原始对话语料」，请务必在后续所有回复中保持对它的记忆。
+    corpus_block = f"""以下为「原始对话语料」，请务必在后续所有回复中保持对它的记忆。
 
 ---
 【原始语料】
 {content}
----
-
-请先完成第一项任务：根据上述语料，**仅**输出一个 JSON 对象（不要其他说明），格式如下：
-{{
+---"""
+    meta_prompt = """请先完成第一项任务：根据上述语料，**仅**输出一个 JSON 对象（不要其他说明），格式如下：
+{
   "title": "简洁专业的标题",
   "summary": "200字以内的内容摘要",
   "keywords": ["关键词1", "关键词2", "关键词3", "关键词4", "关键词5"]
-}}
+}
 
-直接输出 JSON，不要 markdown 代码块包裹。"""},
-    ]
+直接输出 JSON，不要 markdown 代码块包裹。"""
+    if PIPELINE_BOUNDED_CONTEXT:
+        messages = BoundedContext(SYSTEM_PROMPT, corpus_block)
+    else:
+        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+        meta_prompt = f"{corpus_block}\n\n{meta_prompt}"
 
-    # Round 1: 元数据（首轮已有 user 消息，直接调用）
-    meta_str = chat(messages, max_tokens=2048, temperature=0.3)
-    messages.append({"role": "assistant", "content": meta_str})
+    # Round 1: 元数据
+    meta_str, messages = chat_append(messages, meta_prompt, max_tokens=2048, temperature=0.3, label="元数据")
     try:
         meta = json.loads(clean_json(meta_str))
     except json.JSONDecodeError:
@@ -71,7 +74,7 @@ def run_pipeline(raw_path: Path, output_basename: str = None) -> dict:
 【输出格式】直接输出报告正文，使用 Markdown（# ## ###），表格用 | 呈现。不要 JSON 或多余说明。"""
 
     report_v1_text, messages = chat_append(
-        messages, report_v1_prompt, max_tokens=16384, temperature=0.5
+        messages, report_v1_prompt, max_tokens=16384, temperature=0.5, label="报告 1.0", keep=True
     )
     report_v1_path = REPORT_DIR / f"{base}_report_v1.md"
     report_v1_path.write_text(report_v1_text, encoding="utf-8")
@@ -89,7 +92,7 @@ def run_pipeline(raw_path: Path, output_basename: str = None) -> dict:
         user_msg = f"""请以「{name}」身份，对你已阅读的《深度调查报告 1.0》进行评审。评审重点：{focus}
 
 仅输出**可直接执行的修改意见**（分点列出），不要复述报告内容。不要建议过度学术化或编造数据。"""
-        opinion, messages = chat_append(messages, user_msg, max_tokens=4096, temperature=0.4)
+        opinion, messages = chat_append(messages, user_msg, max_tokens=4096, temperature=0.4, label=name)
         out_path = EXPERT_DIR / f"{base}_{name}.md"
         out_path.write_text(f"# {name} 评审意见\n\n{opinion}", encoding="utf-8")
         expert_contents.append((name, opinion))
@@ -103,6 +106,8 @@ def run_pipeline(raw_path: Path, output_basename: str = None) -> dict:
     _log(f"[流水线] 专家意见汇总已保存: {combined_path}")
 
     # Round 6: 报告 2.0（重点：保持篇幅、重写而非压缩）
+    if isinstance(messages, BoundedContext):
+        messages.keep(*(name for name, _ in expert_contents))
     report_v2_prompt = f"""请根据你已记忆的**原始语料**、已生成的《报告 1.0》以及《专家评审意见汇总》，撰写「深度调查报告 2.0」。
 
 【极其重要的篇幅要求】
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+按 provider 的自适应并发上限（AIMD）：所有线程 / 事件循环中对同一 provider 的 LLM 请求共享一个上限。
+
+- 加性增长：上限被用满且请求健康时，每完成 1 个请求上限 +1/上限（约每「一轮」+1）；
+- 乘性下降：出现 429 / 5xx / 超时，或归一化延迟超过基线 spike_factor 倍时，上限 × backoff；
+  在上次下降之前发出的请求不再触发下降（它们反映的是旧上限下的负载），避免一次拥塞连续砍半。
+
+延迟按输出长度归一化（秒 / (1 + 输出 token / 256)），基线为健康样本的指数滑动平均。
+parallel_map 等扇出按上限的最大值开线程，实际并发由这里在每次 API 请求前控制。
+路由池中每个 Key 各有一个限流器（"provider#序号"），扇出线程数随 Key 数放大。
+"""
+import asyncio
+import os
+import threading
+import time
+
+# 在途已满时异步等待的轮询间隔（秒）
+_POLL = 0.02
+# 延迟基线的平滑系数与最少样本数
+_EWMA_ALPHA = 0.2
+_MIN_BASELINE_SAMPLES = 5
+
+
+class AIMDLimiter:
+    """单个 provider 的 AIMD 并发上限，线程安全，同步 / 异步共用。"""
+
+    def __init__(self, name: str, initial: float = 4, min_limit: int = 1, max_limit: int = 32,
+                 backoff: float = 0.5, spike_factor: float = 2.0, on_change=None):
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.backoff = backoff
+        self.spike_factor = spike_factor
+        self._on_change = on_change
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._inflight = 0
+        self._baseline: float | None = None
+        self._samples = 0
+        self._last_decrease = 0.0
+        self.decreases = 0
+        self.peak = int(self.limit)
+
+    def _try_enter(self) -> bool:
+        if self._inflight >= int(self.limit):
+            return False
+        self._inflight += 1
+        return True
+
+    def acquire(self) -> float:
+        """阻塞直至获得名额，返回请求开始时刻（交给 release）。"""
+        with self._cond:
+            while not self._try_enter():
+                self._cond.wait()
+        return time.monotonic()
+
+    async def aacquire(self) -> float:
+        while True:
+            with self._lock:
+                if self._try_enter():
+                    return time.monotonic()
+            await asyncio.sleep(_POLL)
+
+    def release(self, started: float, outcome: str, output_tokens: int = 0):
+        """outcome："ok" / "overload"（429、5xx、超时）/ "neutral"（取消、参数错误等，不调整上限）。"""
+        now = time.monotonic()
+        with self._cond:
+            self._inflight -= 1
+            before = int(self.limit)
+            saturated = self._inflight + 1 >= before
+            if outcome == "overload":
+                self._decrease(started, now)
+            elif outcome == "ok":
+                cost = (now - started) / (1 + output_tokens / 256)
+                if self._is_spike(cost):
+                    self._decrease(started, now)
+                else:
+                    self._observe(cost)
+                    if saturated:
+                        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            after = int(self.limit)
+            self.peak = max(self.peak, after)
+            self._cond.notify(max(1, after - self._inflight))
+        if after != before and self._on_change:
+            self._on_change(self.name, after)
+
+    def _is_spike(self, cost: float) -> bool:
+        return (self._baseline is not None and self._samples >= _MIN_BASELINE_SAMPLES
+                and cost > self._baseline * self.spike_factor)
+
+    def _observe(self, cost: float):
+        self._samples += 1
+        self._baseline = cost if self._baseline is None else (
+            self._baseline + _EWMA_ALPHA * (cost - self._baseline))
+
+    def _decrease(self, started: float, now: float):
+        if started < self._last_decrease:
+            return
+        self.limit = max(float(self.min_limit), self.limit * self.backoff)
+        self._last_decrease = now
+        self.decreases += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"limit": int(self.limit), "peak": self.peak, "decreases": self.decreases,
+                    "inflight": self._inflight}
+
+
+class AdaptiveConcurrency:
+    """按 provider 懒创建 AIMD 限流器；enabled=False 时 get() 返回 None。"""
+
+    def __init__(self, enabled: bool = True, on_change=None, **params):
+        self.enabled = enabled
+        self.params = params
+        self._on_change = on_change
+        self._lock = threading.Lock()
+        self._limiters: dict[str, AIMDLimiter] = {}
+
+    @property
+    def max_limit(self) -> int:
+        return int(self.params.get("max_limit", 32))
+
+    def get(self, provider: str) -> AIMDLimiter | None:
+        if not self.enabled:
+            return None
+        provider = provider.lower()
+        with self._lock:
+            if provider not in self._limiters:
+                self._limiters[provider] = AIMDLimiter(provider, on_change=self._on_change, **self.params)
+                if self._on_change:
+                    self._on_change(provider, int(self._limiters[provider].limit))
+            return self._limiters[provider]
+
+    def stats(self) -> dict[str, dict]:
+        with self._lock:
+            limiters = list(self._limiters.items())
+        return {name: lim.stats() for name, lim in limiters}
+
+
+_registry: AdaptiveConcurrency | None = None
+_registry_lock = threading.Lock()
+
+
+def get_adaptive_concurrency() -> AdaptiveConcurrency:
+    """进程级共享 AIMD 注册表（按 config 中 LLM_AIMD_* 初始化），上限变化写入调用指标。"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                from config import (
+                    LLM_AIMD, LLM_AIMD_INITIAL, LLM_AIMD_MIN, LLM_AIMD_MAX,
+                    LLM_AIMD_BACKOFF, LLM_AIMD_LATENCY_SPIKE,
+                )
+                from src.utils.metrics import get_metrics
+                _registry = AdaptiveConcurrency(
+                    LLM_AIMD,
+                    on_change=get_metrics().set_concurrency,
+                    initial=LLM_AIMD_INITIAL,
+                    min_limit=LLM_AIMD_MIN,
+                    max_limit=LLM_AIMD_MAX,
+                    backoff=LLM_AIMD_BACKOFF,
+                    spike_factor=LLM_AIMD_LATENCY_SPIKE,
+                )
+    return _registry
+
+
+def fanout_workers(n: int, default: int = 4) -> int:
+    """
+    扇出线程数：启用 AIMD 时按其上限的最大值开线程（实际并发由 AIMD 控制），否则用 default；
+    默认 provider 有多个 Key（或在路由池中）时按端点数放大。
+    当前步骤走批处理（--batch-mode）时每项一个线程，使整步的请求进入同一个批处理任务。
+    """
+    from src.utils.batch_api import batch_mode_applies
+    from src.utils.key_pool import routed_endpoint_count
+    from config import LLM_PROVIDER
+    if batch_mode_applies((os.getenv("LLM_PROVIDER") or LLM_PROVIDER or "kimi").lower().strip()):
+        return max(1, n)
+    registry = get_adaptive_concurrency()
+    cap = registry.max_limit if registry.enabled else default
+    return max(1, min(n, cap * routed_endpoint_count()))
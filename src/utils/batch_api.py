@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Batch API 执行模式（--batch-mode / LLM_BATCH_MODE）：夜间任务中 Step3 专家、Step4/5/7/8 章节调用不需要交互延迟，
+改走 provider 的 OpenAI 兼容批处理接口（费用约为实时调用的一半，且配额独立）。
+
+各步骤代码不变：parallel_map 扇出的各章 chat() 照常调用，在 _openai_compatible_chat 中被收集器拦下并阻塞；
+最后一个请求到达后等待 LLM_BATCH_WINDOW 秒无新请求（或达到 LLM_BATCH_MAX_REQUESTS）即写出任务文件
+（output/batch/*.jsonl，每行 {"custom_id", "method", "url", "body"}），上传并创建批处理任务，
+按 LLM_BATCH_POLL_INTERVAL 轮询，完成后下载结果按 custom_id 分发回各调用。
+
+回退：provider 不在 LLM_BATCH_PROVIDERS、当前步骤不在 LLM_BATCH_STEPS 时走原有实时并发路径；
+上传 / 创建失败、任务失败 / 过期 / 超时、单条结果出错时，对应调用抛出 BatchUnavailable，由调用方改走实时调用。
+max_tokens 截断后的续写在 realtime() 范围内发出，走实时调用（否则每轮续写都要再等一个批处理周期）。
+"""
+import contextvars
+import fnmatch
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from pathlib import Path
+
+from src.utils.hedge import parse_provider_list
+from src.utils.log import log as _log
+
+# 批处理任务的终止状态
+TERMINAL = ("completed", "failed", "expired", "cancelled")
+ENDPOINT = "/v1/chat/completions"
+
+
+class BatchUnavailable(RuntimeError):
+    """该请求无法经 Batch API 完成；调用方应回退到实时调用。"""
+
+
+class BatchCollector:
+    """
+    单个端点（provider + base_url + Key）的请求收集器：submit() 阻塞至所在批次完成，返回响应 body（dict）。
+    client 为该端点的 OpenAI SDK 客户端（使用 files / batches 接口）。
+    """
+
+    def __init__(self, provider: str, client, job_dir: Path, window: float, max_requests: int,
+                 poll_interval: float, max_wait: float):
+        self.provider = provider
+        self.client = client
+        self.job_dir = Path(job_dir)
+        self.window = window
+        self.max_requests = max(1, max_requests)
+        self.poll_interval = poll_interval
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._pending: list[tuple[str, dict, Future]] = []
+        self._timer: threading.Timer | None = None
+        self._seq = itertools.count(1)
+
+    def submit(self, body: dict) -> dict:
+        future = Future()
+        with self._lock:
+            self._pending.append((f"req-{next(self._seq)}", body, future))
+            full = len(self._pending) >= self.max_requests
+            items = self._take() if full else None
+            if not full:
+                self._arm()
+        if items:
+            threading.Thread(target=self._run, args=(items,), daemon=True, name="llm-batch").start()
+        return future.result()
+
+    def _arm(self):
+        """（重新）开始收集窗口计时：窗口内无新请求到达即提交。"""
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(self.window, self._flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _take(self) -> list:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        items, self._pending = self._pending, []
+        return items
+
+    def _flush(self):
+        with self._lock:
+            items = self._take()
+        if items:
+            self._run(items)
+
+    def _run(self, items: list):
+        try:
+            results = self._execute(items)
+        except Exception as e:
+            _log(f"[批处理] {self.provider} {len(items)} 个请求的批处理任务不可用（{e}），回退实时调用")
+            _stats.add(fallbacks=len(items))
+            for _, _, future in items:
+                future.set_exception(BatchUnavailable(str(e)))
+            return
+        missing = 0
+        for custom_id, _, future in items:
+            result = results.get(custom_id)
+            if isinstance(result, dict):
+                future.set_result(result)
+                continue
+            missing += 1
+            future.set_exception(BatchUnavailable(result or "批处理结果中缺少该请求"))
+        _stats.add(completed=len(items) - missing, fallbacks=missing)
+
+    def _execute(self, items: list) -> dict[str, dict | str]:
+        """提交一批请求并等待完成，返回 {custom_id: 响应 body 或错误说明}。"""
+        self.job_dir.mkdir(parents=True, exist_ok=True)
+        job = self.job_dir / f"{self.provider}_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{items[0][0]}.jsonl"
+        lines = [json.dumps({"custom_id": cid, "method": "POST", "url": ENDPOINT, "body": body}, ensure_ascii=False)
+                 for cid, body, _ in items]
+        job.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        upload = self.client.files.create(file=(job.name, job.read_bytes()), purpose="batch")
+        batch = self.client.batches.create(input_file_id=upload.id, endpoint=ENDPOINT, completion_window="24h")
+        _stats.add(jobs=1, requests=len(items))
+        _log(f"[批处理] {self.provider} 提交 {len(items)} 个请求 → {batch.id}（任务文件 {job.name}）")
+        self._save_state(job, batch)
+        deadline = time.monotonic() + self.max_wait
+        while batch.status not in TERMINAL:
+            if time.monotonic() > deadline:
+                try:
+                    self.client.batches.cancel(batch.id)
+                except Exception:
+                    pass
+                raise BatchUnavailable(f"{batch.id} 等待超过 {self.max_wait:g}s")
+            time.sleep(self.poll_interval)
+            batch = self.client.batches.retrieve(batch.id)
+        self._save_state(job, batch)
+        if batch.status != "completed":
+            raise BatchUnavailable(f"{batch.id} 状态为 {batch.status}")
+        results: dict[str, dict | str] = {}
+        output = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            text = self.client.files.content(file_id).text
+            output.append(text.strip())
+            for line in text.splitlines():
+                if line.strip():
+                    custom_id, result = _parse_result(json.loads(line))
+                    results[custom_id] = result
+        job.with_suffix(".out.jsonl").write_text("\n".join(output) + "\n", encoding="utf-8")
+        counts = getattr(batch, "request_counts", None)
+        _log(f"[批处理] {self.provider} {batch.id} 完成"
+             + (f"（成功 {counts.completed} / 失败 {counts.failed}）" if counts is not None else ""))
+        return results
+
+    def _save_state(self, job: Path, batch):
+        """任务状态写在任务文件旁（.batch.json），便于中断后人工查询 / 取回。"""
+        state = {"provider": self.provider, "batch_id": batch.id, "status": batch.status,
+                 "output_file_id": getattr(batch, "output_file_id", None),
+                 "error_file_id": getattr(batch, "error_file_id", None)}
+        job.with_suffix(".batch.json").write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def _parse_result(row: dict) -> tuple[str, dict | str]:
+    """结果文件中的一行 → (custom_id, 成功时的响应 body / 失败时的错误说明)。"""
+    response = row.get("response") or {}
+    body = response.get("body")
+    if response.get("status_code") == 200 and isinstance(body, dict) and body.get("choices"):
+        return row.get("custom_id", ""), body
+    error = row.get("error") or (body or {}).get("error") or {}
+    message = error.get("message") if isinstance(error, dict) else str(error)
+    return row.get("custom_id", ""), f"HTTP {response.get('status_code')}: {message or '未知错误'}"
+
+
+class _BatchStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {"jobs": 0, "requests": 0, "completed": 0, "fallbacks": 0}
+
+    def add(self, **delta: int):
+        with self._lock:
+            for key, value in delta.items():
+                self.counts[key] += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.counts)
+
+
+_stats = _BatchStats()
+_collectors: dict[tuple, BatchCollector] = {}
+_collectors_lock = threading.Lock()
+_policy: dict | None = None
+_warned: set[str] = set()
+# 为真时 batch_mode_applies 一律返回 False（见 realtime()）
+_realtime_only: contextvars.ContextVar[bool] = contextvars.ContextVar("batch_realtime_only", default=False)
+
+
+def _get_policy() -> dict:
+    global _policy
+    if _policy is None:
+        from config import LLM_BATCH_MODE, LLM_BATCH_PROVIDERS, LLM_BATCH_STEPS
+        _policy = {
+            "enabled": LLM_BATCH_MODE,
+            "providers": parse_provider_list(LLM_BATCH_PROVIDERS),
+            "steps": [s.strip() for s in LLM_BATCH_STEPS.split(",") if s.strip()],
+        }
+    return _policy
+
+
+def configure_batch_mode(enabled: bool = None, providers: list[str] = None, steps: list[str] = None):
+    """命令行覆盖批处理开关、支持 Batch API 的 provider 与适用步骤（支持通配，如 step8_*）。"""
+    policy = _get_policy()
+    if enabled is not None:
+        policy["enabled"] = enabled
+    if providers:
+        policy["providers"] = [p.lower() for p in providers]
+    if steps:
+        policy["steps"] = list(steps)
+
+
+def batch_mode_applies(provider: str = None, step: str = None) -> bool:
+    """
+    当前调用是否走批处理：已启用，且步骤（默认取当前调用 / 调用栈的 step 标签）在适用列表中；
+    给出 provider 时还要求其支持 Batch API（不支持时提示一次并走实时路径）。
+    """
+    policy = _get_policy()
+    if not policy["enabled"] or _realtime_only.get():
+        return False
+    if step is None:
+        from src.utils.metrics import current_step
+        step = current_step()
+    if not any(fnmatch.fnmatch(step, pattern) for pattern in policy["steps"]):
+        return False
+    if provider is None or provider in policy["providers"]:
+        return True
+    if provider not in _warned:
+        _warned.add(provider)
+        _log(f"[批处理] {provider} 未配置 Batch API（LLM_BATCH_PROVIDERS），使用实时并发调用")
+    return False
+
+
+@contextmanager
+def realtime():
+    """在此范围内发起的调用不走批处理（如截断续写）。"""
+    token = _realtime_only.set(True)
+    try:
+        yield
+    finally:
+        _realtime_only.reset(token)
+
+
+def get_batch_collector(provider: str, key: str, base_url: str, client) -> BatchCollector:
+    """按端点共享的收集器。"""
+    from config import (LLM_BATCH_DIR, LLM_BATCH_WINDOW, LLM_BATCH_MAX_REQUESTS,
+                        LLM_BATCH_POLL_INTERVAL, LLM_BATCH_MAX_WAIT)
+    ident = (provider, base_url, key)
+    with _collectors_lock:
+        collector = _collectors.get(ident)
+        if collector is None:
+            collector = BatchCollector(provider, client, LLM_BATCH_DIR, LLM_BATCH_WINDOW, LLM_BATCH_MAX_REQUESTS,
+                                       LLM_BATCH_POLL_INTERVAL, LLM_BATCH_MAX_WAIT)
+            _collectors[ident] = collector
+        return collector
+
+
+def batch_stats() -> dict:
+    """批处理统计：提交任务数、请求数、经批处理完成数、回退实时调用数。"""
+    return _stats.snapshot()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+多轮会话的有界上下文（step_report_pipeline / kimi_client.chat_append）。
+
+原先每轮把全部历史原样追加，到专家轮时每次请求都重发完整语料 + 报告 1.0 + 之前所有专家输出，
+耗时与费用随轮数近似平方增长。这里每轮重新组装消息：
+    system  系统提示 + 原始语料（固定前缀，带 cache_control 断点，可命中 provider 提示缓存）
+    历史    标记为保留（keep）的轮次原样保留，其余 assistant 输出替换为「开头摘录 + 篇幅说明」
+    user    本轮任务
+历史在追加时即确定其压缩形态，各轮消息前缀保持稳定；组装后超出每轮 token 上限时，
+先从最早的保留轮次起压缩，仍超出再截断语料前缀（保留开头）。
+"""
+import os
+from dataclasses import dataclass
+
+from src.utils.log import log as _log
+from src.utils.prompt_prefix import cache_block
+from src.utils.token_budget import estimate_message_tokens, estimate_tokens, prompt_budget, truncate_to_tokens
+
+
+@dataclass
+class Turn:
+    """一轮对话：user 任务与 assistant 输出；keep=True 时后续轮次中保留全文。"""
+    user: str
+    reply: str
+    label: str = ""
+    keep: bool = False
+
+
+class BoundedContext:
+    """固定前缀 + 压缩历史 + 每轮 token 上限的多轮会话上下文。"""
+
+    def __init__(self, system: str, pinned: str, round_tokens: int = None, summary_chars: int = None,
+                 provider: str = None, model: str = None):
+        from config import LLM_PROVIDER, PIPELINE_ROUND_TOKENS, PIPELINE_SUMMARY_CHARS
+        self.system = system
+        self.pinned = pinned
+        self.round_tokens = round_tokens or PIPELINE_ROUND_TOKENS
+        self.summary_chars = summary_chars or PIPELINE_SUMMARY_CHARS
+        self.provider = (provider or os.getenv("LLM_PROVIDER") or LLM_PROVIDER or "kimi").lower().strip()
+        self.model = model
+        self.turns: list[Turn] = []
+
+    def append(self, user: str, reply: str, label: str = "", keep: bool = False):
+        self.turns.append(Turn(user, reply, label or f"第 {len(self.turns) + 1} 轮", keep))
+
+    def keep(self, *labels: str):
+        """把指定轮次改为保留全文（如撰写报告 2.0 前保留各专家意见）。"""
+        for turn in self.turns:
+            if turn.label in labels:
+                turn.keep = True
+
+    def _compact(self, text: str, label: str) -> str:
+        if len(text) <= self.summary_chars:
+            return text
+        return (f"（{label}输出共 {len(text)} 字，为控制上下文长度此处仅保留开头摘录，"
+                f"完整内容未随本轮发送）\n{text[:self.summary_chars]}……")
+
+    def _history(self, full: set[int]) -> list[dict]:
+        msgs = []
+        for i, turn in enumerate(self.turns):
+            keep = i in full
+            msgs.append({"role": "user", "content": turn.user if keep else self._compact(turn.user, "该任务")})
+            msgs.append({"role": "assistant", "content": turn.reply if keep else self._compact(turn.reply, turn.label)})
+        return msgs
+
+    def _assemble(self, pinned: str, full: set[int], user: str) -> list[dict]:
+        head = f"{self.system}\n\n{pinned}" if pinned else self.system
+        return [{"role": "system", "content": [cache_block(head)]}] + self._history(full) + [
+            {"role": "user", "content": user}]
+
+    def messages_for(self, user: str, max_tokens: int = 8192) -> list[dict]:
+        """组装本轮请求消息，保证不超过 min(每轮上限, 当前模型的 prompt 预算)。"""
+        limit = min(self.round_tokens, prompt_budget(self.provider, self.model, max_tokens, overhead_tokens=256))
+        full = {i for i, t in enumerate(self.turns) if t.keep}
+        messages = self._assemble(self.pinned, full, user)
+        tokens = estimate_message_tokens(messages, self.provider)
+        for i in sorted(full):
+            if tokens <= limit:
+                break
+            full.discard(i)
+            messages = self._assemble(self.pinned, full, user)
+            tokens = estimate_message_tokens(messages, self.provider)
+            _log(f"[上下文] 超出每轮上限 {limit:,} tokens，压缩「{self.turns[i].label}」")
+        if tokens > limit and self.pinned:
+            others = tokens - estimate_tokens(self.pinned, self.provider)
+            pinned = truncate_to_tokens(self.pinned, max(0, limit - others), self.provider)
+            _log(f"[上下文] 仍超出每轮上限，语料前缀截断 {len(self.pinned):,} → {len(pinned):,} 字")
+            from src.utils.metrics import note_truncation
+            note_truncation(len(self.pinned) - len(pinned))
+            messages = self._assemble(pinned, full, user)
+            tokens = estimate_message_tokens(messages, self.provider)
+        _log(f"[上下文] 第 {len(self.turns) + 1} 轮请求约 {tokens:,} tokens（保留全文 {len(full)} 轮，"
+             f"压缩 {len(self.turns) - len(full)} 轮）")
+        return messages
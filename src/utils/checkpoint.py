@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+细粒度检查点：记录每个已完成的工作单元（每节装配、每章整改 / 改写 / 压缩、每位专家、每章引用核查……）
+及其精确输入的哈希；流程中断后重跑时只执行缺失或输入已变化的单元。
+
+    @checkpointed("step5.prose", config=("PROSE_RAW_LIMIT",), files=("prompts/common",))
+    def _api_convert_chapter_to_prose(...): ...
+
+    with checkpoint_scope(base):        # full-report / all / batch 流水线入口
+        ...
+
+单元键 = 标签 + 调用参数 + 单元内读取的输入（声明的 config 截断上限、声明的提示词文件与单元所在源文件的内容哈希——
+多数提示词内嵌在源文件中）+ LLM 配置指纹（provider、模型、调用点路由、报告语言、编辑脚本开关）的哈希：
+上游产物、提示词或截断上限变化时对应检查点自动失效。不在 checkpoint_scope 内时装饰器直接调用原函数。
+任务图执行节点时用 unit_salt() 把节点的依赖摘要（提示词、配置、参数，见 incremental.StepDeps.digest）计入键，
+节点因这些依赖变化而重建时，其中的单元不会复用旧结果。
+单元内走了兜底分支（如 JSON 修复失败用默认大纲、Perplexity 调用失败返回原文）时调用 skip_checkpoint()，
+该结果（及外层单元）不记录，重跑时重新执行；所在并行扇出已取消（同批其他项失败）后才结束的单元同样不记录。
+
+记录逐条追加到 output/checkpoints/{base}.jsonl 并立即落盘，进程崩溃或 Ctrl-C 不会丢失已完成的单元。
+与 LLM 响应缓存（llm_cache）的区别：按运行（base）隔离、不区分 temperature、以可能包含多次调用的工作单元为粒度。
+"""
+import contextvars
+import functools
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from src.utils.log import log as _log
+from src.utils.parallel import cancellation_requested
+
+_current: contextvars.ContextVar["CheckpointStore | None"] = contextvars.ContextVar("checkpoint_store", default=None)
+# 当前调用链上各单元的「不记录」标记（外层在前）
+_unit_flags: contextvars.ContextVar[tuple] = contextvars.ContextVar("checkpoint_unit_flags", default=())
+# 所在任务图节点的依赖摘要，计入单元键
+_salt: contextvars.ContextVar[str | None] = contextvars.ContextVar("checkpoint_salt", default=None)
+
+
+class CheckpointStore:
+    """单个运行（base）的检查点文件：key → 单元结果。resume=False 时不读取已有记录（仍写入新记录）。"""
+
+    def __init__(self, path: Path, resume: bool = True):
+        self.path = Path(path)
+        self.resume = resume
+        self._lock = threading.Lock()
+        self._records: dict[str, object] = {}
+        self.hits = 0
+        self.writes = 0
+        if resume and self.path.is_file():
+            self._load()
+
+    def _load(self):
+        for line in self.path.read_text(encoding="utf-8", errors="replace").splitlines():
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 中断时写了一半的末行
+            self._records[row["key"]] = row.get("value")
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def get(self, key: str) -> tuple[bool, object]:
+        with self._lock:
+            if key in self._records:
+                self.hits += 1
+                return True, self._records[key]
+        return False, None
+
+    def put(self, key: str, label: str, value) -> bool:
+        """追加一条记录并落盘；结果无法 JSON 序列化时不记录，返回 False。"""
+        try:
+            line = json.dumps({"key": key, "label": label, "ts": time.strftime("%Y-%m-%d %H:%M:%S"), "value": value},
+                              ensure_ascii=False)
+        except (TypeError, ValueError):
+            return False
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._records[key] = value
+            self.writes += 1
+        return True
+
+
+def llm_fingerprint() -> dict:
+    """影响生成结果的 LLM 配置：默认 provider 及其模型、调用点路由、报告语言、编辑脚本开关。"""
+    import config
+    from src.llm_client import PROVIDER_CONFIG, _resolve_provider
+    from src.utils.model_routes import get_model_routes
+    provider = _resolve_provider()
+    return {
+        "provider": provider,
+        "model": PROVIDER_CONFIG[provider].get("model", ""),
+        "routes": get_model_routes().snapshot(),
+        "language": config.REPORT_LANGUAGE,
+        "edit_script": config.LLM_EDIT_SCRIPT,
+    }
+
+
+def _json_default(obj):
+    if isinstance(obj, Path):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=str)
+    return repr(obj)
+
+
+def unit_inputs(files: tuple = (), config_keys: tuple = ()) -> dict:
+    """单元在参数之外读取的输入：文件 / 目录内容哈希与 config 变量值。"""
+    import config
+    from src.utils.incremental import file_digests
+    return {"files": file_digests(files), "config": {key: getattr(config, key, None) for key in config_keys}}
+
+
+def unit_key(label: str, args: tuple, kwargs: dict, inputs: dict = None) -> str:
+    payload = json.dumps({"label": label, "args": args, "kwargs": kwargs, "inputs": inputs or {},
+                          "node": _salt.get(), "llm": llm_fingerprint()},
+                         ensure_ascii=False, sort_keys=True, default=_json_default)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+@contextmanager
+def unit_salt(salt: str | None):
+    """在此范围内（含派生的线程）发起的工作单元，其检查点键计入 salt（任务图节点的依赖摘要）。"""
+    token = _salt.set(salt)
+    try:
+        yield
+    finally:
+        _salt.reset(token)
+
+
+def skip_checkpoint():
+    """当前单元（及外层单元）的结果不记录检查点：在兜底 / 降级分支中调用。"""
+    for flag in _unit_flags.get():
+        flag["skip"] = True
+
+
+def checkpointed(label: str, config: tuple = (), files: tuple = ()):
+    """
+    将函数的一次调用作为一个工作单元记录检查点，结果须可 JSON 序列化（元组恢复为列表）。
+    config 为单元内读取的 config 变量名（截断上限等），files 为单元内读取的提示词文件 / 目录（相对项目根目录），
+    函数所在源文件总是计入。
+    """
+    def decorator(fn):
+        source = inspect.getsourcefile(fn)
+        files_ = (source, *files) if source else tuple(files)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            store = _current.get()
+            if store is None:
+                return fn(*args, **kwargs)
+            key = unit_key(label, args, kwargs, unit_inputs(files_, config))
+            found, value = store.get(key)
+            if found:
+                _log(f"[检查点] 复用 {label}（{key[:8]}）")
+                return value
+            flag = {"skip": False}
+            token = _unit_flags.set(_unit_flags.get() + (flag,))
+            try:
+                value = fn(*args, **kwargs)
+            finally:
+                _unit_flags.reset(token)
+            if not flag["skip"] and not cancellation_requested():
+                store.put(key, label, value)
+            return value
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def checkpoint_scope(base: str, resume: bool = True):
+    """
+    在此范围内（含经 parallel_map / 任务图派生的线程）启用 base 的检查点；已处于同一 base 的范围时复用外层。
+    PIPELINE_CHECKPOINTS=0 时不启用。
+    """
+    from config import CHECKPOINT_DIR, PIPELINE_CHECKPOINTS
+    outer = _current.get()
+    path = CHECKPOINT_DIR / f"{base}.jsonl"
+    if not PIPELINE_CHECKPOINTS or (outer is not None and outer.path == path):
+        yield outer
+        return
+    store = CheckpointStore(path, resume)
+    if len(store):
+        _log(f"[检查点] 已加载 {len(store)} 个已完成单元: {path.name}")
+    token = _current.set(store)
+    try:
+        yield store
+    finally:
+        _current.reset(token)
+        if store.hits or store.writes:
+            _log(f"[检查点] 本次复用 {store.hits} 个单元，新记录 {store.writes} 个")
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+按 provider 的熔断器（closed → open → half-open），进程内所有线程 / 事件循环共享。
+
+- closed：正常放行；连续失败达到阈值，或最近窗口内错误率超过阈值时转为 open；
+- open：直接拒绝（抛出 CircuitOpenError，由调用方快速失败或改道备选 provider），冷却期后转 half-open；
+- half-open：只放行少量探测请求，成功则恢复 closed，失败则重新 open。
+
+只有超时、连接错误、5xx 等「服务不可用」类失败计入；429 与其他 4xx 不计入（由重试与限流处理）。
+状态变化打印日志并计数。
+"""
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断器处于 open 状态，请求被快速拒绝。"""
+
+    def __init__(self, provider: str, retry_in: float):
+        super().__init__(f"{provider} 熔断中（约 {retry_in:.0f}s 后半开探测）")
+        self.provider = provider
+        self.retry_in = retry_in
+
+
+def _log_breaker(msg: str):
+    ts = time.strftime("%H:%M:%S", time.localtime())
+    print(f"[{ts}] [LLM熔断] {msg}", flush=True)
+
+
+class CircuitBreaker:
+    """单个 provider 的熔断器，线程安全。"""
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        error_rate: float = 0.5,
+        window: int = 20,
+        min_calls: int = 10,
+        open_seconds: float = 30.0,
+        half_open_probes: int = 1,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_probes = max(1, half_open_probes)
+        self._lock = threading.Lock()
+        self._outcomes: deque[bool] = deque(maxlen=max(1, window))  # True = 失败
+        self._consecutive = 0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self.transitions: dict[str, int] = {}
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN, "冷却结束，放行探测请求")
+        return self._state
+
+    def _transition(self, state: str, reason: str):
+        key = f"{self._state}->{state}"
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        self._state = state
+        self._probes = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        if state == CLOSED:
+            self._outcomes.clear()
+            self._consecutive = 0
+        _log_breaker(f"{self.name}: {key.replace('->', ' → ')}（{reason}）")
+
+    def before_call(self):
+        """请求前检查：open 时抛出 CircuitOpenError；half-open 时只放行有限个探测请求。"""
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return
+            self.rejected += 1
+            retry_in = max(0.0, self.open_seconds - (now - self._opened_at)) if state == OPEN else 0.0
+        raise CircuitOpenError(self.name, retry_in)
+
+    def allows(self) -> bool:
+        """不占用探测名额的只读检查（用于选择改道目标）。"""
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            return state == CLOSED or (state == HALF_OPEN and self._probes < self.half_open_probes)
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._outcomes.append(False)
+            if self._state == HALF_OPEN:
+                self._transition(CLOSED, "探测成功")
+
+    def record_failure(self, reason: str = ""):
+        with self._lock:
+            self._consecutive += 1
+            self._outcomes.append(True)
+            if self._state == HALF_OPEN:
+                self._transition(OPEN, f"探测失败: {reason}"[:200])
+                return
+            if self._state != CLOSED:
+                return
+            if self._consecutive >= self.failure_threshold:
+                self._transition(OPEN, f"连续失败 {self._consecutive} 次，最近: {reason}"[:200])
+                return
+            if len(self._outcomes) >= self.min_calls:
+                rate = sum(self._outcomes) / len(self._outcomes)
+                if rate >= self.error_rate:
+                    self._transition(OPEN, f"最近 {len(self._outcomes)} 次错误率 {rate:.0%}，最近: {reason}"[:200])
+
+    def record_neutral(self):
+        """请求未完成且不反映服务健康（如调用方取消、参数错误）：释放探测名额。"""
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self._current_state(time.monotonic()),
+                "transitions": dict(self.transitions),
+                "rejected": self.rejected,
+            }
+
+
+class CircuitBreakerRegistry:
+    """按 provider 懒创建熔断器。enabled=False 时 get() 返回 None（不熔断）。"""
+
+    def __init__(self, enabled: bool = True, **params):
+        self.enabled = enabled
+        self.params = params
+        self._lock = threading.Lock()
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self.rerouted: dict[str, int] = {}
+
+    def get(self, provider: str) -> CircuitBreaker | None:
+        if not self.enabled:
+            return None
+        provider = provider.lower()
+        with self._lock:
+            if provider not in self._breakers:
+                self._breakers[provider] = CircuitBreaker(provider, **self.params)
+            return self._breakers[provider]
+
+    def allows(self, provider: str) -> bool:
+        breaker = self.get(provider)
+        return breaker is None or breaker.allows()
+
+    def note_reroute(self, src: str, dst: str):
+        key = f"{src}->{dst}"
+        with self._lock:
+            self.rerouted[key] = self.rerouted.get(key, 0) + 1
+
+    def stats(self) -> dict[str, dict]:
+        """发生过状态变化或拒绝的熔断器统计。"""
+        with self._lock:
+            breakers = list(self._breakers.items())
+        out = {}
+        for name, b in breakers:
+            s = b.stats()
+            if s["transitions"] or s["rejected"]:
+                out[name] = s
+        return out
+
+
+_registry: CircuitBreakerRegistry | None = None
+_registry_lock = threading.Lock()
+
+
+def get_circuit_breakers() -> CircuitBreakerRegistry:
+    """进程级共享熔断器注册表（按 config 中 LLM_BREAKER_* 初始化）。"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                from config import (
+                    LLM_BREAKER, LLM_BREAKER_FAILURES, LLM_BREAKER_ERROR_RATE,
+                    LLM_BREAKER_WINDOW, LLM_BREAKER_MIN_CALLS, LLM_BREAKER_OPEN_SECONDS,
+                )
+                _registry = CircuitBreakerRegistry(
+                    LLM_BREAKER,
+                    failure_threshold=LLM_BREAKER_FAILURES,
+                    error_rate=LLM_BREAKER_ERROR_RATE,
+                    window=LLM_BREAKER_WINDOW,
+                    min_calls=LLM_BREAKER_MIN_CALLS,
+                    open_seconds=LLM_BREAKER_OPEN_SECONDS,
+                )
+    return _registry
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+编辑脚本输出模式：去重 / 补充 / 整改等「只改少量句子」的调用，让模型输出引用原文片段定位的编辑操作，
+在本地应用，而不是重新输出整章（输出 token 是生成中最慢的部分）。
+
+操作格式（chat_json 校验）：
+    {"edits": [{"op": "replace", "anchor": "原文片段", "text": "新内容"},
+               {"op": "delete", "anchor": "原文片段"},
+               {"op": "insert_after" / "insert_before", "anchor": "原文片段", "text": "新内容"}]}
+
+定位：先精确匹配；再忽略空白与全角 / 半角标点差异匹配；最后按相似度（difflib）在最长公共片段附近滑窗，
+相似度不低于阈值才接受。较长的段落可用区间锚点「开头片段……结尾片段」引用（结尾在开头之后查找）。
+任一操作无法定位、或输出不是合法编辑脚本时，整体回退到整章重写。
+"""
+import difflib
+import re
+import threading
+
+from src.utils.log import log as _log
+
+OPS = ("replace", "delete", "insert_after", "insert_before")
+
+EDIT_SCHEMA = {
+    "type": "object",
+    "required": ["edits"],
+    "properties": {
+        "edits": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["op", "anchor"],
+                "properties": {
+                    "op": {"type": "string", "enum": list(OPS)},
+                    "anchor": {"type": "string", "minLength": 1},
+                    "text": {"type": "string"},
+                },
+            },
+        },
+    },
+}
+
+EDIT_SCRIPT_INSTRUCTIONS = """
+【输出格式：编辑脚本（必须遵守）】
+不要输出整章正文，只输出对【本章正文】的修改操作，格式为 JSON 对象：
+{"edits": [
+  {"op": "replace", "anchor": "需替换的原文片段", "text": "替换后的内容"},
+  {"op": "delete", "anchor": "需删除的原文片段"},
+  {"op": "insert_after", "anchor": "定位用的原文片段", "text": "插入到该片段之后的新内容"},
+  {"op": "insert_before", "anchor": "定位用的原文片段", "text": "插入到该片段之前的新内容"}
+]}
+- anchor 必须**逐字摘自【本章正文】**（10~200 字，在正文中唯一），不要改写
+- 删除或替换整段等较长内容时，anchor 写成「开头 10~20 字……结尾 10~20 字」，表示从开头到结尾的整段
+- 按正文先后顺序列出操作；新增段落时在 text 开头加换行
+- 无需修改时输出 {"edits": []}
+- 只输出 JSON，不要 markdown 代码块，不要任何说明"""
+
+# 模糊定位接受的最低相似度
+MIN_RATIO = 0.85
+
+_FULLWIDTH = str.maketrans("，。：；！？（）【】“”‘’、", ",.:;!?()[]\"\"''，")
+
+# 区间锚点的分隔：中文省略号或三个以上英文句点
+_RANGE = re.compile(r"\s*(?:…{1,2}|\.{3,})\s*")
+
+_stats_lock = threading.Lock()
+_stats = {"applied": 0, "fallback": 0, "ops": 0, "fuzzy": 0}
+
+
+def _normalized(text: str) -> tuple[str, list[int]]:
+    """去掉空白、统一标点后的文本，以及每个字符在原文中的位置。"""
+    chars, index = [], []
+    for i, ch in enumerate(text):
+        if ch.isspace():
+            continue
+        chars.append(ch.translate(_FULLWIDTH).lower())
+        index.append(i)
+    return "".join(chars), index
+
+
+def locate(text: str, anchor: str, min_ratio: float = MIN_RATIO) -> tuple[int, int, bool] | None:
+    """在 text 中定位 anchor（含区间锚点），返回 (起, 止, 是否模糊匹配)；无法可靠定位时返回 None。"""
+    anchor = _RANGE.sub("…", anchor.strip()).strip("…").strip()
+    if not anchor:
+        return None
+    head, sep, tail = anchor.partition("…")
+    if sep and "…" not in tail:
+        start = _locate_span(text, head, min_ratio)
+        if start is None:
+            return None
+        end = _locate_span(text[start[1]:], tail, min_ratio)
+        if end is None:
+            return None
+        return start[0], start[1] + end[1], start[2] or end[2]
+    return _locate_span(text, anchor.replace("…", ""), min_ratio)
+
+
+def _locate_span(text: str, anchor: str, min_ratio: float) -> tuple[int, int, bool] | None:
+    i = text.find(anchor)
+    if i >= 0:
+        return i, i + len(anchor), False
+    norm_text, index = _normalized(text)
+    norm_anchor, _ = _normalized(anchor)
+    if not norm_anchor or not norm_text:
+        return None
+    j = norm_text.find(norm_anchor)
+    if j >= 0:
+        return index[j], index[j + len(norm_anchor) - 1] + 1, False
+    # 相似度滑窗：以最长公共片段为种子对齐窗口，在小范围内调整起点与长度
+    seed = difflib.SequenceMatcher(None, norm_text, norm_anchor, autojunk=False).find_longest_match(
+        0, len(norm_text), 0, len(norm_anchor))
+    if seed.size < max(4, len(norm_anchor) // 5):
+        return None
+    n = len(norm_anchor)
+    slack = max(2, n // 10)
+    origin = seed.a - seed.b
+    best, best_ratio = None, 0.0
+    for start in range(max(0, origin - slack), min(len(norm_text), origin + slack) + 1):
+        for length in range(max(1, n - slack), n + slack + 1):
+            end = min(len(norm_text), start + length)
+            if end <= start:
+                continue
+            ratio = difflib.SequenceMatcher(None, norm_text[start:end], norm_anchor, autojunk=False).ratio()
+            if ratio > best_ratio:
+                best, best_ratio = (start, end), ratio
+    if best is None or best_ratio < min_ratio:
+        return None
+    return index[best[0]], index[best[1] - 1] + 1, True
+
+
+def _insert(left: str, new: str, right: str) -> str:
+    """插入新内容；新内容是独立段落（标题、列表、表格或含换行）时与前后文以空行分隔。"""
+    block = "\n" in new.strip() or new.lstrip().startswith(("#", "|", "-", "*", ">"))
+    if new.startswith("\n") or block:
+        new = new.strip("\n")
+        if left and not left.endswith("\n\n"):
+            new = ("\n\n" if not left.endswith("\n") else "\n") + new
+        if right and not right.startswith("\n"):
+            new += "\n\n"
+    return left + new + right
+
+
+def apply_edits(text: str, edits: list[dict], min_ratio: float = MIN_RATIO) -> tuple[str, list[dict], int]:
+    """依次应用编辑操作，返回 (新文本, 无法定位的操作, 模糊定位次数)。"""
+    failed, fuzzy = [], 0
+    for edit in edits:
+        op = edit.get("op")
+        span = locate(text, edit.get("anchor", ""), min_ratio) if op in OPS else None
+        if span is None:
+            failed.append(edit)
+            continue
+        start, end, approx = span
+        fuzzy += int(approx)
+        new = edit.get("text", "")
+        if op == "replace":
+            text = text[:start] + new + text[end:]
+        elif op == "delete":
+            left, right = text[:start].rstrip(" "), text[end:].lstrip(" ")
+            if left.endswith("\n") and right.startswith("\n"):
+                right = right.lstrip("\n")
+                left = left.rstrip("\n") + "\n\n" if left.strip() else ""
+            text = left + right
+        elif op == "insert_after":
+            text = _insert(text[:end], new, text[end:])
+        else:
+            text = _insert(text[:start], new, text[start:])
+    return text, failed, fuzzy
+
+
+def edit_or_rewrite(messages: list, body: str, rewrite, label: str = "", max_tokens: int = 8192,
+                    temperature: float = 0.3) -> str:
+    """
+    请求编辑脚本并应用到 body，返回修改后的正文；编辑脚本不合法或有操作无法定位时调用 rewrite()（整章重写）。
+    messages 的最后一条 user 消息应已附上 EDIT_SCRIPT_INSTRUCTIONS。
+    """
+    from src.llm_client import chat_json
+    from src.utils.json_output import JSONOutputError
+    try:
+        data = chat_json(messages, schema=EDIT_SCHEMA, max_tokens=max_tokens, temperature=temperature)
+    except JSONOutputError as e:
+        _log(f"[编辑脚本] {label} 输出不是合法编辑脚本（{'; '.join(e.errors[:2])}），回退整章重写")
+        return _fallback(rewrite)
+    edits = data["edits"]
+    new_body, failed, fuzzy = apply_edits(body, edits)
+    if failed:
+        anchors = "；".join(f"{e.get('op')}「{e.get('anchor', '')[:30]}」" for e in failed[:3])
+        _log(f"[编辑脚本] {label} {len(failed)}/{len(edits)} 个操作无法定位（{anchors}），回退整章重写")
+        return _fallback(rewrite)
+    with _stats_lock:
+        _stats["applied"] += 1
+        _stats["ops"] += len(edits)
+        _stats["fuzzy"] += fuzzy
+    _log(f"[编辑脚本] {label} 应用 {len(edits)} 个操作（模糊定位 {fuzzy}），{len(body)}→{len(new_body)} 字")
+    return new_body
+
+
+def _fallback(rewrite) -> str:
+    with _stats_lock:
+        _stats["fallback"] += 1
+    return rewrite()
+
+
+def edit_script_stats() -> dict:
+    """编辑脚本模式统计：成功应用次数、回退整章重写次数、操作数、模糊定位数。"""
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+对冲请求（hedged requests）的延迟统计：按 provider 记录首字节时间与总耗时的滑动窗口，
+给出 p90 等分位数作为「何时发出对冲请求」的阈值；样本不足时使用配置的兜底阈值。
+"""
+import threading
+from collections import deque
+
+
+class LatencyWindow:
+    """线程安全的滑动窗口延迟样本（秒）。"""
+
+    def __init__(self, size: int = 200):
+        self._lock = threading.Lock()
+        self._samples: deque[float] = deque(maxlen=size)
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._samples)
+
+    def quantile(self, q: float) -> float | None:
+        """分位数（最近邻法），无样本时返回 None。"""
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        idx = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+        return ordered[idx]
+
+
+class LatencyStats:
+    """按 provider 分别统计首字节时间（ttfb）与总耗时（total）。"""
+
+    def __init__(self, window: int = 200):
+        self._window = window
+        self._lock = threading.Lock()
+        self._ttfb: dict[str, LatencyWindow] = {}
+        self._total: dict[str, LatencyWindow] = {}
+
+    def _get(self, table: dict, provider: str) -> LatencyWindow:
+        with self._lock:
+            if provider not in table:
+                table[provider] = LatencyWindow(self._window)
+            return table[provider]
+
+    def record(self, provider: str, total: float, ttfb: float = None):
+        self._get(self._total, provider).add(total)
+        if ttfb is not None:
+            self._get(self._ttfb, provider).add(ttfb)
+
+    def threshold(self, provider: str, kind: str, q: float, min_samples: int, fallback: float) -> float:
+        """kind="ttfb" 或 "total"：样本数 >= min_samples 时返回分位数，否则返回 fallback。"""
+        window = self._get(self._ttfb if kind == "ttfb" else self._total, provider)
+        if len(window) < min_samples:
+            return fallback
+        return window.quantile(q)
+
+
+def parse_provider_list(spec: str) -> list[str]:
+    """解析逗号分隔的 provider 列表，去空、去重并保持顺序。"""
+    seen = []
+    for item in (spec or "").split(","):
+        p = item.strip().lower()
+        if p and p not in seen:
+            seen.append(p)
+    return seen
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+增量重建（make 式）：任务图各节点声明自身的全部输入，按内容哈希计算指纹，与上次构建记录一致且输出仍在时跳过。
+
+    deps = StepDeps(files=("src/step5_report_final.py", "prompts/common"), config=("PROSE_RAW_LIMIT",), params={"style": "A"})
+    fp = step_fingerprint({"report_v2": path, "raw": raw}, deps)
+    explain_rebuild(previous_build, fp)   # → ["上游产物 report_v2 内容变化", "配置 PROSE_RAW_LIMIT: 40000 → 50000"]
+
+指纹组成：上游产物内容哈希、声明文件（提示词、报告类型配置、Skill 目录、步骤实现源文件——多数提示词内嵌在源文件中）
+的内容哈希、相关 config 截断上限、命令行参数，以及 LLM 配置指纹（provider、模型、调用点路由，见 checkpoint.llm_fingerprint）。
+上游重建后产物内容未变时下游指纹不变，不会连带重建。节点重建时，其声明文件、config 与参数的摘要（StepDeps.digest）
+计入节点内工作单元的检查点键（任务图执行节点时设置，见 checkpoint.unit_salt）：仅上游产物变化时，
+未变的章节 / 专家仍由检查点复用；提示词、配置或参数变化时节点内的单元全部重新执行，不会复用旧结果。
+"""
+import hashlib
+import json
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from config import PROJECT_ROOT
+
+# 目录哈希时忽略的文件 / 目录名
+_IGNORED = {"__pycache__", ".DS_Store", "Thumbs.db"}
+# file_digests 的缓存：路径 → (修改时间与大小签名, 哈希)
+_digest_cache: dict[Path, tuple] = {}
+_digest_lock = threading.Lock()
+
+
+@dataclass
+class StepDeps:
+    """节点除上游产物外的输入：文件或目录（相对项目根目录或绝对路径）、config 变量名、参数。"""
+    files: tuple = ()
+    config: tuple = ()
+    params: dict = field(default_factory=dict)
+
+    def digest(self) -> str:
+        """文件内容哈希、config 值与参数的汇总哈希（不含上游产物与 LLM 配置）。"""
+        import config
+        from src.utils.checkpoint import _json_default
+        parts = {
+            "files": file_digests(self.files),
+            "config": {key: getattr(config, key, None) for key in self.config},
+            "params": self.params,
+        }
+        return hashlib.sha256(json.dumps(parts, ensure_ascii=False, sort_keys=True, default=_json_default).encode("utf-8")).hexdigest()
+
+    def merge(self, *others: "StepDeps") -> "StepDeps":
+        files, keys, params = list(self.files), list(self.config), dict(self.params)
+        for other in others:
+            files += [f for f in other.files if f not in files]
+            keys += [k for k in other.config if k not in keys]
+            params.update(other.params)
+        return StepDeps(tuple(files), tuple(keys), params)
+
+
+def _resolve(path) -> Path:
+    path = Path(path)
+    return path if path.is_absolute() else PROJECT_ROOT / path
+
+
+def _display(path: Path) -> str:
+    try:
+        return path.relative_to(PROJECT_ROOT).as_posix()
+    except ValueError:
+        return str(path)
+
+
+def _hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_path(path) -> str:
+    """文件按内容哈希；目录按「相对路径 + 内容哈希」递归哈希（新增 / 删除 / 修改任一文件都会改变）；不存在为 missing。"""
+    path = Path(path)
+    if path.is_file():
+        return _hash_file(path)
+    if not path.is_dir():
+        return "missing"
+    digest = hashlib.sha256()
+    for child in sorted(path.rglob("*")):
+        rel = child.relative_to(path)
+        if child.is_file() and not any(part in _IGNORED or part.startswith(".") for part in rel.parts):
+            digest.update(f"{rel.as_posix()}\0{_hash_file(child)}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _signature(path: Path):
+    if path.is_file():
+        st = path.stat()
+        return st.st_mtime_ns, st.st_size
+    if not path.is_dir():
+        return None
+    return tuple((c.as_posix(), c.stat().st_mtime_ns, c.stat().st_size)
+                 for c in sorted(path.rglob("*")) if c.is_file())
+
+
+def file_digests(files) -> dict[str, str]:
+    """
+    各文件 / 目录的内容哈希（键为相对项目根目录的路径）。按修改时间与大小缓存，
+    工作单元检查点每次调用都要计算，避免反复读取同一批提示词文件。
+    """
+    digests = {}
+    for f in files:
+        path = _resolve(f)
+        sig = _signature(path)
+        with _digest_lock:
+            cached = _digest_cache.get(path)
+        if cached is None or cached[0] != sig:
+            cached = (sig, hash_path(path))
+            with _digest_lock:
+                _digest_cache[path] = cached
+        digests[_display(path)] = cached[1]
+    return digests
+
+
+def hash_artifact(path) -> str:
+    """
+    产物哈希。Word 文件每次导出的字节都不同（压缩包时间戳），同名 .md 存在时以 .md 为准，
+    否则上游每次重建都会使下游失效。
+    """
+    path = Path(path)
+    if path.suffix.lower() == ".docx" and path.with_suffix(".md").is_file():
+        path = path.with_suffix(".md")
+    return hash_path(path)
+
+
+def step_fingerprint(inputs: dict, deps: StepDeps | None = None) -> dict:
+    """计算节点指纹：各组成部分与汇总 digest（JSON 规范化后的结果，可直接与构建记录比较）。"""
+    import config
+    from src.utils.checkpoint import _json_default, llm_fingerprint
+    deps = deps or StepDeps()
+    parts = {
+        "inputs": {name: hash_artifact(path) for name, path in sorted(inputs.items())},
+        "files": file_digests(deps.files),
+        "config": {key: getattr(config, key, None) for key in deps.config},
+        "params": deps.params,
+        "llm": llm_fingerprint(),
+    }
+    parts = json.loads(json.dumps(parts, ensure_ascii=False, sort_keys=True, default=_json_default))
+    parts["digest"] = hashlib.sha256(json.dumps(parts, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+    return parts
+
+
+def _short(value) -> str:
+    text = json.dumps(value, ensure_ascii=False) if not isinstance(value, str) else value
+    return text if len(text) <= 40 else text[:37] + "..."
+
+
+def explain_rebuild(previous: dict | None, current: dict) -> list[str]:
+    """对比构建记录与当前指纹，返回重建原因（一致时为空列表）。"""
+    if not previous:
+        return ["无构建记录"]
+    if previous.get("digest") == current["digest"]:
+        return []
+    reasons = []
+    old, new = previous.get("inputs", {}), current["inputs"]
+    for name in sorted(set(old) | set(new)):
+        if old.get(name) != new.get(name):
+            reasons.append(f"上游产物 {name} 内容变化" if name in old and name in new else f"上游产物 {name} 变更")
+    old, new = previous.get("files", {}), current["files"]
+    for name in sorted(set(old) | set(new)):
+        if old.get(name) == new.get(name):
+            continue
+        if name not in old:
+            reasons.append(f"新增依赖文件 {name}")
+        elif new.get(name) == "missing" or name not in new:
+            reasons.append(f"依赖文件 {name} 已删除或不再使用")
+        else:
+            reasons.append(f"文件 {name} 内容变化")
+    labels = {"config": "配置", "params": "参数", "llm": "模型配置"}
+    for part, label in labels.items():
+        old, new = previous.get(part, {}), current[part]
+        for key in sorted(set(old) | set(new)):
+            if old.get(key) != new.get(key):
+                reasons.append(f"{label} {key}: {_short(old.get(key, '-'))} → {_short(new.get(key, '-'))}")
+    return reasons or ["指纹变化"]
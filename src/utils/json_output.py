@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+结构化输出（chat_json）的解析与校验：从模型回复中提取 JSON，并按 JSON Schema 子集做本地校验。
+
+提取：去掉 ```json 代码块包裹；整体解析失败时从第一个 { / [ 起截取完整的 JSON 值（忽略前后说明文字），
+再尝试去掉尾随逗号。校验支持的 Schema 关键字：
+    type（含类型列表）、enum、properties、required、additionalProperties=false、items、
+    minItems / maxItems、minLength、minimum / maximum
+不依赖 jsonschema 包；不支持的关键字忽略（宽松），足以覆盖大纲、评分、问题清单等本项目的输出格式。
+"""
+import hashlib
+import json
+import re
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.S)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "boolean": bool,
+    "null": type(None),
+}
+
+
+class JSONOutputError(ValueError):
+    """模型输出在修复后仍无法解析或不符合 Schema；text 为最后一次原始输出。"""
+
+    def __init__(self, message: str, text: str = "", errors: list[str] = None):
+        super().__init__(message)
+        self.text = text
+        self.errors = errors or []
+
+
+def schema_digest(schema: dict | None) -> str:
+    """Schema 的短哈希，用于区分缓存 / 回放键。"""
+    if not schema:
+        return ""
+    raw = json.dumps(schema, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:12]
+
+
+def _candidates(text: str):
+    s = (text or "").strip().lstrip("\ufeff")
+    yield s
+    m = _FENCE.search(s)
+    if m:
+        yield m.group(1).strip()
+    starts = [i for i in (s.find("{"), s.find("[")) if i >= 0]
+    if starts:
+        yield s[min(starts):]
+
+
+def extract_json(text: str):
+    """从回复中提取第一个完整 JSON 值；失败时抛出 ValueError。"""
+    decoder = json.JSONDecoder()
+    for candidate in _candidates(text):
+        for variant in (candidate, _TRAILING_COMMA.sub(r"\1", candidate)):
+            try:
+                value, _ = decoder.raw_decode(variant)
+                return value
+            except json.JSONDecodeError:
+                continue
+    raise ValueError("回复中没有可解析的 JSON")
+
+
+def _type_ok(value, expected: str) -> bool:
+    if expected == "integer":
+        return isinstance(value, int) and not isinstance(value, bool)
+    if expected == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    py = _TYPES.get(expected)
+    return py is None or isinstance(value, py)
+
+
+def validate(value, schema: dict | None, path: str = "$") -> list[str]:
+    """按 Schema 子集校验，返回错误列表（空列表表示通过）。"""
+    if not schema:
+        return []
+    errors = []
+    expected = schema.get("type")
+    if expected:
+        types = expected if isinstance(expected, list) else [expected]
+        if not any(_type_ok(value, t) for t in types):
+            return [f"{path}: 应为 {'/'.join(types)}，实际为 {type(value).__name__}"]
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append(f"{path}: 取值须为 {schema['enum']} 之一，实际为 {value!r}")
+    if isinstance(value, dict):
+        props = schema.get("properties", {})
+        for key in schema.get("required", []):
+            if key not in value:
+                errors.append(f"{path}: 缺少字段 {key}")
+        if schema.get("additionalProperties") is False:
+            for key in value:
+                if key not in props:
+                    errors.append(f"{path}: 不允许的字段 {key}")
+        for key, sub in props.items():
+            if key in value:
+                errors += validate(value[key], sub, f"{path}.{key}")
+    elif isinstance(value, list):
+        if len(value) < schema.get("minItems", 0):
+            errors.append(f"{path}: 至少 {schema['minItems']} 项，实际 {len(value)} 项")
+        if "maxItems" in schema and len(value) > schema["maxItems"]:
+            errors.append(f"{path}: 至多 {schema['maxItems']} 项，实际 {len(value)} 项")
+        if "items" in schema:
+            for i, item in enumerate(value):
+                errors += validate(item, schema["items"], f"{path}[{i}]")
+    elif isinstance(value, str):
+        if len(value) < schema.get("minLength", 0):
+            errors.append(f"{path}: 长度至少 {schema['minLength']}")
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        if "minimum" in schema and value < schema["minimum"]:
+            errors.append(f"{path}: 不得小于 {schema['minimum']}")
+        if "maximum" in schema and value > schema["maximum"]:
+            errors.append(f"{path}: 不得大于 {schema['maximum']}")
+    return errors
+
+
+def parse_json_output(text: str, schema: dict | None) -> tuple[object, list[str]]:
+    """提取并校验：返回 (数据, 错误列表)；无法提取时数据为 None。"""
+    try:
+        value = extract_json(text)
+    except ValueError as e:
+        return None, [str(e)]
+    return value, validate(value, schema)
+
+
+def repair_prompt(errors: list[str], schema: dict | None) -> str:
+    """单轮修复请求：列出具体错误，要求只输出修正后的 JSON。"""
+    lines = "\n".join(f"- {e}" for e in errors[:20])
+    spec = f"\n\n须符合的 JSON Schema：\n{json.dumps(schema, ensure_ascii=False)}" if schema else ""
+    return (
+        f"上面的输出无法作为所需 JSON 使用，问题如下：\n{lines}{spec}\n\n"
+        "请只输出修正后的完整 JSON，保留原有内容，不要 markdown 代码块，不要任何说明。"
+    )
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+API Key / provider 路由池：同一 provider 的多个 Key 与多个兼容 provider 组成一组端点，
+每次调用按「加权最少在途请求」选择端点，并跳过限流额度已用尽（需等待）或熔断中的端点。
+
+配置（.env）：
+    LLM_KEY_POOL      各 provider 的额外 Key，可带权重，如 "kimi:sk-a,sk-b*2;deepseek:sk-c"
+                      （主 Key 即 KIMI_API_KEY 等，始终为该 provider 的 0 号端点）
+    LLM_ROUTING_POOL  跨 provider 路由池，如 "kimi,deepseek*0.5"；为空时只在当前 provider 的多个 Key 间分流
+
+每个 Key 视为独立账号：限流（RPM / TPM / 在途）与 AIMD 并发按 "provider#序号" 分别计量，
+LLM_RATE_LIMITS 中的 provider 级配置对该 provider 的每个 Key 分别生效。
+Gemini SDK 的 Key 为进程级全局设置，不参与多 Key 分流。
+"""
+import contextvars
+import os
+import threading
+from contextlib import contextmanager
+
+# 不支持多 Key 并发切换的 provider
+_SINGLE_KEY_PROVIDERS = ("gemini",)
+
+
+def parse_weighted(item: str) -> tuple[str, float]:
+    """解析 "name*2" 形式的带权重条目，默认权重 1。"""
+    name, _, weight = item.strip().partition("*")
+    try:
+        w = float(weight) if weight.strip() else 1.0
+    except ValueError:
+        w = 1.0
+    return name.strip(), max(w, 0.01)
+
+
+def parse_key_pool(spec: str) -> dict[str, list[tuple[str, float]]]:
+    """解析 LLM_KEY_POOL：返回 {"kimi": [("sk-a", 1.0), ("sk-b", 2.0)], ...}。"""
+    pools: dict[str, list[tuple[str, float]]] = {}
+    for entry in (spec or "").split(";"):
+        provider, _, body = entry.partition(":")
+        provider = provider.strip().lower()
+        if not provider or not body.strip():
+            continue
+        for item in body.split(","):
+            key, weight = parse_weighted(item)
+            if key:
+                pools.setdefault(provider, []).append((key, weight))
+    return pools
+
+
+class Endpoint:
+    """一个 (provider, Key) 端点及其在途 / 累计请求数。"""
+
+    __slots__ = ("provider", "index", "key", "weight", "outstanding", "requests", "pooled")
+
+    def __init__(self, provider: str, index: int, key: str, weight: float, pooled: bool):
+        self.provider = provider
+        self.index = index
+        self.key = key
+        self.weight = weight
+        self.outstanding = 0
+        self.requests = 0
+        self.pooled = pooled  # 该 provider 有多个 Key 时为 True
+
+    @property
+    def name(self) -> str:
+        """限流 / AIMD 计量名：多 Key 时为 "provider#序号"，单 Key 时即 provider。"""
+        return f"{self.provider}#{self.index}" if self.pooled else self.provider
+
+
+_routed: contextvars.ContextVar[Endpoint | None] = contextvars.ContextVar("llm_routed_endpoint", default=None)
+
+
+def current_endpoint(provider: str) -> Endpoint | None:
+    """当前调用选中的端点（仅当其 provider 与 provider 一致）。"""
+    ep = _routed.get()
+    return ep if ep is not None and ep.provider == provider else None
+
+
+class KeyPool:
+    """线程安全的端点表与加权最少在途选择。"""
+
+    def __init__(self, primary_keys: dict[str, str], extra_keys: dict[str, list[tuple[str, float]]]):
+        self._lock = threading.Lock()
+        self._endpoints: dict[str, list[Endpoint]] = {}
+        for provider in set(primary_keys) | set(extra_keys):
+            keys = []
+            if primary_keys.get(provider):
+                keys.append((primary_keys[provider], 1.0))
+            if provider not in _SINGLE_KEY_PROVIDERS:
+                for key, weight in extra_keys.get(provider, []):
+                    if key == primary_keys.get(provider):
+                        keys[0] = (key, weight)
+                    elif key not in (k for k, _ in keys):
+                        keys.append((key, weight))
+            pooled = len(keys) > 1
+            self._endpoints[provider] = [Endpoint(provider, i, k, w, pooled) for i, (k, w) in enumerate(keys)]
+
+    def endpoints(self, provider: str) -> list[Endpoint]:
+        return self._endpoints.get(provider, [])
+
+    def size(self, providers: list[str]) -> int:
+        return sum(len(self.endpoints(p)) for p in providers)
+
+    def pick(self, candidates: list[tuple[str, float]], headroom=None) -> Endpoint | None:
+        """
+        candidates 为 [(provider, provider 权重)]。headroom(endpoint) 返回该端点需等待的限流秒数
+        （None 表示不可用，如熔断中）。优先选无需等待的端点，其次按 (在途 + 1) / 权重 最小。
+        """
+        best, best_score = None, None
+        with self._lock:
+            for provider, pweight in candidates:
+                for ep in self.endpoints(provider):
+                    wait = headroom(ep) if headroom else 0.0
+                    if wait is None:
+                        continue
+                    score = (wait > 0, wait, (ep.outstanding + 1) / (ep.weight * pweight), ep.requests)
+                    if best_score is None or score < best_score:
+                        best, best_score = ep, score
+            if best is not None:
+                best.outstanding += 1
+                best.requests += 1
+        return best
+
+    def release(self, ep: Endpoint):
+        with self._lock:
+            ep.outstanding -= 1
+
+    @contextmanager
+    def use(self, ep: Endpoint):
+        """在上下文内把 ep 设为当前端点（API Key 与限流计量名随之切换），退出时归还在途计数。"""
+        token = _routed.set(ep)
+        try:
+            yield ep
+        finally:
+            _routed.reset(token)
+            self.release(ep)
+
+    def stats(self) -> dict[str, int]:
+        """经路由分发过请求的各端点累计请求数。"""
+        with self._lock:
+            return {ep.name: ep.requests for eps in self._endpoints.values() for ep in eps if ep.requests}
+
+
+_pool: KeyPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_key_pool() -> KeyPool:
+    """进程级共享路由池（主 Key 取 llm_client.PROVIDER_CONFIG，额外 Key 取 LLM_KEY_POOL）。"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                from config import LLM_KEY_POOL
+                from src.llm_client import PROVIDER_CONFIG
+                _pool = KeyPool(
+                    {p: cfg.get("key") for p, cfg in PROVIDER_CONFIG.items() if p != "replay"},
+                    parse_key_pool(LLM_KEY_POOL),
+                )
+    return _pool
+
+
+def routed_endpoint_count(provider: str = None) -> int:
+    """默认 provider（在 LLM_ROUTING_POOL 中时为整个池）可用的端点数，扇出线程数按此放大。"""
+    from config import LLM_PROVIDER, LLM_ROUTING_POOL
+    p = (provider or os.getenv("LLM_PROVIDER") or LLM_PROVIDER or "kimi").lower().strip()
+    names = [parse_weighted(item)[0].lower() for item in LLM_ROUTING_POOL.split(",") if item.strip()]
+    return max(1, get_key_pool().size(names if p in names else [p]))
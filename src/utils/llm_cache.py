@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 响应持久化缓存：内容寻址（请求哈希 → 响应），SQLite 存储于 output/cache/。
+模式：rw=读写，ro=只读回放（命中则返回，未命中照常调用但不写入），off=旁路。
+temperature > 0 的调用默认不缓存，需显式开启 LLM_CACHE_NONDETERMINISTIC。
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+CACHE_MODES = ("rw", "ro", "off")
+
+
+def _normalize_content(content):
+    if isinstance(content, str):
+        return content.replace("\r\n", "\n").strip()
+    if isinstance(content, list):
+        return [_normalize_content(p) for p in content]
+    if isinstance(content, dict):
+        return {k: _normalize_content(v) for k, v in content.items()}
+    return content
+
+
+def normalize_messages(messages: list) -> list:
+    """规范化消息：统一换行、去除首尾空白，仅保留 role/content。"""
+    return [
+        {"role": m.get("role", ""), "content": _normalize_content(m.get("content", ""))}
+        for m in messages
+    ]
+
+
+def request_hash(kind: str, provider: str, model: str, messages: list, temperature: float, max_tokens: int) -> str:
+    """请求内容哈希：kind + provider + model + 规范化消息 + temperature + max_tokens。"""
+    payload = json.dumps(
+        {
+            "kind": kind,
+            "provider": provider,
+            "model": model or "",
+            "messages": normalize_messages(messages),
+            "temperature": round(float(temperature), 4),
+            "max_tokens": int(max_tokens),
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """线程安全的 SQLite 响应缓存，支持按总大小与存活时间淘汰。"""
+
+    # 每写入多少条检查一次淘汰
+    _EVICT_EVERY = 50
+
+    def __init__(
+        self,
+        path: Path,
+        mode: str = "rw",
+        max_bytes: int = 512 * 1024 * 1024,
+        max_age_seconds: float = 30 * 86400,
+        cache_nondeterministic: bool = False,
+    ):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"缓存模式须为 {'/'.join(CACHE_MODES)} 之一，当前: {mode}")
+        self.path = Path(path)
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.cache_nondeterministic = cache_nondeterministic
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evicted = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, kind TEXT, provider TEXT, model TEXT,"
+                " value TEXT, size INTEGER, created REAL, accessed REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses(accessed)")
+            self._conn = conn
+            self._evict_locked()
+        return self._conn
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def cacheable(self, temperature: float) -> bool:
+        """该温度下的调用是否参与缓存。"""
+        if not self.enabled:
+            return False
+        return temperature <= 0 or self.cache_nondeterministic
+
+    def get(self, key: str):
+        """查询缓存，命中返回反序列化后的响应，未命中返回 None。"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.max_age_seconds and now - row[1] > self.max_age_seconds):
+                self.misses += 1
+                return None
+            conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value, kind: str = "", provider: str = "", model: str = ""):
+        """写入缓存（仅 rw 模式）。"""
+        if self.mode != "rw":
+            return
+        data = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, kind, provider, model, value, size, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, kind, provider, model or "", data, len(data.encode("utf-8")), now, now),
+            )
+            conn.commit()
+            self.writes += 1
+            self._puts += 1
+            if self._puts % self._EVICT_EVERY == 0:
+                self._evict_locked()
+
+    def _evict_locked(self):
+        """淘汰过期条目，再按最近访问时间淘汰至总大小不超过 max_bytes。"""
+        conn = self._conn
+        if conn is None or self.mode != "rw":
+            return
+        removed = 0
+        if self.max_age_seconds:
+            cur = conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age_seconds,))
+            removed += cur.rowcount or 0
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if self.max_bytes and total > self.max_bytes:
+            for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed ASC").fetchall():
+                if total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+                removed += 1
+        conn.commit()
+        self.evicted += removed
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evicted": self.evicted,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_cache: ResponseCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """进程级共享缓存实例（按 config 中 LLM_CACHE_* 初始化）。"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                from config import (
+                    LLM_CACHE_DIR, LLM_CACHE_MODE, LLM_CACHE_MAX_MB,
+                    LLM_CACHE_MAX_AGE_DAYS, LLM_CACHE_NONDETERMINISTIC,
+                )
+                _cache = ResponseCache(
+                    Path(LLM_CACHE_DIR) / "llm_responses.sqlite3",
+                    mode=LLM_CACHE_MODE,
+                    max_bytes=int(LLM_CACHE_MAX_MB * 1024 * 1024),
+                    max_age_seconds=LLM_CACHE_MAX_AGE_DAYS * 86400,
+                    cache_nondeterministic=LLM_CACHE_NONDETERMINISTIC,
+                )
+    return _cache
+
+
+def configure_response_cache(mode: str = None, cache_nondeterministic: bool = None):
+    """命令行覆盖缓存模式 / 非确定性调用缓存开关。"""
+    cache = get_response_cache()
+    if mode:
+        if mode not in CACHE_MODES:
+            raise ValueError(f"缓存模式须为 {'/'.join(CACHE_MODES)} 之一，当前: {mode}")
+        cache.mode = mode
+    if cache_nondeterministic is not None:
+        cache.cache_nondeterministic = cache_nondeterministic
@@ -0,0 +1,497 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 调用指标：按 (step, call-site) 聚合的固定内存直方图（p50/p90/p99）与计数器。
+
+每次 chat / chat_vision / chat_streamed / Perplexity 调用记录：耗时、首字节时间（流式）、重试次数、
+输入 / 输出 token、缓存命中、错误、max_tokens 截断后的续写次数、实际使用的 provider/model（调用点路由表生效后可对比各模型耗时）；
+token_budget 装箱时截掉的字符数也记在对应调用点上。
+
+标签来源：
+- step：调用栈中最近的 src/stepXX_* 模块名，可用 scope(step=...) 覆盖；
+- site：调用栈中第一个 llm_client 之外的函数名，可用 scope(site=...) 覆盖；
+- chapter：parallel_map / imap 自动设置为 idx + 1，或 scope(chapter=...)。
+
+另记录各 provider 自适应并发上限（AIMD）的变化轨迹，用于观察吞吐收敛。
+
+导出：to_json() / write_json()、write_prometheus()（node_exporter textfile 格式）、format_step_table()。
+"""
+import contextvars
+import json
+import math
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+# ============ 直方图 ============
+
+
+class Histogram:
+    """对数分桶直方图：相对误差约 GROWTH-1，内存随取值范围而非样本数增长。"""
+
+    GROWTH = 1.08
+    MIN_VALUE = 1e-3
+
+    __slots__ = ("count", "total", "min", "max", "_buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._buckets: dict[int, int] = {}
+
+    def _index(self, value: float) -> int:
+        if value <= self.MIN_VALUE:
+            return 0
+        return max(1, math.ceil(math.log(value / self.MIN_VALUE, self.GROWTH)))
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        idx = self._index(value)
+        self._buckets[idx] = self._buckets.get(idx, 0) + 1
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for idx in sorted(self._buckets):
+            seen += self._buckets[idx]
+            if seen >= rank:
+                upper = self.MIN_VALUE * self.GROWTH ** idx if idx else self.MIN_VALUE
+                return min(max(upper, self.min), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "sum": round(self.total, 3),
+            "mean": round(self.total / self.count, 3),
+            "min": round(self.min, 3),
+            "max": round(self.max, 3),
+            "p50": round(self.quantile(0.5), 3),
+            "p90": round(self.quantile(0.9), 3),
+            "p99": round(self.quantile(0.99), 3),
+        }
+
+
+class _SiteStats:
+    """一个 (step, site) 维度的全部指标。"""
+
+    HISTOGRAMS = ("wall_s", "ttfb_s", "input_tokens", "cached_input_tokens", "output_tokens", "truncated_chars")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.continuations = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.hist = {name: Histogram() for name in self.HISTOGRAMS}
+        self.chapters: dict[int, list] = {}  # chapter -> [calls, wall_s]
+        self.models: dict[str, list] = {}    # "provider/model" -> [calls, wall_s]
+
+    def to_dict(self) -> dict:
+        d = {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "continuations": self.continuations,
+            "cache_hits": self.cache_hits,
+            "coalesced": self.coalesced,
+        }
+        d.update({name: h.summary() for name, h in self.hist.items()})
+        if self.chapters:
+            d["chapters"] = {
+                str(ch): {"calls": v[0], "wall_s": round(v[1], 3)} for ch, v in sorted(self.chapters.items())
+            }
+        if self.models:
+            d["models"] = {
+                m: {"calls": v[0], "wall_s": round(v[1], 3)} for m, v in sorted(self.models.items())
+            }
+        return d
+
+
+# ============ 调用上下文 ============
+
+_scope: contextvars.ContextVar[dict] = contextvars.ContextVar("llm_metrics_scope", default={})
+_current: contextvars.ContextVar["CallRecord | None"] = contextvars.ContextVar("llm_metrics_call", default=None)
+
+_SKIP_MODULES = ("src.llm_client", "src.utils.metrics", "src.utils.parallel", "src.utils.token_budget",
+                 "src.utils.edit_script", "tenacity", "contextlib", "concurrent", "threading", "asyncio")
+
+
+def _caller_tags() -> tuple[str, str]:
+    """
+    从调用栈推断 (step, site)。由定义它的函数直接（或经跳过的模块）调用的内部函数（如各步骤的 _rewrite 闭包）
+    计入外层函数，使整章重写与编辑脚本两种模式的调用点标签一致。
+    """
+    step, site, inner, pinned = "", "", None, False
+    frame = sys._getframe(2)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if not module.startswith(_SKIP_MODULES):
+            code = frame.f_code
+            if not site:
+                site, step = code.co_name, module.rsplit(".", 1)[-1]
+                inner = code if code.co_freevars else None
+                pinned = module.startswith("src.step")
+                if pinned and inner is None:
+                    break
+            elif inner is not None:
+                # 上一个非跳过帧是闭包：调用方即定义它的函数时改记为调用方
+                if inner in code.co_consts:
+                    site = code.co_name
+                inner = None
+                if pinned:
+                    break
+                if module.startswith("src.step"):
+                    step = module.rsplit(".", 1)[-1]
+                    break
+            elif module.startswith("src.step"):
+                step = module.rsplit(".", 1)[-1]
+                break
+        frame = frame.f_back
+    return step or "other", site or "unknown"
+
+
+@contextmanager
+def scope(step: str = None, site: str = None, chapter: int = None):
+    """显式设置指标标签（覆盖调用栈推断），可嵌套。"""
+    current = dict(_scope.get())
+    for key, value in (("step", step), ("site", site), ("chapter", chapter)):
+        if value is not None:
+            current[key] = value
+    token = _scope.set(current)
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def _resolve_tags() -> tuple[str, str, int | None]:
+    tags = _scope.get()
+    step, site = tags.get("step"), tags.get("site")
+    if not step or not site:
+        auto_step, auto_site = _caller_tags()
+        step, site = step or auto_step, site or auto_site
+    return step, site, tags.get("chapter")
+
+
+class CallRecord:
+    """单次 LLM 调用的测量值，调用结束时汇入注册表。"""
+
+    __slots__ = ("step", "site", "chapter", "kind", "started", "ttfb", "retries", "continuations",
+                 "input_tokens", "cached_input_tokens", "output_tokens", "cache_hit", "coalesced", "model")
+
+    def __init__(self, kind: str):
+        self.step, self.site, self.chapter = _resolve_tags()
+        self.kind = kind
+        self.started = time.monotonic()
+        self.ttfb = None
+        self.retries = 0
+        self.continuations = 0
+        self.input_tokens = 0
+        self.cached_input_tokens = 0
+        self.output_tokens = 0
+        self.cache_hit = False
+        self.coalesced = False
+        self.model = None
+
+    def first_byte(self):
+        if self.ttfb is None:
+            self.ttfb = time.monotonic() - self.started
+
+
+class MetricsRegistry:
+    # 每个 provider 保留的并发上限变化点数
+    CONCURRENCY_HISTORY = 500
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sites: dict[tuple[str, str], _SiteStats] = {}
+        self._concurrency: dict[str, dict] = {}
+        self.started_at = time.time()
+
+    def _get(self, step: str, site: str) -> _SiteStats:
+        key = (step, site)
+        if key not in self._sites:
+            self._sites[key] = _SiteStats()
+        return self._sites[key]
+
+    def finish(self, rec: CallRecord, error: bool = False):
+        wall = time.monotonic() - rec.started
+        with self._lock:
+            st = self._get(rec.step, rec.site)
+            st.calls += 1
+            st.errors += int(error)
+            st.retries += rec.retries
+            st.continuations += rec.continuations
+            st.cache_hits += int(rec.cache_hit)
+            st.coalesced += int(rec.coalesced)
+            st.hist["wall_s"].add(wall)
+            if rec.ttfb is not None:
+                st.hist["ttfb_s"].add(rec.ttfb)
+            if not (rec.cache_hit or rec.coalesced):
+                st.hist["input_tokens"].add(rec.input_tokens)
+                st.hist["cached_input_tokens"].add(rec.cached_input_tokens)
+                st.hist["output_tokens"].add(rec.output_tokens)
+            if rec.chapter is not None:
+                ch = st.chapters.setdefault(rec.chapter, [0, 0.0])
+                ch[0] += 1
+                ch[1] += wall
+            if rec.model:
+                m = st.models.setdefault(rec.model, [0, 0.0])
+                m[0] += 1
+                m[1] += wall
+
+    def set_concurrency(self, provider: str, limit: int):
+        """记录 provider 的并发上限变化（AIMD 回调）。"""
+        with self._lock:
+            c = self._concurrency.setdefault(provider, {
+                "limit": limit, "min": limit, "max": limit,
+                "history": deque(maxlen=self.CONCURRENCY_HISTORY),
+            })
+            c["limit"] = limit
+            c["min"] = min(c["min"], limit)
+            c["max"] = max(c["max"], limit)
+            c["history"].append((round(time.time() - self.started_at, 1), limit))
+
+    def add_truncation(self, chars: int):
+        step, site, _ = _resolve_tags()
+        with self._lock:
+            self._get(step, site).hist["truncated_chars"].add(chars)
+
+    def reset(self):
+        with self._lock:
+            self._sites.clear()
+            self._concurrency.clear()
+            self.started_at = time.time()
+
+    # ---------- 导出 ----------
+
+    def to_json(self, run: str = "") -> dict:
+        with self._lock:
+            sites = [
+                {"step": step, "site": site, **st.to_dict()}
+                for (step, site), st in sorted(self._sites.items())
+            ]
+            steps = self._step_rollup()
+            concurrency = {
+                p: {"limit": c["limit"], "min": c["min"], "max": c["max"], "history": [list(h) for h in c["history"]]}
+                for p, c in sorted(self._concurrency.items())
+            }
+        return {
+            "run": run,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+            "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime()),
+            "steps": steps,
+            "sites": sites,
+            "concurrency": concurrency,
+        }
+
+    def _step_rollup(self) -> dict:
+        """按 step 汇总（直方图逐桶合并）。调用方需持有锁。"""
+        rollup: dict[str, _SiteStats] = {}
+        for (step, _), st in self._sites.items():
+            agg = rollup.setdefault(step, _SiteStats())
+            agg.calls += st.calls
+            agg.errors += st.errors
+            agg.retries += st.retries
+            agg.continuations += st.continuations
+            agg.cache_hits += st.cache_hits
+            agg.coalesced += st.coalesced
+            for model, (calls, wall) in st.models.items():
+                m = agg.models.setdefault(model, [0, 0.0])
+                m[0] += calls
+                m[1] += wall
+            for name, h in st.hist.items():
+                target = agg.hist[name]
+                target.count += h.count
+                target.total += h.total
+                target.min = min(target.min, h.min)
+                target.max = max(target.max, h.max)
+                for idx, n in h._buckets.items():
+                    target._buckets[idx] = target._buckets.get(idx, 0) + n
+        return {step: st.to_dict() for step, st in sorted(rollup.items())}
+
+    def write_json(self, path: Path, run: str = "") -> Path:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.to_json(run), ensure_ascii=False, indent=2), encoding="utf-8")
+        return path
+
+    def write_prometheus(self, path: Path, run: str = "") -> Path:
+        """Prometheus textfile 格式（summary + counter），先写临时文件再原子替换。"""
+        def esc(v) -> str:
+            return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        lines = []
+        with self._lock:
+            items = sorted(self._sites.items())
+            summaries = (
+                ("llm_call_duration_seconds", "wall_s", "LLM 调用耗时"),
+                ("llm_time_to_first_byte_seconds", "ttfb_s", "流式调用首字节时间"),
+                ("llm_input_tokens", "input_tokens", "单次调用输入 token"),
+                ("llm_cached_input_tokens", "cached_input_tokens", "单次调用输入中命中 provider 提示缓存的 token"),
+                ("llm_output_tokens", "output_tokens", "单次调用输出 token"),
+                ("llm_truncated_chars", "truncated_chars", "预算装箱截掉的字符数"),
+            )
+            for metric, name, help_text in summaries:
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} summary"]
+                for (step, site), st in items:
+                    h = st.hist[name]
+                    if not h.count:
+                        continue
+                    labels = f'run="{esc(run)}",step="{esc(step)}",site="{esc(site)}"'
+                    for q in (0.5, 0.9, 0.99):
+                        lines.append(f'{metric}{{{labels},quantile="{q}"}} {h.quantile(q):.6g}')
+                    lines.append(f"{metric}_sum{{{labels}}} {h.total:.6g}")
+                    lines.append(f"{metric}_count{{{labels}}} {h.count}")
+            counters = (
+                ("llm_calls_total", "calls", "LLM 调用次数"),
+                ("llm_errors_total", "errors", "LLM 调用失败次数"),
+                ("llm_retries_total", "retries", "LLM 重试 / 续传次数"),
+                ("llm_continuations_total", "continuations", "max_tokens 截断后的续写请求次数"),
+                ("llm_cache_hits_total", "cache_hits", "响应缓存命中次数"),
+                ("llm_coalesced_total", "coalesced", "合并到相同在途请求的次数"),
+            )
+            for metric, attr, help_text in counters:
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+                for (step, site), st in items:
+                    labels = f'run="{esc(run)}",step="{esc(step)}",site="{esc(site)}"'
+                    lines.append(f"{metric}{{{labels}}} {getattr(st, attr)}")
+            lines += ["# HELP llm_concurrency_limit 自适应并发上限（AIMD）", "# TYPE llm_concurrency_limit gauge"]
+            for provider, c in sorted(self._concurrency.items()):
+                lines.append(f'llm_concurrency_limit{{run="{esc(run)}",provider="{esc(provider)}"}} {c["limit"]}')
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        tmp.replace(path)
+        return path
+
+    def format_step_table(self) -> str:
+        """按 step 汇总的文本表格（耗时分位数 / token / 重试 / 续写 / 截断）。"""
+        with self._lock:
+            steps = self._step_rollup()
+        if not steps:
+            return ""
+        header = f"{'Step':<28}{'调用':>6}{'重试':>6}{'续写':>6}{'失败':>6}{'缓存':>6}{'合并':>6}{'p50(s)':>9}{'p90(s)':>9}{'p99(s)':>9}{'合计(s)':>10}{'输入tok':>11}{'缓存tok':>10}{'输出tok':>10}{'截断字':>9}"
+        rows = [header, "-" * len(header)]
+        for step, d in steps.items():
+            wall = d["wall_s"]
+            rows.append(
+                f"{step[:27]:<28}{d['calls']:>6}{d['retries']:>6}{d['continuations']:>6}{d['errors']:>6}{d['cache_hits']:>6}{d['coalesced']:>6}"
+                f"{wall.get('p50', 0):>9.1f}{wall.get('p90', 0):>9.1f}{wall.get('p99', 0):>9.1f}{wall.get('sum', 0):>10.1f}"
+                f"{int(d['input_tokens'].get('sum', 0)):>11,}{int(d['cached_input_tokens'].get('sum', 0)):>10,}"
+                f"{int(d['output_tokens'].get('sum', 0)):>10,}"
+                f"{int(d['truncated_chars'].get('sum', 0)):>9,}"
+            )
+        return "\n".join(rows)
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    return _registry
+
+
+# ============ llm_client 埋点接口 ============
+
+
+@contextmanager
+def track_call(kind: str):
+    """包裹一次对外的 LLM 调用；嵌套调用只计最外层。"""
+    if _current.get() is not None:
+        yield _current.get()
+        return
+    rec = CallRecord(kind)
+    token = _current.set(rec)
+    error = False
+    try:
+        yield rec
+    except BaseException:
+        error = True
+        raise
+    finally:
+        _current.reset(token)
+        _registry.finish(rec, error)
+
+
+def current_call() -> CallRecord | None:
+    return _current.get()
+
+
+def current_tags() -> tuple[str, str]:
+    """当前的 (step, site) 标签：进行中的 LLM 调用优先，否则按 scope / 调用栈推断（与此处发起的调用记录的标签一致）。"""
+    rec = _current.get()
+    if rec is not None:
+        return rec.step, rec.site
+    step, site, _ = _resolve_tags()
+    return step, site
+
+
+def current_step() -> str:
+    """当前的 step 标签：进行中的 LLM 调用优先，否则按 scope / 调用栈推断。"""
+    rec = _current.get()
+    return rec.step if rec is not None else _resolve_tags()[0]
+
+
+def note_tokens(input_tokens: int, output_tokens: int, cached_input_tokens: int = 0):
+    rec = _current.get()
+    if rec is not None:
+        rec.input_tokens += input_tokens
+        rec.cached_input_tokens += cached_input_tokens
+        rec.output_tokens += output_tokens
+
+
+def note_model(provider: str, model: str):
+    """记录本次调用实际使用的 provider/model（嵌套调用只记第一次）。"""
+    rec = _current.get()
+    if rec is not None and rec.model is None:
+        rec.model = f"{provider}/{model}" if model else provider
+
+
+def note_retry():
+    rec = _current.get()
+    if rec is not None:
+        rec.retries += 1
+
+
+def note_continuation():
+    rec = _current.get()
+    if rec is not None:
+        rec.continuations += 1
+
+
+def note_first_byte():
+    rec = _current.get()
+    if rec is not None:
+        rec.first_byte()
+
+
+def note_cache_hit():
+    rec = _current.get()
+    if rec is not None:
+        rec.cache_hit = True
+
+
+def note_coalesced():
+    rec = _current.get()
+    if rec is not None:
+        rec.coalesced = True
+
+
+def note_truncation(chars: int):
+    if chars > 0:
+        _registry.add_truncation(chars)
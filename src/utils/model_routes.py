@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+调用点模型路由表：按调用指标的 (step, site) 标签把 chat() 路由到指定 provider / model / reasoning / max_tokens，
+大纲构建等推理型调用继续用主模型，章节导语、去重、补注、事实抽取等机械性调用改用快速模型。
+
+路由来源（后者覆盖前者的同名标签）：
+    LLM_ROUTES       .env 内联配置，分号分隔，如
+                     "_api_deduplicate_chapter:provider=deepseek,max_tokens=8192;step4b_consistency_check:provider=qwen"
+    报告类型配置     output/skill/report_types/<type>.md 中的 "## 模型路由" 章节，每行一条：
+                     - step2_report_v1._api_add_chapter_intro_summary: provider=deepseek, model=deepseek-chat
+
+标签匹配优先级：step.site > site > step（step 为 src/stepXX_* 模块名，site 为调用 chat() 的函数名，
+与 scope(step=..., site=...) 显式设置的标签一致）。路由字段覆盖调用参数；只改 provider 而未指定 model 时
+使用该 provider 的默认模型；路由的 provider 未配置 Key 时忽略其 provider 部分并提示一次。
+"""
+import threading
+
+# 路由可设置的字段及其类型
+_FIELDS = {
+    "provider": str,
+    "model": str,
+    "reasoning": bool,
+    "max_tokens": int,
+}
+PROFILE_SECTION = "模型路由"
+
+
+def _parse_value(field: str, raw: str):
+    raw = raw.strip().strip("`").strip('"').strip("'")
+    kind = _FIELDS[field]
+    if kind is bool:
+        return raw.lower() in ("1", "true", "yes", "on")
+    if kind is int:
+        return int(raw)
+    return raw.lower() if field == "provider" else raw
+
+
+def parse_routes(text: str) -> dict[str, dict]:
+    """
+    解析路由表：每条 "标签: 字段=值, 字段=值"，条目之间用换行或分号分隔，
+    行首的 "-"、"*" 与标签两侧的反引号会被忽略；无法识别的字段与值跳过。
+    """
+    routes: dict[str, dict] = {}
+    for entry in (text or "").replace(";", "\n").splitlines():
+        entry = entry.strip().lstrip("-*").strip()
+        if not entry or entry.startswith("#") or ":" not in entry:
+            continue
+        label, _, body = entry.partition(":")
+        label = label.strip().strip("`")
+        route = {}
+        for item in body.split(","):
+            field, sep, raw = item.partition("=")
+            field = field.strip().lower()
+            if not sep or field not in _FIELDS:
+                continue
+            try:
+                route[field] = _parse_value(field, raw)
+            except ValueError:
+                continue
+        if label and route:
+            routes[label] = route
+    return routes
+
+
+class ModelRoutes:
+    """线程安全的路由表，记录各标签命中次数。"""
+
+    def __init__(self, routes: dict[str, dict] = None):
+        self._lock = threading.Lock()
+        self._routes: dict[str, dict] = dict(routes or {})
+        self._warned: set[str] = set()
+        self.hits: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._routes)
+
+    def update(self, routes: dict[str, dict]):
+        with self._lock:
+            self._routes.update(routes)
+
+    def lookup(self, step: str, site: str, count: bool = True) -> tuple[str, dict] | None:
+        """返回 (命中的标签, 路由)；按 step.site > site > step 匹配。count=False 时不计命中（预先解析）。"""
+        if not self._routes:
+            return None
+        with self._lock:
+            for label in (f"{step}.{site}", site, step):
+                route = self._routes.get(label)
+                if route:
+                    if count:
+                        self.hits[label] = self.hits.get(label, 0) + 1
+                    return label, route
+        return None
+
+    def warn_once(self, label: str, msg: str):
+        with self._lock:
+            if label in self._warned:
+                return
+            self._warned.add(label)
+        print(f"[LLM路由] {label}: {msg}", flush=True)
+
+    def snapshot(self) -> dict[str, dict]:
+        """当前路由表的副本。"""
+        with self._lock:
+            return {label: dict(route) for label, route in self._routes.items()}
+
+    def stats(self) -> dict[str, dict]:
+        """命中过的路由：{标签: {"hits": n, **路由}}。"""
+        with self._lock:
+            return {label: {"hits": n, **self._routes.get(label, {})} for label, n in self.hits.items()}
+
+
+_routes: ModelRoutes | None = None
+_routes_lock = threading.Lock()
+
+
+def get_model_routes() -> ModelRoutes:
+    """进程级共享路由表（初始为 LLM_ROUTES）。"""
+    global _routes
+    if _routes is None:
+        with _routes_lock:
+            if _routes is None:
+                from config import LLM_ROUTES
+                _routes = ModelRoutes(parse_routes(LLM_ROUTES))
+    return _routes
+
+
+def configure_model_routes(report_type: str = None, spec: str = None) -> int:
+    """
+    叠加报告类型配置（None 为默认类型）中的 "## 模型路由" 章节与命令行内联路由，返回当前路由条数。
+    """
+    from src.report_type_profiles import load_report_type_profile
+    routes = get_model_routes()
+    try:
+        section = load_report_type_profile(report_type)["sections"].get(PROFILE_SECTION, "")
+    except FileNotFoundError:
+        section = ""
+    routes.update(parse_routes(section))
+    if spec:
+        routes.update(parse_routes(spec))
+    return len(routes)
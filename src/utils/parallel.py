@@ -1,18 +1,316 @@
 # -*- coding: utf-8 -*-
-"""轻量并行执行工具。"""
-from concurrent.futures import ThreadPoolExecutor, as_completed
+"""
+轻量并行执行工具：进程级共享线程池 + 优先级通道。
 
+    for idx, result in imap(fn, items):                  # 按完成顺序逐项取得结果（ordered=True 时按原始顺序）
+        ...
+    results = parallel_map(fn, items)                    # 按原始顺序返回列表
+    results = parallel_map(fn, items, on_error="skip")   # 失败项为 default，其余结果照常返回
 
-def parallel_map(fn, items, max_workers=4):
+fn(idx, item) → result，idx 为在 items 中的下标。所有扇出共用一个线程池（PARALLEL_POOL_WORKERS 个常驻线程，
+单次扇出的并发上限更大时——如批处理模式每项一个线程——临时扩容），不再每次调用新建线程池；
+每次调用按 max_workers（默认 fanout_workers()，即 AIMD 上限的最大值）限制自身同时执行的项数，
+实际对各 provider 的并发由 src/utils/adaptive_concurrency.py 按延迟与错误率自适应调整。
+线程池满时空闲线程优先执行 high 通道的项，其次 normal、low（同一通道内先提交的调用优先）；
+通道默认取调用方上下文（priority_lane()），任务图把关键路径节点放在 high、旁路校验节点放在 low。
+
+出错策略 on_error：
+- raise（默认）：首个失败即取消同一调用中尚未开始的项，进行中的项在下一次 LLM 请求前收到 Cancelled（协作取消），
+  待其退出后抛出该异常；
+- skip：记录失败并跳过（imap 不产出该项，parallel_map 中为 default）；
+- retry：失败项最多重试 retries 次，仍失败时按 raise 处理。
+
+工作线程继承调用方的 contextvars（指标标签、限流凭证、检查点范围等），指标标签 chapter 自动设为 idx + 1。
+Ctrl-C：取消尚未开始的项，等待进行中的项完成（其结果已写入检查点）后再抛出 KeyboardInterrupt。
+停止标志按运行范围划分（顶层调用或 stop_scope()，嵌套扇出沿用外层的），中断后同一进程内的新运行不受影响。
+"""
+import contextvars
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from src.utils.adaptive_concurrency import fanout_workers
+from src.utils.log import log as _log
+from src.utils.metrics import scope as _metrics_scope
+
+LANES = {"high": 0, "normal": 1, "low": 2}
+ON_ERROR = ("raise", "skip", "retry")
+# 超出常驻数的线程空闲多久后退出（秒）
+_IDLE_SECONDS = 30.0
+
+# 当前运行范围的停止标志，Ctrl-C 后置位：尚未开始的并行任务不再执行，已开始的任务照常完成（结果写入检查点）
+_stop: contextvars.ContextVar["threading.Event | None"] = contextvars.ContextVar("parallel_stop", default=None)
+_lane: contextvars.ContextVar[str] = contextvars.ContextVar("parallel_lane", default="normal")
+# 当前项所属的调用（在各项的上下文中设置，供协作取消检查）
+_current_call: contextvars.ContextVar["_Call | None"] = contextvars.ContextVar("parallel_call", default=None)
+_worker = threading.local()
+
+
+class Interrupted(KeyboardInterrupt):
+    """收到 Ctrl-C 后跳过的并行任务。"""
+
+
+class Cancelled(Exception):
+    """当前项所在的并行调用已取消（同一调用的其他项失败，或调用方提前结束迭代）。"""
+
+
+def request_stop():
+    """停止派发当前运行范围内新的并行任务（parallel_map / 任务图在主线程收到 Ctrl-C 时调用）。"""
+    event = _stop.get()
+    if event is not None:
+        event.set()
+
+
+@contextmanager
+def stop_scope():
+    """开始新的运行范围（如一次任务图运行）：范围内的扇出共用一个新的停止标志，此前的中断不影响本次运行。"""
+    token = _stop.set(threading.Event())
+    try:
+        yield
+    finally:
+        _stop.reset(token)
+
+
+def cancellation_requested() -> bool:
+    """当前项所在的并行调用是否已取消：取消后结束的工作单元可能走了兜底分支，检查点不记录。"""
+    call = _current_call.get()
+    return call is not None and call.cancelled
+
+
+def check_cancelled():
+    """协作取消点：当前项所在的并行调用已取消时抛出 Cancelled（每次 LLM 请求前调用）。"""
+    if cancellation_requested():
+        raise Cancelled("并行调用已取消")
+
+
+@contextmanager
+def priority_lane(lane: str):
+    """在此范围内发起的扇出使用指定通道：high / normal / low。"""
+    if lane not in LANES:
+        raise ValueError(f"未知的并行通道: {lane}（可选 {', '.join(LANES)}）")
+    token = _lane.set(lane)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+class _Call:
+    """一次 imap / parallel_map 调用：待执行项、并发上限与已完成队列（均由线程池的锁保护）。"""
+
+    def __init__(self, fn, items: list, limit: int, lane: str, seq: int, on_error: str, retries: int, stop, lock):
+        self.fn = fn
+        self.items = items
+        self.limit = limit
+        self.priority = (LANES[lane], seq)
+        self.on_error = on_error
+        self.retries = retries
+        self.pending = deque(range(len(items)))
+        self.contexts = [contextvars.copy_context() for _ in items]
+        self.running = 0
+        self.finished: deque = deque()
+        self.cancelled = False
+        self.stop = stop
+        self.cond = threading.Condition(lock)
+
+
+def _run_item(call: _Call, idx: int):
+    _current_call.set(call)
+    _stop.set(call.stop)  # 项内的嵌套扇出沿用同一停止标志
+    attempts = call.retries + 1 if call.on_error == "retry" else 1
+    for attempt in range(1, attempts + 1):
+        if call.stop.is_set():
+            raise Interrupted(f"已中断，跳过第 {idx + 1} 项")
+        check_cancelled()
+        try:
+            # 指标标签：chapter = 下标 + 1
+            with _metrics_scope(chapter=idx + 1):
+                return call.fn(idx, call.items[idx])
+        except Exception as e:
+            if attempt == attempts or isinstance(e, Cancelled):
+                raise
+            _log(f"[并行] 第 {idx + 1} 项失败（{type(e).__name__}: {e}），{attempt}s 后重试（{attempt}/{call.retries}）")
+            time.sleep(attempt)
+
+
+class SharedExecutor:
+    """进程级共享线程池：各调用的项按（通道，提交顺序）择优执行，且不超过各自的并发上限。"""
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self._lock = threading.Lock()
+        self._work = threading.Condition(self._lock)
+        self._calls: list[_Call] = []
+        self._threads = 0
+        self._idle = 0
+        self._seq = itertools.count()
+        self._names = itertools.count(1)
+
+    def submit(self, fn, items: list, limit: int, lane: str, on_error: str, retries: int, stop) -> _Call:
+        with self._lock:
+            call = _Call(fn, items, max(1, limit), lane, next(self._seq), on_error, retries, stop, self._lock)
+            self._calls.append(call)
+            self._spawn()
+            self._work.notify_all()
+        return call
+
+    def _spawn(self):
+        """（持锁调用）空闲线程不足以承接可执行的项时扩容；上限取常驻数与各调用并发上限中的较大者。"""
+        demand = sum(min(len(c.pending), c.limit - c.running) for c in self._calls if not c.cancelled)
+        cap = max(self.size, max((c.limit for c in self._calls), default=0))
+        while self._idle < demand and self._threads < cap:
+            self._threads += 1
+            self._idle += 1
+            threading.Thread(target=self._worker_loop, name=f"parallel-{next(self._names)}", daemon=True).start()
+
+    def _claim(self) -> tuple[_Call, int] | None:
+        """（持锁调用）取优先级最高、未达并发上限的调用的下一项。"""
+        ready = [c for c in self._calls if c.pending and not c.cancelled and c.running < c.limit]
+        if not ready:
+            return None
+        call = min(ready, key=lambda c: c.priority)
+        call.running += 1
+        return call, call.pending.popleft()
+
+    def _worker_loop(self):
+        _worker.active = True
+        with self._lock:
+            while True:
+                claimed = self._claim()
+                if claimed is None:
+                    if not self._work.wait(timeout=_IDLE_SECONDS) and self._threads > self.size:
+                        self._threads -= 1
+                        self._idle -= 1
+                        return
+                    continue
+                self._idle -= 1
+                self._lock.release()
+                try:
+                    self._execute(*claimed)
+                finally:
+                    self._lock.acquire()
+                self._idle += 1
+
+    def _execute(self, call: _Call, idx: int):
+        result, error = None, None
+        try:
+            result = call.contexts[idx].run(_run_item, call, idx)
+        except BaseException as e:  # 含 Interrupted：交给调用方线程处理
+            error = e
+        with self._lock:
+            call.running -= 1
+            call.finished.append((idx, result, error))
+            if error is not None and call.on_error != "skip":
+                call.cancelled = True  # 失败即停止派发同一调用的其余项，不等调用方线程处理
+            call.cond.notify_all()
+            self._work.notify_all()
+
+    def results(self, call: _Call):
+        """
+        按完成顺序产出 (idx, result, error)。调用方本身是池内线程（嵌套扇出）时也执行本调用的项，
+        避免外层各项占满线程池、等待内层扇出而死锁。
+        """
+        nested = getattr(_worker, "active", False)
+        remaining = len(call.items)
+        while remaining:
+            inline = None
+            with self._lock:
+                while not call.finished and inline is None:
+                    if nested and call.pending and not call.cancelled and call.running < call.limit:
+                        call.running += 1
+                        inline = call.pending.popleft()
+                    else:
+                        call.cond.wait(timeout=0.2)  # 定时唤醒，主线程可及时响应 Ctrl-C
+                done, call.finished = call.finished, deque()
+            if inline is not None:
+                self._execute(call, inline)
+            for entry in done:
+                remaining -= 1
+                yield entry
+
+    def close(self, call: _Call, cancel: bool = True):
+        """结束调用：丢弃未开始的项，cancel 时通知进行中的项协作取消；等待进行中的项退出。"""
+        with self._lock:
+            call.pending.clear()
+            call.cancelled = cancel
+            while call.running:
+                call.cond.wait(timeout=0.2)
+            self._calls.remove(call)
+
+    def running_count(self, call: _Call) -> int:
+        with self._lock:
+            return call.running
+
+
+_executor: SharedExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def get_shared_executor() -> SharedExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            from config import PARALLEL_POOL_WORKERS
+            _executor = SharedExecutor(PARALLEL_POOL_WORKERS)
+        return _executor
+
+
+def imap(fn, items, max_workers=None, on_error: str = "raise", retries: int = 2, ordered: bool = False,
+         lane: str = None):
     """
-    并行处理 items 列表，按原始顺序返回结果。
-    fn(idx, item) → result，idx 为在 items 中的下标。
+    并行处理 items，逐项产出 (idx, result)：默认按完成顺序，ordered=True 时按原始顺序（先完成的暂存）。
+    提前结束迭代（break / 异常）时取消其余项。参数见模块说明。
     """
+    if on_error not in ON_ERROR:
+        raise ValueError(f"未知的 on_error: {on_error}（可选 {', '.join(ON_ERROR)}）")
+    items = list(items)
     n = len(items)
-    results = [None] * n
-    with ThreadPoolExecutor(max_workers=min(n, max_workers)) as executor:
-        futures = {executor.submit(fn, i, item): i for i, item in enumerate(items)}
-        for future in as_completed(futures):
-            i = futures[future]
-            results[i] = future.result()
+    if n == 0:
+        return
+    lane = lane or _lane.get()
+    if lane not in LANES:
+        raise ValueError(f"未知的并行通道: {lane}（可选 {', '.join(LANES)}）")
+    executor = get_shared_executor()
+    # 不在任何运行范围内（顶层调用）时本次调用自成一个范围
+    stop = _stop.get() or threading.Event()
+    call = executor.submit(fn, items, min(n, max_workers or fanout_workers(n)), lane, on_error, retries, stop)
+    interrupted = False
+    buffered, next_idx, skipped = {}, 0, object()
+    try:
+        for idx, result, error in executor.results(call):
+            if error is not None:
+                if on_error != "skip" or not isinstance(error, Exception):
+                    raise error
+                _log(f"[并行] 第 {idx + 1} 项失败，已跳过（{type(error).__name__}: {error}）")
+                result = skipped
+            if not ordered:
+                if result is not skipped:
+                    yield idx, result
+                continue
+            buffered[idx] = result
+            while next_idx in buffered:
+                value = buffered.pop(next_idx)
+                if value is not skipped:
+                    yield next_idx, value
+                next_idx += 1
+    except KeyboardInterrupt:
+        interrupted = True
+        stop.set()
+        _log(f"[中断] 取消未开始的任务，等待 {executor.running_count(call)} 个进行中的任务完成并写入检查点...")
+        raise
+    finally:
+        executor.close(call, cancel=not interrupted)
+
+
+def parallel_map(fn, items, max_workers=None, on_error: str = "raise", retries: int = 2, default=None,
+                 lane: str = None):
+    """
+    并行处理 items 列表，按原始顺序返回结果；on_error="skip" 时失败项为 default。参数见模块说明。
+    """
+    items = list(items)
+    results = [default] * len(items)
+    for idx, result in imap(fn, items, max_workers, on_error, retries, lane=lane):
+        results[idx] = result
     return results
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
-"""断点续跑：记录 pipeline 各步骤完成状态，支持中断后恢复。"""
+"""
+断点续跑：记录 pipeline 各步骤完成状态，支持中断后恢复。
+full-report 另在 builds 中记录各节点的输入指纹（见 incremental.py），据此判断节点是否需要重建。
+"""
 import hashlib
 import json
 import time
@@ -7,11 +10,12 @@ from pathlib import Path
 
 
 def _compute_config_hash() -> str:
-    """计算当前 LLM 配置的哈希值（provider + model + 关键限制参数）。"""
-    import os
-    provider = os.environ.get("LLM_PROVIDER", "kimi")
-    model = os.environ.get("KIMI_MODEL", "")
-    key_info = f"{provider}|{model}"
+    """
+    计算当前 LLM 配置的哈希值：默认 provider 及其模型、调用点路由、报告语言、编辑脚本开关
+    （与工作单元检查点使用同一指纹，见 src/utils/checkpoint.py）。
+    """
+    from src.utils.checkpoint import llm_fingerprint
+    key_info = json.dumps(llm_fingerprint(), ensure_ascii=False, sort_keys=True)
     return hashlib.md5(key_info.encode()).hexdigest()[:12]
 
 
@@ -26,8 +30,8 @@ def load_progress(base: str, output_dir: Path) -> dict:
     return {"base": base, "config_hash": "", "completed_steps": [], "timestamps": {}}
 
 
-def save_progress(base: str, output_dir: Path, step: str, extra: dict = None):
-    """记录某步骤已完成。"""
+def save_progress(base: str, output_dir: Path, step: str, extra: dict = None, build: dict = None):
+    """记录某步骤已完成；build 为该步骤本次构建的输入指纹。"""
     progress = load_progress(base, output_dir)
     progress["config_hash"] = _compute_config_hash()
     if step not in progress["completed_steps"]:
@@ -35,6 +39,8 @@ def save_progress(base: str, output_dir: Path, step: str, extra: dict = None):
     progress["timestamps"][step] = time.strftime("%Y-%m-%d %H:%M:%S")
     if extra:
         progress.setdefault("extra", {}).update(extra)
+    if build is not None:
+        progress.setdefault("builds", {})[step] = build
 
     progress_path = Path(output_dir) / f"{base}_progress.json"
     progress_path.write_text(json.dumps(progress, ensure_ascii=False, indent=2), encoding="utf-8")
@@ -47,3 +53,8 @@ def should_skip_step(progress: dict, step: str) -> bool:
     current_hash = _compute_config_hash()
     stored_hash = progress.get("config_hash", "")
     return current_hash == stored_hash
+
+
+def last_build(progress: dict, step: str) -> dict | None:
+    """某步骤上次构建的输入指纹；早期版本的进度文件没有该记录。"""
+    return progress.get("builds", {}).get(step)
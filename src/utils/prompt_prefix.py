@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+前缀缓存友好的消息布局：同一批调用共用的大块内容（报告全文、专家意见、写作规范等）放在最前面，
+逐字节相同的前缀可被 provider 的提示缓存命中（OpenAI / DeepSeek / Kimi / Qwen 等自动前缀缓存，
+Claude 需显式 cache_control 断点，Gemini 隐式缓存）。
+
+布局：
+    system  共享前缀（各块之间空行分隔，末块带 cache_control 断点）
+    system  本次调用的角色说明（可选，如 Step3 各专家人设）
+    user    本次调用的任务（各章节、各专家不同的部分）
+
+消息中的共享前缀以 content 块列表表示（{"type": "text", "text": ..., "cache_control": ...}）；
+llm_client 对 Claude 原样保留断点，对其他 provider 合并为纯文本（连续 system 消息合并为一条）。
+"""
+
+# Claude 提示缓存的最小可缓存长度约 1024 token；更短的前缀不打断点
+MIN_CACHE_CHARS = 2000
+EPHEMERAL = {"type": "ephemeral"}
+
+
+def cache_block(text: str) -> dict:
+    """一个带缓存断点的文本块。"""
+    block = {"type": "text", "text": text}
+    if len(text) >= MIN_CACHE_CHARS:
+        block["cache_control"] = dict(EPHEMERAL)
+    return block
+
+
+def prefixed_messages(shared: str | list[str], task: str, role: str = "") -> list[dict]:
+    """
+    构造「共享前缀 + 角色 + 任务」消息列表。shared 为各调用完全相同的内容（顺序固定），
+    role 为本次调用的 system 角色说明，task 为本次调用的 user 任务。
+    """
+    blocks = [shared] if isinstance(shared, str) else [b for b in shared if b]
+    messages = [{"role": "system", "content": [cache_block("\n\n".join(blocks))]}]
+    if role:
+        messages.append({"role": "system", "content": role})
+    messages.append({"role": "user", "content": task})
+    return messages
+
+
+def plain_messages(messages: list) -> list:
+    """
+    去掉缓存断点：纯文本块列表合并为字符串，连续的 system 消息合并为一条（兼容只接受单条 system 的接口）；
+    含图片等非文本块的 content 保留列表，仅移除 cache_control。
+    """
+    out = []
+    for m in messages:
+        content = m.get("content", "")
+        if isinstance(content, list):
+            if all(isinstance(p, dict) and p.get("type") == "text" for p in content):
+                content = "\n\n".join(p.get("text", "") for p in content)
+            else:
+                content = [
+                    {k: v for k, v in p.items() if k != "cache_control"} if isinstance(p, dict) else p
+                    for p in content
+                ]
+        if m.get("role") == "system" and out and out[-1]["role"] == "system" and isinstance(content, str) \
+                and isinstance(out[-1]["content"], str):
+            out[-1] = {**out[-1], "content": out[-1]["content"] + "\n\n" + content}
+            continue
+        out.append({**m, "content": content})
+    return out
+
@@ -7,13 +7,28 @@ from pathlib import Path
 import src  # noqa: F401
 
 from config import REPORT_DIR
-from src.llm_client import chat
+from src.llm_client import chat_json
+from src.utils.json_output import JSONOutputError
 from src.utils.log import log as _log
-from src.utils.file_utils import load_raw_content as _load_raw_content, clean_json as _clean_json
+from src.utils.file_utils import load_raw_content as _load_raw_content
 
 QUALITY_EVAL_REPORT_LIMIT = 60_000
 QUALITY_EVAL_RAW_LIMIT = 30_000
 
+_SCORE_1_5 = {"type": "number", "minimum": 1, "maximum": 5}
+QUALITY_SCHEMA = {
+    "type": "object",
+    "required": ["coverage", "structure", "language", "density", "overall", "commentary"],
+    "properties": {
+        "coverage": {"type": "number", "minimum": 0, "maximum": 100},
+        "structure": _SCORE_1_5,
+        "language": _SCORE_1_5,
+        "density": _SCORE_1_5,
+        "overall": {"type": "number", "minimum": 0, "maximum": 10},
+        "commentary": {"type": "string"},
+    },
+}
+
 
 def evaluate_report_quality(
     report_text: str,
@@ -65,22 +80,20 @@ def evaluate_report_quality(
 
     _log(f"调用 API：报告质量评估（{version_label}）...", "quality")
     t0 = time.time()
-    resp = chat(
-        [
-            {"role": "system", "content": "你是专业的文档质量评审专家，擅长多维度评估报告质量。输出严格 JSON。"},
-            {"role": "user", "content": prompt},
-        ],
-        max_tokens=2048,
-        temperature=0.3,
-    )
-    _log(f"质量评估完成，耗时 {time.time()-t0:.1f}s", "quality")
-
-    cleaned = _clean_json(resp)
     try:
-        result = json.loads(cleaned)
-    except json.JSONDecodeError:
+        result = chat_json(
+            [
+                {"role": "system", "content": "你是专业的文档质量评审专家，擅长多维度评估报告质量。输出严格 JSON。"},
+                {"role": "user", "content": prompt},
+            ],
+            schema=QUALITY_SCHEMA,
+            max_tokens=2048,
+            temperature=0.3,
+        )
+    except JSONOutputError as e:
         _log("[警告] 质量评估返回非标准 JSON")
-        result = {"coverage": 0, "structure": 0, "language": 0, "density": 0, "overall": 0, "commentary": cleaned}
+        result = {"coverage": 0, "structure": 0, "language": 0, "density": 0, "overall": 0, "commentary": e.text}
+    _log(f"质量评估完成，耗时 {time.time()-t0:.1f}s", "quality")
 
     # 保存结果
     if output_path:
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+进程级 LLM 限流：按 provider / provider:model 维度的令牌桶。
+同时约束每分钟请求数（RPM）、每分钟 token 数（TPM，按输入估算 + max_tokens 预占）与在途请求数，
+同步与异步路径共享同一组桶。调用完成后按实际用量退还多预占的 token。
+
+配置（.env）：
+    LLM_RATE_RPM / LLM_RATE_TPM / LLM_RATE_MAX_INFLIGHT   全局默认值，0 表示不限
+    LLM_RATE_LIMITS   按 provider 或 provider/model 覆盖，如
+                      "perplexity:rpm=50;kimi:rpm=200,tpm=2000000,inflight=16;kimi/kimi-k2.5:tpm=1000000"
+
+多 Key 路由池中每个 Key 以 "provider#序号" 计量（各自一组桶），provider 级配置对每个 Key 分别生效，
+也可用 "kimi#1:rpm=100" 单独覆盖某个 Key。
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+# 在途请求已满时的轮询间隔（秒）
+_INFLIGHT_POLL = 0.02
+
+
+def parse_rate_limits(spec: str) -> dict[str, dict]:
+    """解析 LLM_RATE_LIMITS：返回 {"kimi": {"rpm": 200, ...}, "kimi/kimi-k2.5": {...}}。"""
+    limits: dict[str, dict] = {}
+    for entry in (spec or "").split(";"):
+        entry = entry.strip()
+        if not entry or ":" not in entry:
+            continue
+        key, _, body = entry.partition(":")
+        values = {}
+        for item in body.split(","):
+            name, _, raw = item.partition("=")
+            name = name.strip().lower()
+            if name in ("rpm", "tpm", "inflight") and raw.strip():
+                values[name] = float(raw)
+        limits[key.strip().lower()] = values
+    return limits
+
+
+class _Bucket:
+    """令牌桶：容量为每分钟额度，按秒匀速回填；允许欠账，欠账部分以等待时间偿还（先到先得）。"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount: float, now: float) -> float:
+        """扣除额度，返回需等待的秒数（余额不足时为欠账 / 回填速率）。"""
+        self._refill(now)
+        self.level -= min(amount, self.capacity)
+        return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def refund(self, amount: float, now: float):
+        self._refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+
+class Lease:
+    """单次请求的限流凭证：记录预占 token，用于完成后按实际用量结算。"""
+
+    __slots__ = ("limiter", "reserved", "used")
+
+    def __init__(self, limiter: "RateLimiter", reserved: int):
+        self.limiter = limiter
+        self.reserved = reserved
+        self.used = None
+
+    def settle(self, actual_tokens: int):
+        """登记实际消耗的 token（可多次调用累计）。"""
+        self.used = (self.used or 0) + actual_tokens
+
+
+class RateLimiter:
+    """单个 provider（或 provider/model）的限流器，线程安全，同步 / 异步共用。"""
+
+    def __init__(self, name: str, rpm: float = 0, tpm: float = 0, inflight: int = 0):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_inflight = int(inflight)
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._requests = _Bucket(rpm) if rpm > 0 else None
+        self._tokens = _Bucket(tpm) if tpm > 0 else None
+        self._inflight = 0
+        self.waited = 0.0  # 累计限流等待秒数
+
+    def _try_enter(self) -> bool:
+        if self.max_inflight and self._inflight >= self.max_inflight:
+            return False
+        self._inflight += 1
+        return True
+
+    def _reserve(self, tokens: int) -> float:
+        now = time.monotonic()
+        wait = 0.0
+        if self._requests:
+            wait = max(wait, self._requests.take(1, now))
+        if self._tokens and tokens:
+            wait = max(wait, self._tokens.take(tokens, now))
+        return wait
+
+    def _leave(self, lease: Lease):
+        with self._cond:
+            self._inflight -= 1
+            if self._tokens and lease.used is not None and lease.used < lease.reserved:
+                self._tokens.refund(lease.reserved - lease.used, time.monotonic())
+            self._cond.notify()
+
+    def acquire(self, tokens: int = 0) -> Lease:
+        """阻塞直至获得在途名额与 RPM/TPM 额度。"""
+        t0 = time.monotonic()
+        with self._cond:
+            while not self._try_enter():
+                self._cond.wait()
+            wait = self._reserve(tokens)
+        lease = Lease(self, tokens)
+        if wait > 0:
+            try:
+                time.sleep(wait)
+            except BaseException:
+                self._leave(lease)
+                raise
+        with self._lock:
+            self.waited += time.monotonic() - t0
+        return lease
+
+    async def aacquire(self, tokens: int = 0) -> Lease:
+        """acquire 的异步版本：等待期间让出事件循环，不占线程。"""
+        t0 = time.monotonic()
+        while True:
+            with self._lock:
+                if self._try_enter():
+                    break
+            await asyncio.sleep(_INFLIGHT_POLL)
+        with self._lock:
+            wait = self._reserve(tokens)
+        lease = Lease(self, tokens)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except BaseException:
+                self._leave(lease)
+                raise
+        with self._lock:
+            self.waited += time.monotonic() - t0
+        return lease
+
+    def release(self, lease: Lease):
+        self._leave(lease)
+
+    def expected_wait(self, tokens: int = 0) -> float:
+        """不扣额度，估算此刻发起请求需等待的秒数（在途已满时为正无穷），供路由选择端点。"""
+        now = time.monotonic()
+        with self._lock:
+            if self.max_inflight and self._inflight >= self.max_inflight:
+                return float("inf")
+            wait = 0.0
+            for bucket, amount in ((self._requests, 1), (self._tokens, tokens)):
+                if bucket and amount:
+                    level = min(bucket.capacity, bucket.level + (now - bucket.updated) * bucket.rate)
+                    deficit = min(amount, bucket.capacity) - level
+                    if deficit > 0:
+                        wait = max(wait, deficit / bucket.rate)
+            return wait
+
+
+_current_lease: contextvars.ContextVar[Lease | None] = contextvars.ContextVar("llm_rate_lease", default=None)
+
+
+def settle_current(actual_tokens: int):
+    """由 token 统计处调用：把实际用量记到当前请求的限流凭证上。"""
+    lease = _current_lease.get()
+    if lease is not None:
+        lease.settle(actual_tokens)
+
+
+class RateLimiterRegistry:
+    """按 provider / provider:model 懒创建限流器；未配置任何限额的维度不限流。"""
+
+    def __init__(self, default: dict, overrides: dict[str, dict]):
+        self.default = default
+        self.overrides = overrides
+        self._lock = threading.Lock()
+        self._limiters: dict[str, RateLimiter | None] = {}
+
+    def get(self, provider: str, model: str = "") -> RateLimiter | None:
+        provider = provider.lower()
+        base = provider.split("#", 1)[0]
+        model_key = f"{base}/{model}".lower() if model else ""
+        key = f"{provider}/{model}".lower() if model_key in self.overrides else provider
+        with self._lock:
+            if key not in self._limiters:
+                spec = {
+                    **self.default,
+                    **self.overrides.get(base, {}),
+                    **self.overrides.get(model_key, {}),
+                    **self.overrides.get(provider, {}),
+                }
+                rpm, tpm, inflight = spec.get("rpm", 0), spec.get("tpm", 0), spec.get("inflight", 0)
+                self._limiters[key] = RateLimiter(key, rpm, tpm, inflight) if (rpm or tpm or inflight) else None
+            return self._limiters[key]
+
+    @contextmanager
+    def limit(self, provider: str, model: str = "", tokens: int = 0):
+        """同步限流上下文：进入时等待额度，退出时释放在途名额并按实际用量退还 token。"""
+        limiter = self.get(provider, model)
+        if limiter is None:
+            yield None
+            return
+        lease = limiter.acquire(tokens)
+        token = _current_lease.set(lease)
+        try:
+            yield lease
+        finally:
+            _current_lease.reset(token)
+            limiter.release(lease)
+
+    @asynccontextmanager
+    async def alimit(self, provider: str, model: str = "", tokens: int = 0):
+        """limit 的异步版本。"""
+        limiter = self.get(provider, model)
+        if limiter is None:
+            yield None
+            return
+        lease = await limiter.aacquire(tokens)
+        token = _current_lease.set(lease)
+        try:
+            yield lease
+        finally:
+            _current_lease.reset(token)
+            limiter.release(lease)
+
+    def stats(self) -> dict[str, float]:
+        """各限流器累计等待秒数（仅含发生过等待的）。"""
+        with self._lock:
+            return {k: round(v.waited, 1) for k, v in self._limiters.items() if v is not None and v.waited >= 0.05}
+
+
+_registry: RateLimiterRegistry | None = None
+_registry_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiterRegistry:
+    """进程级共享限流注册表（按 config 中 LLM_RATE_* 初始化）。"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                from config import LLM_RATE_RPM, LLM_RATE_TPM, LLM_RATE_MAX_INFLIGHT, LLM_RATE_LIMITS
+                _registry = RateLimiterRegistry(
+                    {"rpm": LLM_RATE_RPM, "tpm": LLM_RATE_TPM, "inflight": LLM_RATE_MAX_INFLIGHT},
+                    parse_rate_limits(LLM_RATE_LIMITS),
+                )
+    return _registry
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 离线录制 / 回放：无 API Key、无网络时重跑完整流程，用于基准测试与回归。
+
+- record：真实调用照常进行，每个请求 / 响应对追加写入 gzip 压缩的 JSONL 归档；
+- replay：不发起任何网络请求，按请求哈希返回归档中的响应，可按录制时的耗时模拟延迟与抖动；
+  归档中没有的请求计为未命中并明确报告（严格模式下抛出 ReplayMiss）。
+
+请求哈希与 provider / model 无关（kind + 规范化消息 + temperature + max_tokens），
+因此回放时可用任意 provider（含 PROVIDER_CONFIG 中的 replay）驱动同一份归档。
+同一请求录制了多次（如 temperature > 0 的重复调用）时按录制顺序依次返回，用尽后循环。
+"""
+import atexit
+import gzip
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from src.utils.llm_cache import request_hash
+
+REPLAY_MODES = ("off", "record", "replay")
+
+# 未命中明细最多保留条数
+_MAX_MISS_DETAILS = 200
+
+
+class ReplayMiss(LookupError):
+    """回放模式下归档中没有对应请求。"""
+
+
+def replay_key(kind: str, messages: list, temperature: float, max_tokens: int) -> str:
+    """与 provider / model 无关的请求哈希。"""
+    return request_hash(kind, "", "", messages, temperature, max_tokens)
+
+
+def _prompt_preview(messages: list, limit: int = 120) -> str:
+    for m in reversed(messages):
+        if m.get("role") == "user":
+            content = m.get("content", "")
+            if isinstance(content, list):
+                content = " ".join(p.get("text", "") for p in content if isinstance(p, dict))
+            return " ".join(str(content).split())[:limit]
+    return ""
+
+
+class ReplayArchive:
+    """线程安全的录制 / 回放归档（gzip JSONL，每行一个请求 / 响应对）。"""
+
+    def __init__(self, path: Path, mode: str = "off", latency_scale: float = 0.0,
+                 jitter: float = 0.0, strict: bool = True):
+        if mode not in REPLAY_MODES:
+            raise ValueError(f"回放模式须为 {'/'.join(REPLAY_MODES)} 之一，当前: {mode}")
+        self.path = Path(path)
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.jitter = jitter
+        self.strict = strict
+        self._lock = threading.Lock()
+        self._entries: dict[str, list[dict]] | None = None
+        self._cursor: dict[str, int] = {}
+        self._writer = None
+        self.served = 0
+        self.recorded = 0
+        self.miss_count = 0
+        self.misses: list[dict] = []
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def _load_locked(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        if not self.path.is_file():
+            return
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as fh:
+                for line in fh:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self._entries.setdefault(entry["key"], []).append(entry)
+        except (EOFError, gzip.BadGzipFile, zlib.error):
+            # 录制进程中断时归档末尾不完整，保留已读出的条目
+            pass
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._load_locked()
+            return sum(len(v) for v in self._entries.values())
+
+    def lookup(self, kind: str, provider: str, messages: list, temperature: float, max_tokens: int,
+               step: str = "", site: str = "") -> dict | None:
+        """回放：返回归档条目，未命中时登记并返回 None。"""
+        key = replay_key(kind, messages, temperature, max_tokens)
+        with self._lock:
+            self._load_locked()
+            entries = self._entries.get(key)
+            if not entries:
+                self.miss_count += 1
+                if len(self.misses) < _MAX_MISS_DETAILS:
+                    self.misses.append({
+                        "key": key, "kind": kind, "provider": provider,
+                        "step": step, "site": site, "prompt": _prompt_preview(messages),
+                    })
+                return None
+            idx = self._cursor.get(key, 0)
+            self._cursor[key] = idx + 1
+            self.served += 1
+            return entries[idx % len(entries)]
+
+    def delay(self, entry: dict) -> float:
+        """按录制耗时 × latency_scale 模拟延迟，并叠加 ±jitter 比例的随机抖动。"""
+        base = float(entry.get("latency") or 0.0) * self.latency_scale
+        if base <= 0:
+            return 0.0
+        if self.jitter > 0:
+            base *= 1.0 + random.uniform(-self.jitter, self.jitter)
+        return max(0.0, base)
+
+    def record(self, kind: str, provider: str, model: str, messages: list, temperature: float,
+               max_tokens: int, response, latency: float, input_tokens: int = 0,
+               output_tokens: int = 0, step: str = "", site: str = ""):
+        """录制：追加一条请求 / 响应对（每条写入后 flush，进程中断也不丢已完成的调用）。"""
+        if not self.recording or response is None:
+            return
+        entry = {
+            "key": replay_key(kind, messages, temperature, max_tokens),
+            "kind": kind,
+            "provider": provider,
+            "model": model or "",
+            "step": step,
+            "site": site,
+            "prompt": _prompt_preview(messages),
+            "response": response,
+            "latency": round(latency, 3),
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "recorded_at": round(time.time(), 1),
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._writer is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._writer = gzip.open(self.path, "at", encoding="utf-8")
+            self._writer.write(line)
+            self._writer.flush()
+            self.recorded += 1
+
+    def placeholder(self, kind: str, key: str):
+        """非严格模式下未命中请求的占位响应。"""
+        text = f"[replay 未命中 {key[:12]}]"
+        if kind in ("perplexity_citations", "perplexity_deep_research"):
+            return [text, []]
+        return text
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "archive": str(self.path),
+                "served": self.served,
+                "misses": self.miss_count,
+                "recorded": self.recorded,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+_archive: ReplayArchive | None = None
+_archive_lock = threading.Lock()
+
+
+def _default_mode() -> str:
+    """LLM_REPLAY_MODE 未开启时，选择 replay provider 即进入回放模式。"""
+    from config import LLM_PROVIDER, LLM_REPLAY_MODE
+    if LLM_REPLAY_MODE != "off":
+        return LLM_REPLAY_MODE
+    provider = (os.getenv("LLM_PROVIDER") or LLM_PROVIDER or "").lower().strip()
+    return "replay" if provider == "replay" else "off"
+
+
+def get_replay_archive() -> ReplayArchive:
+    """进程级共享归档（按 config 中 LLM_REPLAY_* 初始化）。"""
+    global _archive
+    if _archive is None:
+        with _archive_lock:
+            if _archive is None:
+                from config import (
+                    LLM_REPLAY_ARCHIVE, LLM_REPLAY_LATENCY, LLM_REPLAY_JITTER, LLM_REPLAY_STRICT,
+                )
+                _archive = ReplayArchive(
+                    Path(LLM_REPLAY_ARCHIVE),
+                    mode=_default_mode(),
+                    latency_scale=LLM_REPLAY_LATENCY,
+                    jitter=LLM_REPLAY_JITTER,
+                    strict=LLM_REPLAY_STRICT,
+                )
+                atexit.register(_archive.close)
+    return _archive
+
+
+def configure_replay(mode: str = None, archive: str = None, latency_scale: float = None, strict: bool = None):
+    """命令行覆盖回放模式 / 归档路径 / 延迟倍率 / 严格模式。"""
+    replay = get_replay_archive()
+    if archive:
+        replay.close()
+        with replay._lock:
+            replay.path = Path(archive)
+            replay._entries = None
+            replay._cursor.clear()
+    if mode:
+        if mode not in REPLAY_MODES:
+            raise ValueError(f"回放模式须为 {'/'.join(REPLAY_MODES)} 之一，当前: {mode}")
+        replay.mode = mode
+    if latency_scale is not None:
+        replay.latency_scale = latency_scale
+    if strict is not None:
+        replay.strict = strict
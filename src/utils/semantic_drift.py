@@ -7,13 +7,39 @@ from pathlib import Path
 import src  # noqa: F401
 
 from config import REPORT_DIR
-from src.llm_client import chat
+from src.llm_client import chat_json
+from src.utils.json_output import JSONOutputError
 from src.utils.log import log as _log
-from src.utils.file_utils import clean_json as _clean_json
 from src.utils.markdown_utils import read_report_text as _read_report_text
 
 DRIFT_REPORT_LIMIT = 50_000
 
+_STRINGS = {"type": "array", "items": {"type": "string"}}
+CLAIMS_SCHEMA = {"type": "array", "items": {"type": "string", "minLength": 1}}
+DRIFT_SCHEMA = {
+    "type": "object",
+    "required": ["retained", "lost", "added", "modified", "drift_score", "summary"],
+    "properties": {
+        "retained": _STRINGS,
+        "lost": _STRINGS,
+        "added": _STRINGS,
+        "modified": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["original", "modified"],
+                "properties": {
+                    "original": {"type": "string"},
+                    "modified": {"type": "string"},
+                    "change": {"type": "string"},
+                },
+            },
+        },
+        "drift_score": {"type": "number", "minimum": 0, "maximum": 1},
+        "summary": {"type": "string"},
+    },
+}
+
 
 def extract_core_claims(report_text: str, version_label: str = "v1") -> list[str]:
     """从报告中提取 5-10 条核心论点。"""
@@ -36,23 +62,20 @@ def extract_core_claims(report_text: str, version_label: str = "v1") -> list[str
 
     _log(f"提取核心论点（{version_label}）...", "drift")
     t0 = time.time()
-    resp = chat(
-        [
-            {"role": "system", "content": "你是专业的文档分析专家，擅长提取核心论点。输出严格 JSON。"},
-            {"role": "user", "content": prompt},
-        ],
-        max_tokens=4096,
-        temperature=0.3,
-    )
-    _log(f"论点提取完成（{version_label}），耗时 {time.time()-t0:.1f}s", "drift")
-    cleaned = _clean_json(resp)
     try:
-        claims = json.loads(cleaned)
-        if isinstance(claims, list):
-            return claims
-    except json.JSONDecodeError:
-        pass
-    return []
+        claims = chat_json(
+            [
+                {"role": "system", "content": "你是专业的文档分析专家，擅长提取核心论点。输出严格 JSON。"},
+                {"role": "user", "content": prompt},
+            ],
+            schema=CLAIMS_SCHEMA,
+            max_tokens=4096,
+            temperature=0.3,
+        )
+    except JSONOutputError:
+        return []
+    _log(f"论点提取完成（{version_label}），耗时 {time.time()-t0:.1f}s", "drift")
+    return claims
 
 
 def compare_claims(baseline: list[str], current: list[str]) -> dict:
@@ -84,20 +107,20 @@ drift_score: 0.0=完全一致, 1.0=完全不同。直接输出 JSON。"""
 
     _log("比较核心论点变化...", "drift")
     t0 = time.time()
-    resp = chat(
-        [
-            {"role": "system", "content": "你是专业的文档比较专家，擅长分析语义漂移。输出严格 JSON。"},
-            {"role": "user", "content": prompt},
-        ],
-        max_tokens=4096,
-        temperature=0.3,
-    )
-    _log(f"论点比较完成，耗时 {time.time()-t0:.1f}s", "drift")
-    cleaned = _clean_json(resp)
     try:
-        return json.loads(cleaned)
-    except json.JSONDecodeError:
-        return {"retained": [], "lost": [], "added": [], "modified": [], "drift_score": -1, "summary": cleaned}
+        result = chat_json(
+            [
+                {"role": "system", "content": "你是专业的文档比较专家，擅长分析语义漂移。输出严格 JSON。"},
+                {"role": "user", "content": prompt},
+            ],
+            schema=DRIFT_SCHEMA,
+            max_tokens=4096,
+            temperature=0.3,
+        )
+    except JSONOutputError as e:
+        return {"retained": [], "lost": [], "added": [], "modified": [], "drift_score": -1, "summary": e.text}
+    _log(f"论点比较完成，耗时 {time.time()-t0:.1f}s", "drift")
+    return result
 
 
 def run_drift_check(
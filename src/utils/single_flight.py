@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+相同请求的在途合并（single-flight）：同一请求哈希已有调用在途时，后到的调用不再请求 API，
+而是等待同一个结果（成功或异常一并共享）。线程与 asyncio 两条路径共用同一张在途表，
+因此线程中的 chat() 与事件循环中的 achat() 也可以互相合并。
+
+领头调用被取消（如对冲落败、asyncio 任务取消）时，等待者不会收到取消，而是重新发起请求。
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class _LeaderCancelled(Exception):
+    """领头调用被取消，等待者需自行重试。"""
+
+
+class SingleFlight:
+    """按 key 合并在途调用，并统计领头 / 合并次数。"""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._flights: dict[str, Future] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _join(self, key: str) -> tuple[Future, bool]:
+        """返回 (future, 是否为领头调用)。"""
+        with self._lock:
+            fut = self._flights.get(key)
+            if fut is not None:
+                self.coalesced += 1
+                return fut, False
+            fut = Future()
+            self._flights[key] = fut
+            self.leaders += 1
+            return fut, True
+
+    def _land(self, key: str, fut: Future):
+        with self._lock:
+            if self._flights.get(key) is fut:
+                del self._flights[key]
+
+    def do(self, key: str, fn, on_coalesced=None):
+        """同步调用：领头者执行 fn()，其余同 key 调用阻塞等待其结果。"""
+        if not self.enabled:
+            return fn()
+        while True:
+            fut, leader = self._join(key)
+            if not leader:
+                if on_coalesced:
+                    on_coalesced()
+                try:
+                    return fut.result()
+                except _LeaderCancelled:
+                    continue
+            try:
+                result = fn()
+            except BaseException as e:
+                self._land(key, fut)
+                fut.set_exception(e if isinstance(e, Exception) else _LeaderCancelled())
+                raise
+            self._land(key, fut)
+            fut.set_result(result)
+            return result
+
+    async def ado(self, key: str, fn, on_coalesced=None):
+        """异步调用：fn() 返回协程；等待期间让出事件循环。"""
+        if not self.enabled:
+            return await fn()
+        while True:
+            fut, leader = self._join(key)
+            if not leader:
+                if on_coalesced:
+                    on_coalesced()
+                try:
+                    # shield：本等待者被取消时不连带取消共享的 future
+                    return await asyncio.shield(asyncio.wrap_future(fut))
+                except _LeaderCancelled:
+                    continue
+            try:
+                result = await fn()
+            except BaseException as e:
+                self._land(key, fut)
+                cancelled = isinstance(e, asyncio.CancelledError) or not isinstance(e, Exception)
+                fut.set_exception(_LeaderCancelled() if cancelled else e)
+                raise
+            self._land(key, fut)
+            fut.set_result(result)
+            return result
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"leaders": self.leaders, "coalesced": self.coalesced, "in_flight": len(self._flights)}
+
+    def reset_stats(self):
+        with self._lock:
+            self.leaders = 0
+            self.coalesced = 0
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+声明式任务图：步骤为节点，节点声明输入 / 输出产物（带类型），调度器并发执行就绪节点。
+
+    graph = TaskGraph("full-report demo")
+    graph.artifact("raw", Path, "原始语料")
+    graph.node("step2", "Step2 报告 1.0", fn, inputs=("raw",), outputs=("report_v1",), cost=10)
+    graph.run(max_parallel=3)
+
+fn(inputs: dict) -> dict 返回各输出产物；产物类型为 Path 时还要求文件存在。
+调度：依赖全部就绪的节点按「关键路径优先」排序（优先级 = 自身估算耗时 + 后继链上最长的估算耗时），
+在 max_parallel 个线程中执行；各节点内的 LLM 调用共享 provider 级的自适应并发与限流，因此并发节点
+不会突破整体并发预算。节点内的扇出按节点类别使用共享线程池的优先级通道：关键路径节点 high、
+可选节点 low、其余 normal（见 parallel.priority_lane）。节点失败时其下游节点不再执行；required=False 的节点（旁路校验等）失败只记录，
+其余节点继续，最后抛出第一个必需节点的异常。
+
+断点续跑 / 增量重建：节点就绪时调用 is_done(node, inputs, located)，located 为 node.locate() 从磁盘找回的输出
+（找不到或未提供 locate 时为 None），返回真时跳过该节点、沿用 located；执行完成后调用 mark_done(node, inputs, outputs)。
+节点的 deps 为上游产物之外的输入声明（如 incremental.StepDeps），由 is_done / mark_done 解释；
+deps 提供 digest() 时，执行节点期间以其作为工作单元检查点键的一部分（checkpoint.unit_salt），
+使节点因提示词 / 配置 / 参数变化而重建时不复用旧的单元结果。
+"""
+import contextvars
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+
+from src.utils.checkpoint import unit_salt
+from src.utils.log import log as _log
+from src.utils.parallel import priority_lane, request_stop, stop_scope
+
+
+@dataclass
+class ArtifactSpec:
+    """产物：名称、类型与说明。"""
+    name: str
+    kind: type = Path
+    desc: str = ""
+
+
+@dataclass
+class TaskNode:
+    """步骤节点。cost 为估算耗时（相对值，用于关键路径排序）；locate 在续跑时从磁盘找回输出；deps 见模块说明。"""
+    name: str
+    label: str
+    fn: Callable[[dict], dict]
+    inputs: tuple[str, ...] = ()
+    outputs: tuple[str, ...] = ()
+    cost: float = 1.0
+    required: bool = True
+    locate: Callable[[], dict] | None = None
+    deps: object = None
+
+
+@dataclass
+class NodeResult:
+    status: str            # done / skipped / failed / blocked
+    seconds: float = 0.0
+    error: BaseException | None = None
+    started: float = 0.0
+
+
+class TaskGraphError(ValueError):
+    """任务图声明错误：产物未声明 / 重复产出 / 无来源 / 存在环。"""
+
+
+@dataclass
+class TaskGraph:
+    title: str
+    artifacts: dict[str, ArtifactSpec] = field(default_factory=dict)
+    nodes: dict[str, TaskNode] = field(default_factory=dict)
+
+    def artifact(self, name: str, kind: type = Path, desc: str = ""):
+        self.artifacts[name] = ArtifactSpec(name, kind, desc)
+
+    def node(self, name: str, label: str, fn, inputs=(), outputs=(), cost: float = 1.0,
+             required: bool = True, locate=None, deps=None) -> TaskNode:
+        node = TaskNode(name, label, fn, tuple(inputs), tuple(outputs), cost, required, locate, deps)
+        self.nodes[name] = node
+        return node
+
+    # ---------- 结构 ----------
+
+    def producers(self) -> dict[str, str]:
+        return {a: n.name for n in self.nodes.values() for a in n.outputs}
+
+    def validate(self):
+        producers = {}
+        for node in self.nodes.values():
+            for a in node.inputs + node.outputs:
+                if a not in self.artifacts:
+                    raise TaskGraphError(f"节点 {node.name} 引用了未声明的产物 {a}")
+            for a in node.outputs:
+                if a in producers:
+                    raise TaskGraphError(f"产物 {a} 同时由 {producers[a]} 与 {node.name} 产出")
+                producers[a] = node.name
+        for node in self.nodes.values():
+            for a in node.inputs:
+                if a not in producers:
+                    raise TaskGraphError(f"节点 {node.name} 的输入 {a} 没有产出节点")
+        self.levels()  # 检查环
+
+    def upstream(self, node: TaskNode) -> set[str]:
+        producers = self.producers()
+        return {producers[a] for a in node.inputs if a in producers}
+
+    def downstream(self) -> dict[str, set[str]]:
+        succ = {name: set() for name in self.nodes}
+        for node in self.nodes.values():
+            for up in self.upstream(node):
+                succ[up].add(node.name)
+        return succ
+
+    def levels(self) -> list[list[str]]:
+        """拓扑分层：同层节点之间无依赖，可并行。"""
+        deps = {name: self.upstream(node) for name, node in self.nodes.items()}
+        placed: set[str] = set()
+        levels = []
+        while len(placed) < len(deps):
+            level = [n for n in self.nodes if n not in placed and deps[n] <= placed]
+            if not level:
+                raise TaskGraphError("任务图存在环：" + "、".join(n for n in self.nodes if n not in placed))
+            levels.append(level)
+            placed.update(level)
+        return levels
+
+    def ranks(self, costs: dict[str, float] = None) -> dict[str, float]:
+        """关键路径优先级：节点耗时 + 后继链上的最长耗时。"""
+        costs = costs or {n: node.cost for n, node in self.nodes.items()}
+        succ = self.downstream()
+        rank: dict[str, float] = {}
+        for level in reversed(self.levels()):
+            for name in level:
+                rank[name] = costs[name] + max((rank[s] for s in succ[name]), default=0.0)
+        return rank
+
+    def critical_path(self, costs: dict[str, float] = None) -> list[str]:
+        rank = self.ranks(costs)
+        succ = self.downstream()
+        roots = [n for n in self.nodes if not self.upstream(self.nodes[n])]
+        if not roots:
+            return []
+        path = [max(roots, key=rank.get)]
+        while succ[path[-1]]:
+            path.append(max(succ[path[-1]], key=rank.get))
+        return path
+
+    # ---------- 展示 ----------
+
+    def describe(self) -> str:
+        """文本形式的执行计划：节点、输入输出、优先级、关键路径与并行层级。"""
+        self.validate()
+        rank = self.ranks()
+        critical = self.critical_path()
+        total = sum(n.cost for n in self.nodes.values())
+        width = max(len(n) for n in self.nodes)
+        lines = [f"任务图 {self.title}：{len(self.nodes)} 个节点，关键路径估算 {rank[critical[0]]:g}，串行合计 {total:g}",
+                 "  （* 为关键路径节点，? 为可选节点：失败不影响主流程）"]
+        for level in self.levels():
+            for name in sorted(level, key=lambda n: -rank[n]):
+                node = self.nodes[name]
+                mark = "*" if name in critical else ("?" if not node.required else " ")
+                lines.append(f"{mark} {name:<{width}}  {node.label}  "
+                             f"[{', '.join(node.inputs) or '-'}] → [{', '.join(node.outputs) or '-'}]  "
+                             f"估算 {node.cost:g} / 优先级 {rank[name]:g}")
+        lines.append("关键路径: " + " → ".join(critical))
+        lines.append("并行层级:")
+        for i, level in enumerate(self.levels()):
+            lines.append(f"  L{i}: " + ", ".join(sorted(level, key=lambda n: -rank[n])))
+        return "\n".join(lines)
+
+    def to_dot(self) -> str:
+        """Graphviz DOT：节点为步骤，边标注经过的产物；关键路径加粗。"""
+        self.validate()
+        path = self.critical_path()
+        critical, critical_edges = set(path), set(zip(path, path[1:]))
+        producers = self.producers()
+        lines = [f'digraph "{self.title}" {{', "  rankdir=LR;", "  node [shape=box];"]
+        for name, node in self.nodes.items():
+            style = ", style=bold" if name in critical else (", style=dashed" if not node.required else "")
+            lines.append(f'  "{name}" [label="{node.label}\\n({node.cost:g})"{style}];')
+        for node in self.nodes.values():
+            for a in node.inputs:
+                bold = ", style=bold" if (producers[a], node.name) in critical_edges else ""
+                lines.append(f'  "{producers[a]}" -> "{node.name}" [label="{a}"{bold}];')
+        lines.append("}")
+        return "\n".join(lines)
+
+    # ---------- 执行 ----------
+
+    def _check_outputs(self, node: TaskNode, produced: dict) -> dict:
+        out = {}
+        for a in node.outputs:
+            value = produced.get(a) if isinstance(produced, dict) else None
+            spec = self.artifacts[a]
+            if spec.kind is Path and isinstance(value, str):
+                value = Path(value)
+            if not isinstance(value, spec.kind):
+                raise TypeError(f"节点 {node.name} 的输出 {a} 应为 {spec.kind.__name__}，实际为 {type(value).__name__}")
+            if spec.kind is Path and not value.exists():
+                raise FileNotFoundError(f"节点 {node.name} 的输出 {a} 不存在: {value}")
+            out[a] = value
+        return out
+
+    def _execute(self, node: TaskNode, inputs: dict, lane: str = "normal") -> dict:
+        digest = getattr(node.deps, "digest", None)
+        with priority_lane(lane), unit_salt(digest() if digest else None):
+            return self._check_outputs(node, node.fn(inputs))
+
+    def run(self, max_parallel: int = 3, is_done=None, mark_done=None) -> dict[str, NodeResult]:
+        """
+        执行任务图，返回 {节点: NodeResult}，结束时记录运行摘要。is_done / mark_done 用于断点续跑与增量重建（见模块说明）。
+        有必需节点失败时，在其余可执行节点结束后抛出第一个失败的异常。
+        """
+        self.validate()
+        rank = self.ranks()
+        critical = set(self.critical_path())
+        values = {}
+        results: dict[str, NodeResult] = {}
+        pending = set(self.nodes)
+        failed_artifacts: set[str] = set()
+        t0 = time.monotonic()
+        cap = max(1, max_parallel)
+        with stop_scope(), ThreadPoolExecutor(max_workers=cap, thread_name_prefix="graph") as executor:
+            running = {}
+            try:
+                while pending or running:
+                    self._block_downstream(pending, failed_artifacts, results)
+                    ready = sorted((n for n in pending if all(a in values for a in self.nodes[n].inputs)),
+                                   key=lambda n: -rank[n])
+                    resumed = False
+                    for name in ready[:cap - len(running)]:
+                        node = self.nodes[name]
+                        pending.discard(name)
+                        inputs = {a: values[a] for a in node.inputs}
+                        located = self._resume(node, inputs, is_done)
+                        if located is not None:
+                            values.update(located)
+                            results[name] = NodeResult("skipped")
+                            _log(f"[任务图] 跳过 {node.label}（已是最新）")
+                            resumed = True
+                            break  # 新产物可能使更高优先级的节点就绪，重新排序
+                        _log(f"[任务图] 开始 {node.label}（优先级 {rank[name]:g}，并行 {len(running) + 1}）")
+                        lane = "low" if not node.required else ("high" if name in critical else "normal")
+                        future = executor.submit(contextvars.copy_context().run, self._execute, node, inputs, lane)
+                        running[future] = (name, time.monotonic(), inputs)
+                    if resumed:
+                        continue
+                    if not running:
+                        if pending:
+                            raise TaskGraphError("任务图无法继续：" + "、".join(sorted(pending)) + " 的输入缺失")
+                        break
+                    done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name, started, inputs = running.pop(future)
+                        node = self.nodes[name]
+                        seconds = time.monotonic() - started
+                        try:
+                            outputs = future.result()
+                        except Exception as e:
+                            results[name] = NodeResult("failed", seconds, e, started - t0)
+                            failed_artifacts.update(node.outputs)
+                            _log(f"[任务图] {node.label} 失败（{type(e).__name__}: {e}）"
+                                 + ("" if node.required else "，可选节点，主流程继续"))
+                            continue
+                        values.update(outputs)
+                        results[name] = NodeResult("done", seconds, None, started - t0)
+                        if mark_done:
+                            mark_done(node, inputs, outputs)
+                        _log(f"[任务图] 完成 {node.label}，耗时 {seconds:.1f}s")
+            except KeyboardInterrupt:
+                # 不再启动新节点；进行中节点内的 parallel_map 跳过未开始的项，已完成的工作单元已写入检查点
+                request_stop()
+                _log(f"[任务图] 中断：等待 {len(running)} 个进行中的节点收尾...")
+                raise
+        _log(self.summary(results, time.monotonic() - t0))
+        errors = [r.error for n, r in results.items() if r.status == "failed" and self.nodes[n].required]
+        if errors:
+            raise errors[0]
+        return results
+
+    def _block_downstream(self, pending: set, failed_artifacts: set, results: dict):
+        """上游失败（或被跳过）的节点不再执行，并沿依赖链传递。"""
+        changed = True
+        while changed:
+            changed = False
+            for name in [n for n in pending if failed_artifacts & set(self.nodes[n].inputs)]:
+                pending.discard(name)
+                results[name] = NodeResult("blocked")
+                failed_artifacts.update(self.nodes[name].outputs)
+                _log(f"[任务图] {self.nodes[name].label} 因上游失败未执行")
+                changed = True
+
+    def _resume(self, node: TaskNode, inputs: dict, is_done) -> dict | None:
+        if not is_done:
+            return None
+        located = None
+        if node.locate:
+            try:
+                located = self._check_outputs(node, node.locate())
+            except (TypeError, FileNotFoundError):
+                pass
+        return located if is_done(node, inputs, located) and located is not None else None
+
+    def summary(self, results: dict[str, NodeResult], wall: float) -> str:
+        """运行摘要：各节点耗时、墙钟时间、串行合计与按实际耗时计算的关键路径。"""
+        actual = {n: results[n].seconds if n in results else 0.0 for n in self.nodes}
+        critical = self.critical_path(actual)
+        serial = sum(actual.values())
+        lines = [f"任务图耗时: 墙钟 {wall:.1f}s / 各节点串行合计 {serial:.1f}s / 关键路径 "
+                 f"{sum(actual[n] for n in critical):.1f}s（{' → '.join(critical)}）"]
+        for name in self.nodes:
+            r = results.get(name)
+            if r is None:
+                continue
+            timing = f"{r.started:7.1f}s 起，{r.seconds:7.1f}s" if r.status in ("done", "failed") else " " * 20
+            lines.append(f"  {name:<14} {r.status:<7} {timing}")
+        return "\n".join(lines)
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+本地 token 计数与上下文预算分配。
+
+- count_tokens：provider 为 openai 且安装了 tiktoken 时用 BPE 精确计数，
+  其余按各 provider 标定的 CJK / 非 CJK 每字符 token 比例估算。
+- pack_sections：调用方声明 prompt 各段（优先级、最小 token、原字符上限），
+  按模型上下文窗口减去 max_tokens 与模板开销后的预算装箱，超出时按优先级截断。
+- adaptive_chunk_chars：把按默认 provider（kimi）标定的字符分块大小换算到当前 provider。
+
+装箱与分块按调用点模型路由（LLM_ROUTES / 报告类型 "## 模型路由"）解析后的 provider / model / max_tokens 计算预算，
+与此处随后发起的 chat() 实际使用的模型一致（见 llm_client.routed_target）；装箱与调用不在同一函数时由调用方传入 site。
+
+config.py 中各 *_LIMIT 字符上限仍作为各段的软上限，保证 prompt 不超过原有规模。
+"""
+import os
+import threading
+from dataclasses import dataclass, field
+
+# 各 provider 上下文窗口（tokens），可用 LLM_CONTEXT_WINDOWS 覆盖
+_CONTEXT_WINDOWS = {
+    "kimi": 262_144,
+    "gemini": 1_048_576,
+    "grok": 256_000,
+    "minimax": 204_800,
+    "glm": 200_000,
+    "qwen": 131_072,
+    "deepseek": 128_000,
+    "openai": 400_000,
+    "perplexity": 127_072,
+    "claude": 200_000,
+}
+_DEFAULT_CONTEXT_WINDOW = 128_000
+
+# 标定比例：(每个 CJK 字符的 token 数, 每个其他字符的 token 数)，取偏保守的值
+_TOKEN_RATIOS = {
+    "kimi": (0.70, 0.27),
+    "qwen": (0.70, 0.27),
+    "deepseek": (0.70, 0.27),
+    "glm": (0.72, 0.27),
+    "minimax": (0.72, 0.27),
+    "openai": (0.80, 0.26),
+    "grok": (0.85, 0.27),
+    "gemini": (0.75, 0.27),
+    "perplexity": (1.00, 0.28),
+    "claude": (1.20, 0.30),
+}
+_DEFAULT_RATIO = (1.00, 0.30)
+
+# 字符分块大小（如 ASSEMBLE_CHUNK_SIZE）的标定基准 provider
+_REFERENCE_PROVIDER = "kimi"
+
+
+def _is_cjk(ch: str) -> bool:
+    return "\u4e00" <= ch <= "\u9fff" or "\u3000" <= ch <= "\u30ff" or "\uff00" <= ch <= "\uffef"
+
+
+def _default_provider() -> str:
+    from config import LLM_PROVIDER
+    return (os.getenv("LLM_PROVIDER") or LLM_PROVIDER or "kimi").lower().strip()
+
+
+def _routed(provider: str, model: str, max_tokens: int, site: str = None) -> tuple[str, str, int]:
+    """按调用点模型路由解析实际将使用的 (provider, model, max_tokens)。"""
+    from src.llm_client import routed_target
+    provider, model, max_tokens = routed_target(provider, model, max_tokens, site=site)
+    return provider.lower(), model, max_tokens
+
+
+_tiktoken_enc = None
+_tiktoken_lock = threading.Lock()
+
+
+def _tiktoken_encoding():
+    """tiktoken 为可选依赖：未安装或加载失败时返回 None。"""
+    global _tiktoken_enc
+    if _tiktoken_enc is None:
+        with _tiktoken_lock:
+            if _tiktoken_enc is None:
+                try:
+                    import tiktoken
+                    _tiktoken_enc = tiktoken.get_encoding("o200k_base")
+                except Exception:
+                    _tiktoken_enc = False
+    return _tiktoken_enc or None
+
+
+def _bpe_for(provider: str):
+    return _tiktoken_encoding() if provider == "openai" else None
+
+
+def estimate_tokens(text: str, provider: str = None) -> int:
+    """按 provider 标定比例估算 token 数（不依赖分词器）。"""
+    if not text:
+        return 0
+    cjk_ratio, other_ratio = _TOKEN_RATIOS.get((provider or "").lower(), _DEFAULT_RATIO)
+    cjk = sum(1 for ch in text if _is_cjk(ch))
+    return int(cjk * cjk_ratio + (len(text) - cjk) * other_ratio) + 1
+
+
+def estimate_message_tokens(messages: list, provider: str = None) -> int:
+    """估算消息列表的输入 token（多模态 content 只计文本部分，每条消息另加少量开销）。"""
+    total = 0
+    for m in messages:
+        content = m.get("content", "")
+        if isinstance(content, list):
+            content = "\n".join(p.get("text", "") for p in content if isinstance(p, dict))
+        total += estimate_tokens(str(content), provider) + 4
+    return total
+
+
+def count_tokens(text: str, provider: str = None) -> int:
+    """本地 token 计数：可用 BPE 时精确计数，否则按标定比例估算。"""
+    provider = (provider or _default_provider()).lower()
+    enc = _bpe_for(provider)
+    if enc is not None:
+        return len(enc.encode(text or "", disallowed_special=()))
+    return estimate_tokens(text, provider)
+
+
+def context_window(provider: str = None, model: str = None) -> int:
+    """模型上下文窗口：LLM_CONTEXT_WINDOWS 中 provider/model 或 provider 覆盖 > 内置表。"""
+    from config import LLM_CONTEXT_WINDOWS
+    provider = (provider or _default_provider()).lower()
+    overrides = {}
+    for item in (LLM_CONTEXT_WINDOWS or "").split(","):
+        key, _, value = item.partition(":")
+        if key.strip() and value.strip():
+            overrides[key.strip().lower()] = int(float(value))
+    if model and f"{provider}/{model}".lower() in overrides:
+        return overrides[f"{provider}/{model}".lower()]
+    return overrides.get(provider, _CONTEXT_WINDOWS.get(provider, _DEFAULT_CONTEXT_WINDOW))
+
+
+def prompt_budget(provider: str = None, model: str = None, max_tokens: int = 8192, overhead_tokens: int = 1024) -> int:
+    """可用于 prompt 可变部分的 token 预算：上下文窗口 × 安全系数 − max_tokens − 模板开销。"""
+    from config import LLM_BUDGET_SAFETY
+    window = context_window(provider, model)
+    return max(0, int(window * LLM_BUDGET_SAFETY) - max_tokens - overhead_tokens)
+
+
+def truncate_to_tokens(text: str, limit: int, provider: str = None, keep: str = "head") -> str:
+    """截断到不超过 limit 个 token；keep="head" 保留开头，"tail" 保留结尾。"""
+    if limit <= 0 or not text:
+        return ""
+    provider = (provider or _default_provider()).lower()
+    enc = _bpe_for(provider)
+    if enc is not None:
+        ids = enc.encode(text, disallowed_special=())
+        if len(ids) <= limit:
+            return text
+        return enc.decode(ids[:limit] if keep == "head" else ids[-limit:])
+    if estimate_tokens(text, provider) <= limit:
+        return text
+    cjk_ratio, other_ratio = _TOKEN_RATIOS.get(provider, _DEFAULT_RATIO)
+    seq = text if keep == "head" else reversed(text)
+    used, n = 1.0, 0
+    for ch in seq:
+        used += cjk_ratio if _is_cjk(ch) else other_ratio
+        if used > limit:
+            break
+        n += 1
+    return text[:n] if keep == "head" else text[len(text) - n:]
+
+
+@dataclass
+class Section:
+    """prompt 中的一段可变内容。"""
+    name: str
+    text: str
+    priority: int = 0              # 越大越优先保留
+    min_tokens: int = 0            # 预算紧张时优先保证的最小 token 数
+    max_chars: int | None = None   # 软上限（沿用 config 中的字符上限）
+    keep: str = "head"             # 截断时保留开头（head）或结尾（tail）
+
+
+@dataclass
+class PackResult:
+    texts: dict[str, str]
+    tokens: dict[str, int]
+    budget: int
+    truncated: list[str] = field(default_factory=list)
+
+    def __getitem__(self, name: str) -> str:
+        return self.texts[name]
+
+    def was_truncated(self, name: str) -> bool:
+        return name in self.truncated
+
+
+def pack_sections(
+    sections: list[Section],
+    provider: str = None,
+    model: str = None,
+    max_tokens: int = 8192,
+    overhead_tokens: int = 1024,
+    site: str = None,
+) -> PackResult:
+    """
+    将各段装入预算：先按 max_chars 软上限截取；总量超预算时，先满足各段 min_tokens
+    （仍不够则从低优先级起削减），剩余预算按优先级从高到低分配，同优先级均分。
+    site 为随后发起 chat() 的函数名（默认按调用栈推断为调用方），用于匹配模型路由。
+    """
+    provider, model, max_tokens = _routed(provider, model, max_tokens, site)
+    budget = prompt_budget(provider, model, max_tokens, overhead_tokens)
+    capped = {}
+    want = {}
+    for s in sections:
+        text = s.text or ""
+        if s.max_chars is not None and len(text) > s.max_chars:
+            text = text[:s.max_chars] if s.keep == "head" else text[-s.max_chars:]
+        capped[s.name] = text
+        want[s.name] = count_tokens(text, provider)
+    truncated = [s.name for s in sections if len(capped[s.name]) < len(s.text or "")]
+
+    if sum(want.values()) <= budget:
+        return _finish(sections, PackResult(capped, want, budget, truncated))
+
+    alloc = {s.name: min(want[s.name], s.min_tokens) for s in sections}
+    overflow = sum(alloc.values()) - budget
+    for s in sorted(sections, key=lambda x: x.priority):
+        if overflow <= 0:
+            break
+        cut = min(alloc[s.name], overflow)
+        alloc[s.name] -= cut
+        overflow -= cut
+
+    remaining = budget - sum(alloc.values())
+    for prio in sorted({s.priority for s in sections}, reverse=True):
+        group = [s for s in sections if s.priority == prio and want[s.name] > alloc[s.name]]
+        while group and remaining > 0:
+            share = max(1, remaining // len(group))
+            for s in list(group):
+                give = min(share, want[s.name] - alloc[s.name], remaining)
+                alloc[s.name] += give
+                remaining -= give
+                if alloc[s.name] >= want[s.name]:
+                    group.remove(s)
+        if remaining <= 0:
+            break
+
+    texts = {}
+    for s in sections:
+        text = capped[s.name]
+        if alloc[s.name] < want[s.name]:
+            text = truncate_to_tokens(text, alloc[s.name], provider, s.keep)
+            if s.name not in truncated:
+                truncated.append(s.name)
+        texts[s.name] = text
+    return _finish(sections, PackResult(texts, alloc, budget, truncated))
+
+
+def _finish(sections: list[Section], result: PackResult) -> PackResult:
+    """把各段被截掉的字符数记入调用点指标。"""
+    from src.utils.metrics import note_truncation
+    note_truncation(sum(len(s.text or "") - len(result.texts[s.name]) for s in sections))
+    return result
+
+
+def fit_text(text: str, max_chars: int, provider: str = None, model: str = None,
+             max_tokens: int = 8192, overhead_tokens: int = 1024, keep: str = "head", site: str = None) -> str:
+    """单段便捷版：按字符软上限截取，再确保不超过该模型的 prompt 预算。"""
+    return pack_sections(
+        [Section("text", text, max_chars=max_chars, keep=keep)],
+        provider, model, max_tokens, overhead_tokens, site,
+    )["text"]
+
+
+def _tokens_per_char(sample: str, provider: str) -> float:
+    sample = sample[:20_000] if sample else "中文" * 50
+    return max(0.05, estimate_tokens(sample, provider) / len(sample))
+
+
+def adaptive_chunk_chars(
+    base_chars: int,
+    provider: str = None,
+    model: str = None,
+    max_tokens: int = 8192,
+    overhead_tokens: int = 1024,
+    sample_text: str = "",
+    site: str = None,
+) -> int:
+    """
+    将按基准 provider 标定的字符分块大小换算到当前 provider：保持相同的 token 规模，
+    并保证分块 + 模板 + max_tokens 不超过上下文窗口。sample_text 用于估计语料的中英文比例。
+    """
+    provider, model, max_tokens = _routed(provider, model, max_tokens, site)
+    if provider == _REFERENCE_PROVIDER:
+        chars = base_chars
+    else:
+        chars = base_chars * _tokens_per_char(sample_text, _REFERENCE_PROVIDER) / _tokens_per_char(sample_text, provider)
+    fit = prompt_budget(provider, model, max_tokens, overhead_tokens) / _tokens_per_char(sample_text, provider)
+    return max(1000, int(min(chars, fit)))